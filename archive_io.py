@@ -0,0 +1,283 @@
+"""
+Streaming zip/tar input and output.
+
+Converting the contents of an archive normally means extracting it to disk,
+walking the tree and re-packing the results, paying several syscalls per
+small file. Here members are read straight out of the archive into memory
+(tar archives as a single forward stream), decoded and encoded on a thread
+pool, and handed in input order to one writer thread that appends them to
+the output archive (or writes them under an output directory). Nothing is
+extracted to a temporary directory.
+"""
+import collections
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import format_sniffing
+from conversion_events import report_start, report_done, report_error, report_progress
+from io_pipeline import ByteBudget
+
+DEFAULT_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ARCHIVE_EXTENSIONS = (".zip",) + TAR_EXTENSIONS
+
+# Outputs that are already compressed gain nothing from deflate; store them as is.
+_STORED_FORMATS = ("gif", "jpeg", "jpg", "png", "webp")
+_TAR_WRITE_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2",
+                    ".tbz2": "w:bz2", ".tar.xz": "w:xz", ".txz": "w:xz"}
+
+
+def is_archive_path(path):
+    """True when path names a zip or tar archive (judged by extension)."""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _tar_extension(path):
+    name = path.lower()
+    # Longest match first so "x.tar.gz" is not taken for plain ".tar".
+    for extension in sorted(TAR_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(extension):
+            return extension
+    return None
+
+
+def _safe_member_name(name):
+    """Normalized relative member name, or None for names that would escape the destination."""
+    name = name.replace("\\", "/")
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if not parts or ".." in parts or name.startswith("/") or ":" in parts[0]:
+        return None
+    return "/".join(parts)
+
+
+def iter_members(archive_path, extensions):
+    """
+    Yields (member_path, member_name, data) for every regular member whose
+    name ends with one of extensions. member_path is "<archive>/<name>", used
+    in reports. Tar archives are read as one forward stream, so even
+    compressed tars are never seeked or extracted.
+    """
+    if archive_path.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(extensions):
+                    yield f"{archive_path}/{info.filename}", info.filename, archive.read(info)
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for info in archive:
+                if info.isfile() and info.name.lower().endswith(extensions):
+                    yield f"{archive_path}/{info.name}", info.name, archive.extractfile(info).read()
+
+
+def iter_files(files, input_root):
+    """
+    Yields (path, member_name, data) for plain files, naming each member by
+    its path relative to input_root. A file that cannot be read yields the
+    OSError as its data, so only that member fails.
+    """
+    for path in files:
+        member_name = os.path.relpath(path, input_root).replace(os.sep, "/")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            data = e
+        yield path, member_name, data
+
+
+def count_members(archive_path, extensions):
+    """Number of matching members for progress reporting, or None when that would need an extra pass over a tar."""
+    if not archive_path.lower().endswith(".zip"):
+        return None
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except (OSError, zipfile.BadZipFile):
+        # Left for iter_members to raise while the conversion is running.
+        return None
+    with archive:
+        return sum(1 for info in archive.infolist() if not info.is_dir() and info.filename.lower().endswith(extensions))
+
+
+class ArchiveWriter(object):
+    """Appends members to a new zip or tar archive. Not thread-safe: used by the single writer thread."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tar_extension = _tar_extension(path)
+        if tar_extension:
+            self._tar = tarfile.open(path, _TAR_WRITE_MODES[tar_extension])
+            self._zip = None
+        else:
+            self._zip = zipfile.ZipFile(path, "w")
+            self._tar = None
+
+    def location(self, name):
+        return f"{self.path}/{name}"
+
+    def add(self, name, buffer, output_format):
+        if self._zip is not None:
+            compression = zipfile.ZIP_STORED if output_format in _STORED_FORMATS else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = compression
+            self._zip.writestr(info, buffer)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(buffer)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(buffer))
+
+    def close(self):
+        (self._zip or self._tar).close()
+
+
+class DirectoryWriter(object):
+    """Writes members as plain files under a directory, keeping their relative paths."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def location(self, name):
+        return os.path.join(self.path, *name.split("/"))
+
+    def add(self, name, buffer, output_format):
+        path = self.location(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(buffer)
+
+    def close(self):
+        pass
+
+
+def open_writer(destination):
+    """An ArchiveWriter when destination is a zip/tar path, otherwise a DirectoryWriter."""
+    if is_archive_path(destination):
+        return ArchiveWriter(destination)
+    return DirectoryWriter(destination)
+
+
+def _output_member_name(member_name, output_format, taken):
+    """
+    The output name for member_name, unique among `taken` (lower-cased names
+    already used, updated here): inputs sharing a stem, like a.gif and a.bmp,
+    become a.png and a_bmp.png instead of shadowing each other.
+    """
+    stem, extension = os.path.splitext(member_name)
+    name = f"{stem}.{output_format}"
+    if name.lower() in taken and extension:
+        name = f"{stem}_{extension[1:]}.{output_format}"
+    base, counter = os.path.splitext(name)[0], 2
+    while name.lower() in taken:
+        name = f"{base}_{counter}.{output_format}"
+        counter += 1
+    taken.add(name.lower())
+    return name
+
+
+def default_destination(archive_path, output_format):
+    """Sibling archive of the same type named after the input and the output format, e.g. photos_webp.zip."""
+    extension = ".zip" if archive_path.lower().endswith(".zip") else _tar_extension(archive_path)
+    stem, extension = archive_path[:-len(extension)], archive_path[-len(extension):]
+    return f"{stem}_{output_format}{extension}"
+
+
+def convert_members(members, destination, output_format, transform, kind="image", workers=None, force=False,
+                    total=None, in_flight_bytes=DEFAULT_IN_FLIGHT_BYTES):
+    """
+    Converts (member_path, member_name, data) items from `members` and writes
+    the results to destination, an archive path or a directory. `data` may
+    instead be the OSError that reading the member raised; that member is
+    reported as an error and the others are still converted.
+
+    transform(member_path, data, output_format, output) decodes `data` and
+    encodes it into the BytesIO `output`; it runs on `workers` threads while
+    the calling thread keeps reading members, bounded by in_flight_bytes of
+    input held in memory. Members whose content is not of `kind`, is already
+    in output_format (unless force), or whose names would escape the
+    destination are skipped. Returns (events in member order, rejected)
+    where rejected is a list of (member_path, reason).
+    """
+    budget = ByteBudget(in_flight_bytes)
+    encoders = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="archive-encode")
+    ready = collections.deque()
+    ready_condition = threading.Condition()
+    results = []
+    rejected = []
+    taken = set()
+    target = format_sniffing.normalize_format(output_format)
+    writer = open_writer(destination)
+
+    def encode(member_path, data):
+        output = io.BytesIO()
+        transform(member_path, data, output_format, output)
+        return output.getbuffer()
+
+    def write_outputs():
+        # The only thread that touches the writer, so members land sequentially and in order.
+        while True:
+            with ready_condition:
+                while not ready:
+                    ready_condition.wait()
+                item = ready.popleft()
+            if item is None:
+                return
+            member_path, output_name, size, started, future, read_error = item
+            if read_error is not None:
+                results.append(report_error(member_path, output_format, read_error, f"Error: Could not read '{member_path}'. Details: {read_error}", started, kind=kind))
+                report_progress(len(results), total, member_path, kind=kind)
+                continue
+            output_path = writer.location(output_name)
+            try:
+                buffer = future.result()
+                writer.add(output_name, buffer, output_format)
+                event = report_done(member_path, output_format, output_path, started, kind=kind, bytes_in=size, bytes_out=len(buffer))
+            except Exception as e:
+                event = report_error(member_path, output_format, e, f"Error: Failed to convert '{member_path}' into '{output_path}'. Details: {e}", started,
+                                     kind=kind, output_path=output_path, bytes_in=size)
+            finally:
+                budget.release(size)
+            results.append(event)
+            report_progress(len(results), total, member_path, kind=kind)
+
+    def enqueue(item):
+        with ready_condition:
+            ready.append(item)
+            ready_condition.notify()
+
+    writer_thread = threading.Thread(target=write_outputs, name="archive-writer")
+    writer_thread.start()
+    try:
+        for member_path, member_name, data in members:
+            safe_name = _safe_member_name(member_name)
+            if safe_name is None:
+                rejected.append((member_path, "member name points outside the archive"))
+                continue
+            if isinstance(data, OSError):
+                enqueue((member_path, None, 0, time.perf_counter(), None, data))
+                continue
+            sniffed_kind, sniffed_format = format_sniffing.sniff_bytes(data[:format_sniffing.SNIFF_BYTES])
+            if sniffed_kind != kind:
+                rejected.append((member_path, f"content is not a recognized {kind} format"))
+                continue
+            if sniffed_format == target and not force:
+                rejected.append((member_path, f"already {target} (use --force to convert anyway)"))
+                continue
+            budget.acquire(len(data))
+            started = time.perf_counter()
+            report_start(member_path, output_format, kind=kind, bytes_in=len(data))
+            enqueue((member_path, _output_member_name(safe_name, output_format, taken), len(data), started, encoders.submit(encode, member_path, data), None))
+            del data
+    finally:
+        enqueue(None)
+        writer_thread.join()
+        encoders.shutdown(wait=True)
+        writer.close()
+    return results, rejected
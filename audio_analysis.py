@@ -0,0 +1,300 @@
+"""
+Waveform and spectrogram rendering from a PCM pipe.
+
+ffmpeg decodes a track to mono 16-bit PCM on stdout (optionally writing a
+converted copy from the same decode), and the samples are consumed in
+fixed-size chunks:
+
+    waveform      min/max peaks per column;
+    spectrogram   power spectra of Hann-windowed STFT frames, averaged per
+                  column.
+
+Both fold their input into at most twice the image width in columns. When
+that fills up, neighbouring columns are merged pairwise and every later
+column covers twice as many samples, so memory stays constant however
+long the track is and no duration probe is needed up front. Pillow then
+renders the columns as PNGs.
+"""
+import collections
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from PIL import Image
+
+import memory_profile
+from conversion_events import report_start, report_done, report_error
+
+try:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    # Analysis needs NumPy; conversions do not.
+    numpy = None
+
+SAMPLE_RATE = 22050
+FFT_SIZE = 1024
+HOP_SIZE = FFT_SIZE // 2
+# Samples read from the pipe per chunk.
+CHUNK_SAMPLES = 1 << 16
+DYNAMIC_RANGE_DB = 80.0
+
+WAVEFORM_SIZE = (1800, 280)
+SPECTROGRAM_SIZE = (1800, 512)
+WAVEFORM_COLOR = (38, 110, 190)
+BACKGROUND_COLOR = (255, 255, 255)
+# Spectrogram palette stops, from silence to the loudest bin.
+SPECTROGRAM_COLORS = ((0, 0, 0), (60, 10, 110), (190, 40, 70), (250, 160, 30), (255, 255, 210))
+
+STDERR_TAIL_LINES = 50
+
+
+class _ColumnReducer(object):
+    """
+    Folds a stream of items into at most 2 * width columns, each column
+    reducing `per_column` consecutive items. reduce(items, axis) collapses
+    items into a column value and combine(a, b) merges two column values.
+    """
+
+    def __init__(self, width, reduce, combine):
+        self.width = width
+        self.reduce = reduce
+        self.combine = combine
+        self.per_column = 1
+        self.columns = None
+        # Column being filled: its value so far and how many items it holds.
+        self.pending = None
+        self.pending_count = 0
+
+    def _append(self, columns):
+        self.columns = columns if self.columns is None else numpy.concatenate((self.columns, columns))
+
+    def _halve(self):
+        columns = self.columns
+        paired = len(columns) - len(columns) % 2
+        self.columns = self.combine(columns[0:paired:2], columns[1:paired:2])
+        if paired < len(columns):
+            # The odd column out is the first half of the new, wider pending column.
+            last = columns[-1]
+            self.pending = last if not self.pending_count else self.combine(last, self.pending)
+            self.pending_count += self.per_column
+        self.per_column *= 2
+
+    def feed(self, items):
+        if self.pending_count:
+            take = min(self.per_column - self.pending_count, len(items))
+            if take:
+                self.pending = self.combine(self.pending, self.reduce(items[:take], 0))
+                self.pending_count += take
+                items = items[take:]
+            if self.pending_count < self.per_column:
+                return
+            self._append(self.pending[numpy.newaxis])
+            self.pending, self.pending_count = None, 0
+        full = len(items) - len(items) % self.per_column
+        if full:
+            self._append(self.reduce(items[:full].reshape((-1, self.per_column) + items.shape[1:]), 1))
+        if full < len(items):
+            self.pending = self.reduce(items[full:], 0)
+            self.pending_count = len(items) - full
+        while self.columns is not None and len(self.columns) > 2 * self.width:
+            self._halve()
+
+    def finish(self):
+        """Returns (columns, counts): every column value and the number of items it covers, or (None, None) if nothing was fed."""
+        columns = self.columns
+        if self.pending_count:
+            columns = self.pending[numpy.newaxis] if columns is None else numpy.concatenate((columns, self.pending[numpy.newaxis]))
+        if columns is None:
+            return None, None
+        counts = numpy.full(len(columns), self.per_column)
+        if self.pending_count:
+            counts[-1] = self.pending_count
+        return columns, counts
+
+
+def _peak_reduce(samples, axis):
+    return numpy.stack((samples.min(axis), samples.max(axis)), -1)
+
+
+def _peak_combine(a, b):
+    return numpy.stack((numpy.minimum(a[..., 0], b[..., 0]), numpy.maximum(a[..., 1], b[..., 1])), -1)
+
+
+class _Analyzer(object):
+    """Consumes int16 sample chunks and keeps waveform peaks and STFT power columns."""
+
+    def __init__(self, width):
+        self.peaks = _ColumnReducer(width, _peak_reduce, _peak_combine)
+        self.spectra = _ColumnReducer(width, lambda items, axis: items.sum(axis), numpy.add)
+        self.window = numpy.hanning(FFT_SIZE).astype(numpy.float32)
+        self.tail = numpy.zeros(0, dtype=numpy.float32)
+
+    def feed(self, samples):
+        self.peaks.feed(samples)
+        # Frames overlap by FFT_SIZE - HOP_SIZE samples, so keep the unconsumed tail for the next chunk.
+        signal = numpy.concatenate((self.tail, samples.astype(numpy.float32) / 32768.0))
+        frames = (len(signal) - FFT_SIZE) // HOP_SIZE + 1 if len(signal) >= FFT_SIZE else 0
+        if frames:
+            windows = sliding_window_view(signal, FFT_SIZE)[::HOP_SIZE][:frames]
+            spectrum = numpy.fft.rfft(windows * self.window, axis=1)
+            self.spectra.feed((spectrum.real ** 2 + spectrum.imag ** 2).astype(numpy.float32))
+        self.tail = signal[frames * HOP_SIZE:]
+
+
+def _column_edges(count, width):
+    # Start index of the columns that make up each output pixel column; repeats when count < width.
+    return (numpy.arange(width) * count) // width
+
+
+def _gradient(stops):
+    positions = numpy.linspace(0, 255, len(stops))
+    channels = [numpy.interp(numpy.arange(256), positions, [stop[channel] for stop in stops]) for channel in range(3)]
+    return numpy.stack(channels, -1).round().astype(numpy.uint8).ravel().tolist()
+
+
+def render_waveform(peaks, size=WAVEFORM_SIZE, color=WAVEFORM_COLOR, background=BACKGROUND_COLOR):
+    """Renders (n, 2) int16 min/max peaks as a size[0] x size[1] palette image."""
+    width, height = size
+    edges = _column_edges(len(peaks), width)
+    lows = numpy.minimum.reduceat(peaks[:, 0], edges).astype(numpy.float32)
+    highs = numpy.maximum.reduceat(peaks[:, 1], edges).astype(numpy.float32)
+    # Row of a sample value: 32767 at the top, -32768 at the bottom, silence exactly in the middle.
+    scale = (height - 1) / 65535.0
+    top = numpy.floor((32767.5 - highs) * scale)
+    bottom = numpy.ceil((32767.5 - lows) * scale)
+    rows = numpy.arange(height, dtype=numpy.float32)[:, numpy.newaxis]
+    mask = ((rows >= top) & (rows <= bottom)).astype(numpy.uint8)
+    image = Image.frombuffer("P", size, mask, "raw", "P", 0, 1)
+    image.putpalette(list(background) + list(color))
+    return image
+
+
+def render_spectrogram(power, counts, size=SPECTROGRAM_SIZE):
+    """Renders (n, bins) summed power spectra covering `counts` frames each, low frequencies at the bottom."""
+    edges = _column_edges(len(power), size[0])
+    mean = numpy.add.reduceat(power, edges, axis=0) / numpy.add.reduceat(counts, edges)[:, numpy.newaxis]
+    decibels = 10.0 * numpy.log10(mean + 1e-12)
+    decibels -= decibels.max()
+    levels = numpy.clip((decibels + DYNAMIC_RANGE_DB) * (255.0 / DYNAMIC_RANGE_DB), 0, 255).astype(numpy.uint8)
+    pixels = numpy.ascontiguousarray(levels.T[::-1])
+    image = Image.frombuffer("L", (pixels.shape[1], pixels.shape[0]), pixels, "raw", "L", 0, 1)
+    # Smooth in grayscale first; palette images can only be resized with NEAREST.
+    image = image.resize(size, Image.BILINEAR)
+    image.putpalette(_gradient(SPECTROGRAM_COLORS))
+    return image
+
+
+def analysis_paths(input_path, output_dir):
+    """Waveform and spectrogram PNG paths for input_path, in output_dir."""
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    return (os.path.join(output_dir, f"{base_name}_waveform.png"),
+            os.path.join(output_dir, f"{base_name}_spectrogram.png"))
+
+
+def analysis_command(ffmpeg_path, input_path, conversion_path=None):
+    """One ffmpeg decode: optionally converting to conversion_path, always streaming mono s16le PCM to stdout."""
+    command = [ffmpeg_path, "-nostdin", "-v", "error", "-y", "-i", input_path]
+    if conversion_path:
+        command.append(conversion_path)
+    command += ["-map", "0:a:0", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"]
+    return command
+
+
+def _creationflags():
+    return subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+
+def _drain(stream, tail):
+    for line in iter(stream.readline, b""):
+        tail.append(line.decode("utf-8", errors="replace").rstrip())
+    stream.close()
+
+
+def _read_chunk(stream, view):
+    """Fills view from stream until it is full or the stream ends; returns the number of bytes read."""
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+def analyze_audio(input_path, output_dir, ffmpeg_path, conversion_path=None, waveform_size=WAVEFORM_SIZE, spectrogram_size=SPECTROGRAM_SIZE):
+    """
+    Writes <name>_waveform.png and <name>_spectrogram.png for input_path to
+    output_dir. With conversion_path, the same ffmpeg run also converts the
+    track there. Returns the final conversion event; its output_path is the
+    converted file if there is one, otherwise the waveform.
+    """
+    output_format = os.path.splitext(conversion_path)[1].lstrip(".") if conversion_path else "png"
+    waveform_path, spectrogram_path = analysis_paths(input_path, output_dir)
+    started = time.perf_counter()
+    if numpy is None:
+        return report_error(input_path, output_format, ImportError, "Error: Audio analysis needs NumPy (pip install numpy).", started, kind="audio")
+    bytes_in = None
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+    process = None
+    try:
+        bytes_in = os.path.getsize(input_path)
+        report_start(input_path, output_format, kind="audio", bytes_in=bytes_in)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        command = analysis_command(ffmpeg_path, input_path, conversion_path)
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+                                   creationflags=_creationflags())
+        drainer = threading.Thread(target=_drain, args=(process.stderr, stderr_tail), daemon=True)
+        drainer.start()
+
+        analyzer = _Analyzer(max(waveform_size[0], spectrogram_size[0]))
+        buffer = bytearray(CHUNK_SAMPLES * 2)
+        view = memoryview(buffer)
+        carry = 0
+        while True:
+            filled = carry + _read_chunk(process.stdout, view[carry:])
+            if filled == carry:
+                break
+            usable = filled - filled % 2
+            # The chunk buffer is reused, so the analyzer only keeps reductions of it, never the samples themselves.
+            analyzer.feed(numpy.frombuffer(buffer, dtype="<i2", count=usable // 2))
+            carry = filled - usable
+            if carry:
+                buffer[0] = buffer[usable]
+        memory_profile.wait(process, input_path, "audio", output_format)
+        drainer.join()
+        stderr = "\n".join(stderr_tail)
+        result_path = conversion_path or waveform_path
+        if process.returncode != 0:
+            error = subprocess.CalledProcessError(process.returncode, command)
+            return report_error(input_path, output_format, error, f"Error during audio analysis with ffmpeg: {error}", started,
+                                kind="audio", output_path=result_path, bytes_in=bytes_in, stderr=stderr)
+        peaks, _ = analyzer.peaks.finish()
+        power, counts = analyzer.spectra.finish()
+        if peaks is None:
+            return report_error(input_path, output_format, "NoAudio", f"Error: No audio could be decoded from '{input_path}'.", started,
+                                kind="audio", output_path=result_path, bytes_in=bytes_in, stderr=stderr)
+        render_waveform(peaks, waveform_size).save(waveform_path, format="PNG")
+        written = [waveform_path]
+        if power is not None:
+            # Tracks shorter than one FFT frame get a waveform only.
+            render_spectrogram(power, counts, spectrogram_size).save(spectrogram_path, format="PNG")
+            written.append(spectrogram_path)
+        if conversion_path:
+            written.append(conversion_path)
+        return report_done(input_path, output_format, result_path, started, kind="audio", bytes_in=bytes_in,
+                           bytes_out=sum(os.path.getsize(path) for path in written), stderr=stderr)
+    except FileNotFoundError as e:
+        return report_error(input_path, output_format, e, f"Error: The input file '{input_path}' was not found.", started, kind="audio")
+    except Exception as e:
+        return report_error(input_path, output_format, e, f"An unexpected error occurred during audio analysis: {e}", started,
+                            kind="audio", output_path=conversion_path or waveform_path, bytes_in=bytes_in, stderr="\n".join(stderr_tail))
+    finally:
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
@@ -0,0 +1,247 @@
+"""
+Adaptive concurrency for batch runners.
+
+No fixed worker count suits every batch: small PNGs are I/O-bound and
+want dozens of workers, 4K transcodes saturate the CPU with two. With
+--autotune the batch runners start at the CPU count and an Autotuner
+adjusts how many jobs may run at once, every `interval` seconds, by hill
+climbing on completed jobs per second:
+
+    memory headroom below MIN_MEMORY_HEADROOM   shrink;
+    throughput rose                             keep moving the same way;
+    throughput fell                             reverse direction;
+    throughput flat, CPU saturated              shrink;
+    throughput flat otherwise                   keep probing.
+
+CPU utilization and I/O wait come from /proc/stat and memory headroom from
+/proc/meminfo; where those do not exist the tuner climbs on throughput
+alone. Every change of the limit is logged as a summary event with the
+measurements behind it.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conversion_events import report_summary
+
+DEFAULT_MIN_WORKERS = 1
+DEFAULT_MAX_WORKERS = 64
+DEFAULT_INTERVAL = 2.0
+# Relative throughput changes smaller than this are treated as noise.
+TOLERANCE = 0.05
+MIN_MEMORY_HEADROOM = 0.10
+CPU_SATURATED = 0.95
+
+_settings = {"enabled": False, "min_workers": DEFAULT_MIN_WORKERS, "max_workers": DEFAULT_MAX_WORKERS, "interval": DEFAULT_INTERVAL}
+
+
+class SystemSampler(object):
+    """Samples (cpu_utilization, io_wait, memory_headroom) as fractions since the previous sample; None where unknown."""
+
+    def __init__(self, proc_root="/proc"):
+        self.proc_root = proc_root
+        self._previous = self._cpu_times()
+
+    def _cpu_times(self):
+        try:
+            with open(os.path.join(self.proc_root, "stat")) as stat:
+                fields = [int(value) for value in stat.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # user nice system idle iowait irq softirq steal ...
+        return sum(fields[:8]), fields[3], fields[4]
+
+    def _memory_headroom(self):
+        values = {}
+        try:
+            with open(os.path.join(self.proc_root, "meminfo")) as meminfo:
+                for line in meminfo:
+                    name, _, rest = line.partition(":")
+                    if name in ("MemTotal", "MemAvailable"):
+                        values[name] = int(rest.split()[0])
+        except (OSError, ValueError):
+            return None
+        if not values.get("MemTotal") or "MemAvailable" not in values:
+            return None
+        return values["MemAvailable"] / values["MemTotal"]
+
+    def sample(self):
+        current = self._cpu_times()
+        cpu = io_wait = None
+        if current is not None and self._previous is not None:
+            total = current[0] - self._previous[0]
+            if total > 0:
+                idle = current[1] - self._previous[1]
+                io_wait = (current[2] - self._previous[2]) / total
+                cpu = 1.0 - (idle + current[2] - self._previous[2]) / total
+        self._previous = current
+        return cpu, io_wait, self._memory_headroom()
+
+
+class Decision(object):
+    """One tuning step: the limit before and after, why, and the measurements it was based on."""
+
+    def __init__(self, before, after, reason, throughput, cpu, io_wait, memory_headroom):
+        self.before = before
+        self.after = after
+        self.reason = reason
+        self.throughput = throughput
+        self.cpu = cpu
+        self.io_wait = io_wait
+        self.memory_headroom = memory_headroom
+
+    def describe(self):
+        measurements = [f"{self.throughput:.2f} jobs/s"]
+        for label, value in (("CPU", self.cpu), ("I/O wait", self.io_wait), ("memory free", self.memory_headroom)):
+            if value is not None:
+                measurements.append(f"{label} {value:.0%}")
+        return f"Autotune: {self.before} -> {self.after} workers ({self.reason}; {', '.join(measurements)})"
+
+
+class Autotuner(object):
+    """
+    Hill-climbing controller for the number of concurrently running jobs.
+    Runners read `limit`, call record_completion() after each job and
+    step() every `interval` seconds.
+    """
+
+    def __init__(self, min_workers=DEFAULT_MIN_WORKERS, max_workers=DEFAULT_MAX_WORKERS, initial=None, interval=DEFAULT_INTERVAL,
+                 sampler=None, clock=time.monotonic, log=None):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = self._clamp(initial or os.cpu_count() or 4)
+        self.interval = interval
+        self.sampler = sampler or SystemSampler()
+        self.clock = clock
+        self.log = log if log is not None else report_summary
+        self.decisions = []
+        self._direction = 1
+        self._previous_throughput = None
+        self._completed = 0
+        self._measured_completed = 0
+        self._measured_at = clock()
+        self._lock = threading.Lock()
+
+    def _clamp(self, workers):
+        return max(self.min_workers, min(self.max_workers, workers))
+
+    def record_completion(self):
+        with self._lock:
+            self._completed += 1
+
+    def step(self):
+        """Measures the last interval, moves the limit and returns the Decision."""
+        now = self.clock()
+        with self._lock:
+            completed = self._completed - self._measured_completed
+            self._measured_completed = self._completed
+        elapsed = max(now - self._measured_at, 1e-9)
+        self._measured_at = now
+        throughput = completed / elapsed
+        cpu, io_wait, memory_headroom = self.sampler.sample()
+        previous = self._previous_throughput
+        self._previous_throughput = throughput
+
+        if memory_headroom is not None and memory_headroom < MIN_MEMORY_HEADROOM:
+            self._direction = -1
+            reason = f"memory headroom below {MIN_MEMORY_HEADROOM:.0%}"
+        elif previous is None:
+            reason = "first measurement, probing"
+        elif throughput > previous * (1 + TOLERANCE) and throughput > 0:
+            reason = f"throughput rose from {previous:.2f} jobs/s, continuing"
+        elif throughput < previous * (1 - TOLERANCE):
+            self._direction = -self._direction
+            reason = f"throughput fell from {previous:.2f} jobs/s, reversing"
+        elif cpu is not None and cpu >= CPU_SATURATED:
+            self._direction = -1
+            reason = "CPU saturated without a throughput gain"
+        else:
+            reason = "throughput flat, probing"
+
+        before = self.limit
+        self.limit = self._clamp(before + self._direction * max(1, round(before / 4)))
+        if self.limit == before:
+            # At a bound; the next probe has to go the other way.
+            self._direction = -self._direction
+        decision = Decision(before, self.limit, reason, throughput, cpu, io_wait, memory_headroom)
+        self.decisions.append(decision)
+        if self.limit != before:
+            self.log(decision.describe())
+        return decision
+
+
+class ThreadSlots(object):
+    """Admits at most tuner.limit concurrent holders; the limit may change at any time."""
+
+    def __init__(self, tuner):
+        self.tuner = tuner
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= self.tuner.limit:
+                self._condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def notify(self):
+        """Wakes waiters after the limit changed."""
+        with self._condition:
+            self._condition.notify_all()
+
+
+def map_adaptive(function, items, tuner):
+    """
+    Calls function(item) for every item on a thread pool whose number of
+    concurrently running calls follows `tuner`, and returns the results in
+    item order.
+    """
+    slots = ThreadSlots(tuner)
+    stop = threading.Event()
+
+    def tune():
+        while not stop.wait(tuner.interval):
+            tuner.step()
+            slots.notify()
+
+    def run(item):
+        try:
+            return function(item)
+        finally:
+            tuner.record_completion()
+            slots.release()
+
+    tuning = threading.Thread(target=tune, name="autotune", daemon=True)
+    tuning.start()
+    try:
+        with ThreadPoolExecutor(max_workers=tuner.max_workers, thread_name_prefix="autotuned") as pool:
+            futures = []
+            for item in items:
+                slots.acquire()
+                futures.append(pool.submit(run, item))
+            return [future.result() for future in futures]
+    finally:
+        stop.set()
+        tuning.join()
+
+
+def configure(enabled=False, min_workers=DEFAULT_MIN_WORKERS, max_workers=DEFAULT_MAX_WORKERS, interval=DEFAULT_INTERVAL):
+    """Turns autotuning of batch concurrency on or off and sets its limits."""
+    _settings.update(enabled=enabled, min_workers=min_workers, max_workers=max_workers, interval=interval)
+
+
+def enabled():
+    return _settings["enabled"]
+
+
+def new_tuner(initial=None):
+    """A fresh Autotuner with the configured limits, or None when autotuning is off."""
+    if not _settings["enabled"]:
+        return None
+    return Autotuner(_settings["min_workers"], _settings["max_workers"], initial, _settings["interval"])
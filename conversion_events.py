@@ -0,0 +1,204 @@
+"""
+Structured conversion events.
+
+Every conversion reports what it is doing as a small event record
+(start, progress, done, error, summary). Sinks subscribe to those events:
+the text sink renders the familiar human-readable messages and the JSONL
+sink writes one JSON object per line for machine consumers. Emission is
+kept cheap: events are slotted objects and nothing is formatted unless a
+sink actually wants the event.
+"""
+import json
+import sys
+import threading
+import time
+
+EVENT_START = "start"
+EVENT_PROGRESS = "progress"
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+EVENT_SUMMARY = "summary"
+
+OUTPUT_FORMATS = ["text", "jsonl"]
+
+
+class ConversionEvent(object):
+    """A single conversion event. Unset fields stay None and are not serialized."""
+
+    __slots__ = ("event", "kind", "path", "format", "output_path", "bytes_in", "bytes_out",
+                 "duration", "error", "message", "stdout", "stderr", "completed", "total",
+                 "eta", "timestamp")
+
+    def __init__(self, event, path=None, format=None, kind=None, output_path=None, bytes_in=None,
+                 bytes_out=None, duration=None, error=None, message=None, stdout=None, stderr=None,
+                 completed=None, total=None, eta=None):
+        self.event = event
+        self.kind = kind
+        self.path = path
+        self.format = format
+        self.output_path = output_path
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.duration = duration
+        self.error = error
+        self.message = message
+        self.stdout = stdout
+        self.stderr = stderr
+        self.completed = completed
+        self.total = total
+        self.eta = eta
+        self.timestamp = time.time()
+
+    @property
+    def ok(self):
+        return self.event == EVENT_DONE
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    @classmethod
+    def from_dict(cls, fields):
+        """Rebuilds an event serialized with to_dict (e.g. one received from another process)."""
+        event = cls(fields["event"])
+        for name in cls.__slots__:
+            if name in fields:
+                setattr(event, name, fields[name])
+        return event
+
+
+class TextSink(object):
+    """Renders events as the human-readable messages printed by the converters."""
+
+    events = frozenset((EVENT_DONE, EVENT_ERROR, EVENT_SUMMARY))
+
+    def handle(self, event):
+        if event.event == EVENT_DONE:
+            print(f"Success! Converted '{event.path}' to '{event.output_path}'.")
+            if event.stdout is not None:
+                print("FFmpeg stdout:", event.stdout)
+            if event.stderr:
+                print("FFmpeg stderr:", event.stderr)
+        elif event.event == EVENT_ERROR:
+            print(event.message)
+            if event.stdout is not None or event.stderr is not None:
+                print("FFmpeg stdout:", event.stdout)
+                print("FFmpeg stderr:", event.stderr)
+        elif event.message:
+            print(event.message)
+
+    def close(self):
+        pass
+
+
+class JsonlSink(object):
+    """Writes every event as one JSON object per line to a stream or file."""
+
+    events = frozenset((EVENT_START, EVENT_PROGRESS, EVENT_DONE, EVENT_ERROR, EVENT_SUMMARY))
+
+    def __init__(self, stream=None, path=None):
+        self._owns_stream = path is not None
+        self._stream = open(path, "a", encoding="utf-8") if path is not None else stream
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        # One write per line under a lock so lines from concurrent workers never interleave.
+        line = json.dumps(event.to_dict(), separators=(",", ":")) + "\n"
+        stream = self._stream if self._stream is not None else sys.stdout
+        with self._lock:
+            stream.write(line)
+            stream.flush()
+
+    def close(self):
+        if self._owns_stream:
+            self._stream.close()
+
+
+_sinks = [TextSink()]
+_wanted = set(TextSink.events)
+
+
+def set_sinks(sinks):
+    """Replaces the active sinks, closing the previous ones."""
+    global _sinks, _wanted
+    old_sinks = _sinks
+    _sinks = list(sinks)
+    _wanted = set()
+    for sink in _sinks:
+        _wanted.update(sink.events)
+    for sink in old_sinks:
+        if sink not in _sinks:
+            sink.close()
+
+
+def get_sinks():
+    return list(_sinks)
+
+
+def configure_output(output_format="text", events_file=None, stdout=True):
+    """
+    Configures the sinks for a CLI run. `output_format` decides what goes to
+    stdout; `events_file`, when given, additionally receives the JSONL stream.
+    With stdout=False nothing is written to stdout, which carries other
+    output (e.g. manifest results).
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{output_format}'. Supported formats are: {','.join(OUTPUT_FORMATS)}")
+    if not stdout:
+        sinks = []
+    else:
+        sinks = [TextSink()] if output_format == "text" else [JsonlSink()]
+    if events_file:
+        sinks.append(JsonlSink(path=events_file))
+    set_sinks(sinks)
+
+
+def wants(event_type):
+    return event_type in _wanted
+
+
+def emit(event):
+    for sink in _sinks:
+        if event.event in sink.events:
+            sink.handle(event)
+    return event
+
+
+def report_start(path, output_format, kind=None, bytes_in=None):
+    if EVENT_START not in _wanted:
+        return None
+    return emit(ConversionEvent(EVENT_START, path, output_format, kind=kind, bytes_in=bytes_in))
+
+
+def report_progress(completed, total, path=None, kind=None, eta=None):
+    """Emits a progress event; eta is the estimated number of seconds left in the batch, when known."""
+    if EVENT_PROGRESS not in _wanted:
+        return None
+    return emit(ConversionEvent(EVENT_PROGRESS, path, kind=kind, completed=completed, total=total,
+                                eta=round(eta, 1) if eta is not None else None))
+
+
+def report_done(path, output_format, output_path, started, kind=None, bytes_in=None, bytes_out=None,
+                stdout=None, stderr=None):
+    """Emits a done event. The event is always returned so callers can use it as a result."""
+    event = ConversionEvent(EVENT_DONE, path, output_format, kind=kind, output_path=output_path,
+                            bytes_in=bytes_in, bytes_out=bytes_out,
+                            duration=time.perf_counter() - started, stdout=stdout, stderr=stderr)
+    return emit(event)
+
+
+def report_error(path, output_format, error, message, started, kind=None, output_path=None,
+                 bytes_in=None, stdout=None, stderr=None):
+    """
+    Emits an error event. `error` is the exception (or its class name) and
+    `message` the human-readable text shown by the text sink.
+    """
+    if not isinstance(error, str):
+        error = type(error).__name__ if not isinstance(error, type) else error.__name__
+    event = ConversionEvent(EVENT_ERROR, path, output_format, kind=kind, output_path=output_path,
+                            bytes_in=bytes_in, duration=time.perf_counter() - started,
+                            error=error, message=message, stdout=stdout, stderr=stderr)
+    return emit(event)
+
+
+def report_summary(message, completed=None, total=None, kind=None):
+    return emit(ConversionEvent(EVENT_SUMMARY, kind=kind, message=message, completed=completed, total=total))
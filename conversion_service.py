@@ -0,0 +1,279 @@
+"""
+Local HTTP conversion service.
+
+Exposes the image/audio/video converters over HTTP on localhost so callers
+can convert many files without paying process startup for each one:
+
+    POST /convert/<kind>?format=<fmt>&filename=<name>   body: the input file
+    GET  /health
+    GET  /metrics
+
+Uploads are streamed to a temporary file (Content-Length or chunked), the
+conversion runs on a warm worker pool and the result is streamed back on the
+same keep-alive connection. When every worker is busy and the wait queue is
+full the service answers 429 instead of piling up work.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 16
+COPY_BUFFER_SIZE = 1024 * 1024
+
+CONTENT_TYPES = {
+    "bmp": "image/bmp", "gif": "image/gif", "ico": "image/x-icon", "jpeg": "image/jpeg",
+    "jpg": "image/jpeg", "png": "image/png", "pdf": "application/pdf", "tiff": "image/tiff",
+    "webp": "image/webp", "mp3": "audio/mpeg", "wav": "audio/wav", "flac": "audio/flac",
+    "ogg": "audio/ogg", "aac": "audio/aac", "mp4": "video/mp4", "avi": "video/x-msvideo",
+    "mov": "video/quicktime", "mkv": "video/x-matroska", "flv": "video/x-flv", "webm": "video/webm",
+}
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class ConversionService(object):
+    """
+    Holds the warm worker pool, the admission limit and the metrics.
+    `converters` maps a kind ("image", "audio", "video") to a pair of
+    (convert_function, supported_formats); convert_function(input_path,
+    output_format) must return a conversion event.
+    """
+
+    def __init__(self, converters, workers=None, queue_size=DEFAULT_QUEUE_SIZE):
+        self.converters = converters
+        self.workers = workers or os.cpu_count() or 4
+        self.queue_size = queue_size
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="convert")
+        # Running plus waiting conversions; anything beyond this is rejected with 429.
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.metrics = {
+            "requests": 0, "completed": 0, "failed": 0, "rejected": 0,
+            "in_flight": 0, "bytes_in": 0, "bytes_out": 0, "convert_seconds": 0.0,
+        }
+        self._warm_up()
+
+    def _warm_up(self):
+        # Start every worker thread now so the first requests don't pay for it.
+        barrier = threading.Barrier(self.workers + 1)
+        for _ in range(self.workers):
+            self._pool.submit(barrier.wait)
+        barrier.wait()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.metrics[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        metrics["workers"] = self.workers
+        metrics["queue_size"] = self.queue_size
+        metrics["uptime_seconds"] = round(time.time() - self._started, 3)
+        return metrics
+
+    def admit(self):
+        if not self._slots.acquire(blocking=False):
+            self.count("rejected")
+            raise ServiceBusy()
+        self.count("in_flight")
+
+    def release(self):
+        self.count("in_flight", -1)
+        self._slots.release()
+
+    def convert(self, kind, input_path, output_format):
+        """Runs one conversion on the worker pool and waits for its event."""
+        convert_function = self.converters[kind][0]
+        started = time.perf_counter()
+        event = self._pool.submit(convert_function, input_path, output_format).result()
+        self.count("convert_seconds", time.perf_counter() - started)
+        return event
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MediaConverter"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/metrics":
+            self._send_json(200, service.snapshot())
+        else:
+            self._send_json(404, {"error": "NotFound", "message": f"Unknown endpoint '{path}'."})
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        query = parse_qs(url.query)
+        service.count("requests")
+
+        if len(parts) != 2 or parts[0] != "convert" or parts[1] not in service.converters:
+            self._discard_body()
+            return self._send_json(404, {"error": "NotFound", "message": f"Unknown endpoint '{url.path}'. Use /convert/<{'|'.join(service.converters)}>."})
+        kind = parts[1]
+        output_format = query.get("format", [""])[0].lower()
+        supported_formats = service.converters[kind][1]
+        if output_format not in supported_formats:
+            self._discard_body()
+            return self._send_json(400, {"error": "UnsupportedFormat", "message": f"Unsupported {kind} output format '{output_format}'. Supported formats are: {','.join(supported_formats)}"})
+
+        try:
+            service.admit()
+        except ServiceBusy:
+            # Don't read the upload: tell the client to back off and drop the connection.
+            self.close_connection = True
+            return self._send_json(429, {"error": "ServiceBusy", "message": "All workers are busy and the queue is full. Retry later."}, {"Retry-After": "1", "Connection": "close"})
+
+        work_dir = tempfile.mkdtemp(prefix="media_converter_")
+        try:
+            filename = os.path.basename(query.get("filename", [f"upload.{kind}"])[0]) or f"upload.{kind}"
+            input_path = os.path.join(work_dir, filename)
+            with open(input_path, "wb") as upload:
+                service.count("bytes_in", self._receive_body(upload))
+
+            event = service.convert(kind, input_path, output_format)
+            if event is None or not event.ok:
+                service.count("failed")
+                error = getattr(event, "error", None) or "ConversionError"
+                message = getattr(event, "message", None) or "Conversion failed."
+                return self._send_json(422, {"error": error, "message": message})
+
+            size = os.path.getsize(event.output_path)
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPES.get(output_format, "application/octet-stream"))
+            self.send_header("Content-Length", str(size))
+            self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(event.output_path)}"')
+            self.end_headers()
+            with open(event.output_path, "rb") as result:
+                shutil.copyfileobj(result, self.wfile, COPY_BUFFER_SIZE)
+            service.count("bytes_out", size)
+            service.count("completed")
+        except ValueError as e:
+            service.count("failed")
+            self.close_connection = True
+            self._send_json(400, {"error": "BadRequest", "message": str(e)}, {"Connection": "close"})
+        finally:
+            service.release()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _receive_body(self, destination):
+        """Streams the request body into destination and returns its size."""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            return self._receive_chunked(destination)
+        length = self._content_length()
+        if length is None:
+            raise ValueError("The request needs a Content-Length header or chunked transfer encoding.")
+        remaining = length
+        while remaining:
+            chunk = self.rfile.read(min(remaining, COPY_BUFFER_SIZE))
+            if not chunk:
+                raise ValueError("The upload ended before Content-Length bytes were received.")
+            destination.write(chunk)
+            remaining -= len(chunk)
+        return length
+
+    def _content_length(self):
+        """The Content-Length header as an int, or None when absent. Raises ValueError unless it is a non-negative integer."""
+        length = self.headers.get("Content-Length")
+        if length is None:
+            return None
+        # A negative length would make rfile.read() read until the client closes the connection.
+        if not length.strip().isdigit():
+            raise ValueError(f"Invalid Content-Length '{length}': it must be a non-negative integer.")
+        return int(length)
+
+    def _receive_chunked(self, destination):
+        total = 0
+        while True:
+            size_line = self.rfile.readline(1024)
+            try:
+                size = int(size_line.split(b";")[0].strip(), 16)
+            except ValueError:
+                raise ValueError("Malformed chunk size in chunked upload.")
+            if size < 0:
+                raise ValueError("Malformed chunk size in chunked upload.")
+            if size == 0:
+                # Skip optional trailers up to the terminating blank line.
+                while self.rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+                    pass
+                return total
+            remaining = size
+            while remaining:
+                chunk = self.rfile.read(min(remaining, COPY_BUFFER_SIZE))
+                if not chunk:
+                    raise ValueError("The chunked upload ended unexpectedly.")
+                destination.write(chunk)
+                remaining -= len(chunk)
+            total += size
+            self.rfile.readline(1024)
+
+    def _discard_body(self):
+        try:
+            length = self._content_length() or 0
+        except ValueError:
+            # The body's end cannot be found, so the connection cannot be reused.
+            self.close_connection = True
+            return
+        if length and length <= COPY_BUFFER_SIZE:
+            self.rfile.read(length)
+        elif length or self.headers.get("Transfer-Encoding"):
+            self.close_connection = True
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ConversionHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.service = service
+        super().__init__((host, port), ConversionRequestHandler)
+
+
+def create_server(converters, port=DEFAULT_PORT, workers=None, queue_size=DEFAULT_QUEUE_SIZE, host=DEFAULT_HOST):
+    """Creates (but does not start) a service bound to localhost. Port 0 picks a free port."""
+    return ConversionHTTPServer(ConversionService(converters, workers, queue_size), host, port)
+
+
+def serve(converters, port=DEFAULT_PORT, workers=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """Runs the conversion service on localhost until interrupted."""
+    server = create_server(converters, port, workers, queue_size)
+    host, port = server.server_address[:2]
+    print(f"Serving media conversions on http://{host}:{port} with {server.service.workers} workers (queue size {queue_size}). Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
@@ -0,0 +1,230 @@
+"""
+Duplicate-input detection.
+
+Byte-identical inputs only need to be converted once. Candidates are grouped
+by size first (a stat per file), then by a BLAKE2 hash of their first block,
+and only files that still collide are hashed in full. One representative per
+group is converted and its output is reflinked, hardlinked or copied to the
+other output locations.
+
+An optional perceptual hash (dHash) reports visually near-identical images
+that are not byte-identical; those are reported only, never merged. The
+hashes are taken from the images the converters decode anyway, and only
+pairs that share some bands of hash bits are compared (see find_near_duplicates).
+"""
+import contextlib
+import hashlib
+import itertools
+import os
+import shutil
+import sys
+
+HEAD_BYTES = 64 * 1024
+CHUNK_BYTES = 1024 * 1024
+LINK_MODES = ["auto", "reflink", "hardlink", "copy"]
+# Maximum Hamming distance between 64-bit dHashes to call two images near-duplicates.
+DEFAULT_NEAR_DUPLICATE_DISTANCE = 4
+
+# path -> dHash of the images decoded while collecting_hashes() is active, else None.
+_collected_hashes = None
+
+# FICLONE from <linux/fs.h>: share the source file's extents copy-on-write.
+_FICLONE = 0x40049409
+
+
+def _hash_file(path, limit=None):
+    digest = hashlib.blake2b(digest_size=20)
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_BYTES if remaining is None else min(CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.digest()
+
+
+def _split_by(paths, key):
+    groups = {}
+    for path in paths:
+        try:
+            groups.setdefault(key(path), []).append(path)
+        except OSError:
+            # Unreadable files are left to the converter to report.
+            groups.setdefault(("unreadable", path), []).append(path)
+    return groups.values()
+
+
+def find_duplicate_groups(files):
+    """
+    Groups byte-identical files. Returns a list of groups in input order, each
+    a list of paths whose first entry is the representative; unique files form
+    single-entry groups.
+    """
+    order = {path: index for index, path in enumerate(files)}
+    groups = []
+    for same_size in _split_by(files, os.path.getsize):
+        if len(same_size) == 1:
+            groups.append(same_size)
+            continue
+        for same_head in _split_by(same_size, lambda path: _hash_file(path, HEAD_BYTES)):
+            if len(same_head) == 1 or os.path.getsize(same_head[0]) <= HEAD_BYTES:
+                groups.append(same_head)
+                continue
+            groups.extend(_split_by(same_head, _hash_file))
+    for group in groups:
+        group.sort(key=order.__getitem__)
+    groups.sort(key=lambda group: order[group[0]])
+    return groups
+
+
+def _reflink(source, destination):
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflinks are only supported on Linux")
+    import fcntl
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def materialize_copy(source, destination, mode="auto"):
+    """
+    Places a copy of source at destination using `mode` (reflink, hardlink or
+    copy). "auto" tries a reflink, then a hardlink, then a plain copy.
+    Returns the method that worked.
+    """
+    directory = os.path.dirname(destination)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.lexists(destination):
+        os.remove(destination)
+    attempts = ["reflink", "hardlink", "copy"] if mode == "auto" else [mode]
+    for attempt in attempts:
+        try:
+            if attempt == "reflink":
+                _reflink(source, destination)
+            elif attempt == "hardlink":
+                os.link(source, destination)
+            else:
+                shutil.copyfile(source, destination)
+            return attempt
+        except OSError:
+            if attempt == attempts[-1]:
+                raise
+    return None
+
+
+def image_dhash(image, hash_size=8):
+    """64-bit difference hash of an opened image: compares neighbouring pixels of a tiny grayscale thumbnail."""
+    pixels = image.convert("L").resize((hash_size + 1, hash_size)).tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def dhash(path, hash_size=8):
+    """The image_dhash of the image file at path."""
+    from PIL import Image
+    with Image.open(path) as image:
+        # draft() lets the JPEG decoder skip most of the full-resolution work.
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        return image_dhash(image, hash_size)
+
+
+@contextlib.contextmanager
+def collecting_hashes(enabled=True):
+    """
+    While active (and enabled), record_hash() keeps the dHash of every image
+    the converters decode; yields the path -> dHash dict it fills, for
+    find_near_duplicates.
+    """
+    global _collected_hashes
+    hashes = {}
+    if not enabled:
+        yield hashes
+        return
+    previous, _collected_hashes = _collected_hashes, hashes
+    try:
+        yield hashes
+    finally:
+        _collected_hashes = previous
+
+
+def record_hash(path, image):
+    """Hashes an image a converter has already decoded, when collecting_hashes() is active."""
+    hashes = _collected_hashes
+    if hashes is None:
+        return
+    try:
+        hashes[path] = image_dhash(image)
+    except Exception:
+        # find_near_duplicates hashes the file itself instead.
+        pass
+
+
+def _bands(bits, count):
+    """Splits `bits` bit positions into `count` contiguous (shift, mask) bands of near-equal width."""
+    bands = []
+    start = 0
+    for index in range(count):
+        width = bits // count + (index < bits % count)
+        bands.append((start, (1 << width) - 1))
+        start += width
+    return bands
+
+
+def find_near_duplicates(files, max_distance=DEFAULT_NEAR_DUPLICATE_DISTANCE, hashes=None, bits=64):
+    """
+    Returns (path_a, path_b, distance) for image pairs whose dHashes differ
+    by at most max_distance bits, in input order. `hashes` holds dHashes
+    already computed (by collecting_hashes); other files are hashed here.
+
+    Rather than comparing every pair, the hashes are split into
+    max_distance + 2 bands. Two hashes within max_distance bits differ in at
+    most max_distance bands, so by the pigeonhole principle they agree
+    exactly on at least two; only pairs that share the values of some two
+    bands are compared.
+    """
+    hashes = hashes or {}
+    hashed = []
+    for path in files:
+        try:
+            hashed.append((path, hashes[path] if path in hashes else dhash(path)))
+        except Exception:
+            continue
+    count = len(hashed)
+    candidates = set()
+    if max_distance + 2 > bits:
+        candidates.update(a * count + b for a in range(count) for b in range(a + 1, count))
+    else:
+        bands = _bands(bits, max_distance + 2)
+        values = [[(value >> shift) & mask for shift, mask in bands] for _, value in hashed]
+        for first, second in itertools.combinations(range(len(bands)), 2):
+            buckets = {}
+            for index, value in enumerate(values):
+                buckets.setdefault((value[first], value[second]), []).append(index)
+            for bucket in buckets.values():
+                if len(bucket) > 1:
+                    candidates.update(a * count + b for position, a in enumerate(bucket) for b in bucket[position + 1:])
+    pairs = []
+    for candidate in sorted(candidates):
+        a, b = divmod(candidate, count)
+        distance = bin(hashed[a][1] ^ hashed[b][1]).count("1")
+        if distance <= max_distance:
+            pairs.append((hashed[a][0], hashed[b][0], distance))
+    return pairs
+
+
+def describe_near_duplicates(pairs):
+    lines = [f"Found {len(pairs)} near-duplicate image pair(s) (converted separately):"]
+    lines.extend(f"  '{path_a}' ~ '{path_b}' (distance {distance})" for path_a, path_b, distance in pairs)
+    return "\n".join(lines)
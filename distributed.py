@@ -0,0 +1,321 @@
+"""
+Distributed batch conversion across several machines.
+
+A coordinator discovers the files once and hands them out as leases over
+TCP. Workers on any number of nodes pull a job, convert it from shared
+storage with the normal converters and send the resulting event back,
+renewing their lease while the conversion runs. A lease that is not
+renewed in time (its worker died or lost the network) is put back in the
+queue for another worker, up to max_attempts times.
+
+The protocol is one JSON object per line in each direction over a
+persistent connection:
+
+    {"op": "hello", "worker": id, "secret": s}          -> {"ok": true, "lease_seconds": n}
+    {"op": "lease"}                                     -> {"job": {...}} | {"wait": seconds} | {"done": true}
+    {"op": "renew", "job": id, "lease": token}          -> {"ok": bool}
+    {"op": "result", "job": id, "lease": token, "event": {...}} -> {"ok": bool}
+"""
+import collections
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import time
+
+from conversion_events import ConversionEvent, emit, report_error, report_progress, report_summary
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+DEFAULT_LEASE_SECONDS = 30.0
+DEFAULT_MAX_ATTEMPTS = 3
+# Longest a worker sleeps before asking again while every remaining job is leased out.
+MAX_WAIT_SECONDS = 1.0
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def insecure_bind_reason(host, secret):
+    """
+    Why listening on host without a secret would be unsafe (any host that
+    can reach it could lease jobs, learning the input paths, or post forged
+    results), or None when the address is loopback-only or a secret is set.
+    """
+    if secret:
+        return None
+    try:
+        loopback = ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = host == "localhost"
+    if loopback:
+        return None
+    return f"listening on {host} without a secret would let any host lease jobs; set --secret (or $MEDIA_CONVERTER_SECRET) or listen on 127.0.0.1"
+
+
+class Coordinator(object):
+    """
+    Owns the job queue and the leases. `jobs` is a list of dicts with
+    "kind", "path", "format" and optionally "output_dir". Results are
+    collected in job order.
+    """
+
+    def __init__(self, jobs, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, secret=None):
+        self.jobs = jobs
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.secret = secret
+        self.results = [None] * len(jobs)
+        self._pending = collections.deque(range(len(jobs)))
+        self._leases = {}
+        self._attempts = [0] * len(jobs)
+        self._completed = 0
+        self._lock = threading.Lock()
+        self.finished = threading.Event()
+        if not jobs:
+            self.finished.set()
+
+    def authorize(self, secret):
+        return self.secret is None or hmac.compare_digest(str(secret or ""), self.secret)
+
+    def _finish(self, index, event):
+        # Called with the lock held.
+        self.results[index] = event
+        self._completed += 1
+        report_progress(self._completed, len(self.jobs), event.path, kind=event.kind)
+        if self._completed == len(self.jobs):
+            self.finished.set()
+
+    def expire_leases(self):
+        """Re-queues jobs whose lease ran out; gives up on jobs that used up max_attempts."""
+        now = time.monotonic()
+        with self._lock:
+            for index, (_, worker, deadline) in list(self._leases.items()):
+                if deadline > now:
+                    continue
+                del self._leases[index]
+                if self._attempts[index] >= self.max_attempts:
+                    job = self.jobs[index]
+                    self._finish(index, report_error(job["path"], job["format"], "LeaseExpired",
+                                                     f"Error: '{job['path']}' was abandoned after {self._attempts[index]} attempt(s); the last worker ({worker}) stopped responding.",
+                                                     time.perf_counter(), kind=job["kind"]))
+                else:
+                    self._pending.appendleft(index)
+
+    def lease(self, worker):
+        self.expire_leases()
+        with self._lock:
+            if self._pending:
+                index = self._pending.popleft()
+                self._attempts[index] += 1
+                token = secrets.token_hex(8)
+                self._leases[index] = (token, worker, time.monotonic() + self.lease_seconds)
+                return {"job": dict(self.jobs[index], id=index, lease=token)}
+            if self._completed == len(self.jobs):
+                return {"done": True}
+            return {"wait": min(MAX_WAIT_SECONDS, self.lease_seconds / 4)}
+
+    def renew(self, index, token):
+        with self._lock:
+            lease = self._leases.get(index)
+            if lease is None or lease[0] != token:
+                return False
+            self._leases[index] = (token, lease[1], time.monotonic() + self.lease_seconds)
+            return True
+
+    def complete(self, index, token, fields):
+        """Records a worker's result. A late result from an expired lease still counts if nobody finished the job first."""
+        with self._lock:
+            if not 0 <= index < len(self.jobs) or self.results[index] is not None:
+                return False
+            lease = self._leases.get(index)
+            if lease is not None and lease[0] != token:
+                # Someone else holds the job now; let their result decide.
+                return False
+            self._leases.pop(index, None)
+            if index in self._pending:
+                self._pending.remove(index)
+            self._finish(index, emit(ConversionEvent.from_dict(fields)))
+            return True
+
+    def wait(self, poll_interval=0.5):
+        """Blocks until every job has a result, expiring leases meanwhile, and returns the results."""
+        while not self.finished.wait(poll_interval):
+            self.expire_leases()
+        return self.results
+
+
+class CoordinatorRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        worker = None
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "hello":
+                    if not coordinator.authorize(message.get("secret")):
+                        self._send({"ok": False, "error": "Unauthorized"})
+                        return
+                    worker = str(message.get("worker") or self.client_address[0])
+                    self._send({"ok": True, "lease_seconds": coordinator.lease_seconds})
+                elif worker is None:
+                    self._send({"ok": False, "error": "Send hello first."})
+                    return
+                elif op == "lease":
+                    self._send(coordinator.lease(worker))
+                elif op == "renew":
+                    self._send({"ok": coordinator.renew(int(message["job"]), message["lease"])})
+                elif op == "result":
+                    self._send({"ok": coordinator.complete(int(message["job"]), message["lease"], message["event"])})
+                else:
+                    self._send({"ok": False, "error": f"Unknown op '{op}'."})
+            except (ValueError, KeyError, TypeError) as e:
+                self._send({"ok": False, "error": f"Malformed message: {e}"})
+                return
+
+    def _send(self, payload):
+        self.wfile.write(json.dumps(payload).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, coordinator, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.coordinator = coordinator
+        super().__init__((host, port), CoordinatorRequestHandler)
+
+
+def create_coordinator_server(jobs, host=DEFAULT_HOST, port=DEFAULT_PORT, lease_seconds=DEFAULT_LEASE_SECONDS,
+                              max_attempts=DEFAULT_MAX_ATTEMPTS, secret=None):
+    """
+    Creates (but does not start) a coordinator server for jobs. Port 0 picks
+    a free port. Raises ValueError for a non-loopback host without a secret.
+    """
+    reason = insecure_bind_reason(host, secret)
+    if reason:
+        raise ValueError(reason)
+    return CoordinatorServer(Coordinator(jobs, lease_seconds, max_attempts, secret), host, port)
+
+
+def run_coordinator(jobs, host=DEFAULT_HOST, port=DEFAULT_PORT, lease_seconds=DEFAULT_LEASE_SECONDS,
+                    max_attempts=DEFAULT_MAX_ATTEMPTS, secret=None):
+    """Serves jobs to workers until every one has a result and returns the results in job order."""
+    server = create_coordinator_server(jobs, host, port, lease_seconds, max_attempts, secret)
+    host, port = server.server_address[:2]
+    report_summary(f"Coordinating {len(jobs)} job(s) on {host}:{port}. Start workers with --worker <this-host>:{port}.", total=len(jobs))
+    thread = threading.Thread(target=server.serve_forever, name="coordinator", daemon=True)
+    thread.start()
+    try:
+        return server.coordinator.wait()
+    finally:
+        # Give waiting workers a moment to hear "done" before the listener goes away.
+        time.sleep(min(MAX_WAIT_SECONDS, lease_seconds / 4))
+        server.shutdown()
+        server.server_close()
+
+
+class _Connection(object):
+    """One request/reply line at a time over a socket shared by the worker loop and its lease renewer."""
+
+    def __init__(self, host, port, timeout):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._reader = self._socket.makefile("rb")
+        self._lock = threading.Lock()
+
+    def request(self, payload):
+        with self._lock:
+            self._socket.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+            line = self._reader.readline()
+        if not line:
+            raise ConnectionError("The coordinator closed the connection.")
+        try:
+            return json.loads(line)
+        except ValueError:
+            # A truncated or garbled reply means the connection cannot be trusted any more.
+            raise ConnectionError("The coordinator sent a malformed reply.")
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+
+def _renew_lease(connection, job, interval, stop):
+    while not stop.wait(interval):
+        try:
+            if not connection.request({"op": "renew", "job": job["id"], "lease": job["lease"]})["ok"]:
+                return
+        except (OSError, ValueError):
+            return
+
+
+def _run_job(converters, job):
+    started = time.perf_counter()
+    kind, output_format = job.get("kind"), job.get("format")
+    if not isinstance(kind, str) or kind not in converters:
+        return report_error(job.get("path"), output_format, "UnsupportedKind",
+                            f"Error: This worker cannot convert '{kind}' jobs. Supported kinds are: {','.join(converters)}", started)
+    supported_formats = converters[kind][1]
+    if output_format not in supported_formats:
+        return report_error(job.get("path"), output_format, "UnsupportedFormat",
+                            f"Error: Unsupported {kind} output format '{output_format}'. Supported formats are: {','.join(supported_formats)}", started, kind=kind)
+    try:
+        convert_function = converters[kind][0]
+        if job.get("output_dir"):
+            event = convert_function(job["path"], job["format"], job["output_dir"])
+        else:
+            event = convert_function(job["path"], job["format"])
+        if event is None:
+            raise RuntimeError("the converter returned no result")
+        return event
+    except Exception as e:
+        return report_error(job["path"], job["format"], e, f"An unexpected error occurred during {job['kind']} conversion: {e}", started, kind=job["kind"])
+
+
+def run_worker(host, port=DEFAULT_PORT, converters=None, worker_id=None, secret=None, timeout=30.0):
+    """
+    Pulls jobs from the coordinator at host:port and converts them with
+    `converters` (kind -> (convert_function, supported_formats)) until the
+    coordinator reports that everything is done or goes away. Returns the
+    number of jobs this worker converted.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    connection = _Connection(host, port, timeout)
+    converted = 0
+    try:
+        reply = connection.request({"op": "hello", "worker": worker_id, "secret": secret})
+        if not reply.get("ok"):
+            raise ProtocolError(f"The coordinator refused this worker: {reply.get('error')}")
+        renew_interval = reply["lease_seconds"] / 3
+        while True:
+            reply = connection.request({"op": "lease"})
+            if reply.get("done"):
+                break
+            if "wait" in reply:
+                time.sleep(reply["wait"])
+                continue
+            job = reply["job"]
+            stop = threading.Event()
+            renewer = threading.Thread(target=_renew_lease, args=(connection, job, renew_interval, stop), daemon=True)
+            renewer.start()
+            try:
+                event = _run_job(converters, job)
+            finally:
+                stop.set()
+                renewer.join()
+            connection.request({"op": "result", "job": job["id"], "lease": job["lease"], "event": event.to_dict()})
+            converted += 1
+    except (ConnectionError, socket.timeout):
+        # The coordinator finished or went away; nothing more to do.
+        pass
+    finally:
+        connection.close()
+    return converted
@@ -0,0 +1,228 @@
+"""
+A stand-in for ffmpeg and ffprobe, for exercising the batch runners at scale.
+
+Testing scheduling, timeouts and retries with real ffmpeg needs real media
+and real encoding time. This script answers the subset of ffmpeg and
+ffprobe invocations the converter makes, takes as long as it is told to,
+and writes progress output the watchdog understands. install() writes
+`ffmpeg` and `ffprobe` launchers for it into a directory; point
+main_converter.FFMPEG_PATH / FFPROBE_PATH (or $MEDIA_CONVERTER_FFMPEG /
+$MEDIA_CONVERTER_FFPROBE) at them. Launched under any name containing
+"ffprobe" it behaves as ffprobe, otherwise as ffmpeg. It needs a POSIX
+system, where a script with a shebang line can be executed directly.
+
+What a job does is read from its input file when the file holds a JSON
+object, falling back to $FAKE_FFMPEG_<KEY> and then to the defaults:
+
+    duration  media duration in seconds, announced as "Duration:" and
+              reported by ffprobe (default 10);
+    seconds   wall-clock seconds the conversion takes (default 0);
+    progress  number of "time=" progress lines spread over that time
+              (default 4);
+    exit      exit status; a non-zero status prints an encoder error
+              first, which the watchdog does not retry (default 0);
+    corrupt   fail with status 1 on a decoding error unless the
+              watchdog's safer decoding options (-err_detect ignore_err)
+              are given (default false);
+    hang      stop writing output halfway for this many seconds, or
+              forever when true (default 0);
+    memory    megabytes to allocate and touch while converting (default 0);
+    codec     audio codec ffprobe reports; null for no audio stream
+              (default "aac");
+    width, height
+              video stream size ffprobe reports (default: no video stream);
+    rotation  degrees the video is displayed rotated by, reported by
+              ffprobe as display matrix side data (default 0);
+    output    bytes written to the output file (default 16).
+
+Like ffmpeg, it creates the output file before converting (so failed,
+hung and killed runs leave it behind) and, without -y, refuses to
+overwrite an existing one. Outputs to a pipe ("-" or "pipe:") get no
+data, so frame extraction and audio analysis see an empty stream.
+"""
+import json
+import os
+import sys
+import time
+
+DEFAULTS = {"duration": 10.0, "seconds": 0.0, "progress": 4, "exit": 0, "corrupt": False, "hang": 0, "memory": 0,
+            "codec": "aac", "width": None, "height": None, "rotation": 0, "output": 16}
+ENCODERS = ("libmp3lame", "pcm_s16le", "flac", "libvorbis", "aac", "libx264", "libvpx-vp9", "mpeg4", "flv", "png", "mjpeg")
+MUXERS = ("mp3", "wav", "flac", "ogg", "adts", "mp4", "avi", "mov", "matroska", "flv", "webm", "image2", "rawvideo", "s16le")
+VERSION = "fake-1.0"
+
+
+def _timestamp(seconds):
+    return f"{int(seconds // 3600):02d}:{int(seconds // 60 % 60):02d}:{seconds % 60:05.2f}"
+
+
+def behaviour(input_path, environ=None):
+    """The settings for a job on input_path: its JSON content over $FAKE_FFMPEG_* over DEFAULTS."""
+    environ = os.environ if environ is None else environ
+    settings = dict(DEFAULTS)
+    for key in DEFAULTS:
+        value = environ.get(f"FAKE_FFMPEG_{key.upper()}")
+        if value is not None:
+            settings[key] = json.loads(value)
+    try:
+        with open(input_path, "rb") as source:
+            content = json.loads(source.read(65536))
+        if isinstance(content, dict):
+            settings.update((key, value) for key, value in content.items() if key in DEFAULTS)
+    except ValueError:
+        pass
+    return settings
+
+
+def _streams(settings):
+    streams = []
+    if settings["width"] and settings["height"]:
+        streams.append({"index": 0, "codec_type": "video", "codec_name": "h264", "width": settings["width"], "height": settings["height"]})
+        if settings["rotation"]:
+            # Like ffprobe: the display matrix turns the other way round from the old "rotate" tag.
+            streams[0]["side_data_list"] = [{"side_data_type": "Display Matrix", "rotation": -settings["rotation"]}]
+    if settings["codec"]:
+        streams.append({"index": len(streams), "codec_type": "audio", "codec_name": settings["codec"]})
+    return streams
+
+
+def _option(argv, name, default=None):
+    return argv[argv.index(name) + 1] if name in argv[:-1] else default
+
+
+def ffprobe(argv, out=sys.stdout, err=sys.stderr):
+    """Answers -show_entries queries for the input (the last argument) as JSON or CSV."""
+    input_path = argv[-1]
+    if not os.path.isfile(input_path):
+        err.write(f"{input_path}: No such file or directory\n")
+        return 1
+    settings = behaviour(input_path)
+    streams = _streams(settings)
+    selected = _option(argv, "-select_streams")
+    if selected:
+        wanted = {"a": "audio", "v": "video"}.get(selected.split(":")[0])
+        streams = [stream for stream in streams if stream["codec_type"] == wanted][:1]
+    entries = {}
+    for section in _option(argv, "-show_entries", "").split(":"):
+        name, _, keys = section.partition("=")
+        entries[name] = keys.split(",") if keys else []
+    output_format = _option(argv, "-of", "default")
+    fields = {"duration": f"{float(settings['duration']):.6f}"}
+    if output_format == "json":
+        result = {}
+        if "stream" in entries:
+            result["streams"] = [{key: stream[key] for key in entries["stream"] if key in stream} for stream in streams]
+            if "stream_side_data" in entries:
+                for selected, stream in zip(result["streams"], streams):
+                    if "side_data_list" in stream:
+                        selected["side_data_list"] = [{key: side_data[key] for key in entries["stream_side_data"] if key in side_data}
+                                                      for side_data in stream["side_data_list"]]
+        if "format" in entries:
+            result["format"] = {key: fields[key] for key in entries["format"] if key in fields}
+        out.write(json.dumps(result) + "\n")
+        return 0
+    # csv=p=0[:s=x]
+    separator = ","
+    for option in output_format.partition("=")[2].split(":"):
+        if option.startswith("s="):
+            separator = option[2:]
+    for stream in streams:
+        out.write(separator.join(str(stream.get(key, "")) for key in entries.get("stream", [])) + "\n")
+    if "format" in entries:
+        out.write(separator.join(fields.get(key, "") for key in entries["format"]) + "\n")
+    return 0
+
+
+def _touch_memory(megabytes):
+    block = bytearray(int(megabytes * 1024 * 1024))
+    for offset in range(0, len(block), 4096):
+        block[offset] = 1
+    return block
+
+
+def _sleep(seconds):
+    if seconds is True:
+        while True:
+            time.sleep(3600)
+    time.sleep(seconds)
+
+
+def ffmpeg(argv, out=sys.stdout, err=sys.stderr):
+    """Answers capability queries, or "converts" the -i input into the last argument."""
+    if "-version" in argv:
+        out.write(f"ffmpeg version {VERSION} Copyright (c) the fake_ffmpeg authors\n")
+        return 0
+    if "-encoders" in argv:
+        out.write("Encoders:\n V..... = Video\n A..... = Audio\n ------\n")
+        out.writelines(f" A..... {name:<20} {name}\n" for name in ENCODERS)
+        return 0
+    if "-muxers" in argv:
+        out.write("File formats:\n D. = Demuxing supported\n .E = Muxing supported\n --\n")
+        out.writelines(f"  E {name:<15} {name}\n" for name in MUXERS)
+        return 0
+    input_path = _option(argv, "-i")
+    if input_path is None or not os.path.isfile(input_path):
+        err.write(f"{input_path}: No such file or directory\n")
+        return 1
+    settings = behaviour(input_path)
+    output_path = argv[-1]
+    duration = float(settings["duration"])
+    held = _touch_memory(settings["memory"]) if settings["memory"] else None
+    err.write(f"Input #0, fake, from '{input_path}':\n  Duration: {_timestamp(duration)}, start: 0.000000, bitrate: 128 kb/s\n")
+    to_file = output_path != "-" and not output_path.startswith("pipe:")
+    if to_file and os.path.exists(output_path) and "-y" not in argv:
+        # Like ffmpeg with stdin not a terminal: the prompt reads EOF.
+        err.write(f"File '{output_path}' already exists. Overwrite? [y/N] Not overwriting - exiting\n")
+        return 1
+    # ffmpeg creates the output up front, so failed and killed runs leave a partial file behind.
+    output = open(output_path, "wb") if to_file else None
+    size = int(settings["output"])
+    if output is not None:
+        output.write(b"\0" * (size // 2))
+        output.flush()
+    err.write(f"Output #0, fake, to '{output_path}':\n")
+    err.flush()
+    steps = max(1, int(settings["progress"]))
+    for step in range(1, steps + 1):
+        if settings["hang"] and step == steps // 2 + 1:
+            _sleep(settings["hang"])
+        time.sleep(float(settings["seconds"]) / steps)
+        err.write(f"size=  {step * 64}kB time={_timestamp(duration * step / steps)} bitrate= 128.0kbits/s speed=1x\r")
+        err.flush()
+    err.write("\n")
+    if settings["corrupt"] and _option(argv, "-err_detect") != "ignore_err":
+        err.write("Error while decoding stream #0:0: Invalid data found when processing input\n")
+        return int(settings["exit"]) or 1
+    if settings["exit"]:
+        err.write("Error initializing output stream 0:0 -- Error while opening encoder\n")
+        return int(settings["exit"])
+    if output is not None:
+        with output:
+            output.write(b"\0" * (size - size // 2))
+    del held
+    return 0
+
+
+def install(directory, python=sys.executable):
+    """Writes executable `ffmpeg` and `ffprobe` launchers for this script into directory; returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name in ("ffmpeg", "ffprobe"):
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as launcher:
+            launcher.write(f"#!{python}\nimport sys\nsys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+                           f"import fake_ffmpeg\nsys.exit(fake_ffmpeg.main(sys.argv))\n")
+        os.chmod(path, 0o755)
+        paths.append(path)
+    return tuple(paths)
+
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    if "ffprobe" in os.path.basename(argv[0]):
+        return ffprobe(argv[1:])
+    return ffmpeg(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""
+asyncio orchestration for ffmpeg conversions.
+
+Runs many ffmpeg children from a single event loop: a semaphore bounds the
+number of concurrent processes, stdout/stderr are streamed with asyncio
+readers (no helper threads), and every job can have its own timeout and be
+cancelled individually. A watchdog (see ffmpeg_watchdog) follows each
+job's progress output, kills jobs that stall or run past their time budget,
+and retries stalled jobs and decoding failures with safer options. Results are reported through
+conversion_events just like the synchronous converters.
+"""
+import asyncio
+import collections
+import os
+import re
+import subprocess
+import signal
+import sys
+import threading
+import time
+
+import ffmpeg_watchdog
+import memory_profile
+from conversion_events import report_start, report_done, report_error, report_progress
+
+# Lines of stdout/stderr kept per job for error reporting. Keeping only a tail
+# keeps memory flat when hundreds of jobs run at once.
+OUTPUT_TAIL_LINES = 50
+
+_LINE_BREAK = re.compile(rb"\r\n|\r|\n")
+
+
+class FFmpegJob(object):
+    """One ffmpeg invocation converting input_path into output_path."""
+
+    def __init__(self, input_path, output_format, output_path, command, kind="audio", timeout=None):
+        self.input_path = input_path
+        self.output_format = output_format
+        self.output_path = output_path
+        self.command = command
+        self.kind = kind
+        self.timeout = timeout
+        self.result = None
+        self.attempts = 0
+        self._task = None
+        self._monitor = None
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _exists(path):
+    return path is not None and os.path.isfile(path)
+
+
+def _discard(path):
+    """Removes the partial output of a failed attempt, if there is one."""
+    if _exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class AsyncFFmpegRunner(object):
+    """
+    Drives FFmpegJob instances on the running event loop with at most
+    `max_concurrency` ffmpeg processes alive at a time. `on_output`, when
+    given, is called as on_output(job, stream_name, line) for every line
+    ffmpeg writes. `watchdog` (default: the configured
+    ffmpeg_watchdog policy) decides when a job is stuck and how it is
+    retried. With an `autotuner`, the number of running processes follows
+    autotuner.limit instead of max_concurrency. `eta`, a
+    scheduling.EtaTracker, adds the batch ETA to progress events.
+    """
+
+    def __init__(self, max_concurrency=4, timeout=None, on_output=None, watchdog=None, autotuner=None, eta=None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self.on_output = on_output
+        self.watchdog = watchdog or ffmpeg_watchdog.current_policy()
+        self.autotuner = autotuner
+        self.eta = eta
+        self._semaphore = None
+        self._completed = 0
+        self._total = 0
+
+    async def run(self, jobs):
+        """Runs all jobs and returns their final events in job order."""
+        jobs = list(jobs)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency) if self.autotuner is None else _AdaptiveSlots(self.autotuner)
+        self._completed = 0
+        self._total = len(jobs)
+        tuning = asyncio.ensure_future(self._tune()) if self.autotuner is not None else None
+        for job in jobs:
+            job._task = asyncio.ensure_future(self.run_job(job))
+        try:
+            await asyncio.gather(*(job._task for job in jobs), return_exceptions=True)
+        finally:
+            if tuning is not None:
+                tuning.cancel()
+        return [job.result for job in jobs]
+
+    async def _tune(self):
+        while True:
+            await asyncio.sleep(self.autotuner.interval)
+            self.autotuner.step()
+            self._semaphore.notify()
+
+    def cancel(self, jobs):
+        for job in jobs:
+            job.cancel()
+
+    async def run_job(self, job):
+        try:
+            async with self._semaphore:
+                return await self._run_job(job)
+        except asyncio.CancelledError as e:
+            if job.result is None:
+                # Cancelled while still waiting for a free slot.
+                job.result = report_error(job.input_path, job.output_format, e, f"Conversion of '{job.input_path}' was cancelled.", time.perf_counter(), kind=job.kind)
+            raise
+        except Exception as e:
+            # gather() would swallow it and leave the job without a result.
+            if job.result is None:
+                job.result = report_error(job.input_path, job.output_format, e, f"An unexpected error occurred during {job.kind} conversion: {e}", time.perf_counter(),
+                                          kind=job.kind, output_path=job.output_path)
+            return job.result
+        finally:
+            self._completed += 1
+            if self.autotuner is not None:
+                self.autotuner.record_completion()
+            report_progress(self._completed, self._total, job.input_path, kind=job.kind,
+                            eta=self.eta.complete(job.input_path) if self.eta is not None else None)
+
+    async def _run_job(self, job):
+        started = time.perf_counter()
+        timeout = job.timeout if job.timeout is not None else self.timeout
+        bytes_in = None
+        try:
+            bytes_in = os.path.getsize(job.input_path)
+        except OSError as e:
+            job.result = report_error(job.input_path, job.output_format, e, f"Error: The input file '{job.input_path}' was not found.", started, kind=job.kind)
+            return job.result
+        report_start(job.input_path, job.output_format, kind=job.kind, bytes_in=bytes_in)
+        # ffmpeg is not run with -y, so output left by a killed or failed attempt would make the retry refuse to overwrite it.
+        output_existed = _exists(job.output_path)
+
+        policy = self.watchdog
+        attempt = 0
+        while True:
+            command = policy.command_for(job.command, attempt)
+            job.attempts = attempt + 1
+            try:
+                failure, returncode, stdout, stderr = await self._attempt(job, command, timeout, policy)
+            except OSError as e:
+                job.result = report_error(job.input_path, job.output_format, e, f"Error: could not start ffmpeg at '{command[0]}': {e}", started, kind=job.kind, bytes_in=bytes_in)
+                return job.result
+            except asyncio.CancelledError as e:
+                if not output_existed:
+                    _discard(job.output_path)
+                job.result = report_error(job.input_path, job.output_format, e, f"Conversion of '{job.input_path}' was cancelled.", started,
+                                          kind=job.kind, output_path=job.output_path, bytes_in=bytes_in)
+                raise
+            if failure is None and returncode == 0:
+                break
+            if not output_existed:
+                _discard(job.output_path)
+            # Output that was there before the job is never discarded, so a retry would only refuse to overwrite it.
+            if output_existed or not policy.retryable(failure, stderr) or attempt >= policy.retries:
+                job.result = self._report_failure(job, failure, returncode, command, timeout, started, bytes_in, stdout, stderr)
+                return job.result
+            attempt += 1
+            await asyncio.sleep(policy.backoff_delay(attempt))
+
+        try:
+            bytes_out = os.path.getsize(job.output_path)
+        except OSError:
+            bytes_out = None
+        job.result = report_done(job.input_path, job.output_format, job.output_path, started, kind=job.kind,
+                                 bytes_in=bytes_in, bytes_out=bytes_out, stdout=stdout, stderr=stderr)
+        return job.result
+
+    async def _attempt(self, job, command, timeout, policy):
+        """
+        Runs one ffmpeg attempt under the watchdog. Returns (failure,
+        returncode, stdout, stderr) where failure is None, "TimeoutError" or
+        one of the watchdog verdicts.
+        """
+        kwargs = {}
+        if sys.platform == "win32":
+            kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        if memory_profile.enabled() and hasattr(os, "wait4"):
+            process = await _ReapedProcess.start(
+                command, lambda rusage: memory_profile.record_child(job.input_path, job.kind, job.output_format, rusage))
+        else:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs)
+
+        stdout_tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+        stderr_tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+        job._monitor = monitor = policy.monitor()
+        work = asyncio.ensure_future(asyncio.gather(
+            self._pump(job, "stdout", process.stdout, stdout_tail),
+            self._pump(job, "stderr", process.stderr, stderr_tail),
+            process.wait()))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        failure = None
+        try:
+            while True:
+                wait = policy.poll_interval if deadline is None else max(0.0, min(policy.poll_interval, deadline - time.monotonic()))
+                done, _ = await asyncio.wait({work}, timeout=wait)
+                if done:
+                    work.result()
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    failure = "TimeoutError"
+                else:
+                    failure = monitor.verdict()
+                if failure is not None:
+                    await _kill(process)
+                    work.cancel()
+                    break
+        except BaseException:
+            # Cancelled, or failed unexpectedly (e.g. in on_output): never leave ffmpeg running.
+            work.cancel()
+            await _kill(process)
+            raise
+        finally:
+            job._monitor = None
+        return failure, process.returncode, "\n".join(stdout_tail), "\n".join(stderr_tail)
+
+    def _report_failure(self, job, failure, returncode, command, timeout, started, bytes_in, stdout, stderr):
+        attempts = f" after {job.attempts} attempts" if job.attempts > 1 else ""
+        if failure == "TimeoutError":
+            error, message = failure, f"Error: ffmpeg timed out after {timeout} seconds converting '{job.input_path}'."
+        elif failure == ffmpeg_watchdog.STALLED:
+            error, message = failure, f"Error: ffmpeg made no progress for {self.watchdog.stall_timeout:g} seconds converting '{job.input_path}' and was killed{attempts}."
+        elif failure == ffmpeg_watchdog.TIME_BUDGET_EXCEEDED:
+            error, message = failure, f"Error: ffmpeg ran past its time budget ({self.watchdog.budget_factor:g}x the media duration) converting '{job.input_path}' and was killed."
+        else:
+            error = subprocess.CalledProcessError(returncode, command)
+            message = f"Error during {job.kind} conversion with ffmpeg{attempts}: {error}"
+        return report_error(job.input_path, job.output_format, error, message, started,
+                            kind=job.kind, output_path=job.output_path, bytes_in=bytes_in, stdout=stdout, stderr=stderr)
+
+    async def _pump(self, job, stream_name, reader, tail):
+        # ffmpeg ends its progress lines with "\r", so split on both line breaks
+        # instead of using readline(), which would buffer them indefinitely.
+        pending = b""
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                if pending:
+                    self._line(job, stream_name, pending, tail)
+                return
+            *lines, pending = _LINE_BREAK.split(pending + chunk)
+            for line in lines:
+                if line:
+                    self._line(job, stream_name, line, tail)
+
+    def _line(self, job, stream_name, line, tail):
+        text = line.decode("utf-8", errors="replace")
+        tail.append(text)
+        if job._monitor is not None:
+            job._monitor.observe(text)
+        if self.on_output is not None:
+            self.on_output(job, stream_name, text)
+
+
+class _AdaptiveSlots(object):
+    """asyncio counterpart of autotune.ThreadSlots: admits up to autotuner.limit jobs at a time."""
+
+    def __init__(self, autotuner):
+        self.autotuner = autotuner
+        self.active = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.autotuner.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def notify(self):
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+
+class _ReapedProcess(object):
+    """
+    An ffmpeg child reaped with os.wait4 instead of by asyncio's child
+    watcher, so memory instrumentation gets its rusage (peak RSS). Like the
+    default watcher it waits for the child on a thread of its own; it offers
+    the parts of asyncio.subprocess.Process the runner uses.
+    """
+
+    def __init__(self, popen, on_exit):
+        self.pid = popen.pid
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+        self._popen = popen
+        self._on_exit = on_exit
+        self._loop = asyncio.get_running_loop()
+        self._exited = self._loop.create_future()
+        self._reaped = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    async def start(cls, command, on_exit):
+        popen = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process = cls(popen, on_exit)
+        process.stdout = await process._reader(popen.stdout)
+        process.stderr = await process._reader(popen.stderr)
+        threading.Thread(target=process._reap, name=f"reap-{process.pid}", daemon=True).start()
+        return process
+
+    async def _reader(self, pipe):
+        reader = asyncio.StreamReader()
+        await self._loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader
+
+    def _reap(self):
+        # Wait for the exit without reaping, then reap under the lock kill() takes: a pid is never signalled after reuse.
+        os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT)
+        with self._lock:
+            _, status, rusage = os.wait4(self.pid, 0)
+            self._reaped = True
+        try:
+            self._loop.call_soon_threadsafe(self._exit, os.waitstatus_to_exitcode(status), rusage)
+        except RuntimeError:
+            # The event loop is already closed; nobody is waiting any more.
+            pass
+
+    def _exit(self, returncode, rusage):
+        self.returncode = self._popen.returncode = returncode
+        self._on_exit(rusage)
+        self._exited.set_result(returncode)
+
+    def kill(self):
+        with self._lock:
+            if not self._reaped:
+                os.kill(self.pid, signal.SIGKILL)
+
+    async def wait(self):
+        return await asyncio.shield(self._exited)
+
+
+async def _kill(process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+
+def run_ffmpeg_jobs(jobs, max_concurrency=4, timeout=None, on_output=None, watchdog=None, autotuner=None, eta=None):
+    """Runs the jobs on a fresh event loop and returns their final events in order."""
+    runner = AsyncFFmpegRunner(max_concurrency, timeout=timeout, on_output=on_output, watchdog=watchdog, autotuner=autotuner, eta=eta)
+    return asyncio.run(runner.run(jobs))
+
+
+def run_ffmpeg_job(job, timeout=None, watchdog=None):
+    """Runs a single job under the watchdog, without batch progress events, and returns its final event."""
+    runner = AsyncFFmpegRunner(1, timeout=timeout, watchdog=watchdog)
+    return asyncio.run(runner._run_job(job))
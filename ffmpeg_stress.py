@@ -0,0 +1,241 @@
+"""
+Stress harness for the audio/video batch runners, driven by fake_ffmpeg.
+
+    python ffmpeg_stress.py --count 10000 --jobs 32 [--kind video] [--autotune] [--min-throughput 100]
+
+Writes `count` fake media files describing a mix of jobs: mostly quick
+successes, plus failing inputs, corrupt inputs that only convert on the
+watchdog's retry with safer options, memory-hungry jobs, and hung jobs
+that the per-job timeout has to kill. They are run through
+run_conversion_logic_audio or run_conversion_logic_video with fake_ffmpeg
+as ffmpeg and ffprobe, on the asyncio runner with `jobs` processes (or the
+serial runner with jobs=1, or the autotuned one), and then checked for:
+
+    completeness  every job got exactly one final event, and the one its
+                  input called for;
+    throughput    at least min_throughput jobs per second;
+    fairness      jobs start in batch order, overtaken by at most as many
+                  jobs as run at once: slow and hung jobs hold their own
+                  slot but never starve the rest of the queue;
+    shutdown      once the batch returns, no ffmpeg child is left running
+                  or unreaped and no thread or file descriptor has leaked.
+
+The process exits with status 1 if any check fails.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import autotune
+import conversion_events
+import fake_ffmpeg
+import main_converter
+
+# Every FAILURE_EVERY-th job fails, and so on; the offsets keep the kinds of job apart.
+FAILURE_EVERY = 97
+CORRUPT_EVERY = 89
+MEMORY_EVERY = 53
+HANG_EVERY = 997
+DEFAULT_HANG_TIMEOUT = 2.0
+MEMORY_MEGABYTES = 32
+# How long leftover threads and descriptors get to wind down after the batch returns.
+SHUTDOWN_GRACE_SECONDS = 5.0
+
+KINDS = {
+    "audio": (".wav", "mp3", main_converter.run_conversion_logic_audio),
+    "video": (".mp4", "mkv", main_converter.run_conversion_logic_video),
+}
+
+
+def job_spec(index, seconds=0.0):
+    """The fake_ffmpeg settings of the index-th job and the (event, error) it must end with."""
+    spec = {"duration": 5 + index % 240, "seconds": seconds}
+    if index % HANG_EVERY == HANG_EVERY - 1:
+        spec["hang"] = True
+        return spec, ("error", "TimeoutError")
+    if index % FAILURE_EVERY == FAILURE_EVERY - 1:
+        spec["exit"] = 1
+        return spec, ("error", "CalledProcessError")
+    if index % CORRUPT_EVERY == CORRUPT_EVERY - 1:
+        spec["corrupt"] = True
+    elif index % MEMORY_EVERY == MEMORY_EVERY - 1:
+        spec["memory"] = MEMORY_MEGABYTES
+    return spec, ("done", None)
+
+
+def write_inputs(directory, count, extension, seconds=0.0):
+    """Writes the job files into directory and returns {path: expected (event, error)}."""
+    expected = {}
+    os.makedirs(directory, exist_ok=True)
+    for index in range(count):
+        spec, outcome = job_spec(index, seconds)
+        path = os.path.join(directory, f"job{index:06d}{extension}")
+        with open(path, "w", encoding="utf-8") as job:
+            json.dump(spec, job)
+        expected[path] = outcome
+    return expected
+
+
+class _Recorder(object):
+    """A conversion_events sink keeping (event, path, error) of every start and final event, in emission order."""
+
+    events = frozenset((conversion_events.EVENT_START, conversion_events.EVENT_DONE, conversion_events.EVENT_ERROR))
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        with self._lock:
+            self.records.append((event.event, event.path, event.error))
+
+    def close(self):
+        pass
+
+
+def _children():
+    """PIDs of this process's children, or None where /proc cannot tell."""
+    if not os.path.isdir("/proc/self"):
+        return None
+    children = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", encoding="utf-8") as stat:
+                # The command name may contain spaces; the fields after it are fixed.
+                parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == os.getpid():
+            children.append(int(name))
+    return children
+
+
+def _open_descriptors():
+    return len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+
+
+class StressReport(object):
+    """What one run measured; failures() lists the checks it did not pass."""
+
+    def __init__(self, count, jobs, elapsed, results, expected, records, slots, leftovers, min_throughput):
+        self.count = count
+        self.jobs = jobs
+        self.elapsed = elapsed
+        self.results = results
+        self.expected = expected
+        self.records = records
+        self.slots = slots
+        self.leftovers = leftovers
+        self.min_throughput = min_throughput
+
+    @property
+    def throughput(self):
+        return self.count / self.elapsed if self.elapsed else float("inf")
+
+    def max_overtake(self):
+        """How many places later than its batch position the most overtaken job started."""
+        position = {event.path: index for index, event in enumerate(self.results)}
+        starts = [path for event, path, _ in self.records if event == conversion_events.EVENT_START]
+        return max((rank - position[path] for rank, path in enumerate(starts) if path in position), default=0)
+
+    def failures(self):
+        failures = []
+        finals = [(path, event, error) for event, path, error in self.records if event != conversion_events.EVENT_START]
+        if len(finals) != self.count or len({path for path, _, _ in finals}) != self.count:
+            failures.append(f"completeness: {len(finals)} final events for {self.count} jobs")
+        wrong = [(event.path, event.event, event.error) for event in self.results if (event.event, event.error) != self.expected.get(event.path)]
+        if wrong:
+            failures.append(f"completeness: {len(wrong)} job(s) ended differently than expected, e.g. {wrong[0]}")
+        if self.throughput < self.min_throughput:
+            failures.append(f"throughput: {self.throughput:.1f} jobs/s, below {self.min_throughput:g}")
+        overtake = self.max_overtake()
+        if overtake > self.slots:
+            failures.append(f"fairness: a job started {overtake} places late with {self.slots} slot(s)")
+        for name, value in sorted(self.leftovers.items()):
+            if value:
+                failures.append(f"shutdown: {value} {name} left over")
+        return failures
+
+    def describe(self):
+        lines = [f"{self.count} jobs on {self.jobs} slot(s) in {self.elapsed:.1f} s: {self.throughput:.1f} jobs/s",
+                 f"  done {sum(event.ok for event in self.results)}, failed {sum(not event.ok for event in self.results)}, "
+                 f"max overtake {self.max_overtake()} (limit {self.slots})"]
+        failures = self.failures()
+        lines.extend(f"  FAILED {failure}" for failure in failures)
+        if not failures:
+            lines.append("  all checks passed")
+        return "\n".join(lines)
+
+
+def run(directory, count, kind="audio", jobs=16, hang_timeout=DEFAULT_HANG_TIMEOUT, seconds=0.0, min_throughput=0.0):
+    """
+    Runs a stress batch of `count` jobs in directory (which must not hold
+    other media) and returns its StressReport. Installs fake_ffmpeg as
+    main_converter's ffmpeg and ffprobe for the duration of the run. With
+    autotuning configured, `jobs` is the runner's starting concurrency.
+    """
+    extension, output_format, run_batch = KINDS[kind]
+    tools = fake_ffmpeg.install(os.path.join(directory, "bin"))
+    inputs = os.path.join(directory, "inputs")
+    expected = write_inputs(inputs, count, extension, seconds)
+    recorder = _Recorder()
+    saved_sinks = conversion_events.get_sinks()
+    saved_tools = main_converter.FFMPEG_PATH, main_converter.FFPROBE_PATH
+    children, descriptors, threads = _children(), _open_descriptors(), threading.active_count()
+    conversion_events.set_sinks([recorder])
+    main_converter.FFMPEG_PATH, main_converter.FFPROBE_PATH = tools
+    try:
+        started = time.perf_counter()
+        results = run_batch(inputs, output_format, False, jobs, hang_timeout, os.path.join(directory, "outputs"), False)
+        elapsed = time.perf_counter() - started
+    finally:
+        main_converter.FFMPEG_PATH, main_converter.FFPROBE_PATH = saved_tools
+        conversion_events.set_sinks(saved_sinks)
+
+    deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+    while True:
+        leftovers = {
+            "child process(es)": len(set(_children()) - set(children)) if children is not None else 0,
+            "file descriptor(s)": _open_descriptors() - descriptors if descriptors is not None else 0,
+            "thread(s)": threading.active_count() - threads,
+        }
+        if not any(value > 0 for value in leftovers.values()) or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    slots = autotune.new_tuner().max_workers if autotune.enabled() else jobs
+    return StressReport(count, jobs, elapsed, results, expected, recorder.records, slots, leftovers, min_throughput)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run simulated ffmpeg jobs through the batch runners and check throughput, fairness and shutdown.")
+    parser.add_argument("--count", type=int, default=10000, help="Number of simulated jobs (default 10000).")
+    parser.add_argument("--jobs", type=int, default=32, help="Concurrent ffmpeg processes (default 32; 1 runs the serial path).")
+    parser.add_argument("--kind", choices=sorted(KINDS), default="audio", help="Run the audio or the video batch converter (default audio).")
+    parser.add_argument("--seconds", type=float, default=0.0, help="Wall-clock seconds every simulated conversion takes (default 0).")
+    parser.add_argument("--hang-timeout", type=float, default=DEFAULT_HANG_TIMEOUT,
+                        help=f"Per-job timeout that kills the hung jobs (default {DEFAULT_HANG_TIMEOUT:g}).")
+    parser.add_argument("--autotune", action="store_true", help="Let the autotuner choose the concurrency, starting from --jobs.")
+    parser.add_argument("--min-throughput", type=float, default=0.0, help="Fail unless at least this many jobs per second complete.")
+    parser.add_argument("--keep", metavar="DIR", help="Run in this directory and keep it, instead of a temporary one.")
+    args = parser.parse_args(argv)
+
+    autotune.configure(args.autotune, max_workers=max(args.jobs, autotune.DEFAULT_MAX_WORKERS) if args.autotune else autotune.DEFAULT_MAX_WORKERS)
+    directory = args.keep or tempfile.mkdtemp(prefix="ffmpeg_stress-")
+    try:
+        report = run(directory, args.count, args.kind, args.jobs, args.hang_timeout, args.seconds, args.min_throughput)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(report.describe())
+    return 1 if report.failures() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Locating ffmpeg/ffprobe and knowing what the binary can do.
+
+Each tool is resolved once per process, first match wins:
+
+    1. $MEDIA_CONVERTER_FFMPEG / $MEDIA_CONVERTER_FFPROBE, for deployments
+       that pin a specific build;
+    2. the bundle directory (ffmpeg.exe / ffprobe.exe on Windows, ffmpeg /
+       ffprobe elsewhere);
+    3. the PATH.
+
+What a binary can do (its version, encoders and muxers) comes from
+`ffmpeg -version`, `-encoders` and `-muxers`. Running those on every
+launch would cost more than converting a small file, so the answers are
+kept in a small JSON cache in the user's cache directory, keyed by the
+binary's path, size and modification time: replacing or upgrading ffmpeg
+invalidates its entry, and nothing is probed again until then.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+ENV_OVERRIDES = {"ffmpeg": "MEDIA_CONVERTER_FFMPEG", "ffprobe": "MEDIA_CONVERTER_FFPROBE"}
+CACHE_FILE_NAME = "ffmpeg_capabilities.json"
+# Entries kept in the cache file; older binaries are dropped first.
+MAX_CACHE_ENTRIES = 8
+
+# Output format -> the muxer that writes it, where the names differ.
+MUXERS = {"aac": "adts", "mkv": "matroska"}
+# Audio output format -> encoders ffmpeg picks from for it by default, in its order of preference.
+AUDIO_ENCODERS = {
+    "mp3": ("libmp3lame", "libshine", "mp3_mf"),
+    "wav": ("pcm_s16le",),
+    "flac": ("flac",),
+    "ogg": ("libvorbis", "flac"),
+    "aac": ("aac", "libfdk_aac", "aac_mf", "aac_at"),
+}
+
+_ENTRY = re.compile(r"^\s*([A-Z.]{6})\s+(\S+)", re.MULTILINE)
+_MUXER = re.compile(r"^\s*[D ]?E\s+(\S+)", re.MULTILINE)
+_VERSION = re.compile(r"version\s+(\S+)")
+
+_lock = threading.Lock()
+_memory = {}
+
+
+class ToolNotFoundError(EnvironmentError):
+    pass
+
+
+def executable_name(name):
+    return f"{name}.exe" if sys.platform == "win32" else name
+
+
+def _is_executable(path):
+    return os.path.isfile(path) and os.access(path, os.X_OK)
+
+
+def find_tool(name, bundle_dir, environ=None):
+    """
+    Returns (path, source) for the ffmpeg tool `name`, source being "env",
+    "bundle" or "PATH". Raises ToolNotFoundError when it is nowhere; an
+    environment override that does not point at an executable is an error
+    rather than something to fall back from.
+    """
+    environ = os.environ if environ is None else environ
+    override = environ.get(ENV_OVERRIDES[name])
+    if override:
+        if not _is_executable(override):
+            raise ToolNotFoundError(f"${ENV_OVERRIDES[name]} is set to '{override}', which is not an executable file.")
+        return override, "env"
+    for candidate in dict.fromkeys((executable_name(name), name, f"{name}.exe")):
+        path = os.path.join(bundle_dir, candidate)
+        if _is_executable(path):
+            return path, "bundle"
+    path = shutil.which(name, path=environ.get("PATH"))
+    if path:
+        return path, "PATH"
+    raise ToolNotFoundError(f"{name} was not found in the bundle directory '{bundle_dir}' or on the PATH. "
+                            f"Install it or set ${ENV_OVERRIDES[name]} to its location.")
+
+
+class Capabilities(object):
+    """What one ffmpeg binary supports: its version string, encoder names and muxer names."""
+
+    def __init__(self, version, encoders, muxers):
+        self.version = version
+        self.encoders = frozenset(encoders)
+        self.muxers = frozenset(muxers)
+
+    def to_dict(self):
+        return {"version": self.version, "encoders": sorted(self.encoders), "muxers": sorted(self.muxers)}
+
+    @classmethod
+    def from_dict(cls, fields):
+        return cls(fields["version"], fields["encoders"], fields["muxers"])
+
+    def audio_encoder(self, output_format):
+        """The encoder ffmpeg would use for an audio output_format, or None if it has none of them."""
+        return next((encoder for encoder in AUDIO_ENCODERS.get(output_format, ()) if encoder in self.encoders), None)
+
+    def unsupported_reason(self, output_format):
+        """Why this ffmpeg cannot write output_format, or None if it can."""
+        muxer = MUXERS.get(output_format, output_format)
+        if muxer not in self.muxers:
+            return f"this ffmpeg ({self.version}) has no '{muxer}' muxer for {output_format} output"
+        if output_format in AUDIO_ENCODERS and self.audio_encoder(output_format) is None:
+            return f"this ffmpeg ({self.version}) has no encoder for {output_format} audio (needs one of: {', '.join(AUDIO_ENCODERS[output_format])})"
+        return None
+
+
+def parse_version(text):
+    match = _VERSION.search(text)
+    return match.group(1) if match else "unknown"
+
+
+def parse_encoders(text):
+    # "-encoders" lists " V....D libx264   H.264 ..." after a legend and a "------" separator.
+    _, _, table = text.partition("------")
+    return [name for _, name in _ENTRY.findall(table)]
+
+
+def parse_muxers(text):
+    # "-muxers" lists "  E mp4   MP4 (MPEG-4 Part 14)"; some rows name several muxers separated by commas.
+    _, _, table = text.partition("--")
+    names = []
+    for name in _MUXER.findall(table):
+        names.extend(name.split(","))
+    return names
+
+
+def _run(ffmpeg_path, option):
+    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+    return subprocess.run([ffmpeg_path, "-hide_banner", option], capture_output=True, text=True, check=True,
+                          creationflags=creationflags).stdout
+
+
+def query_capabilities(ffmpeg_path):
+    """
+    Asks ffmpeg_path for its version, encoders and muxers (three short
+    subprocess runs). Raises ValueError if the binary does not identify
+    itself as ffmpeg.
+    """
+    version = _run(ffmpeg_path, "-version")
+    if not version.startswith("ffmpeg version"):
+        raise ValueError(f"'{ffmpeg_path}' does not identify itself as ffmpeg")
+    return Capabilities(parse_version(version), parse_encoders(_run(ffmpeg_path, "-encoders")), parse_muxers(_run(ffmpeg_path, "-muxers")))
+
+
+def default_cache_path(file_name=CACHE_FILE_NAME):
+    """Path of file_name in this application's per-user cache directory."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "media_converter", file_name)
+
+
+def _cache_key(ffmpeg_path):
+    status = os.stat(ffmpeg_path)
+    return f"{os.path.abspath(ffmpeg_path)}|{status.st_size}|{status.st_mtime_ns}"
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, encoding="utf-8") as cache:
+            entries = json.load(cache)
+    except (OSError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+def _write_cache(cache_path, entries):
+    """Replaces the cache file atomically; a cache that cannot be written only costs a probe next time."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(cache_path), prefix=".capabilities-")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as cache:
+            json.dump(entries, cache)
+        os.replace(temporary, cache_path)
+    except OSError:
+        pass
+
+
+def capabilities(ffmpeg_path, cache_path=None, query=query_capabilities):
+    """
+    Capabilities of ffmpeg_path, from memory, then the on-disk cache, and
+    only then by querying the binary (the result is cached). Raises OSError,
+    CalledProcessError or ValueError when the binary cannot be run or is not
+    ffmpeg.
+    """
+    cache_path = cache_path or default_cache_path()
+    key = _cache_key(ffmpeg_path)
+    with _lock:
+        if key in _memory:
+            found = _memory[key]
+            if isinstance(found, Exception):
+                raise found
+            return found
+        entries = _read_cache(cache_path)
+        if key in entries:
+            try:
+                _memory[key] = Capabilities.from_dict(entries[key])
+                return _memory[key]
+            except (KeyError, TypeError):
+                pass
+        try:
+            found = query(ffmpeg_path)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            # Remembered for this process only: the binary may be fixed before the next run.
+            _memory[key] = e
+            raise
+        _memory[key] = found
+        # Stale entries for the same binary are dropped, then the oldest entries beyond the limit.
+        path_prefix = key.rsplit("|", 2)[0] + "|"
+        entries = {name: value for name, value in entries.items() if not name.startswith(path_prefix)}
+        entries[key] = found.to_dict()
+        _write_cache(cache_path, dict(list(entries.items())[-MAX_CACHE_ENTRIES:]))
+        return found
+
+
+def clear_memory():
+    """Forgets the capabilities held in memory (the on-disk cache is kept)."""
+    with _lock:
+        _memory.clear()
@@ -0,0 +1,154 @@
+"""
+Watchdog policy for ffmpeg children.
+
+A corrupt input can leave ffmpeg hung forever, or grinding without ever
+finishing. The runner feeds every output line of a job to a
+ProgressMonitor, which follows the media duration ffmpeg announces
+("Duration: ...") and the position it reports while working ("time=..."
+in the stats line, or out_time_us= from -progress). The job is killed as
+
+    Stalled             when its position has not advanced for
+                        stall_timeout seconds;
+    TimeBudgetExceeded  when it has run longer than budget_factor times the
+                        media duration (never less than min_budget). Off
+                        by default: slow encoders such as VP9 on 4K input
+                        legitimately run far slower than realtime, and
+                        stall detection already catches hung jobs.
+
+Stalled jobs and jobs that exit on a decoding error are retried up to
+`retries` times after a bounded exponential backoff, each retry with
+progressively safer decoder options (discard corrupt packets, ignore
+decode errors, single-threaded decoding). Other failures (an unknown
+encoder, an output that already exists) would only fail again, and
+over-budget jobs were making progress, just too slowly: neither is retried.
+"""
+import re
+import time
+
+DEFAULT_STALL_SECONDS = 60.0
+DEFAULT_BUDGET_FACTOR = 0.0
+DEFAULT_MIN_BUDGET_SECONDS = 120.0
+DEFAULT_RETRIES = 1
+DEFAULT_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+
+STALLED = "Stalled"
+TIME_BUDGET_EXCEEDED = "TimeBudgetExceeded"
+
+# Input options added before -i on each retry; later entries are used for later retries.
+SAFER_INPUT_OPTIONS = (
+    ["-fflags", "+discardcorrupt+genpts", "-err_detect", "ignore_err"],
+    ["-fflags", "+discardcorrupt+genpts", "-err_detect", "ignore_err", "-threads", "1"],
+)
+
+# stderr lines of ffmpeg failing on damaged input, which the safer options of a retry may get past.
+_DECODE_ERROR = re.compile(r"Invalid data found when processing input|[Ee]rror while decoding|corrupt|"
+                           r"Invalid NAL unit|decode_slice_header error|non-existing PPS|Header missing|concealing \d+")
+_DURATION = re.compile(r"Duration:\s*(\d+):(\d\d):(\d\d(?:\.\d+)?)")
+_POSITION = re.compile(r"(?:^|\s)time=\s*(\d+):(\d\d):(\d\d(?:\.\d+)?)")
+_PROGRESS_POSITION = re.compile(r"^out_time_us=(\d+)")
+
+
+def _seconds(match):
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class ProgressMonitor(object):
+    """Follows one ffmpeg attempt's output and decides whether it should be killed."""
+
+    def __init__(self, policy, clock=time.monotonic):
+        self.policy = policy
+        self.clock = clock
+        self.started = clock()
+        self.last_progress = self.started
+        self.duration = None
+        self.position = None
+
+    def observe(self, line):
+        if self.duration is None:
+            match = _DURATION.search(line)
+            if match:
+                self.duration = _seconds(match)
+        match = _POSITION.search(line)
+        if match:
+            position = _seconds(match)
+        else:
+            match = _PROGRESS_POSITION.match(line)
+            position = int(match.group(1)) / 1e6 if match else None
+        if position is not None:
+            if self.position is None or position > self.position:
+                self.position = position
+                self.last_progress = self.clock()
+        elif self.position is None:
+            # Until ffmpeg reports a position, any output shows it is alive.
+            self.last_progress = self.clock()
+
+    @property
+    def budget(self):
+        """Seconds this attempt may run, or None while the duration is unknown or budgets are off."""
+        if self.duration is None or not self.policy.budget_factor:
+            return None
+        return max(self.policy.min_budget, self.duration * self.policy.budget_factor)
+
+    def verdict(self):
+        """STALLED, TIME_BUDGET_EXCEEDED or None if the attempt may keep running."""
+        now = self.clock()
+        if self.policy.stall_timeout and now - self.last_progress > self.policy.stall_timeout:
+            return STALLED
+        budget = self.budget
+        if budget is not None and now - self.started > budget:
+            return TIME_BUDGET_EXCEEDED
+        return None
+
+
+class WatchdogPolicy(object):
+    """Stall and budget limits plus the retry schedule. A stall_timeout or budget_factor of 0/None disables that check."""
+
+    def __init__(self, stall_timeout=DEFAULT_STALL_SECONDS, budget_factor=DEFAULT_BUDGET_FACTOR, min_budget=DEFAULT_MIN_BUDGET_SECONDS,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF_SECONDS, max_backoff=MAX_BACKOFF_SECONDS):
+        self.stall_timeout = stall_timeout
+        self.budget_factor = budget_factor
+        self.min_budget = min_budget
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @property
+    def poll_interval(self):
+        """How often the runner asks the monitor for a verdict."""
+        return min(1.0, self.stall_timeout / 4) if self.stall_timeout else 1.0
+
+    def monitor(self):
+        return ProgressMonitor(self)
+
+    def retryable(self, failure, stderr):
+        """Whether an attempt that ended with `failure` (None for a non-zero exit) and stderr is worth retrying."""
+        if failure == STALLED:
+            return True
+        return failure is None and _DECODE_ERROR.search(stderr or "") is not None
+
+    def backoff_delay(self, retry):
+        """Seconds to wait before retry number `retry` (1-based): doubling from backoff, capped at max_backoff."""
+        return min(self.max_backoff, self.backoff * 2 ** (retry - 1))
+
+    def command_for(self, command, attempt):
+        """The command for attempt number `attempt` (0 is the original), with safer input options on retries."""
+        if attempt == 0 or "-i" not in command:
+            return list(command)
+        options = SAFER_INPUT_OPTIONS[min(attempt, len(SAFER_INPUT_OPTIONS)) - 1]
+        position = command.index("-i")
+        return command[:position] + options + command[position:]
+
+
+_policy = WatchdogPolicy()
+
+
+def configure(stall_timeout=DEFAULT_STALL_SECONDS, budget_factor=DEFAULT_BUDGET_FACTOR, retries=DEFAULT_RETRIES):
+    """Sets the policy used by ffmpeg runners that are not given one explicitly."""
+    global _policy
+    _policy = WatchdogPolicy(stall_timeout, budget_factor, retries=retries)
+
+
+def current_policy():
+    return _policy
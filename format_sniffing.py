@@ -0,0 +1,140 @@
+"""
+Magic-byte format sniffing.
+
+Identifies a file's real format from its first few bytes so the batch
+runners can reject mislabeled or unrecognized files, route images straight
+to the right Pillow decoder and skip conversions that would not change the
+format, all without opening the file with Pillow or ffmpeg.
+"""
+import os
+
+SNIFF_BYTES = 64
+
+# Pillow plugin names for the image formats we can identify.
+PILLOW_DECODERS = {
+    "png": "PNG", "jpeg": "JPEG", "gif": "GIF", "bmp": "BMP",
+    "webp": "WEBP", "tiff": "TIFF", "ico": "ICO",
+}
+
+# Output format names that describe the same container.
+_ALIASES = {"jpg": "jpeg", "tif": "tiff"}
+
+# Sniffed kinds each backend can take: ffmpeg extracts audio from video files
+# and happily wraps audio-only streams, so the two media kinds mix.
+_COMPATIBLE_KINDS = {
+    "image": ("image",),
+    "audio": ("audio", "video"),
+    "video": ("audio", "video"),
+}
+
+_QUICKTIME_ATOMS = (b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot")
+
+
+def sniff_bytes(header):
+    """Returns (kind, format) for the leading bytes of a file, or (None, None) if unknown."""
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image", "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image", "jpeg"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image", "gif"
+    if header.startswith(b"BM") and len(header) >= 14:
+        return "image", "bmp"
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image", "tiff"
+    if header.startswith(b"\x00\x00\x01\x00"):
+        return "image", "ico"
+    if header.startswith(b"%PDF"):
+        return "document", "pdf"
+    if header.startswith(b"RIFF") and len(header) >= 12:
+        riff_type = header[8:12]
+        if riff_type == b"WEBP":
+            return "image", "webp"
+        if riff_type == b"WAVE":
+            return "audio", "wav"
+        if riff_type == b"AVI ":
+            return "video", "avi"
+        return None, None
+    if header.startswith(b"fLaC"):
+        return "audio", "flac"
+    if header.startswith(b"OggS"):
+        return "audio", "ogg"
+    if header.startswith(b"ID3"):
+        return "audio", "mp3"
+    if header.startswith(b"ADIF"):
+        return "audio", "aac"
+    if header.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "audio", "wma"
+    if len(header) >= 2 and header[0] == 0xFF:
+        # MPEG audio frame sync: ADTS (AAC) uses layer bits 00, MP3 does not.
+        if header[1] & 0xF6 == 0xF0:
+            return "audio", "aac"
+        if header[1] & 0xE0 == 0xE0:
+            return "audio", "mp3"
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand == b"qt  ":
+            return "video", "mov"
+        if brand in (b"M4A ", b"M4B "):
+            return "audio", "m4a"
+        return "video", "mp4"
+    if header[4:8] in _QUICKTIME_ATOMS:
+        return "video", "mov"
+    if header.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video", "webm" if b"webm" in header else "mkv"
+    if header.startswith(b"FLV\x01"):
+        return "video", "flv"
+    return None, None
+
+
+def sniff_format(path):
+    """Reads the first SNIFF_BYTES of path and returns (kind, format), or (None, None)."""
+    with open(path, "rb") as f:
+        return sniff_bytes(f.read(SNIFF_BYTES))
+
+
+def normalize_format(output_format):
+    output_format = output_format.lower()
+    return _ALIASES.get(output_format, output_format)
+
+
+def prefilter(files, kind, output_format, force=False):
+    """
+    Splits files into (accepted, rejected) without decoding them.
+
+    accepted is a list of (path, sniffed_format) and rejected a list of
+    (path, reason). A file is rejected when its content is positively another
+    kind of media, when an image's content is not recognized at all, or when
+    it is already in output_format (unless force is set). Audio and video
+    files with unknown headers are passed through for ffmpeg to judge, and
+    either media kind is accepted by both since containers like MP4 and Ogg
+    can hold audio only.
+    """
+    target = normalize_format(output_format)
+    accepted = []
+    rejected = []
+    for path in files:
+        try:
+            sniffed_kind, sniffed_format = sniff_format(path)
+        except OSError as e:
+            rejected.append((path, f"could not be read ({e.strerror or e})"))
+            continue
+        if sniffed_kind is None:
+            if kind == "image":
+                rejected.append((path, "content is not a recognized image format"))
+                continue
+        elif sniffed_kind not in _COMPATIBLE_KINDS[kind]:
+            rejected.append((path, f"content is {sniffed_kind} ({sniffed_format}), not {kind}"))
+            continue
+        if sniffed_format == target and not force:
+            rejected.append((path, f"already {target} (use --force to convert anyway)"))
+            continue
+        accepted.append((path, sniffed_format))
+    return accepted, rejected
+
+
+def describe_rejections(rejected):
+    """Human-readable summary of prefilter rejections."""
+    lines = [f"Skipped {len(rejected)} file(s) without converting them:"]
+    lines.extend(f"  '{os.path.normpath(path)}': {reason}" for path, reason in rejected)
+    return "\n".join(lines)
@@ -0,0 +1,283 @@
+"""
+Raw frame pipes between Pillow and ffmpeg.
+
+Turning a folder of rendered frames into a video normally means writing
+intermediate files and calling ffmpeg separately. Here Pillow workers
+decode the frames in parallel and their raw RGB buffers are written, in
+order, straight into the stdin of a single ffmpeg process reading
+`-f rawvideo`. No temporary files are written.
+
+Frames finish decoding out of order, so results wait in a bounded reorder
+buffer (a window of in-flight decodes) until every earlier frame has been
+written. Each decoded frame is handed to the pipe as a memoryview, so its
+bytes are not copied again on the way to ffmpeg.
+
+The reverse direction extracts frames: ffmpeg decodes only the requested
+range and sampled frames to a raw RGB pipe, every frame is wrapped with
+Image.frombuffer without copying, and a pool encodes them to image files.
+"""
+import collections
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import memory_profile
+from conversion_events import report_start, report_done, report_error, report_progress
+
+DEFAULT_FRAMERATE = 24.0
+# Lines of ffmpeg's stderr kept for error reports.
+STDERR_TAIL_LINES = 50
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def natural_sort_key(path):
+    """Sorts frame_2.png before frame_10.png."""
+    return [int(part) if part.isdigit() else part.lower() for part in _DIGITS.split(os.path.basename(path))]
+
+
+def _creationflags():
+    return subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+
+def _drain(stream, tail):
+    # Keep reading stderr so ffmpeg never blocks on a full pipe while we feed stdin.
+    for line in iter(stream.readline, b""):
+        tail.append(line.decode("utf-8", errors="replace").rstrip())
+    stream.close()
+
+
+def _decode_frame(path, size):
+    """Decodes one frame to packed RGB and returns it as a memoryview over the raw bytes."""
+    with Image.open(path) as image:
+        if image.size != size:
+            raise ValueError(f"Frame '{path}' is {image.size[0]}x{image.size[1]}, but the sequence is {size[0]}x{size[1]}.")
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return memoryview(image.tobytes())
+
+
+def sequence_command(ffmpeg_path, size, framerate, output_path):
+    width, height = size
+    return [
+        ffmpeg_path, "-y",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(framerate),
+        "-i", "-",
+        # yuv420p needs even dimensions; pad odd ones by a pixel.
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-pix_fmt", "yuv420p",
+        output_path,
+    ]
+
+
+def encode_image_sequence(frames, output_path, ffmpeg_path, framerate=DEFAULT_FRAMERATE, workers=None, reorder_window=None):
+    """
+    Encodes the image files `frames`, in the given order, into the video at
+    output_path with one ffmpeg process. Frames are decoded on `workers`
+    threads; at most reorder_window decoded or decoding frames are held at
+    once (default: twice the worker count). Every frame must have the size
+    of the first one. Returns the final conversion event.
+    """
+    source = os.path.dirname(frames[0]) if frames else ""
+    output_format = os.path.splitext(output_path)[1].lstrip(".")
+    started = time.perf_counter()
+    if not frames:
+        return report_error(source, output_format, FileNotFoundError, "Error: No image frames were found to encode.", started, kind="video")
+    bytes_in = sum(os.path.getsize(frame) for frame in frames)
+    report_start(source, output_format, kind="video", bytes_in=bytes_in)
+
+    workers = workers or os.cpu_count() or 4
+    reorder_window = max(1, reorder_window or 2 * workers)
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+    process = None
+    try:
+        with Image.open(frames[0]) as first:
+            size = first.size
+        command = sequence_command(ffmpeg_path, size, framerate, output_path)
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   creationflags=_creationflags())
+        drainer = threading.Thread(target=_drain, args=(process.stderr, stderr_tail), daemon=True)
+        drainer.start()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-decode") as decoders:
+            window = collections.deque()
+            next_frame = 0
+            for written in range(1, len(frames) + 1):
+                while next_frame < len(frames) and len(window) < reorder_window:
+                    window.append(decoders.submit(_decode_frame, frames[next_frame], size))
+                    next_frame += 1
+                process.stdin.write(window.popleft().result())
+                report_progress(written, len(frames), frames[written - 1], kind="video")
+            process.stdin.close()
+        memory_profile.wait(process, source, "video", output_format)
+        drainer.join()
+        stderr = "\n".join(stderr_tail)
+        if process.returncode != 0:
+            error = subprocess.CalledProcessError(process.returncode, command)
+            return report_error(source, output_format, error, f"Error during video conversion with ffmpeg: {error}", started,
+                                kind="video", output_path=output_path, bytes_in=bytes_in, stderr=stderr)
+        return report_done(source, output_format, output_path, started, kind="video", bytes_in=bytes_in,
+                           bytes_out=os.path.getsize(output_path), stderr=stderr)
+    except BrokenPipeError as e:
+        # ffmpeg quit while frames were still coming; its stderr says why.
+        process.wait()
+        return report_error(source, output_format, e, f"Error: ffmpeg stopped reading frames (exit code {process.returncode}).", started,
+                            kind="video", output_path=output_path, bytes_in=bytes_in, stderr="\n".join(stderr_tail))
+    except Exception as e:
+        return report_error(source, output_format, e, f"An unexpected error occurred while encoding the image sequence: {e}", started,
+                            kind="video", output_path=output_path, bytes_in=bytes_in, stderr="\n".join(stderr_tail))
+    finally:
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+
+def probe_video_size(ffprobe_path, input_path):
+    """
+    Returns (width, height) of the frames ffmpeg decodes from the first video
+    stream. ffmpeg applies the stream's rotation (a "rotate" tag, or the
+    display matrix newer versions report), so for phone videos turned by
+    90 or 270 degrees the stored width and height are swapped.
+    """
+    result = subprocess.run([ffprobe_path, "-v", "error", "-select_streams", "v:0",
+                             "-show_entries", "stream=width,height:stream_tags=rotate:stream_side_data=rotation",
+                             "-of", "json", input_path],
+                            capture_output=True, text=True, check=True, creationflags=_creationflags())
+    stream = json.loads(result.stdout)["streams"][0]
+    rotation = stream.get("tags", {}).get("rotate", 0)
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+    width, height = int(stream["width"]), int(stream["height"])
+    if round(float(rotation)) % 180 == 90:
+        return height, width
+    return width, height
+
+
+def extraction_command(ffmpeg_path, input_path, start=None, end=None, frame_step=1, scene_threshold=None, keyframes_only=False):
+    """
+    ffmpeg command that decodes input_path to packed RGB frames on stdout.
+    Seeking happens before the input is opened and decoding stops at `end`,
+    so frames outside the range are never decoded; keyframes_only makes the
+    decoder skip every non-key frame.
+    """
+    command = [ffmpeg_path, "-nostdin", "-v", "error"]
+    if keyframes_only:
+        command += ["-skip_frame", "nokey"]
+    if start:
+        command += ["-ss", str(start)]
+    command += ["-i", input_path]
+    if end is not None:
+        command += ["-t", str(end - (start or 0))]
+    conditions = []
+    if frame_step > 1:
+        conditions.append(f"not(mod(n\\,{frame_step}))")
+    if scene_threshold is not None:
+        conditions.append(f"gt(scene\\,{scene_threshold})")
+    if conditions:
+        # select drops the other frames; vfr keeps ffmpeg from duplicating frames to fill the gaps.
+        command += ["-vf", "select='" + "*".join(conditions) + "'", "-vsync", "vfr"]
+    command += ["-an", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    return command
+
+
+def _read_frame(stream, frame_size):
+    """Reads exactly one frame into a new buffer; returns (buffer, bytes_read)."""
+    buffer = bytearray(frame_size)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < frame_size:
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return buffer, filled
+
+
+def extract_frames(input_path, output_dir, output_format, save_frame, ffmpeg_path, ffprobe_path, start=None, end=None, frame_step=1,
+                   scene_threshold=None, keyframes_only=False, workers=None, max_pending=None):
+    """
+    Decodes the selected frames of the video at input_path with ffmpeg and
+    writes each one to output_dir as <name>_<index>.<output_format>.
+
+    ffmpeg writes raw RGB frames to a pipe; each frame is read into its own
+    buffer and wrapped with Image.frombuffer without copying, then
+    save_frame(image, path) encodes it on one of `workers` threads. At most
+    max_pending frames (default: twice the worker count) wait for a worker,
+    which bounds memory. Returns one conversion event for the whole video.
+    """
+    started = time.perf_counter()
+    bytes_in = None
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+    process = None
+    try:
+        bytes_in = os.path.getsize(input_path)
+        report_start(input_path, output_format, kind="video", bytes_in=bytes_in)
+        size = probe_video_size(ffprobe_path, input_path)
+        frame_size = size[0] * size[1] * 3
+        os.makedirs(output_dir, exist_ok=True)
+        base_name = os.path.splitext(os.path.basename(input_path))[0]
+
+        workers = workers or os.cpu_count() or 4
+        pending = threading.BoundedSemaphore(max_pending or 2 * workers)
+        command = extraction_command(ffmpeg_path, input_path, start, end, frame_step, scene_threshold, keyframes_only)
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+                                   creationflags=_creationflags())
+        drainer = threading.Thread(target=_drain, args=(process.stderr, stderr_tail), daemon=True)
+        drainer.start()
+
+        def encode(image, path):
+            try:
+                save_frame(image, path)
+                return os.path.getsize(path)
+            finally:
+                pending.release()
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-encode") as encoders:
+            while True:
+                buffer, filled = _read_frame(process.stdout, frame_size)
+                if filled < frame_size:
+                    break
+                image = Image.frombuffer("RGB", size, buffer, "raw", "RGB", 0, 1)
+                path = os.path.join(output_dir, f"{base_name}_{len(futures):06d}.{output_format}")
+                pending.acquire()
+                futures.append(encoders.submit(encode, image, path))
+                report_progress(len(futures), None, path, kind="video")
+        memory_profile.wait(process, input_path, "video", output_format)
+        drainer.join()
+        stderr = "\n".join(stderr_tail)
+        if process.returncode != 0:
+            error = subprocess.CalledProcessError(process.returncode, command)
+            return report_error(input_path, output_format, error, f"Error during frame extraction with ffmpeg: {error}", started,
+                                kind="video", output_path=output_dir, bytes_in=bytes_in, stderr=stderr)
+        bytes_out = sum(future.result() for future in futures)
+        if not futures:
+            return report_error(input_path, output_format, "NoFramesSelected", f"Error: No frames of '{input_path}' matched the requested range and sampling.", started,
+                                kind="video", output_path=output_dir, bytes_in=bytes_in, stderr=stderr)
+        return report_done(input_path, output_format, output_dir, started, kind="video", bytes_in=bytes_in, bytes_out=bytes_out, stderr=stderr)
+    except FileNotFoundError as e:
+        return report_error(input_path, output_format, e, f"Error: The input file '{input_path}' was not found.", started, kind="video")
+    except subprocess.CalledProcessError as e:
+        return report_error(input_path, output_format, e, f"Error: ffprobe could not read the video stream of '{input_path}': {e}", started,
+                            kind="video", bytes_in=bytes_in, stderr=e.stderr)
+    except Exception as e:
+        return report_error(input_path, output_format, e, f"An unexpected error occurred while extracting frames: {e}", started,
+                            kind="video", output_path=output_dir, bytes_in=bytes_in, stderr="\n".join(stderr_tail))
+    finally:
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
@@ -0,0 +1,88 @@
+"""
+Multi-resolution ICO output.
+
+An .ico file holds the same icon at several sizes. Letting Pillow build
+them resizes the full decoded image once per size; here the image is
+decoded once (JPEG sources in draft mode, so the decoder itself downscales
+by up to 8x), scaled to the largest icon size, and every smaller level is
+then resized from the level above it. The work per level shrinks with the
+level instead of always starting from the full-resolution image.
+"""
+from PIL import Image
+
+import image_modes
+
+DEFAULT_ICO_SIZES = (16, 32, 48, 64, 128, 256)
+# The ICO directory stores sizes in one byte (0 meaning 256).
+MAX_ICO_SIZE = 256
+
+_sizes = DEFAULT_ICO_SIZES
+
+
+def parse_sizes(text):
+    """Parses "16,32,48" into a tuple of distinct sizes. Raises ValueError for anything outside 1..256."""
+    sizes = set()
+    for part in text.split(","):
+        size = int(part.strip())
+        if not 1 <= size <= MAX_ICO_SIZE:
+            raise ValueError(f"ICO sizes must be between 1 and {MAX_ICO_SIZE}, got {size}.")
+        sizes.add(size)
+    if not sizes:
+        raise ValueError("At least one ICO size is required.")
+    return tuple(sorted(sizes))
+
+
+def configure(sizes=DEFAULT_ICO_SIZES):
+    """Sets the icon sizes written for ICO output."""
+    global _sizes
+    _sizes = tuple(sorted(set(sizes)))
+
+
+def configured_sizes():
+    return _sizes
+
+
+def _square(image, size):
+    """image scaled to fit a size x size square, centred on a transparent canvas when not square."""
+    width, height = image.size
+    scale = size / max(width, height)
+    fitted = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if fitted != image.size:
+        # reducing_gap lets Pillow take large steps with a cheap box reduce before the Lanczos pass.
+        image = image.resize(fitted, Image.LANCZOS, reducing_gap=3.0)
+    if fitted == (size, size):
+        return image
+    canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    canvas.paste(image, ((size - fitted[0]) // 2, (size - fitted[1]) // 2))
+    return canvas
+
+
+def build_pyramid(image, sizes=None):
+    """
+    Returns square RGBA icons for sizes, largest first, each level resized
+    from the one before it. Sizes larger than the image are skipped unless
+    none fit, in which case the smallest size is used.
+    """
+    sizes = sorted(set(sizes or _sizes), reverse=True)
+    fitting = [size for size in sizes if size <= max(image.size)] or sizes[-1:]
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    levels = []
+    current = image
+    for size in fitting:
+        current = _square(current, size)
+        levels.append(current)
+    return levels
+
+
+def save_ico(image, destination, sizes=None):
+    """Writes image to destination (a path or file object) as an ICO holding every pyramid level."""
+    sizes = sizes or _sizes
+    if image.format == "JPEG":
+        # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding, keeping
+        # the long side at least as large as the biggest icon.
+        scale = max(sizes) / max(image.size)
+        if scale < 1:
+            image.draft(None, (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+    levels = build_pyramid(image_modes.normalize_mode(image, "ico"), sizes)
+    levels[0].save(destination, format="ICO", sizes=[level.size for level in levels], append_images=levels[1:])
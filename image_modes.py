@@ -0,0 +1,141 @@
+"""
+Mode normalization before encoding.
+
+Pillow's encoders only take certain modes: JPEG rejects alpha and palettes
+with transparency, and several formats either reject 16-bit and float
+images or clip them to white. normalize_mode() turns a decoded image into
+a mode the target format can store faithfully:
+
+    high bit depth  I;16 / I / F are scaled down to 8-bit L (NumPy,
+                    writing straight into the output buffer) unless the
+                    target stores 16-bit data;
+    palettes        P / PA are expanded to RGB(A) when the target has no
+                    palette support or would lose their transparency;
+    alpha           RGBA / LA are flattened onto a background colour when
+                    the target cannot store alpha.
+
+Images already in an accepted mode are returned untouched.
+"""
+from PIL import Image, ImageColor
+
+try:
+    import numpy
+except ImportError:
+    # Bit-depth reduction falls back to Pillow's point() without NumPy.
+    numpy = None
+
+DEFAULT_BACKGROUND = "white"
+
+# Modes handed to each encoder as is; anything else is normalized first.
+TARGET_MODES = {
+    "bmp": ("1", "L", "P", "RGB", "RGBA"),
+    "gif": ("1", "L", "P", "RGB", "RGBA"),
+    "ico": ("1", "L", "LA", "P", "RGB", "RGBA"),
+    "jpeg": ("1", "L", "RGB", "CMYK"),
+    "jpg": ("1", "L", "RGB", "CMYK"),
+    "pdf": ("1", "L", "P", "RGB", "CMYK"),
+    "png": ("1", "L", "LA", "P", "RGB", "RGBA", "I;16", "I;16B"),
+    "tiff": ("1", "L", "LA", "P", "RGB", "RGBA", "CMYK", "YCbCr", "LAB", "I", "I;16", "I;16B", "F"),
+    "webp": ("1", "L", "LA", "P", "RGB", "RGBA"),
+}
+
+HIGH_BIT_DEPTH_MODES = ("I", "I;16", "I;16L", "I;16B", "I;16N", "F")
+# Pixels reduce_bit_depth copies out of the image and scales at a time, so a
+# large scan needs no full-size temporaries besides the 8-bit result.
+REDUCE_BLOCK_PIXELS = 1 << 18
+
+_background = DEFAULT_BACKGROUND
+
+
+def configure(background=DEFAULT_BACKGROUND):
+    """Sets the colour (any Pillow colour string) that alpha is flattened onto. Raises ValueError if unknown."""
+    global _background
+    ImageColor.getrgb(background)
+    _background = background
+
+
+def background():
+    return _background
+
+
+def reduce_bit_depth(image):
+    """
+    Scales a 16-bit, 32-bit integer or float image down to 8-bit L.
+    Integer images are treated as 16-bit samples (>> 8); float images as
+    0..1 when their maximum is at most 1, otherwise as 16-bit samples.
+    """
+    if numpy is None:
+        return _reduce_bit_depth_with_pillow(image)
+    if not image.width or not image.height:
+        return Image.new("L", image.size)
+    scale = (255.0 if image.getextrema()[1] <= 1.0 else 1 / 256) if image.mode == "F" else None
+    reduced = numpy.empty((image.height, image.width), dtype=numpy.uint8)
+    rows = max(1, REDUCE_BLOCK_PIXELS // image.width)
+    scratch = None
+    for top in range(0, image.height, rows):
+        # Only a band of rows is copied out of the image at a time.
+        pixels = numpy.asarray(image.crop((0, top, image.width, min(image.height, top + rows))))
+        target = reduced[top:top + rows]
+        if pixels.dtype.kind == "u" and pixels.dtype.itemsize == 2:
+            # Write the high byte of every sample straight into the 8-bit buffer.
+            numpy.right_shift(pixels, 8, out=target, casting="unsafe")
+            continue
+        if scratch is None:
+            scratch = numpy.empty((min(rows, image.height), image.width), dtype=pixels.dtype)
+        scaled = scratch[:len(pixels)]
+        if scale is None:
+            numpy.right_shift(pixels, 8, out=scaled)
+        else:
+            numpy.multiply(pixels, scale, out=scaled)
+        numpy.clip(scaled, 0, 255, out=scaled)
+        numpy.copyto(target, scaled, casting="unsafe")
+    # frombuffer shares the array's memory instead of copying it again.
+    return Image.frombuffer("L", image.size, reduced, "raw", "L", 0, 1)
+
+
+def _reduce_bit_depth_with_pillow(image):
+    if image.mode.startswith("I;16"):
+        image = image.convert("I")
+    if image.mode == "F":
+        low, high = image.getextrema()
+        scale = 255.0 if high <= 1.0 else 1 / 256
+    else:
+        scale = 1 / 256
+    return image.point(lambda value: value * scale).convert("L")
+
+
+def flatten_alpha(image, background=None, mode="RGB"):
+    """Composites an image with alpha onto a solid background and returns it in `mode` (RGB or L)."""
+    canvas = Image.new(mode, image.size, ImageColor.getcolor(background or _background, mode))
+    # paste() blends through the alpha band in C, without a separate compositing pass.
+    canvas.paste(image, mask=image.getchannel("A"))
+    return canvas
+
+
+def normalize_mode(image, output_format, background=None):
+    """Returns image converted to a mode `output_format` stores faithfully (or image itself if it already is)."""
+    allowed = TARGET_MODES.get(output_format.lower())
+    if allowed is None or image.mode in allowed:
+        return image
+    if image.mode == "I" and "I;16" in allowed:
+        return image.convert("I;16")
+    if image.mode in HIGH_BIT_DEPTH_MODES:
+        image = reduce_bit_depth(image)
+        if image.mode in allowed:
+            return image
+    if image.mode in ("P", "PA"):
+        image = image.convert("RGBA" if image.mode == "PA" or "transparency" in image.info else "RGB")
+        if image.mode in allowed:
+            return image
+    if image.mode in ("RGBa", "La"):
+        # Undo premultiplied alpha first.
+        image = image.convert(image.mode.upper())
+    if "A" in image.getbands():
+        if "RGBA" in allowed:
+            return image.convert("RGBA")
+        gray = image.mode == "LA" and "L" in allowed
+        return flatten_alpha(image, background, "L" if gray else "RGB")
+    for fallback in ("RGB", "L"):
+        if fallback in allowed:
+            return image.convert(fallback)
+    return image
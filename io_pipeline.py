@@ -0,0 +1,152 @@
+"""
+Overlapped I/O for batch image conversion.
+
+On slow or network storage a plain convert loop spends most of its time
+blocked in reads and writes while the CPU idles. The pipeline splits each
+conversion into three stages:
+
+    read-ahead   I/O threads load the bytes of upcoming files into memory,
+                 bounded by a byte budget;
+    transform    the calling thread decodes and encodes from/to memory,
+                 back to back;
+    write-behind I/O threads flush the encoded outputs to disk, also bounded
+                 by a byte budget.
+
+Results are reported through conversion_events as each output lands on disk.
+"""
+import collections
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conversion_events import report_start, report_done, report_progress
+
+DEFAULT_IO_THREADS = 4
+DEFAULT_PREFETCH_BYTES = 64 * 1024 * 1024
+DEFAULT_WRITE_BEHIND_BYTES = 64 * 1024 * 1024
+# Upper bound on files read ahead, whatever their size.
+MAX_READ_AHEAD_FILES = 64
+
+
+class ByteBudget(object):
+    """Counts bytes held in memory by a stage and blocks producers when the limit is reached."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self, amount, force=False):
+        # `force` admits an item larger than the whole budget when nothing else is held,
+        # so one huge file cannot stall the pipeline forever.
+        with self._condition:
+            if self.used + amount <= self.limit or (force and self.used == 0):
+                self.used += amount
+                return True
+            return False
+
+    def acquire(self, amount):
+        with self._condition:
+            while self.used and self.used + amount > self.limit:
+                self._condition.wait()
+            self.used += amount
+
+    def release(self, amount):
+        with self._condition:
+            self.used -= amount
+            self._condition.notify_all()
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path, buffer):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(buffer)
+
+
+def run_pipeline(jobs, transform, report_failure, kind="image", io_threads=DEFAULT_IO_THREADS,
+                 prefetch_bytes=DEFAULT_PREFETCH_BYTES, write_behind_bytes=DEFAULT_WRITE_BEHIND_BYTES):
+    """
+    Runs `jobs`, a list of (input_path, output_path, output_format) tuples.
+
+    transform(input_path, data, output_format, output) decodes `data` and
+    writes the encoded result into the BytesIO `output`. report_failure(error,
+    input_path, output_format, output_path, started, bytes_in) must report and
+    return an error event. Returns the final events in job order.
+    """
+    read_budget = ByteBudget(prefetch_bytes)
+    write_budget = ByteBudget(write_behind_bytes)
+    readers = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="read-ahead")
+    writers = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="write-behind")
+    results = [None] * len(jobs)
+    in_flight = collections.deque()
+    lock = threading.Lock()
+    completed = [0]
+    next_job = 0
+
+    def finish(index, event):
+        results[index] = event
+        with lock:
+            completed[0] += 1
+            count = completed[0]
+        report_progress(count, len(jobs), event.path, kind=kind)
+
+    def flush(index, input_path, output_path, output_format, output, started, bytes_in):
+        size = output.getbuffer().nbytes
+        try:
+            _write_file(output_path, output.getbuffer())
+            finish(index, report_done(input_path, output_format, output_path, started, kind=kind, bytes_in=bytes_in, bytes_out=size))
+        except Exception as e:
+            finish(index, report_failure(e, input_path, output_format, output_path, started, bytes_in))
+        finally:
+            write_budget.release(size)
+
+    try:
+        while next_job < len(jobs) or in_flight:
+            # Keep the read-ahead window full within the byte budget.
+            while next_job < len(jobs) and len(in_flight) < MAX_READ_AHEAD_FILES:
+                input_path = jobs[next_job][0]
+                try:
+                    size = os.path.getsize(input_path)
+                except OSError:
+                    size = 0
+                if not read_budget.try_acquire(size, force=not in_flight):
+                    break
+                in_flight.append((next_job, size, readers.submit(_read_file, input_path)))
+                next_job += 1
+
+            index, size, future = in_flight.popleft()
+            input_path, output_path, output_format = jobs[index]
+            started = time.perf_counter()
+            try:
+                data = future.result()
+            except Exception as e:
+                read_budget.release(size)
+                finish(index, report_failure(e, input_path, output_format, output_path, started, None))
+                continue
+            read_budget.release(size)
+            bytes_in = len(data)
+            report_start(input_path, output_format, kind=kind, bytes_in=bytes_in)
+
+            output = io.BytesIO()
+            try:
+                transform(input_path, data, output_format, output)
+            except Exception as e:
+                finish(index, report_failure(e, input_path, output_format, output_path, started, bytes_in))
+                continue
+            finally:
+                del data
+            write_budget.acquire(output.getbuffer().nbytes)
+            writers.submit(flush, index, input_path, output_path, output_format, output, started, bytes_in)
+    finally:
+        readers.shutdown(wait=True)
+        writers.shutdown(wait=True)
+    return results
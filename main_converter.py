@@ -2,12 +2,45 @@ import argparse
 import os
 import sys
 import ctypes
-import winreg
+import io
+import time
 import tkinter as tk
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog, messagebox, scrolledtext
 from PIL import Image, UnidentifiedImageError
 import subprocess
+import tarfile
+import zipfile
+import conversion_events
+import ffmpeg_async
+import ffmpeg_watchdog
+import autotune
+import scheduling
+import conversion_service
+import watch_folder
+import io_pipeline
+import shm_pipeline
+import format_sniffing
+import dedup
+import archive_io
+import distributed
+import manifest
+import registry_state
+import image_modes
+import icon_pyramid
+import frame_pipes
+import ffmpeg_tools
+import quality_search
+import memory_profile
+import audio_analysis
+from conversion_events import report_start, report_done, report_error, report_progress, report_summary
+
+try:
+    import winreg
+except ImportError:
+    # winreg only exists on Windows; the converters still work elsewhere.
+    winreg = None
 # --- Global Configuration ---
 
 # Determine if running as a PyInstaller bundled executable
@@ -18,45 +51,51 @@ else:
     # Running as a normal Python script
     BUNDLE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Path to ffmpeg.exe and ffprobe.exe (assuming they are bundled in the same directory as the executable)
-FFMPEG_PATH = os.path.join(BUNDLE_DIR, "ffmpeg.exe")
-FFPROBE_PATH = os.path.join(BUNDLE_DIR, "ffprobe.exe")
-
-# Temporarily add BUNDLE_DIR to PATH to ensure pydub finds ffmpeg/ffprobe
-# This is crucial when running from a PyInstaller executable
-
-
-def _verify_ffmpeg_executables():
-    """Verifies that ffmpeg.exe and ffprobe.exe exist and are executable."""
-    if not os.path.exists(FFMPEG_PATH):
-        raise EnvironmentError(f"ffmpeg.exe not found at {FFMPEG_PATH}. Please ensure it's bundled correctly.")
-    if not os.path.isfile(FFMPEG_PATH):
-        raise EnvironmentError(f"ffmpeg.exe at {FFMPEG_PATH} is not a file.")
-    if not os.access(FFMPEG_PATH, os.X_OK):
-        raise EnvironmentError(f"ffmpeg.exe at {FFMPEG_PATH} is not executable.")
-
-    if not os.path.exists(FFPROBE_PATH):
-        raise EnvironmentError(f"ffprobe.exe not found at {FFPROBE_PATH}. Please ensure it's bundled correctly.")
-    if not os.path.isfile(FFPROBE_PATH):
-        raise EnvironmentError(f"ffprobe.exe at {FFPROBE_PATH} is not a file.")
-    if not os.access(FFPROBE_PATH, os.X_OK):
-        raise EnvironmentError(f"ffprobe.exe at {FFPROBE_PATH} is not executable.")
-
-# Debug prints to verify paths
-print(f"DEBUG: BUNDLE_DIR = {BUNDLE_DIR}")
-print(f"DEBUG: FFMPEG_PATH = {FFMPEG_PATH}")
-print(f"DEBUG: FFPROBE_PATH = {FFPROBE_PATH}")
-print(f"DEBUG: ffmpeg.exe exists at FFMPEG_PATH: {os.path.exists(FFMPEG_PATH)}")
-print(f"DEBUG: ffprobe.exe exists at FFPROBE_PATH: {os.path.exists(FFPROBE_PATH)}")
-print(f"DEBUG: PATH contains BUNDLE_DIR: {BUNDLE_DIR in os.environ["PATH"]}")
+def _locate_ffmpeg_tool(name):
+    """
+    Returns (path, source) for ffmpeg or ffprobe (see ffmpeg_tools.find_tool).
+    When the tool is nowhere, path is where the bundle would have it and
+    source the reason it was not found; conversions needing it then fail
+    with an error event while everything else keeps working.
+    """
+    try:
+        return ffmpeg_tools.find_tool(name, BUNDLE_DIR)
+    except ffmpeg_tools.ToolNotFoundError as e:
+        return os.path.join(BUNDLE_DIR, ffmpeg_tools.executable_name(name)), str(e)
 
-try:
-    _verify_ffmpeg_executables()
-    print("DEBUG: ffmpeg and ffprobe executables verified.")
-except EnvironmentError as e:
-    print(f"ERROR: FFmpeg/FFprobe verification failed: {e}")
-    # Depending on severity, you might want to exit or disable audio features here
-    # For now, we'll let the audio conversion attempt and fail gracefully there.
+FFMPEG_PATH, FFMPEG_SOURCE = _locate_ffmpeg_tool("ffmpeg")
+FFPROBE_PATH, FFPROBE_SOURCE = _locate_ffmpeg_tool("ffprobe")
+
+def _ffmpeg_capabilities():
+    """Capabilities of FFMPEG_PATH (cached on disk), or None when they cannot be determined."""
+    try:
+        return ffmpeg_tools.capabilities(FFMPEG_PATH)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+def _ffmpeg_cannot_write(output_format):
+    """Why the installed ffmpeg cannot produce output_format, or None (also when its capabilities are unknown)."""
+    capabilities = _ffmpeg_capabilities()
+    return capabilities.unsupported_reason(output_format) if capabilities else None
+
+def describe_ffmpeg():
+    """Human-readable report of which ffmpeg/ffprobe are used, where they were found and what ffmpeg supports."""
+    lines = []
+    for name, path, source in (("ffmpeg", FFMPEG_PATH, FFMPEG_SOURCE), ("ffprobe", FFPROBE_PATH, FFPROBE_SOURCE)):
+        found = source in ("env", "bundle", "PATH")
+        lines.append(f"{name}: {path} (from {source})" if found else f"{name}: not found. {source}")
+    capabilities = _ffmpeg_capabilities()
+    if capabilities is None:
+        lines.append("ffmpeg capabilities: unknown (ffmpeg could not be run)")
+        return "\n".join(lines)
+    lines.append(f"ffmpeg version: {capabilities.version}, {len(capabilities.encoders)} encoders, {len(capabilities.muxers)} muxers")
+    for kind, formats in (("audio", SUPPORTED_AUDIO_FORMATS), ("video", SUPPORTED_VIDEO_FORMATS)):
+        for output_format in formats:
+            reason = capabilities.unsupported_reason(output_format)
+            encoder = capabilities.audio_encoder(output_format)
+            status = f"unavailable: {reason}" if reason else (f"ok ({encoder})" if encoder else "ok")
+            lines.append(f"  {kind} {output_format}: {status}")
+    return "\n".join(lines)
 
 # Get the absolute path to the current executable for context menu registration
 CURRENT_EXECUTABLE_PATH = sys.argv[0]
@@ -72,259 +111,664 @@ VIDEO_EXTENSIONS = [".mp4", ".avi", ".mov", ".mkv", ".flv", ".webm"]
 
 # --- Image Conversion Functions ---
 
-def convert_image(input_path, output_format):
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tiff", ".ico")
+
+# Map common output formats to Pillow's expected format strings
+PILLOW_FORMATS = {
+    "jpg": "JPEG",
+    "jpeg": "JPEG",
+    "ico": "ICO",
+    "pdf": "PDF"
+}
+
+def _pillow_format(output_format):
+    return PILLOW_FORMATS.get(output_format, output_format.upper())
+
+def _output_path_for(input_path, output_format, output_dir=None):
+    """
+    Output path for a conversion: the input's base name with the new extension,
+    in output_dir when given, otherwise next to the input.
+    """
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    directory = output_dir if output_dir is not None else os.path.dirname(input_path)
+    return os.path.join(directory, f"{base_name}.{output_format}")
+
+def _report_image_error(e, input_path, output_format, output_path, started, bytes_in):
+    """Reports an image conversion failure with the message matching its exception type."""
+    if isinstance(e, FileNotFoundError):
+        return report_error(input_path, output_format, e, f"Error: The input file '{input_path}' was not found.", started, kind="image", bytes_in=bytes_in)
+    if isinstance(e, UnidentifiedImageError):
+        return report_error(input_path, output_format, e, f"Error: Could not identify image file '{input_path}'. It might be corrupt or an unsupported format.", started, kind="image", bytes_in=bytes_in)
+    if isinstance(e, OSError):
+        return report_error(input_path, output_format, e, f"Error: Failed to save image to '{output_path}'. This might be due to an unsupported output format for the given image data, or a permissions issue. Details: {e}", started, kind="image", output_path=output_path, bytes_in=bytes_in)
+    return report_error(input_path, output_format, e, f"An unexpected error occurred during image conversion: {e}", started, kind="image", output_path=output_path, bytes_in=bytes_in)
+
+def _save_image(image, destination, output_format):
+    """
+    Encodes a decoded image into destination (a path or file object) after
+    normalizing its mode for output_format. ICO output gets every icon size;
+    JPEG and WebP output is quality-searched when a target SSIM is set.
+    """
+    if output_format == "ico":
+        icon_pyramid.save_ico(image, destination)
+    elif quality_search.applies_to(output_format):
+        data = quality_search.encode(image_modes.normalize_mode(image, output_format), output_format).data
+        if hasattr(destination, "write"):
+            destination.write(data)
+        else:
+            with open(destination, "wb") as output:
+                output.write(data)
+    else:
+        image_modes.normalize_mode(image, output_format).save(destination, format=_pillow_format(output_format))
+
+def convert_image(input_path, output_format, output_dir=None, input_format=None, output_path=None):
     """
     Converts an image from the input_path to the specified output_format.
-    The new file is saved with the same base name in the original directory.
+    The new file is saved with the same base name in the original directory,
+    or in output_dir when one is given, unless an explicit output_path is
+    given. input_format, the sniffed source format, lets Pillow go straight
+    to the right decoder.
+    Returns the final conversion event (done or error).
     """
+    started = time.perf_counter()
+    bytes_in = None
     try:
         if not os.path.exists(input_path):
-            print(f"Error: The input file '{input_path}' was not found.")
-            return
-
-        image = Image.open(input_path)
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        input_directory = os.path.dirname(input_path)
-        output_path = os.path.join(input_directory, f"{base_name}.{output_format}")
-        
-        pillow_formats = {
-            "jpg": "JPEG",
-            "jpeg": "JPEG",
-            "ico": "ICO",
-            "pdf": "PDF"
-        }
-        pillow_format = pillow_formats.get(output_format, output_format.upper())
-        
-        image.save(output_path, format=pillow_format)
-        
-        print(f"Success! Converted '{input_path}' to '{output_path}'.")
-
-    except FileNotFoundError:
-        print(f"Error: The input file '{input_path}' was not found.")
-    except UnidentifiedImageError:
-        print(f"Error: Could not identify image file '{input_path}'. It might be corrupt or an unsupported format.")
-    except OSError as e:
-        print(f"Error: Failed to save image to '{output_path}'. This might be due to an unsupported output format for the given image data, or a permissions issue. Details: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred during image conversion: {e}")
+            return report_error(input_path, output_format, FileNotFoundError, f"Error: The input file '{input_path}' was not found.", started, kind="image")
 
-def run_conversion_logic_image(input_path, output_format, recursive):
+        bytes_in = os.path.getsize(input_path)
+        report_start(input_path, output_format, kind="image", bytes_in=bytes_in)
+        with memory_profile.track_image(input_path, output_format) as memory:
+            if input_format in format_sniffing.PILLOW_DECODERS:
+                image = Image.open(input_path, formats=[format_sniffing.PILLOW_DECODERS[input_format]])
+            else:
+                image = Image.open(input_path)
+            output_path = output_path or _output_path_for(input_path, output_format, output_dir)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+
+            _save_image(image, output_path, output_format)
+            memory.decoded(image)
+            dedup.record_hash(input_path, image)
+
+        return report_done(input_path, output_format, output_path, started, kind="image", bytes_in=bytes_in, bytes_out=os.path.getsize(output_path))
+
+    except Exception as e:
+        return _report_image_error(e, input_path, output_format, output_path, started, bytes_in)
+
+def _image_settings():
+    """The image settings configured in this process, for _apply_image_settings() in pipeline worker processes."""
+    return {"background": image_modes.background(), "ico_sizes": icon_pyramid.configured_sizes(), "quality": quality_search.settings()}
+
+def _apply_image_settings(settings):
+    image_modes.configure(settings["background"])
+    icon_pyramid.configure(settings["ico_sizes"])
+    quality_search.configure(**settings["quality"])
+
+def _transform_image(image, output_format):
+    return image_modes.normalize_mode(image, output_format)
+
+def _encode_image(input_path, data, output_format, output):
+    """Decodes image bytes already in memory and encodes them into the output buffer."""
+    _, input_format = format_sniffing.sniff_bytes(data[:format_sniffing.SNIFF_BYTES])
+    decoders = [format_sniffing.PILLOW_DECODERS[input_format]] if input_format in format_sniffing.PILLOW_DECODERS else None
+    with Image.open(io.BytesIO(data), formats=decoders) as image:
+        _save_image(image, output, output_format)
+        dedup.record_hash(input_path, image)
+
+def _collect_input_files(input_path, extensions, recursive):
+    """Lists the files under input_path whose extension is in extensions."""
+    matched = []
+    for root, _, files in os.walk(input_path):
+        for file in files:
+            if file.lower().endswith(extensions):
+                matched.append(os.path.join(root, file))
+        if not recursive:
+            break
+    return matched
+
+def _mirrored_output_dir(file_path, input_root, output_dir):
+    """Directory under output_dir that mirrors file_path's location below input_root."""
+    if output_dir is None:
+        return None
+    relative_directory = os.path.relpath(os.path.dirname(file_path), input_root)
+    return os.path.normpath(os.path.join(output_dir, relative_directory))
+
+def _convert_files(files, output_format, convert, kind, input_root=None, output_dir=None, eta=None):
+    """Converts each file in turn, reporting batch progress (and the ETA, given an EtaTracker) after every file."""
+    total = len(files)
+    results = []
+    for completed, current_input_file_path in enumerate(files, 1):
+        file_output_dir = _mirrored_output_dir(current_input_file_path, input_root, output_dir)
+        results.append(convert(current_input_file_path, output_format, file_output_dir))
+        report_progress(completed, total, current_input_file_path, kind=kind, eta=eta.complete(current_input_file_path) if eta else None)
+    return results
+
+def _convert_files_adaptive(files, output_format, convert, kind, input_root=None, output_dir=None, eta=None):
+    """Like _convert_files, but converts on a thread pool whose concurrency the autotuner adjusts."""
+    total = len(files)
+    completed = [0]
+    lock = threading.Lock()
+
+    def convert_one(path):
+        result = convert(path, output_format, _mirrored_output_dir(path, input_root, output_dir))
+        with lock:
+            completed[0] += 1
+            report_progress(completed[0], total, path, kind=kind, eta=eta.complete(path) if eta else None)
+        return result
+
+    return autotune.map_adaptive(convert_one, files, autotune.new_tuner())
+
+def _plan_batch(files, kind):
+    """
+    Orders files by the configured scheduling policy and returns (files, eta),
+    eta being an EtaTracker when costs were estimated. Costs are only
+    estimated when the policy, a dry run or progress events (which carry the
+    ETA) need them. A dry run reports the plan as a summary.
+    """
+    policy = scheduling.policy()
+    if not scheduling.dry_run() and (len(files) < 2 or (policy == "fifo" and not conversion_events.wants(conversion_events.EVENT_PROGRESS))):
+        return files, None
+    estimates = scheduling.order(scheduling.estimate_costs(files, kind, FFPROBE_PATH), policy)
+    if scheduling.dry_run():
+        report_summary(scheduling.describe_plan(estimates, kind, policy), kind=kind)
+    return [estimate.path for estimate in estimates], scheduling.EtaTracker(estimates)
+
+def _report_invalid_input_path(input_path, output_format, kind):
+    return report_error(input_path, output_format, FileNotFoundError, f"Error: The provided path '{input_path}' is neither a file nor a directory.", time.perf_counter(), kind=kind)
+
+def _input_files_and_root(input_path, extensions, recursive):
+    """Returns (files, input_root) for a file or directory input, or (None, None) if it is neither."""
     if os.path.isdir(input_path):
-        image_extensions = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tiff", ".ico")
-        for root, _, files in os.walk(input_path):
-            for file in files:
-                if file.lower().endswith(image_extensions):
-                    current_input_file_path = os.path.join(root, file)
-                    convert_image(current_input_file_path, output_format)
-            if not recursive:
-                break
+        return _collect_input_files(input_path, extensions, recursive), input_path
     elif os.path.isfile(input_path):
-        convert_image(input_path, output_format)
-    else:
-        print(f"Error: The provided path '{input_path}' is neither a file nor a directory.")
+        return [input_path], os.path.dirname(input_path)
+    return None, None
+
+def _prefilter_files(files, kind, output_format, force):
+    """
+    Sniffs each file's real format from its first bytes. Returns the accepted
+    files and a mapping of path -> sniffed format, plus the rejected files.
+    """
+    accepted, rejected = format_sniffing.prefilter(files, kind, output_format, force)
+    return [path for path, _ in accepted], dict(accepted), rejected
+
+def _report_rejected_files(rejected, kind):
+    if rejected:
+        report_summary(format_sniffing.describe_rejections(rejected), kind=kind)
+
+def _copy_duplicate_outputs(results, duplicates, output_format, input_root, output_dir, link_mode):
+    """
+    Gives every duplicate input the output of its converted representative by
+    reflinking, hardlinking or copying it. Returns the duplicates' events.
+    """
+    events = []
+    for event in results:
+        for duplicate_path in duplicates.get(event.path, ()):
+            started = time.perf_counter()
+            if not event.ok:
+                events.append(report_error(duplicate_path, output_format, "DuplicateSourceFailed", f"Error: '{duplicate_path}' was not converted because its identical copy '{event.path}' failed to convert.", started, kind="image"))
+                continue
+            output_path = _output_path_for(duplicate_path, output_format, _mirrored_output_dir(duplicate_path, input_root, output_dir))
+            try:
+                if os.path.abspath(output_path) != os.path.abspath(event.output_path):
+                    dedup.materialize_copy(event.output_path, output_path, link_mode)
+                events.append(report_done(duplicate_path, output_format, output_path, started, kind="image", bytes_in=event.bytes_in, bytes_out=event.bytes_out))
+            except OSError as e:
+                events.append(report_error(duplicate_path, output_format, e, f"Error: Failed to place the converted copy of '{event.path}' at '{output_path}'. Details: {e}", started, kind="image", output_path=output_path))
+    return events
+
+def _convert_into_archive(members, source, destination, output_format, workers, force, total=None):
+    """
+    Streams (member_path, member_name, data) items through the archive
+    converter into destination. A corrupt or unreadable source archive is
+    reported as one error for the whole source; unreadable files of a
+    directory source only fail their own member.
+    """
+    started = time.perf_counter()
+    try:
+        results, rejected = archive_io.convert_members(members, destination, output_format, _encode_image, "image", workers, force, total)
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        if os.path.isdir(source):
+            return [report_error(source, output_format, e, f"Error: Could not write the archive '{destination}'. Details: {e}", started, kind="image", output_path=destination)]
+        return [report_error(source, output_format, e, f"Error: Could not read the archive '{source}'. It might be corrupt or an unsupported format. Details: {e}", started, kind="image")]
+    _report_rejected_files(rejected, "image")
+    return results
+
+def run_conversion_logic_image(input_path, output_format, recursive, output_dir=None, pipeline=False, io_threads=io_pipeline.DEFAULT_IO_THREADS, force=False,
+                               deduplicate=False, link_mode="auto", near_duplicates=False, output_archive=None, workers=None, processes=None):
+    """
+    Converts an image file or every image in a directory. With pipeline=True
+    reads and writes are overlapped with decoding/encoding on io_threads I/O
+    threads, which helps most on slow or network storage. Files whose content
+    is not an image, or is already in output_format (unless force), are
+    skipped without being opened and listed in a summary.
+
+    With deduplicate=True byte-identical inputs are converted once and the
+    result is linked or copied (link_mode) to the other outputs;
+    near_duplicates=True additionally reports visually similar images.
+
+    A zip or tar input_path is read member by member without extracting it;
+    its results go to output_archive, output_dir or a sibling archive named
+    after the output format. With output_archive set, outputs are written
+    into that zip/tar archive instead of next to the inputs. Archive members
+    are encoded on `workers` threads and written by a single writer thread.
+
+    processes=(decoders, transformers, encoders) runs a directory batch as
+    separate process stages that hand decoded pixels to each other through
+    shared memory instead of converting each file in one thread.
+    """
+    if os.path.isfile(input_path) and archive_io.is_archive_path(input_path):
+        destination = output_archive or output_dir or archive_io.default_destination(input_path, output_format)
+        return _convert_into_archive(archive_io.iter_members(input_path, IMAGE_EXTENSIONS), input_path, destination, output_format, workers, force,
+                                     archive_io.count_members(input_path, IMAGE_EXTENSIONS))
+    files, input_root = _input_files_and_root(input_path, IMAGE_EXTENSIONS, recursive)
+    if files is None:
+        return [_report_invalid_input_path(input_path, output_format, "image")]
+    files, input_formats, rejected = _prefilter_files(files, "image", output_format, force)
+    if output_archive:
+        results = _convert_into_archive(archive_io.iter_files(files, input_root), input_path, output_archive, output_format, workers, force, len(files))
+        _report_rejected_files(rejected, "image")
+        return results
+    duplicates = {}
+    if deduplicate:
+        groups = dedup.find_duplicate_groups(files)
+        files = [group[0] for group in groups]
+        duplicates = {group[0]: group[1:] for group in groups if len(group) > 1}
+    files, eta = _plan_batch(files, "image")
+    if scheduling.dry_run():
+        _report_rejected_files(rejected, "image")
+        return []
+    # Near-duplicate hashes come from the decodes the conversion does anyway
+    # (except in pipeline worker processes, whose images are hashed afterwards).
+    with dedup.collecting_hashes(near_duplicates) as hashes:
+        if pipeline or processes:
+            jobs = [(file, _output_path_for(file, output_format, _mirrored_output_dir(file, input_root, output_dir)), output_format) for file in files]
+            if processes:
+                results = shm_pipeline.run_pipeline(jobs, Image.open, _transform_image, _save_image, _report_image_error, "image", processes,
+                                                    initializer=_apply_image_settings, initargs=(_image_settings(),))
+            else:
+                results = io_pipeline.run_pipeline(jobs, _encode_image, _report_image_error, "image", io_threads)
+        elif os.path.isfile(input_path):
+            results = [convert_image(input_path, output_format, output_dir, input_formats[input_path]) for input_path in files]
+        else:
+            def convert(path, fmt, file_output_dir):
+                return convert_image(path, fmt, file_output_dir, input_formats[path])
+            convert_all = _convert_files_adaptive if autotune.enabled() else _convert_files
+            results = convert_all(files, output_format, convert, "image", input_root, output_dir, eta)
+    if duplicates:
+        results.extend(_copy_duplicate_outputs(results, duplicates, output_format, input_root, output_dir, link_mode))
+        duplicate_count = sum(len(paths) for paths in duplicates.values())
+        report_summary(f"Found {duplicate_count} duplicate file(s) in {len(duplicates)} group(s); each group was converted once and its output reused.", kind="image")
+    if near_duplicates:
+        pairs = dedup.find_near_duplicates(files, hashes=hashes)
+        if pairs:
+            report_summary(dedup.describe_near_duplicates(pairs), kind="image")
+    _report_rejected_files(rejected, "image")
+    return results
 
 # --- Audio Conversion Functions ---
 
-def convert_audio(input_path, output_format):
+def _ffmpeg_command(input_path, output_path):
+    return [
+        FFMPEG_PATH,
+        "-i", input_path,
+        output_path
+    ]
+
+def _run_ffmpeg_batch(files, output_format, kind, jobs, timeout, input_root=None, output_dir=None, plan=None, eta=None):
     """
-    Converts an audio file from the input_path to the specified output_format using ffmpeg.
-    The new file is saved with the same base name in the original directory.
+    Converts files with up to `jobs` concurrent ffmpeg processes driven by the
+    asyncio runner, killing any job that runs longer than `timeout` seconds.
+    `plan`, when given, maps an input path to (output_format, build_command)
+    for that file; by default every file gets a plain conversion to
+    output_format.
+    """
+    ffmpeg_jobs = []
+    unsupported = []
+    for input_path in files:
+        file_format, build_command = plan(input_path) if plan else (output_format, _ffmpeg_command)
+        reason = _ffmpeg_cannot_write(file_format)
+        if reason:
+            unsupported.append(report_error(input_path, file_format, "UnsupportedByFFmpeg", f"Error: Cannot convert '{input_path}' to {file_format}: {reason}.",
+                                            time.perf_counter(), kind=kind))
+            continue
+        file_output_dir = _mirrored_output_dir(input_path, input_root, output_dir)
+        if file_output_dir:
+            os.makedirs(file_output_dir, exist_ok=True)
+        output_path = _output_path_for(input_path, file_format, file_output_dir)
+        ffmpeg_jobs.append(ffmpeg_async.FFmpegJob(input_path, file_format, output_path, build_command(input_path, output_path), kind=kind, timeout=timeout))
+    return unsupported + ffmpeg_async.run_ffmpeg_jobs(ffmpeg_jobs, max_concurrency=jobs, autotuner=autotune.new_tuner(jobs if jobs > 1 else None), eta=eta)
+
+def _convert_with_ffmpeg(input_path, output_format, kind, output_dir=None, build_command=_ffmpeg_command, output_path=None):
+    """
+    Runs ffmpeg to convert input_path to output_format, saving the result with
+    the same base name in the original directory (or output_dir), or at
+    output_path when one is given. `kind` is
+    "audio" or "video" and is used for reporting only. build_command(input_path,
+    output_path) returns the ffmpeg command to run. The run is supervised by
+    the ffmpeg watchdog, so a hung ffmpeg cannot stall a serial batch.
     """
+    started = time.perf_counter()
     try:
         if not os.path.exists(input_path):
-            print(f"Error: The input file '{input_path}' was not found.")
-            return
-
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        input_directory = os.path.dirname(input_path)
-        output_path = os.path.join(input_directory, f"{base_name}.{output_format}")
-
-        command = [
-            FFMPEG_PATH,
-            "-i", input_path,
-            output_path
-        ]
-
-        # Run ffmpeg command
-        if sys.platform == "win32":
-            creationflags = subprocess.CREATE_NO_WINDOW
-        else:
-            creationflags = 0
-        result = subprocess.run(command, capture_output=True, text=True, check=True, creationflags=creationflags)
-
-        print(f"Success! Converted '{input_path}' to '{output_path}'.")
-        print("FFmpeg stdout:", result.stdout)
-        if result.stderr:
-            print("FFmpeg stderr:", result.stderr)
-
-    except FileNotFoundError:
-        print(f"Error: The input file '{input_path}' was not found.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error during audio conversion with ffmpeg: {e}")
-        print("FFmpeg stdout:", e.stdout)
-        print("FFmpeg stderr:", e.stderr)
+            return report_error(input_path, output_format, FileNotFoundError, f"Error: The input file '{input_path}' was not found.", started, kind=kind)
+
+        unsupported = _ffmpeg_cannot_write(output_format)
+        if unsupported:
+            return report_error(input_path, output_format, "UnsupportedByFFmpeg", f"Error: Cannot convert '{input_path}' to {output_format}: {unsupported}.", started, kind=kind)
+
+        output_path = output_path or _output_path_for(input_path, output_format, output_dir)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        # The runner reports start/done/error itself; the watchdog kills and retries stuck jobs.
+        job = ffmpeg_async.FFmpegJob(input_path, output_format, output_path, build_command(input_path, output_path), kind=kind)
+        return ffmpeg_async.run_ffmpeg_job(job)
+
     except EnvironmentError as e:
-        print(f"Error: {e}")
+        return report_error(input_path, output_format, e, f"Error: {e}", started, kind=kind, output_path=output_path)
     except Exception as e:
-        print(f"An unexpected error occurred during audio conversion: {e}")
+        return report_error(input_path, output_format, e, f"An unexpected error occurred during {kind} conversion: {e}", started, kind=kind, output_path=output_path)
 
-def run_conversion_logic_audio(input_path, output_format, recursive):
-    if os.path.isdir(input_path):
-        audio_extensions = (".mp3", ".wav", ".flac", ".ogg", ".aac", ".m4a", ".wma")
-        for root, _, files in os.walk(input_path):
-            for file in files:
-                if file.lower().endswith(audio_extensions):
-                    current_input_file_path = os.path.join(root, file)
-                    convert_audio(current_input_file_path, output_format)
-            if not recursive:
-                break
-    elif os.path.isfile(input_path):
-        convert_audio(input_path, output_format)
+def convert_audio(input_path, output_format, output_dir=None, output_path=None):
+    """
+    Converts an audio file from the input_path to the specified output_format using ffmpeg.
+    The new file is saved with the same base name in the original directory,
+    or in output_dir when one is given, unless an explicit output_path is given.
+    Returns the final conversion event (done or error).
+    """
+    return _convert_with_ffmpeg(input_path, output_format, "audio", output_dir, output_path=output_path)
+
+def run_conversion_logic_audio(input_path, output_format, recursive, jobs=1, timeout=None, output_dir=None, force=False):
+    """
+    Converts an audio file or every audio file in a directory. With jobs > 1, a
+    per-job timeout or autotuning the files go to the asyncio ffmpeg runner. Files
+    that are really images or documents, or are already in output_format
+    (unless force), are skipped and listed in a summary.
+    """
+    files, input_root = _input_files_and_root(input_path, tuple(AUDIO_EXTENSIONS), recursive)
+    if files is None:
+        return [_report_invalid_input_path(input_path, output_format, "audio")]
+    files, _, rejected = _prefilter_files(files, "audio", output_format, force)
+    files, eta = _plan_batch(files, "audio")
+    if scheduling.dry_run():
+        results = []
+    elif jobs > 1 or timeout is not None or autotune.enabled():
+        results = _run_ffmpeg_batch(files, output_format, "audio", jobs, timeout, input_root, output_dir, eta=eta)
+    else:
+        results = _convert_files(files, output_format, convert_audio, "audio", input_root, output_dir, eta)
+    _report_rejected_files(rejected, "audio")
+    return results
+
+def analyze_audio(input_path, output_format=None, output_dir=None, output_path=None):
+    """
+    Renders <name>_waveform.png and <name>_spectrogram.png for an audio file,
+    next to it or in output_dir. With output_format, the file is converted in
+    the same ffmpeg run, from the same decode, to output_path when one is given.
+    Returns the final conversion event (done or error).
+    """
+    conversion_path = (output_path or _output_path_for(input_path, output_format, output_dir)) if output_format else None
+    return audio_analysis.analyze_audio(input_path, output_dir or os.path.dirname(input_path), FFMPEG_PATH, conversion_path)
+
+def run_audio_analysis(input_path, output_format, recursive, output_dir=None, force=False):
+    """
+    Analyzes an audio file or every audio file in a directory, converting each
+    one to output_format as well when it is given. Files already in
+    output_format are still analyzed, just not converted (unless force is set).
+    """
+    target_format = output_format or "png"
+    files, input_root = _input_files_and_root(input_path, tuple(AUDIO_EXTENSIONS), recursive)
+    if files is None:
+        return [_report_invalid_input_path(input_path, target_format, "audio")]
+    # Analysis is never a no-op, so only content rejections apply here.
+    files, sniffed, rejected = _prefilter_files(files, "audio", target_format, True)
+    target = format_sniffing.normalize_format(target_format)
+
+    def analyze(path, file_format, file_output_dir=None):
+        return analyze_audio(path, None if sniffed.get(path) == target and not force else file_format, file_output_dir)
+
+    results = _convert_files(files, output_format, analyze, "audio", input_root, output_dir)
+    _report_rejected_files(rejected, "audio")
+    return results
+
+# --- Audio Extraction Functions ---
+
+# Audio codec -> output formats whose container can take that stream as is.
+AUDIO_COPY_FORMATS = {
+    "mp3": ("mp3",),
+    "aac": ("aac",),
+    "flac": ("flac",),
+    "vorbis": ("ogg",),
+    "opus": ("ogg",),
+    "pcm_s16le": ("wav",),
+    "pcm_s24le": ("wav",),
+    "pcm_s32le": ("wav",),
+    "pcm_u8": ("wav",),
+    "pcm_f32le": ("wav",),
+}
+# Used when no output format is given and the source codec has no matching container,
+# in order of preference: the first one the installed ffmpeg can encode is chosen.
+DEFAULT_EXTRACTED_AUDIO_FORMAT = "mp3"
+FALLBACK_EXTRACTED_AUDIO_FORMATS = ("mp3", "aac", "flac")
+
+def probe_audio_codec(input_path):
+    """Returns the codec name of input_path's first audio stream, or None if it has none."""
+    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+    result = subprocess.run([FFPROBE_PATH, "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name", "-of", "csv=p=0", input_path],
+                            capture_output=True, text=True, check=True, creationflags=creationflags)
+    return result.stdout.strip().splitlines()[0] if result.stdout.strip() else None
+
+def _audio_extraction_plan(codec, output_format=None):
+    """
+    Returns (output_format, copy) for extracting a `codec` stream: copy is
+    True when output_format's container takes the stream without
+    re-encoding. Without output_format, the format matching the codec is
+    chosen.
+    """
+    copy_formats = AUDIO_COPY_FORMATS.get(codec, ())
+    output_format = output_format or (copy_formats[0] if copy_formats else _default_extracted_audio_format())
+    return output_format, output_format in copy_formats
+
+def _default_extracted_audio_format():
+    """The first fallback format the installed ffmpeg can encode (mp3 when its capabilities are unknown)."""
+    capabilities = _ffmpeg_capabilities()
+    if capabilities is None:
+        return DEFAULT_EXTRACTED_AUDIO_FORMAT
+    return next((fmt for fmt in FALLBACK_EXTRACTED_AUDIO_FORMATS if capabilities.audio_encoder(fmt)), DEFAULT_EXTRACTED_AUDIO_FORMAT)
+
+def _audio_extraction_command(copy):
+    def build_command(input_path, output_path):
+        codec = ["-c:a", "copy"] if copy else []
+        return [FFMPEG_PATH, "-i", input_path, "-map", "0:a:0", "-vn"] + codec + [output_path]
+    return build_command
+
+def _report_audio_probe_error(input_path, output_format, e, started):
+    if isinstance(e, subprocess.CalledProcessError):
+        return report_error(input_path, output_format, e, f"Error: ffprobe could not read '{input_path}': {e}", started, kind="audio", stderr=e.stderr)
+    return report_error(input_path, output_format, e, f"Error: Could not probe '{input_path}': {e}", started, kind="audio")
+
+def _probe_for_extraction(input_path, output_format):
+    """Returns (output_format, copy) for input_path, or an error event if it cannot be extracted."""
+    started = time.perf_counter()
+    try:
+        codec = probe_audio_codec(input_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        return _report_audio_probe_error(input_path, output_format or DEFAULT_EXTRACTED_AUDIO_FORMAT, e, started)
+    if codec is None:
+        return report_error(input_path, output_format or DEFAULT_EXTRACTED_AUDIO_FORMAT, "NoAudioStream",
+                            f"Error: '{input_path}' has no audio stream to extract.", started, kind="audio")
+    return _audio_extraction_plan(codec, output_format)
+
+def extract_audio(input_path, output_format=None, output_dir=None, output_path=None):
+    """
+    Extracts the soundtrack of a video file into output_format (or, when it is
+    None, the format matching the source codec), at output_path when one is
+    given. The stream is copied without re-encoding when the target
+    container can hold it and transcoded otherwise. Returns the final
+    conversion event (done or error).
+    """
+    plan = _probe_for_extraction(input_path, output_format)
+    if isinstance(plan, conversion_events.ConversionEvent):
+        return plan
+    output_format, copy = plan
+    return _convert_with_ffmpeg(input_path, output_format, "audio", output_dir, _audio_extraction_command(copy), output_path)
+
+def run_audio_extraction(input_path, output_format, recursive, jobs=1, timeout=None, output_dir=None, force=False):
+    """
+    Extracts the audio of a video file or every video file in a directory.
+    With jobs > 1, a per-job timeout or autotuning, the files are probed `jobs` at a time
+    and handed to the asyncio ffmpeg runner.
+    """
+    target_format = output_format or DEFAULT_EXTRACTED_AUDIO_FORMAT
+    files, input_root = _input_files_and_root(input_path, tuple(VIDEO_EXTENSIONS), recursive)
+    if files is None:
+        return [_report_invalid_input_path(input_path, target_format, "audio")]
+    files, _, rejected = _prefilter_files(files, "video", target_format, force)
+    # Extraction time follows the soundtrack's duration, not the picture size.
+    files, eta = _plan_batch(files, "audio")
+    if scheduling.dry_run():
+        results = []
+    elif jobs > 1 or timeout is not None or autotune.enabled():
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as probes:
+            plans = dict(zip(files, probes.map(lambda path: _probe_for_extraction(path, output_format), files)))
+        results = [plan for plan in plans.values() if isinstance(plan, conversion_events.ConversionEvent)]
+        extractable = [path for path in files if not isinstance(plans[path], conversion_events.ConversionEvent)]
+        results += _run_ffmpeg_batch(extractable, target_format, "audio", jobs, timeout, input_root, output_dir,
+                                     plan=lambda path: (plans[path][0], _audio_extraction_command(plans[path][1])), eta=eta)
     else:
-        print(f"Error: The provided path '{input_path}' is neither a file nor a directory.")
+        results = _convert_files(files, output_format, extract_audio, "audio", input_root, output_dir, eta)
+    _report_rejected_files(rejected, "audio")
+    return results
 
 # --- Video Conversion Functions ---
 
-def convert_video(input_path, output_format):
+def convert_video(input_path, output_format, output_dir=None, output_path=None):
     """
     Converts a video file from the input_path to the specified output_format using ffmpeg.
-    The new file is saved with the same base name in the original directory.
+    The new file is saved with the same base name in the original directory,
+    or in output_dir when one is given, unless an explicit output_path is given.
+    Returns the final conversion event (done or error).
     """
-    try:
-        if not os.path.exists(input_path):
-            print(f"Error: The input file '{input_path}' was not found.")
-            return
-
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        input_directory = os.path.dirname(input_path)
-        output_path = os.path.join(input_directory, f"{base_name}.{output_format}")
-
-        command = [
-            FFMPEG_PATH,
-            "-i", input_path,
-            output_path
-        ]
-
-        # Run ffmpeg command
-        if sys.platform == "win32":
-            creationflags = subprocess.CREATE_NO_WINDOW
-        else:
-            creationflags = 0
-        result = subprocess.run(command, capture_output=True, text=True, check=True, creationflags=creationflags)
-
-        print(f"Success! Converted '{input_path}' to '{output_path}'.")
-        print("FFmpeg stdout:", result.stdout)
-        if result.stderr:
-            print("FFmpeg stderr:", result.stderr)
-
-    except FileNotFoundError:
-        print(f"Error: The input file '{input_path}' was not found.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error during video conversion with ffmpeg: {e}")
-        print("FFmpeg stdout:", e.stdout)
-        print("FFmpeg stderr:", e.stderr)
-    except EnvironmentError as e:
-        print(f"Error: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred during video conversion: {e}")
+    return _convert_with_ffmpeg(input_path, output_format, "video", output_dir, output_path=output_path)
 
-def run_conversion_logic_video(input_path, output_format, recursive):
-    if os.path.isdir(input_path):
-        for root, _, files in os.walk(input_path):
-            for file in files:
-                if file.lower().endswith(tuple(VIDEO_EXTENSIONS)):
-                    current_input_file_path = os.path.join(root, file)
-                    convert_video(current_input_file_path, output_format)
-            if not recursive:
-                break
-    elif os.path.isfile(input_path):
-        convert_video(input_path, output_format)
+def run_conversion_logic_video(input_path, output_format, recursive, jobs=1, timeout=None, output_dir=None, force=False):
+    """
+    Converts a video file or every video file in a directory. With jobs > 1, a
+    per-job timeout or autotuning the files go to the asyncio ffmpeg runner. Files
+    that are really images or documents, or are already in output_format
+    (unless force), are skipped and listed in a summary.
+    """
+    files, input_root = _input_files_and_root(input_path, tuple(VIDEO_EXTENSIONS), recursive)
+    if files is None:
+        return [_report_invalid_input_path(input_path, output_format, "video")]
+    files, _, rejected = _prefilter_files(files, "video", output_format, force)
+    files, eta = _plan_batch(files, "video")
+    if scheduling.dry_run():
+        results = []
+    elif jobs > 1 or timeout is not None or autotune.enabled():
+        results = _run_ffmpeg_batch(files, output_format, "video", jobs, timeout, input_root, output_dir, eta=eta)
     else:
-        print(f"Error: The provided path '{input_path}' is neither a file nor a directory.")
+        results = _convert_files(files, output_format, convert_video, "video", input_root, output_dir, eta)
+    _report_rejected_files(rejected, "video")
+    return results
 
-# --- Registry Management Functions ---
+def run_image_sequence_to_video(input_path, output_format, output_dir=None, framerate=frame_pipes.DEFAULT_FRAMERATE, workers=None):
+    """
+    Encodes the image frames in the directory input_path (in natural file
+    name order) into one video named after the directory, written next to it
+    or into output_dir. Frames are decoded in parallel and piped to ffmpeg as
+    raw RGB, without intermediate files.
+    """
+    if not os.path.isdir(input_path):
+        return _report_invalid_input_path(input_path, output_format, "video")
+    frames = sorted(_collect_input_files(input_path, IMAGE_EXTENSIONS, False), key=frame_pipes.natural_sort_key)
+    directory = os.path.normpath(input_path)
+    output_path = _output_path_for(directory, output_format, output_dir)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    return frame_pipes.encode_image_sequence(frames, output_path, FFMPEG_PATH, framerate, workers)
+
+def run_video_to_frames(input_path, output_format, recursive, output_dir=None, start=None, end=None, frame_step=1, scene_threshold=None,
+                        keyframes_only=False, workers=None, force=False):
+    """
+    Extracts frames from a video file or every video file in a directory as
+    output_format images, into a <name>_frames directory next to each video
+    or under output_dir. Only the frames in [start, end) are decoded, and
+    frame_step, scene_threshold and keyframes_only thin them out further.
+    """
+    files, input_root = _input_files_and_root(input_path, tuple(VIDEO_EXTENSIONS), recursive)
+    if files is None:
+        return [_report_invalid_input_path(input_path, output_format, "video")]
+    files, _, rejected = _prefilter_files(files, "video", output_format, force)
 
-def add_context_menu_entry(file_type, menu_name, command, icon_path=None):
-    try:
-        key_path = rf"Software\Classes\{file_type}\shell\{menu_name}"
-        key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, key_path)
-        if icon_path:
-            winreg.SetValueEx(key, "Icon", 0, winreg.REG_SZ, icon_path)
-        winreg.CloseKey(key)
-
-        command_key_path = rf"{key_path}\command"
-        command_key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, command_key_path)
-        winreg.SetValueEx(command_key, None, 0, winreg.REG_SZ, command)
-        winreg.CloseKey(command_key)
-        print(f"Added context menu for {file_type}: {menu_name}")
-    except Exception as e:
-        print(f"Error adding context menu for {file_type}: {menu_name} - {e}")
+    def convert(path, fmt, file_output_dir):
+        frames_dir = os.path.join(file_output_dir or os.path.dirname(path), f"{os.path.splitext(os.path.basename(path))[0]}_frames")
+        return frame_pipes.extract_frames(path, frames_dir, fmt, lambda image, destination: _save_image(image, destination, fmt),
+                                          FFMPEG_PATH, FFPROBE_PATH, start, end, frame_step, scene_threshold, keyframes_only, workers)
 
-def add_subcommand_entry(parent_key_path, submenu_name, command):
-    try:
-        submenu_key_path = rf"{parent_key_path}\shell\{submenu_name}"
-        submenu_key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, submenu_key_path)
-        winreg.CloseKey(submenu_key)
-
-        command_key_path = rf"{submenu_key_path}\command"
-        command_key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, command_key_path)
-        winreg.SetValueEx(command_key, None, 0, winreg.REG_SZ, command)
-        winreg.CloseKey(command_key)
-        print(f"Added subcommand: {submenu_name}")
-    except Exception as e:
-        print(f"Error adding subcommand {submenu_name} - {e}")
+    results = _convert_files(files, output_format, convert, "video", input_root, output_dir)
+    _report_rejected_files(rejected, "video")
+    return results
 
-def remove_context_menu_entry(file_type, menu_name):
-    try:
-        key_path = rf"Software\Classes\{file_type}\shell\{menu_name}"
-        winreg.DeleteKey(winreg.HKEY_CURRENT_USER, key_path + r'\command')
-        winreg.DeleteKey(winreg.HKEY_CURRENT_USER, key_path)
-        print(f"Removed context menu for {file_type}: {menu_name}")
-    except FileNotFoundError:
-        print(f"Context menu for {file_type}: {menu_name} not found, skipping removal.")
-    except Exception as e:
-        print(f"Error removing context menu for {file_type}: {menu_name} - {e}")
+# --- Registry Management Functions ---
 
-def add_main_context_menu_entry_with_subcommands(file_type, main_menu_name, icon_path=None):
-    try:
-        key_path = rf"Software\Classes\{file_type}\shell\{main_menu_name}"
-        key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, key_path)
-        winreg.SetValueEx(key, "SubCommands", 0, winreg.REG_SZ, "")
-        if icon_path:
-            winreg.SetValueEx(key, "Icon", 0, winreg.REG_SZ, icon_path)
-        winreg.CloseKey(key)
-        print(f"Added main context menu with subcommands for {file_type}: {main_menu_name}")
-        return key_path
-    except Exception as e:
-        print(f"Error adding main context menu with subcommands for {file_type}: {main_menu_name} - {e}")
-        return None
+CONTEXT_MENU_NAME = "Convert Media To"
+# Menu name used by older releases; still cleaned up on register/unregister.
+OLD_IMAGE_MENU_NAME = "Convert Image(s) To"
+IMAGE_FILE_TYPE = r"SystemFileAssociations\image"
 
-def remove_subcommand_entry(parent_key_path, submenu_name):
-    try:
-        submenu_key_path = rf"{parent_key_path}\shell\{submenu_name}"
-        winreg.DeleteKey(winreg.HKEY_CURRENT_USER, submenu_key_path + r'\command')
-        winreg.DeleteKey(winreg.HKEY_CURRENT_USER, submenu_key_path)
-        print(f"Removed subcommand: {submenu_name}")
-    except FileNotFoundError:
-        print(f"Subcommand {submenu_name} not found, skipping removal.")
-    except Exception as e:
-        print(f"Error removing subcommand {submenu_name} - {e}")
+def _context_menu_key(file_type, menu_name=CONTEXT_MENU_NAME):
+    return rf"Software\Classes\{file_type}\shell\{menu_name}"
 
-def delete_key_recursive(hkey, subkey):
-    try:
-        reg_key = winreg.OpenKey(hkey, subkey, 0, winreg.KEY_ALL_ACCESS)
-        while True:
-            try:
-                sub = winreg.EnumKey(reg_key, 0)
-                delete_key_recursive(reg_key, sub)
-            except OSError:
-                break
-        winreg.CloseKey(reg_key)
-        winreg.DeleteKey(hkey, subkey)
-    except FileNotFoundError:
-        pass
-    except Exception as e:
-        print(f"Error deleting key recursively {subkey}: {e}")
+def _context_menu_roots():
+    """Every menu key this program owns; keys below them that are no longer wanted get deleted."""
+    file_types = ([IMAGE_FILE_TYPE]
+                  + [rf"SystemFileAssociations\{ext}" for ext in AUDIO_EXTENSIONS]
+                  + [rf"SystemFileAssociations\{ext}" for ext in VIDEO_EXTENSIONS]
+                  + ["Directory", r"Directory\Background"])
+    return [_context_menu_key(file_type) for file_type in file_types] + [_context_menu_key(IMAGE_FILE_TYPE, OLD_IMAGE_MENU_NAME)]
+
+def desired_context_menu_state(executable_path=None):
+    """
+    The registry keys and values the context menus should have, as
+    {key_path: {value_name: data}} relative to HKEY_CURRENT_USER.
+    """
+    executable_path = executable_path or CURRENT_EXECUTABLE_PATH
+    desired = {}
+
+    def add_menu(file_type, entries):
+        key_path = _context_menu_key(file_type)
+        desired[key_path] = {"SubCommands": ""}
+        desired[rf"{key_path}\shell"] = {}
+        for submenu_name, command in entries:
+            desired[rf"{key_path}\shell\{submenu_name}"] = {}
+            desired[rf"{key_path}\shell\{submenu_name}\command"] = {registry_state.DEFAULT_VALUE: command}
+
+    # For individual image, audio and video files
+    add_menu(IMAGE_FILE_TYPE, [(output_format.upper(), f'"{executable_path}" --image "%1" {output_format}')
+                               for output_format in SUPPORTED_IMAGE_FORMATS])
+    for ext in AUDIO_EXTENSIONS:
+        add_menu(rf"SystemFileAssociations\{ext}", [(output_format.upper(), f'"{executable_path}" --audio -ai "%1" -o {output_format}')
+                                                     for output_format in SUPPORTED_AUDIO_FORMATS])
+    for ext in VIDEO_EXTENSIONS:
+        add_menu(rf"SystemFileAssociations\{ext}", [(output_format.upper(), f'"{executable_path}" --video -vi "%1" -vo {output_format}')
+                                                     for output_format in SUPPORTED_VIDEO_FORMATS])
+
+    # For directories (%1) and the directory background (%V, right-clicking empty space in a folder)
+    for file_type, target in (("Directory", "%1"), (r"Directory\Background", "%V")):
+        entries = [(f"IMAGE_TO_{output_format.upper()}", f'"{executable_path}" --image "{target}" {output_format} -ir')
+                   for output_format in SUPPORTED_IMAGE_FORMATS]
+        entries += [(f"AUDIO_TO_{output_format.upper()}", f'"{executable_path}" --audio -ai "{target}" -o {output_format} -ar')
+                    for output_format in SUPPORTED_AUDIO_FORMATS]
+        entries += [(f"VIDEO_TO_{output_format.upper()}", f'"{executable_path}" --video -vi "{target}" -vo {output_format} -vr')
+                    for output_format in SUPPORTED_VIDEO_FORMATS]
+        add_menu(file_type, entries)
+    return desired
+
+def _registry_backend():
+    if winreg is None:
+        raise EnvironmentError("Context menu entries can only be registered on Windows.")
+    return registry_state.WinregBackend(winreg)
 
 def is_admin():
     try:
@@ -332,202 +776,46 @@ def is_admin():
     except AttributeError:
         return ctypes.windll.shell32.IsUserAnAdmin()
 
-def check_if_entries_exist():
-    main_menu_name = "Convert Media To"
-    image_file_type = r"SystemFileAssociations\image"
-    key_path = rf"Software\Classes\{image_file_type}\shell\{main_menu_name}"
+def check_if_entries_exist(backend=None):
     try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path)
-        winreg.CloseKey(key)
-        return True
-    except FileNotFoundError:
-        return False
+        return (backend or _registry_backend()).key_exists(_context_menu_key(IMAGE_FILE_TYPE))
     except Exception as e:
         print(f"Error checking for existing entries: {e}")
         return False
 
-def register_context_menu():
+def _synchronize_context_menu(desired, backend):
+    """Applies the difference between desired and the registry; returns the operations, or None on failure."""
     if not is_admin():
         print("This script needs to be run with administrator privileges to modify the registry.")
         print("Please right-click on your terminal/command prompt and select 'Run as administrator'.")
-        return
-
-    main_menu_name = "Convert Media To"
-    
-    # For individual image files
-    image_file_type = r"SystemFileAssociations\image"
-    main_key_path_image = add_main_context_menu_entry_with_subcommands(image_file_type, main_menu_name)
-    if main_key_path_image:
-        for output_format in SUPPORTED_IMAGE_FORMATS:
-            command = f'\"{CURRENT_EXECUTABLE_PATH}\" --image \"%1\" {output_format}'
-            add_subcommand_entry(main_key_path_image, output_format.upper(), command)
-
-    # For individual audio files
-    for ext in AUDIO_EXTENSIONS:
-        audio_file_type = rf"SystemFileAssociations\{ext}"
-        main_key_path_audio = add_main_context_menu_entry_with_subcommands(audio_file_type, main_menu_name)
-        if main_key_path_audio:
-            for output_format in SUPPORTED_AUDIO_FORMATS:
-                command = f'"{CURRENT_EXECUTABLE_PATH}" --audio -ai "%1" -o {output_format}'
-                add_subcommand_entry(main_key_path_audio, output_format.upper(), command)
-
-    # For individual video files
-    for ext in VIDEO_EXTENSIONS:
-        video_file_type = rf"SystemFileAssociations\{ext}"
-        main_key_path_video = add_main_context_menu_entry_with_subcommands(video_file_type, main_menu_name)
-        if main_key_path_video:
-            for output_format in SUPPORTED_VIDEO_FORMATS:
-                command = f'"{CURRENT_EXECUTABLE_PATH}" --video -vi "%1" -vo {output_format}'
-                add_subcommand_entry(main_key_path_video, output_format.upper(), command)
-
-    # For directories (when right-clicking on a folder)
-    directory_file_type = "Directory"
-    main_key_path_directory = add_main_context_menu_entry_with_subcommands(directory_file_type, main_menu_name)
-    if main_key_path_directory:
-        # Offer both image and audio conversion for directories
-        for output_format in SUPPORTED_IMAGE_FORMATS:
-            command = f'\"{CURRENT_EXECUTABLE_PATH}\" --image \"%1\" {output_format} -r'
-            add_subcommand_entry(main_key_path_directory, f"IMAGE_TO_{output_format.upper()}", command)
-        for output_format in SUPPORTED_AUDIO_FORMATS:
-            command = f'"{CURRENT_EXECUTABLE_PATH}" --audio -ai "%1" -o {output_format} -ar'
-            add_subcommand_entry(main_key_path_directory, f"AUDIO_TO_{output_format.upper()}", command)
-        # Offer video conversion for directories
-        for output_format in SUPPORTED_VIDEO_FORMATS:
-            command = f'"{CURRENT_EXECUTABLE_PATH}" --video -vi "%1" -vo {output_format} -vr'
-            add_subcommand_entry(main_key_path_directory, f"VIDEO_TO_{output_format.upper()}", command)
-
-    # For directory background (when right-clicking in an empty space within a folder)
-    directory_background_file_type = r"Directory\Background"
-    main_key_path_directory_bg = add_main_context_menu_entry_with_subcommands(directory_background_file_type, main_menu_name)
-    if main_key_path_directory_bg:
-        # Offer both image and audio conversion for directory background
-        for output_format in SUPPORTED_IMAGE_FORMATS:
-            command = f'"{CURRENT_EXECUTABLE_PATH}" --image "%V" {output_format} -r'
-            add_subcommand_entry(main_key_path_directory_bg, f"IMAGE_TO_{output_format.upper()}", command)
-        for output_format in SUPPORTED_AUDIO_FORMATS:
-            command = f'"{CURRENT_EXECUTABLE_PATH}" --audio -ai "%V" -o {output_format} -ar'
-            add_subcommand_entry(main_key_path_directory_bg, f"AUDIO_TO_{output_format.upper()}", command)
-        # Offer video conversion for directory background
-        for output_format in SUPPORTED_VIDEO_FORMATS:
-            command = f'"{CURRENT_EXECUTABLE_PATH}" --video -vi "%V" -vo {output_format} -vr'
-            add_subcommand_entry(main_key_path_directory_bg, f"VIDEO_TO_{output_format.upper()}", command)
-    
-    print("Context menu entries added successfully. You might need to restart Explorer or your computer for changes to take effect.")
-
-def unregister_context_menu():
-    if not is_admin():
-        print("This script needs to be run with administrator privileges to modify the registry.")
-        print("Please right-click on your terminal/command prompt and select 'Run as administrator'.")
-        return
-
-    main_menu_name = "Convert Media To"
-    old_image_menu_name = "Convert Image(s) To" # Old menu name to remove
-
-    # Remove for individual image files (new menu name)
-    image_file_type = r"SystemFileAssociations\image"
-    main_key_path_image = rf"Software\Classes\{image_file_type}\shell\{main_menu_name}"
-    for output_format in SUPPORTED_IMAGE_FORMATS:
-        remove_subcommand_entry(main_key_path_image, output_format.upper())
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, main_key_path_image, 0, winreg.KEY_SET_VALUE)
-        winreg.DeleteValue(key, "SubCommands")
-        winreg.CloseKey(key)
-        delete_key_recursive(winreg.HKEY_CURRENT_USER, main_key_path_image)
-        print(f"Removed main '{main_menu_name}' menu for image files.")
-    except FileNotFoundError:
-        pass
-    except Exception as e:
-        print(f"Error removing main '{main_menu_name}' menu for image files: {e}")
-
-    # Remove for individual image files (old menu name)
-    old_main_key_path_image = rf"Software\Classes\{image_file_type}\shell\{old_image_menu_name}"
-    for output_format in SUPPORTED_IMAGE_FORMATS:
-        remove_subcommand_entry(old_main_key_path_image, output_format.upper())
+        return None
     try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, old_main_key_path_image, 0, winreg.KEY_SET_VALUE)
-        winreg.DeleteValue(key, "SubCommands")
-        winreg.CloseKey(key)
-        delete_key_recursive(winreg.HKEY_CURRENT_USER, old_main_key_path_image)
-        print(f"Removed old main '{old_image_menu_name}' menu for image files.")
-    except FileNotFoundError:
-        pass
+        return registry_state.synchronize(backend or _registry_backend(), desired, _context_menu_roots())
     except Exception as e:
-        print(f"Error removing old main '{old_image_menu_name}' menu for image files: {e}")
+        # Every run re-reads the registry, so running the command again resumes from here.
+        print(f"Error updating context menu entries: {e}")
+        return None
 
-    # Remove for individual audio files
-    for ext in AUDIO_EXTENSIONS:
-        audio_file_type = rf"SystemFileAssociations\{ext}"
-        main_key_path_audio = rf"Software\Classes\{audio_file_type}\shell\{main_menu_name}"
-        for output_format in SUPPORTED_AUDIO_FORMATS:
-            remove_subcommand_entry(main_key_path_audio, output_format.upper())
-        try:
-            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, main_key_path_audio, 0, winreg.KEY_SET_VALUE)
-            winreg.DeleteValue(key, "SubCommands")
-            winreg.CloseKey(key)
-            delete_key_recursive(winreg.HKEY_CURRENT_USER, main_key_path_audio)
-            print(f"Removed main '{main_menu_name}' menu for audio files with extension {ext}.")
-        except FileNotFoundError:
-            pass
-        except Exception as e:
-            print(f"Error removing main '{main_menu_name}' menu for audio files with extension {ext}: {e}")
-
-    # Remove for individual video files
-    for ext in VIDEO_EXTENSIONS:
-        video_file_type = rf"SystemFileAssociations\{ext}"
-        main_key_path_video = rf"Software\Classes\{video_file_type}\shell\{main_menu_name}"
-        for output_format in SUPPORTED_VIDEO_FORMATS:
-            remove_subcommand_entry(main_key_path_video, output_format.upper())
-        try:
-            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, main_key_path_video, 0, winreg.KEY_SET_VALUE)
-            winreg.DeleteValue(key, "SubCommands")
-            winreg.CloseKey(key)
-            delete_key_recursive(winreg.HKEY_CURRENT_USER, main_key_path_video)
-            print(f"Removed main '{main_menu_name}' menu for video files with extension {ext}.")
-        except FileNotFoundError:
-            pass
-        except Exception as e:
-            print(f"Error removing main '{main_menu_name}' menu for video files with extension {ext}: {e}")
-
-    # Remove for directories
-    directory_file_type = "Directory"
-    main_key_path_directory = rf"Software\Classes\{directory_file_type}\shell\{main_menu_name}"
-    for output_format in SUPPORTED_IMAGE_FORMATS:
-        remove_subcommand_entry(main_key_path_directory, f"IMAGE_TO_{output_format.upper()}")
-    for output_format in SUPPORTED_AUDIO_FORMATS:
-        remove_subcommand_entry(main_key_path_directory, f"AUDIO_TO_{output_format.upper()}")
-    for output_format in SUPPORTED_VIDEO_FORMATS:
-        remove_subcommand_entry(main_key_path_directory, f"VIDEO_TO_{output_format.upper()}")
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, main_key_path_directory, 0, winreg.KEY_SET_VALUE)
-        winreg.DeleteValue(key, "SubCommands")
-        winreg.CloseKey(key)
-        delete_key_recursive(winreg.HKEY_CURRENT_USER, main_key_path_directory)
-        print(f"Removed main '{main_menu_name}' menu for directories.")
-    except FileNotFoundError:
-        pass
-    except Exception as e:
-        print(f"Error removing main '{main_menu_name}' menu for directories: {e}")
-
-    # Remove for directory background
-    directory_background_file_type = r"Directory\Background"
-    main_key_path_directory_bg = rf"Software\Classes\{directory_background_file_type}\shell\{main_menu_name}"
-    for output_format in SUPPORTED_IMAGE_FORMATS:
-        remove_subcommand_entry(main_key_path_directory_bg, f"IMAGE_TO_{output_format.upper()}")
-    for output_format in SUPPORTED_AUDIO_FORMATS:
-        remove_subcommand_entry(main_key_path_directory_bg, f"AUDIO_TO_{output_format.upper()}")
-    for output_format in SUPPORTED_VIDEO_FORMATS:
-        remove_subcommand_entry(main_key_path_directory_bg, f"VIDEO_TO_{output_format.upper()}")
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, main_key_path_directory_bg, 0, winreg.KEY_SET_VALUE)
-        winreg.DeleteValue(key, "SubCommands")
-        winreg.CloseKey(key)
-        delete_key_recursive(winreg.HKEY_CURRENT_USER, main_key_path_directory_bg)
-        print(f"Removed main '{main_menu_name}' menu for directory background.")
-    except FileNotFoundError:
-        pass
-    except Exception as e:
-        print(f"Error removing main '{main_menu_name}' menu for directory background: {e}")
+def register_context_menu(backend=None):
+    """Creates or updates the context menu entries, writing only keys and values that differ."""
+    operations = _synchronize_context_menu(desired_context_menu_state(), backend)
+    if operations is None:
+        return
+    if not operations:
+        print("Context menu entries are already up to date.")
+        return
+    print(f"Applied {len(operations)} registry change(s).")
+    print("Context menu entries added successfully. You might need to restart Explorer or your computer for changes to take effect.")
 
+def unregister_context_menu(backend=None):
+    """Removes every context menu key this program created, including the old image-only menu."""
+    operations = _synchronize_context_menu({}, backend)
+    if operations is None:
+        return
+    if not operations:
+        print("No context menu entries were found.")
+        return
+    print(f"Applied {len(operations)} registry change(s).")
     print("Context menu entries removed successfully. You might need to restart Explorer or your computer for changes to take effect.")
 
 # --- GUI Implementation ---
@@ -689,11 +977,171 @@ class MediaConverterGUI:
 
 # --- Main Entry Point ---
 
+def _service_converters():
+    """Converters exposed by --serve, keyed by the kind used in /convert/<kind>."""
+    return {
+        "image": (convert_image, SUPPORTED_IMAGE_FORMATS),
+        "audio": (convert_audio, SUPPORTED_AUDIO_FORMATS),
+        "video": (convert_video, SUPPORTED_VIDEO_FORMATS),
+    }
+
+def _require_format(output_format, supported_formats, kind):
+    if output_format not in supported_formats:
+        raise ValueError(f"Unsupported {kind} output format '{output_format}'. Supported formats are: {','.join(supported_formats)}")
+
+def _manifest_image_job(input_path, output_format, output_dir=None, output_path=None):
+    _require_format(output_format, SUPPORTED_IMAGE_FORMATS, "image")
+    return convert_image(input_path, output_format, output_dir, output_path=output_path)
+
+def _manifest_audio_job(input_path, output_format, output_dir=None, output_path=None, analyze=False):
+    if analyze:
+        if output_format is not None:
+            _require_format(output_format, SUPPORTED_AUDIO_FORMATS, "audio")
+        return analyze_audio(input_path, output_format, output_dir, output_path)
+    _require_format(output_format, SUPPORTED_AUDIO_FORMATS, "audio")
+    return convert_audio(input_path, output_format, output_dir, output_path)
+
+def _manifest_video_job(input_path, output_format, output_dir=None, output_path=None, **options):
+    if options.pop("extract_audio", False):
+        if output_format is not None:
+            _require_format(output_format, SUPPORTED_AUDIO_FORMATS, "audio")
+        return extract_audio(input_path, output_format, output_dir, output_path)
+    if output_format in SUPPORTED_IMAGE_FORMATS:
+        # For frame extraction, output names the directory the frames are written to.
+        frames_dir = output_path or os.path.join(output_dir or os.path.dirname(input_path), f"{os.path.splitext(os.path.basename(input_path))[0]}_frames")
+        return frame_pipes.extract_frames(input_path, frames_dir, output_format, lambda image, destination: _save_image(image, destination, output_format),
+                                          FFMPEG_PATH, FFPROBE_PATH, options.get("start"), options.get("end"), options.get("frame_step", 1),
+                                          options.get("scene_threshold"), options.get("keyframes_only", False))
+    _require_format(output_format, SUPPORTED_VIDEO_FORMATS, "video")
+    return convert_video(input_path, output_format, output_dir, output_path)
+
+def _manifest_converters():
+    """Job kinds accepted by --manifest: kind -> (convert, input extensions, option names)."""
+    return {
+        "image": (_manifest_image_job, IMAGE_EXTENSIONS, ()),
+        "audio": (_manifest_audio_job, tuple(AUDIO_EXTENSIONS), ("analyze",)),
+        "video": (_manifest_video_job, tuple(VIDEO_EXTENSIONS), ("extract_audio", "start", "end", "frame_step", "scene_threshold", "keyframes_only")),
+    }
+
+def run_manifest(manifest_path, results_path=None, workers=None, output_dir=None):
+    """
+    Runs every job of a JSONL manifest (or of stdin when manifest_path is
+    "-") in this process and writes one JSON result per job, in manifest
+    order, to results_path or stdout. Returns (succeeded, failed).
+    """
+    manifest_file = sys.stdin if manifest_path == "-" else open(manifest_path, encoding="utf-8")
+    results_file = open(results_path, "w", encoding="utf-8") if results_path else sys.stdout
+    try:
+        return manifest.run_manifest(manifest_file, _manifest_converters(), results_file, workers, output_dir)
+    finally:
+        if manifest_file is not sys.stdin:
+            manifest_file.close()
+        if results_file is not sys.stdout:
+            results_file.close()
+
+def _parse_address(address, default_host):
+    """Splits "host:port" (or just "port") into (host, port)."""
+    host, _, port = address.rpartition(":")
+    return host or default_host, int(port)
+
+def run_distributed_coordinator(kind, input_path, output_format, recursive, output_dir=None, force=False,
+                                host=distributed.DEFAULT_HOST, port=distributed.DEFAULT_PORT,
+                                lease_seconds=distributed.DEFAULT_LEASE_SECONDS, secret=None):
+    """
+    Discovers the files of a batch like the local runners do, then hands them
+    out to --worker processes instead of converting them here. Paths are made
+    absolute, so workers must see the same shared storage at the same paths.
+    Returns the workers' events in file order.
+    """
+    extensions = {"image": IMAGE_EXTENSIONS, "audio": tuple(AUDIO_EXTENSIONS), "video": tuple(VIDEO_EXTENSIONS)}[kind]
+    files, input_root = _input_files_and_root(input_path, extensions, recursive)
+    if files is None:
+        return [_report_invalid_input_path(input_path, output_format, kind)]
+    files, _, rejected = _prefilter_files(files, kind, output_format, force)
+    jobs = []
+    for file in files:
+        file_output_dir = _mirrored_output_dir(file, input_root, output_dir)
+        jobs.append({"kind": kind, "path": os.path.abspath(file), "format": output_format,
+                     "output_dir": os.path.abspath(file_output_dir) if file_output_dir else None})
+    results = distributed.run_coordinator(jobs, host, port, lease_seconds, secret=secret)
+    _report_rejected_files(rejected, kind)
+    return results
+
+def _watch_routes(image_output_format, audio_output_format, video_output_format):
+    """Maps input extensions to (converter, output format) for --watch, validating the formats."""
+    routes = {}
+    for output_format, supported_formats, extensions, convert, kind in (
+            (image_output_format, SUPPORTED_IMAGE_FORMATS, IMAGE_EXTENSIONS, convert_image, "image"),
+            (audio_output_format, SUPPORTED_AUDIO_FORMATS, AUDIO_EXTENSIONS, convert_audio, "audio"),
+            (video_output_format, SUPPORTED_VIDEO_FORMATS, VIDEO_EXTENSIONS, convert_video, "video")):
+        if not output_format:
+            continue
+        output_format = output_format.lower()
+        if output_format not in supported_formats:
+            print(f"Error: Unsupported {kind} output format '{output_format}'. Supported formats are: {','.join(supported_formats)}")
+            sys.exit(1)
+        for extension in extensions:
+            routes[extension] = (convert, output_format)
+    return routes
+
 def cli_main():
     parser = argparse.ArgumentParser(description="Convert media formats and manage context menu entries.")
 
     parser.add_argument("--register", action="store_true", help="Register context menu entries.")
     parser.add_argument("--unregister", action="store_true", help="Unregister context menu entries.")
+    parser.add_argument("--output-format", choices=conversion_events.OUTPUT_FORMATS, default="text", help="How conversion results are written to stdout: human-readable text or one JSON event per line (jsonl).")
+    parser.add_argument("--events-file", help="Also append the JSONL event stream (start/progress/done/error) to this file.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of ffmpeg processes to run concurrently for audio/video batches.")
+    parser.add_argument("--job-timeout", type=float, help="Kill any single audio/video conversion that runs longer than this many seconds.")
+    parser.add_argument("--stall-timeout", type=float, default=ffmpeg_watchdog.DEFAULT_STALL_SECONDS,
+                        help=f"Kill an ffmpeg job whose progress has not advanced for this many seconds (default {ffmpeg_watchdog.DEFAULT_STALL_SECONDS:g}; 0 disables).")
+    parser.add_argument("--time-budget", type=float, default=ffmpeg_watchdog.DEFAULT_BUDGET_FACTOR,
+                        help=f"Kill an ffmpeg job that runs longer than this many times its media duration, at least {ffmpeg_watchdog.DEFAULT_MIN_BUDGET_SECONDS:g} s (default off).")
+    parser.add_argument("--retries", type=int, default=ffmpeg_watchdog.DEFAULT_RETRIES,
+                        help=f"Retry an ffmpeg job that stalled or failed to decode its input this many times, with backoff and safer decoding options (default {ffmpeg_watchdog.DEFAULT_RETRIES}).")
+    parser.add_argument("--autotune", action="store_true", help="Adjust how many conversions run at once (image threads or ffmpeg processes) while a batch runs, based on throughput, CPU, I/O wait and free memory.")
+    parser.add_argument("--min-workers", type=int, default=autotune.DEFAULT_MIN_WORKERS, help=f"Lower bound for --autotune (default {autotune.DEFAULT_MIN_WORKERS}).")
+    parser.add_argument("--max-workers", type=int, default=autotune.DEFAULT_MAX_WORKERS, help=f"Upper bound for --autotune (default {autotune.DEFAULT_MAX_WORKERS}).")
+    parser.add_argument("--schedule", choices=scheduling.POLICIES, default=scheduling.DEFAULT_POLICY,
+                        help="Order of batch jobs by estimated cost: fifo (discovery order, default), sjf (shortest first) or ljf (largest first, packs parallel workers best).")
+    parser.add_argument("--dry-run", action="store_true", help="Estimate the cost of every job in the batch and print the plan and total work without converting anything.")
+    parser.add_argument("--memory-profile", action="store_true",
+                        help="Measure each job's memory (Python allocation peak and decoded pixels for images, peak RSS of ffmpeg) and list the jobs that used the most at the end.")
+    parser.add_argument("--memory-top", type=int, default=memory_profile.DEFAULT_TOP, help=f"Jobs listed by --memory-profile (default {memory_profile.DEFAULT_TOP}).")
+    parser.add_argument("--memory-dump-job", metavar="INPUT",
+                        help="With --memory-profile: write the Python allocations of converting this input image (a path or a file name) as collapsed stacks for flame graph tools.")
+    parser.add_argument("--memory-dump-file", default=memory_profile.DEFAULT_DUMP_PATH,
+                        help=f"Where --memory-dump-job writes its collapsed stacks (default {memory_profile.DEFAULT_DUMP_PATH}).")
+    parser.add_argument("--ffmpeg-info", action="store_true", help="Show which ffmpeg and ffprobe are used, where they were found, and which audio/video output formats that ffmpeg can write.")
+    parser.add_argument("--force", action="store_true", help="Convert files even when their content is already in the requested output format.")
+    parser.add_argument("--output-dir", help="Write converted files to this directory (mirroring subdirectories for recursive runs) instead of next to the inputs.")
+
+    # Service mode arguments
+    service_group = parser.add_argument_group('Service Mode')
+    service_group.add_argument("--serve", action="store_true", help="Run a local HTTP conversion service on 127.0.0.1.")
+    service_group.add_argument("--port", type=int, default=conversion_service.DEFAULT_PORT, help=f"Port for --serve (default {conversion_service.DEFAULT_PORT}).")
+    service_group.add_argument("--workers", type=int, help="Number of conversion workers for --serve, --watch and archive conversions (default: CPU count).")
+    service_group.add_argument("--queue-size", type=int, default=conversion_service.DEFAULT_QUEUE_SIZE, help="Conversions allowed to wait for a worker before --serve answers 429.")
+
+    # Manifest arguments
+    manifest_group = parser.add_argument_group('Manifest')
+    manifest_group.add_argument("--manifest", metavar="JOBS.jsonl", help="Run every job listed in this JSONL file (- for stdin) in one process: one object per line with input, format and optionally output, output_dir, kind, options and id.")
+    manifest_group.add_argument("--manifest-results", metavar="FILE", help="Write the per-job JSONL results of --manifest to this file instead of stdout. While results go to stdout, events go only to --events-file.")
+
+    # Watch-folder arguments
+    watch_group = parser.add_argument_group('Watch Folder')
+    watch_group.add_argument("--watch", metavar="DIR", help="Watch a directory and convert new files as they arrive. Use -io, -o and -vo to choose the image, audio and video output formats.")
+    watch_group.add_argument("-io", "--image-output", help=f"Image output format for --watch ({','.join(SUPPORTED_IMAGE_FORMATS)}).")
+    watch_group.add_argument("-wr", "--watch-recursive", action="store_true", help="Also watch subdirectories of the --watch directory.")
+    watch_group.add_argument("--watch-existing", action="store_true", help="Convert files already in the --watch directory on startup.")
+
+    # Distributed conversion arguments
+    distributed_group = parser.add_argument_group('Distributed Conversion')
+    distributed_group.add_argument("--coordinator", action="store_true", help="With --image, --audio or --video: discover the files and hand them out to --worker processes instead of converting them locally.")
+    distributed_group.add_argument("--listen", default=f"{distributed.DEFAULT_HOST}:{distributed.DEFAULT_PORT}", help=f"Address the --coordinator listens on (default {distributed.DEFAULT_HOST}:{distributed.DEFAULT_PORT}).")
+    distributed_group.add_argument("--worker", metavar="HOST:PORT", help="Run as a worker: pull conversion jobs from the coordinator at HOST:PORT until the batch is done. Inputs are read from shared storage.")
+    distributed_group.add_argument("--lease-seconds", type=float, default=distributed.DEFAULT_LEASE_SECONDS, help="How long a worker may go silent before its job is handed to another worker.")
+    distributed_group.add_argument("--secret", default=os.environ.get("MEDIA_CONVERTER_SECRET"), help="Shared secret workers must present to the coordinator (default: $MEDIA_CONVERTER_SECRET).")
 
     # Image conversion arguments
     image_group = parser.add_argument_group('Image Conversion')
@@ -701,6 +1149,19 @@ def cli_main():
     image_group.add_argument("image_input_path", nargs='?', help="Path to the input image file or a directory containing images.")
     image_group.add_argument("image_output_format", nargs='?', help=f"Desired image output format ({','.join(SUPPORTED_IMAGE_FORMATS)}).")
     image_group.add_argument("-ir", "--image-recursive", action="store_true", help="Recursively search for images in subdirectories when image_input_path is a directory.")
+    image_group.add_argument("--background", default=image_modes.DEFAULT_BACKGROUND, help="Colour transparent areas are flattened onto when the output format has no alpha channel, e.g. JPEG (default white; names or #rrggbb).")
+    image_group.add_argument("--ico-sizes", default=",".join(str(size) for size in icon_pyramid.DEFAULT_ICO_SIZES), help="Comma-separated icon sizes written into .ico outputs (default 16,32,48,64,128,256; at most 256).")
+    image_group.add_argument("--target-ssim", type=float, help="JPEG/WebP output: use the lowest encoder quality whose result still reaches this SSIM against the source (e.g. 0.98), found by binary search per image. Needs NumPy.")
+    image_group.add_argument("--min-quality", type=int, default=quality_search.DEFAULT_MIN_QUALITY, help=f"Lowest quality --target-ssim may choose (default {quality_search.DEFAULT_MIN_QUALITY}).")
+    image_group.add_argument("--max-quality", type=int, default=quality_search.DEFAULT_MAX_QUALITY, help=f"Highest quality --target-ssim may choose (default {quality_search.DEFAULT_MAX_QUALITY}).")
+    image_group.add_argument("--pipeline", action="store_true", help="Overlap file reads and writes with decoding/encoding (read-ahead and write-behind I/O threads). Helps most on network drives.")
+    image_group.add_argument("--dedup", action="store_true", help="Convert byte-identical input files only once and reuse the output for their copies.")
+    image_group.add_argument("--dedup-link", choices=dedup.LINK_MODES, default="auto", help="How --dedup places reused outputs: reflink, hardlink or copy (auto tries them in that order).")
+    image_group.add_argument("--near-duplicates", action="store_true", help="Report visually near-identical images (perceptual hash). They are still converted separately.")
+    image_group.add_argument("--output-archive", help="Write the converted images into this .zip or .tar(.gz/.bz2/.xz) archive instead of separate files. Zip and tar inputs are always read without extracting them.")
+    image_group.add_argument("--process-pipeline", nargs="?", const="auto", metavar="DECODE,TRANSFORM,ENCODE",
+                             help="Run directory batches as separate decode, transform and encode process stages with these process counts (default: half the CPUs decoding, half encoding, a quarter transforming). Decoded pixels are passed between stages in recycled shared-memory blocks instead of being copied.")
+    image_group.add_argument("--io-threads", type=int, default=io_pipeline.DEFAULT_IO_THREADS, help=f"Number of read-ahead and write-behind threads for --pipeline (default {io_pipeline.DEFAULT_IO_THREADS}).")
 
     # Audio conversion arguments
     audio_group = parser.add_argument_group('Audio Conversion')
@@ -708,50 +1169,160 @@ def cli_main():
     audio_group.add_argument("-ai", "--audio-input", help="Path to the input audio file or a directory containing audio files.")
     audio_group.add_argument("-o", "--audio-output", help=f"Desired audio output format ({','.join(SUPPORTED_AUDIO_FORMATS)}).")
     audio_group.add_argument("-ar", "--audio-recursive", action="store_true", help="Recursively search for audio files in subdirectories when audio_input_path is a directory.")
+    audio_group.add_argument("--analyze", action="store_true", help="Render a waveform and a spectrogram PNG for every track. With -o, each track is also converted from the same decode.")
 
     # Video conversion arguments
     video_group = parser.add_argument_group('Video Conversion')
     video_group.add_argument("--video", action="store_true", help="Perform video conversion.")
     video_group.add_argument("-vi", "--video-input", help="Path to the input video file or a directory containing video files.")
-    video_group.add_argument("-vo", "--video-output", help=f"Desired video output format ({','.join(SUPPORTED_VIDEO_FORMATS)}).")
+    video_group.add_argument("-vo", "--video-output", help=f"Desired video output format ({','.join(SUPPORTED_VIDEO_FORMATS)}), or an image format ({','.join(SUPPORTED_IMAGE_FORMATS)}) to extract frames.")
     video_group.add_argument("-vr", "--video-recursive", action="store_true", help="Recursively search for video files in subdirectories when video_input_path is a directory.")
+    video_group.add_argument("--from-frames", action="store_true", help="Treat -vi as a directory of image frames and encode them, in file name order, into a single video.")
+    video_group.add_argument("--framerate", type=float, default=frame_pipes.DEFAULT_FRAMERATE, help=f"Frames per second for --from-frames (default {frame_pipes.DEFAULT_FRAMERATE:g}).")
+    video_group.add_argument("--extract-audio", nargs="?", const="auto", metavar="FORMAT",
+                             help=f"Extract the soundtrack of the -vi video(s) instead of converting them ({','.join(SUPPORTED_AUDIO_FORMATS)}; default: the format matching the source codec). The audio is copied without re-encoding whenever the format allows.")
+    video_group.add_argument("--start", type=float, help="Frame extraction: start this many seconds into the video (seeks without decoding the frames before it).")
+    video_group.add_argument("--end", type=float, help="Frame extraction: stop at this many seconds into the video.")
+    video_group.add_argument("--frame-step", type=int, default=1, help="Frame extraction: keep every Nth frame (default 1).")
+    video_group.add_argument("--scene-threshold", type=float, help="Frame extraction: keep only frames whose scene-change score exceeds this value (0-1, e.g. 0.3).")
+    video_group.add_argument("--keyframes-only", action="store_true", help="Frame extraction: decode only keyframes, the fastest way to sample a long video.")
     
     args = parser.parse_args()
 
-    if args.register:
+    conversion_events.configure_output(args.output_format, args.events_file, stdout=not (args.manifest and not args.manifest_results))
+    try:
+        image_modes.configure(args.background)
+    except ValueError:
+        print(f"Error: Unknown --background colour '{args.background}'.")
+        sys.exit(1)
+    ffmpeg_watchdog.configure(args.stall_timeout, args.time_budget, args.retries)
+    autotune.configure(args.autotune, args.min_workers, args.max_workers)
+    scheduling.configure(args.schedule, args.dry_run)
+    memory_profile.configure(args.memory_profile, args.memory_top, args.memory_dump_job, args.memory_dump_file)
+    try:
+        quality_search.configure(args.target_ssim, args.min_quality, args.max_quality)
+    except ValueError as e:
+        print(f"Error: Invalid --target-ssim settings: {e}.")
+        sys.exit(1)
+    try:
+        icon_pyramid.configure(icon_pyramid.parse_sizes(args.ico_sizes))
+    except ValueError as e:
+        print(f"Error: Invalid --ico-sizes '{args.ico_sizes}': {e}")
+        sys.exit(1)
+
+    if args.ffmpeg_info:
+        print(describe_ffmpeg())
+    elif args.register:
         register_context_menu()
     elif args.unregister:
         unregister_context_menu()
+    elif args.serve:
+        conversion_service.serve(_service_converters(), args.port, args.workers, args.queue_size)
+    elif args.worker:
+        host, port = _parse_address(args.worker, "127.0.0.1")
+        try:
+            converted = distributed.run_worker(host, port, _service_converters(), secret=args.secret)
+        except (OSError, distributed.ProtocolError) as e:
+            report_summary(f"Error: Could not work for the coordinator at {args.worker}: {e}")
+            sys.exit(1)
+        report_summary(f"Worker finished after converting {converted} file(s).", completed=converted)
+    elif args.coordinator:
+        host, port = _parse_address(args.listen, distributed.DEFAULT_HOST)
+        insecure = distributed.insecure_bind_reason(host, args.secret)
+        if insecure:
+            report_summary(f"Error: Not starting the coordinator: {insecure}.")
+            sys.exit(1)
+        for kind, enabled, input_path, output_format, recursive, supported_formats in (
+                ("image", args.image, args.image_input_path, args.image_output_format, args.image_recursive, SUPPORTED_IMAGE_FORMATS),
+                ("audio", args.audio, args.audio_input, args.audio_output, args.audio_recursive, SUPPORTED_AUDIO_FORMATS),
+                ("video", args.video, args.video_input, args.video_output, args.video_recursive, SUPPORTED_VIDEO_FORMATS)):
+            if enabled:
+                break
+        else:
+            print("Error: --coordinator needs an --image, --audio or --video batch to distribute.")
+            sys.exit(1)
+        if not (input_path and output_format):
+            parser.print_help()
+        elif output_format.lower() not in supported_formats:
+            print(f"Error: Unsupported {kind} output format '{output_format.lower()}'. Supported formats are: {','.join(supported_formats)}")
+            sys.exit(1)
+        else:
+            run_distributed_coordinator(kind, input_path, output_format.lower(), recursive, args.output_dir, args.force, host, port, args.lease_seconds, args.secret)
+    elif args.manifest:
+        try:
+            succeeded, failed = run_manifest(args.manifest, args.manifest_results, args.workers, args.output_dir)
+        except OSError as e:
+            print(f"Error: Could not run the manifest '{args.manifest}': {e}")
+            sys.exit(1)
+        report_summary(f"Manifest finished: {succeeded} job(s) succeeded, {failed} failed.", completed=succeeded, total=succeeded + failed)
+    elif args.watch:
+        routes = _watch_routes(args.image_output, args.audio_output, args.video_output)
+        if not routes:
+            print("Error: --watch needs at least one output format: -io for images, -o for audio or -vo for video.")
+            sys.exit(1)
+        report_summary(f"Watching '{args.watch}' for new files. Press Ctrl+C to stop.")
+        watch_folder.watch_directory(args.watch, routes, args.watch_recursive, args.workers, process_existing=args.watch_existing)
     elif args.image:
         if args.image_input_path and args.image_output_format:
             image_output_format = args.image_output_format.lower()
             if image_output_format not in SUPPORTED_IMAGE_FORMATS:
                 print(f"Error: Unsupported image output format '{image_output_format}'. Supported formats are: {','.join(SUPPORTED_IMAGE_FORMATS)}")
                 sys.exit(1)
-            run_conversion_logic_image(args.image_input_path, image_output_format, args.image_recursive)
+            processes = None
+            if args.process_pipeline:
+                try:
+                    processes = shm_pipeline.parse_processes(args.process_pipeline)
+                except ValueError as e:
+                    print(f"Error: Invalid --process-pipeline '{args.process_pipeline}': {e}")
+                    sys.exit(1)
+            run_conversion_logic_image(args.image_input_path, image_output_format, args.image_recursive, args.output_dir, args.pipeline, args.io_threads, args.force,
+                                       args.dedup, args.dedup_link, args.near_duplicates, args.output_archive, args.workers, processes)
         else:
             parser.print_help()
     elif args.audio:
-        if args.audio_input and args.audio_output:
-            audio_output_format = args.audio_output.lower()
-            if audio_output_format not in SUPPORTED_AUDIO_FORMATS:
+        if args.audio_input and (args.audio_output or args.analyze):
+            audio_output_format = args.audio_output.lower() if args.audio_output else None
+            if audio_output_format and audio_output_format not in SUPPORTED_AUDIO_FORMATS:
                 print(f"Error: Unsupported audio output format '{audio_output_format}'. Supported formats are: {','.join(SUPPORTED_AUDIO_FORMATS)}")
                 sys.exit(1)
-            run_conversion_logic_audio(args.audio_input, audio_output_format, args.audio_recursive)
+            if args.analyze:
+                run_audio_analysis(args.audio_input, audio_output_format, args.audio_recursive, args.output_dir, args.force)
+            else:
+                run_conversion_logic_audio(args.audio_input, audio_output_format, args.audio_recursive, args.jobs, args.job_timeout, args.output_dir, args.force)
         else:
             parser.print_help()
     elif args.video:
-        if args.video_input and args.video_output:
+        if args.video_input and args.extract_audio:
+            extracted_format = None if args.extract_audio == "auto" else args.extract_audio.lower()
+            if extracted_format and extracted_format not in SUPPORTED_AUDIO_FORMATS:
+                print(f"Error: Unsupported audio output format '{extracted_format}'. Supported formats are: {','.join(SUPPORTED_AUDIO_FORMATS)}")
+                sys.exit(1)
+            run_audio_extraction(args.video_input, extracted_format, args.video_recursive, args.jobs, args.job_timeout, args.output_dir, args.force)
+        elif args.video_input and args.video_output:
             video_output_format = args.video_output.lower()
-            if video_output_format not in SUPPORTED_VIDEO_FORMATS:
+            if video_output_format in SUPPORTED_IMAGE_FORMATS and not args.from_frames:
+                if args.frame_step < 1 or (args.start is not None and args.end is not None and args.end <= args.start):
+                    print("Error: --frame-step must be at least 1 and --end must come after --start.")
+                    sys.exit(1)
+                run_video_to_frames(args.video_input, video_output_format, args.video_recursive, args.output_dir, args.start, args.end,
+                                    args.frame_step, args.scene_threshold, args.keyframes_only, args.workers, args.force)
+            elif video_output_format not in SUPPORTED_VIDEO_FORMATS:
                 print(f"Error: Unsupported video output format '{video_output_format}'. Supported formats are: {','.join(SUPPORTED_VIDEO_FORMATS)}")
                 sys.exit(1)
-            run_conversion_logic_video(args.video_input, video_output_format, args.video_recursive)
+            elif args.from_frames:
+                run_image_sequence_to_video(args.video_input, video_output_format, args.output_dir, args.framerate, args.workers)
+            else:
+                run_conversion_logic_video(args.video_input, video_output_format, args.video_recursive, args.jobs, args.job_timeout, args.output_dir, args.force)
         else:
             parser.print_help()
     else:
         parser.print_help()
 
+    if memory_profile.enabled():
+        worst = memory_profile.describe_worst()
+        if worst:
+            report_summary(worst)
+
 
 if __name__ == "__main__":
     if len(sys.argv) > 1: # Check if any command-line arguments are provided
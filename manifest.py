@@ -0,0 +1,169 @@
+"""
+Manifest mode: many conversion jobs, one process.
+
+Invoking the converter once per file pays interpreter start-up, imports and
+ffmpeg discovery for every file. A manifest lists any number of jobs, of
+any media type, one JSON object per line:
+
+    {"input": "photos/a.png", "format": "webp"}
+    {"input": "talk.mp4", "output": "out/talk.aac", "options": {"extract_audio": true}, "id": 7}
+
+    input       path of the file to convert (required);
+    format      output format; defaults to the extension of `output`;
+    output      output file path (default: the input's base name with the
+                new extension, next to the input or in output_dir);
+    output_dir  directory for the output when no `output` is given;
+    kind        image, audio or video (default: from the input extension);
+    options     options for the kind's converter (see its option names);
+    id          any JSON value, echoed in the result.
+
+Blank lines and lines starting with # are skipped. All jobs run in this
+process on one shared worker pool. For every job one result line is
+written, in manifest order, as soon as it and every job before it have
+finished: the job's final conversion event plus its manifest line number
+and id.
+"""
+import collections
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from conversion_events import report_error
+
+# Jobs that may be queued or running ahead of the oldest unfinished one, per worker.
+PENDING_PER_WORKER = 4
+FIELDS = frozenset(("input", "format", "output", "output_dir", "kind", "options", "id"))
+
+
+class ManifestError(ValueError):
+    pass
+
+
+class Job(object):
+    """One parsed manifest line."""
+
+    __slots__ = ("line", "id", "kind", "input_path", "output_format", "output_path", "output_dir", "options")
+
+    def __init__(self, line, id, kind, input_path, output_format, output_path, output_dir, options):
+        self.line = line
+        self.id = id
+        self.kind = kind
+        self.input_path = input_path
+        self.output_format = output_format
+        self.output_path = output_path
+        self.output_dir = output_dir
+        self.options = options
+
+
+def parse_job(text, line, converters, output_dir=None):
+    """
+    Parses one manifest line into a Job, or returns None for blank and
+    comment lines. `converters` maps kind -> (convert, extensions,
+    option_names). Raises ManifestError when the line is not a valid job.
+    """
+    text = text.strip()
+    if not text or text.startswith("#"):
+        return None
+    try:
+        fields = json.loads(text)
+    except ValueError as e:
+        raise ManifestError(f"line {line} is not valid JSON: {e}")
+    if not isinstance(fields, dict):
+        raise ManifestError(f"line {line} is not a JSON object")
+    unknown = sorted(set(fields) - FIELDS)
+    if unknown:
+        raise ManifestError(f"line {line} has unknown field(s): {', '.join(unknown)}")
+    input_path = fields.get("input")
+    if not isinstance(input_path, str) or not input_path:
+        raise ManifestError(f"line {line} has no input path")
+
+    kind = fields.get("kind")
+    if kind is None:
+        extension = os.path.splitext(input_path)[1].lower()
+        kind = next((name for name, (_, extensions, _) in converters.items() if extension in extensions), None)
+        if kind is None:
+            raise ManifestError(f"line {line}: cannot tell the kind of '{input_path}' from its extension; give a kind")
+    elif kind not in converters:
+        raise ManifestError(f"line {line} has unknown kind '{kind}'. Supported kinds are: {','.join(converters)}")
+
+    output_path = fields.get("output")
+    output_format = fields.get("format")
+    if output_format is None and output_path:
+        output_format = os.path.splitext(output_path)[1][1:] or None
+    options = fields.get("options") or {}
+    if not isinstance(options, dict):
+        raise ManifestError(f"line {line}: options must be a JSON object")
+    option_names = converters[kind][2]
+    unknown = sorted(set(options) - set(option_names))
+    if unknown:
+        raise ManifestError(f"line {line} has unknown {kind} option(s): {', '.join(unknown)}. Supported options are: {','.join(option_names)}")
+    return Job(line, fields.get("id"), kind, input_path, output_format.lower() if output_format else None, output_path,
+               fields.get("output_dir", output_dir), options)
+
+
+def _run(job, converters):
+    started = time.perf_counter()
+    convert = converters[job.kind][0]
+    output_dir = (os.path.dirname(job.output_path) or None) if job.output_path else job.output_dir
+    try:
+        return convert(job.input_path, job.output_format, output_dir, output_path=job.output_path, **job.options)
+    except ValueError as e:
+        return report_error(job.input_path, job.output_format, "InvalidJob", f"Error: Manifest line {job.line}: {e}", started, kind=job.kind)
+
+
+def _result_line(line, id, event):
+    result = {"line": line}
+    if id is not None:
+        result["id"] = id
+    result["ok"] = event.ok
+    result.update(event.to_dict())
+    return json.dumps(result, separators=(",", ":")) + "\n"
+
+
+def run_manifest(lines, converters, results, workers=None, output_dir=None):
+    """
+    Runs the jobs in `lines` (any iterable of manifest lines, e.g. an open
+    file or sys.stdin) on `workers` threads and writes one JSON result line
+    per job to the `results` stream, in manifest order. Lines are read
+    while earlier jobs run and results are written as soon as they are in
+    order, so a manifest can be streamed in. Returns (succeeded, failed).
+    """
+    workers = max(1, workers or os.cpu_count() or 4)
+    pending = collections.deque()
+    counts = [0, 0]
+    lock = threading.Lock()
+
+    def flush_finished(_=None):
+        # Runs on the reading thread and in job completion callbacks; the lock keeps results in order.
+        with lock:
+            while pending and pending[0][2].done():
+                line, id, future = pending.popleft()
+                event = future.result()
+                counts[0 if event.ok else 1] += 1
+                results.write(_result_line(line, id, event))
+                results.flush()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="manifest") as pool:
+        for number, text in enumerate(lines, 1):
+            started = time.perf_counter()
+            try:
+                job = parse_job(text, number, converters, output_dir)
+            except ManifestError as e:
+                job_id, future = None, Future()
+                future.set_result(report_error(None, None, "InvalidManifestLine", f"Error: Manifest {e}.", started))
+            else:
+                if job is None:
+                    continue
+                job_id, future = job.id, pool.submit(_run, job, converters)
+            with lock:
+                pending.append((number, job_id, future))
+                oldest = pending[0][2] if len(pending) >= workers * PENDING_PER_WORKER else None
+            future.add_done_callback(flush_finished)
+            if oldest is not None:
+                # Backpressure: do not read further ahead than the pool can use.
+                wait([oldest])
+                flush_finished()
+    flush_finished()
+    return counts[0], counts[1]
@@ -0,0 +1,223 @@
+"""
+Opt-in memory instrumentation: which files and formats use the most memory.
+
+When enabled, every conversion job gets a memory record:
+
+    python peak   the high-water mark of Python allocations (tracemalloc)
+                  while convert_image ran, above what was allocated when it
+                  started;
+    decoded       the size of the decoded pixel buffer, which Pillow
+                  allocates outside the Python allocator and tracemalloc
+                  cannot see;
+    child RSS     the peak resident set size of the ffmpeg process, from the
+                  rusage os.wait4 returns when the child is reaped (not
+                  available on Windows). Linux carries the high-water mark
+                  of the process that started the child across exec, so a
+                  child's peak never reads below this process's own peak
+                  RSS at that moment.
+
+describe_worst() lists the top-N jobs by peak at the end of a batch. For one
+chosen image job, the Python allocations it still holds when it finishes
+encoding are written as collapsed stacks ("frame;frame;frame bytes" lines),
+the input format of flamegraph.pl, speedscope and inferno.
+
+tracemalloc peaks are process-wide: when images convert on several threads
+at once, a job's python peak also includes what the others allocated
+meanwhile, so it is an upper bound. Run with one worker for exact numbers.
+"""
+import contextlib
+import os
+import sys
+import threading
+import tracemalloc
+
+from PIL import ImageMode
+
+DEFAULT_TOP = 10
+# Frames kept per allocation: one is enough for peaks, the dump needs whole stacks.
+DUMP_FRAMES = 64
+DEFAULT_DUMP_PATH = "allocations.folded"
+
+_settings = {"enabled": False, "top": DEFAULT_TOP, "dump_job": None, "dump_path": DEFAULT_DUMP_PATH}
+_records = {}
+_lock = threading.Lock()
+_active = 0
+
+
+class MemoryRecord(object):
+    """Memory use of one job; fields that were not measured are None."""
+
+    def __init__(self, path, kind, output_format):
+        self.path = path
+        self.kind = kind
+        self.output_format = output_format
+        self.python_peak = None
+        self.decoded_bytes = None
+        self.child_rss = None
+
+    @property
+    def peak(self):
+        """The job's footprint: its child's RSS, or its Python peak plus the decoded pixels."""
+        if self.child_rss is not None:
+            return self.child_rss
+        return (self.python_peak or 0) + (self.decoded_bytes or 0)
+
+    def to_dict(self):
+        return {"path": self.path, "kind": self.kind, "output_format": self.output_format, "peak": self.peak,
+                "python_peak": self.python_peak, "decoded_bytes": self.decoded_bytes, "child_rss": self.child_rss}
+
+
+def configure(enabled=False, top=DEFAULT_TOP, dump_job=None, dump_path=DEFAULT_DUMP_PATH):
+    """
+    Turns the instrumentation on or off and forgets earlier records.
+    dump_job, an input path (or a bare file name), selects the job whose
+    allocations are written to dump_path.
+    """
+    with _lock:
+        _settings.update(enabled=enabled, top=top, dump_job=dump_job, dump_path=dump_path)
+        _records.clear()
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(DUMP_FRAMES if dump_job else 1)
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled():
+    return _settings["enabled"]
+
+
+def records():
+    with _lock:
+        return list(_records.values())
+
+
+def _record(path, kind, output_format):
+    # Called with _lock held. Retries of a job update the same record.
+    key = (path, kind, output_format)
+    if key not in _records:
+        _records[key] = MemoryRecord(path, kind, output_format)
+    return _records[key]
+
+
+def decoded_size(image):
+    """Bytes of an image's decoded pixel buffer (Pillow stores multi-band 8-bit pixels in 4 bytes)."""
+    mode = ImageMode.getmode(image.mode)
+    band_bytes = int(mode.typestr[-1]) if mode.typestr[-1].isdigit() else 1
+    bands = len(mode.bands)
+    pixel_bytes = 4 if bands > 1 and band_bytes == 1 else bands * band_bytes
+    return image.width * image.height * pixel_bytes
+
+
+def _is_dump_job(path):
+    dump_job = _settings["dump_job"]
+    if not dump_job or path is None:
+        return False
+    if os.path.basename(dump_job) == dump_job:
+        return os.path.basename(path) == dump_job
+    return os.path.normcase(os.path.abspath(path)) == os.path.normcase(os.path.abspath(dump_job))
+
+
+class _ImageProbe(object):
+    def __init__(self, record):
+        self.record = record
+
+    def decoded(self, image):
+        """Records the decoded footprint of `image` (call after it is loaded or converted)."""
+        if self.record is not None:
+            size = decoded_size(image)
+            with _lock:
+                self.record.decoded_bytes = max(self.record.decoded_bytes or 0, size)
+
+
+@contextlib.contextmanager
+def track_image(path, output_format, kind="image"):
+    """
+    Measures one image conversion: use as `with track_image(...) as probe:`
+    around it and call probe.decoded(image) once the image is decoded. A
+    no-op when the instrumentation is off.
+    """
+    global _active
+    if not enabled() or not tracemalloc.is_tracing():
+        yield _ImageProbe(None)
+        return
+    with _lock:
+        record = _record(path, kind, output_format)
+        if _active == 0:
+            # Only reset the process-wide peak when no other job is being measured.
+            tracemalloc.reset_peak()
+        _active += 1
+    baseline = tracemalloc.get_traced_memory()[0]
+    before = tracemalloc.take_snapshot() if _is_dump_job(path) else None
+    try:
+        yield _ImageProbe(record)
+        if before is not None:
+            write_folded(tracemalloc.take_snapshot().compare_to(before, "traceback"), _settings["dump_path"])
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        with _lock:
+            _active -= 1
+            record.python_peak = max(record.python_peak or 0, peak - baseline)
+
+
+def write_folded(differences, path):
+    """Writes tracemalloc StatisticDiffs as collapsed stacks, root frame first, one "stack bytes" line each."""
+    stacks = {}
+    for difference in differences:
+        # What tracemalloc allocated for the snapshots themselves is left out.
+        if difference.size_diff <= 0 or any(frame.filename == tracemalloc.__file__ for frame in difference.traceback):
+            continue
+        stack = ";".join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in difference.traceback)
+        stacks[stack] = stacks.get(stack, 0) + difference.size_diff
+    with open(path, "w", encoding="utf-8") as dump:
+        for stack, size in sorted(stacks.items()):
+            dump.write(f"{stack} {size}\n")
+
+
+def _rss_bytes(rusage):
+    # ru_maxrss is in kilobytes on Linux and the BSDs, and in bytes on macOS.
+    return rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+
+
+def record_child(path, kind, output_format, rusage):
+    """Records the peak RSS of an ffmpeg child from the rusage os.wait4 returned for it."""
+    if not enabled():
+        return
+    with _lock:
+        record = _record(path, kind, output_format)
+        record.child_rss = max(record.child_rss or 0, _rss_bytes(rusage))
+
+
+def wait(process, path, kind, output_format):
+    """
+    process.wait() for a subprocess.Popen ffmpeg child, reaping it with
+    os.wait4 to record its peak RSS when the instrumentation is on.
+    """
+    if not enabled() or not hasattr(os, "wait4") or process.returncode is not None:
+        return process.wait()
+    _, status, rusage = os.wait4(process.pid, 0)
+    # Popen would find the child already reaped; give it the exit status it would have read.
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record_child(path, kind, output_format, rusage)
+    return process.returncode
+
+
+def _mib(size):
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+
+def describe_worst(top=None):
+    """The top-N jobs by peak memory as a summary message, or None when nothing was measured."""
+    ranked = sorted(records(), key=lambda record: record.peak, reverse=True)[:top or _settings["top"]]
+    if not ranked:
+        return None
+    lines = [f"Peak memory, top {len(ranked)} job(s):"]
+    for record in ranked:
+        details = []
+        if record.child_rss is not None:
+            details.append(f"ffmpeg RSS {_mib(record.child_rss)}")
+        if record.python_peak is not None:
+            details.append(f"Python peak {_mib(record.python_peak)}")
+        if record.decoded_bytes is not None:
+            details.append(f"decoded {_mib(record.decoded_bytes)}")
+        lines.append(f"  {_mib(record.peak):>12}  {record.path} ({record.kind} -> {record.output_format}; {', '.join(details)})")
+    return "\n".join(lines)
@@ -0,0 +1,219 @@
+"""
+Quality-targeted encoding: the smallest JPEG/WebP that meets an SSIM bar.
+
+With a target SSIM configured, encode() binary-searches the encoder quality
+of every image instead of using the encoder's default:
+
+    1. the lowest allowed quality is tried first; simple images (flat
+       graphics, screenshots) often pass already and the search stops;
+    2. the highest allowed quality is tried next; if even that misses the
+       target the search stops and keeps it;
+    3. otherwise the range between a failing and a passing quality is
+       halved until they are adjacent, which takes about six more trials.
+
+Every trial is encoded into memory, decoded again and scored against the
+source with SSIM over 7x7 windows of the luma plane, downscaled to at most
+SCORE_SIDE pixels on its longer side and computed with NumPy from
+integral images. The bytes of the winning trial are what gets written, so
+the image is never encoded a final extra time.
+
+The chosen quality is remembered per image (a hash of the decoded pixels,
+the format and the search settings), in memory and in an append-only
+JSONL file in the user cache directory: converting the same image again
+costs one encode.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+
+from PIL import Image
+
+import ffmpeg_tools
+
+try:
+    import numpy
+except ImportError:
+    # Quality search needs NumPy; encoding at the default quality does not.
+    numpy = None
+
+QUALITY_FORMATS = {"jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP"}
+DEFAULT_MIN_QUALITY = 30
+DEFAULT_MAX_QUALITY = 95
+# Longest side of the luma plane SSIM is computed on.
+SCORE_SIDE = 512
+SSIM_WINDOW = 7
+CACHE_FILE_NAME = "quality_search.jsonl"
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+_settings = {"target": None, "min_quality": DEFAULT_MIN_QUALITY, "max_quality": DEFAULT_MAX_QUALITY, "cache_path": None}
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class SearchResult(object):
+    """The chosen encode: its quality, SSIM and bytes, and how many trial encodes it took (0 when cached)."""
+
+    def __init__(self, quality, score, data, trials):
+        self.quality = quality
+        self.score = score
+        self.data = data
+        self.trials = trials
+
+
+def _box_mean(values, size):
+    """Mean over every size x size window (valid positions only), from an integral image."""
+    integral = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    numpy.cumsum(numpy.cumsum(values, axis=0), axis=1, out=integral[1:, 1:])
+    total = integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+    return total / (size * size)
+
+
+def ssim(reference, candidate, window=SSIM_WINDOW):
+    """Mean structural similarity of two equally sized 8-bit planes (NumPy arrays)."""
+    x = reference.astype(numpy.float64)
+    y = candidate.astype(numpy.float64)
+    if min(x.shape) < window:
+        window = min(x.shape)
+    mean_x, mean_y = _box_mean(x, window), _box_mean(y, window)
+    # Unbiased (sample) variances, as in the reference implementation.
+    correction = window * window / (window * window - 1) if window > 1 else 1.0
+    variance_x = (_box_mean(x * x, window) - mean_x * mean_x) * correction
+    variance_y = (_box_mean(y * y, window) - mean_y * mean_y) * correction
+    covariance = (_box_mean(x * y, window) - mean_x * mean_y) * correction
+    score = ((2 * mean_x * mean_y + _C1) * (2 * covariance + _C2)) / \
+            ((mean_x * mean_x + mean_y * mean_y + _C1) * (variance_x + variance_y + _C2))
+    return float(score.mean())
+
+
+def luma(image, side=SCORE_SIDE):
+    """The image's luma plane as a uint8 array, box-downscaled so its longer side is at most `side`."""
+    plane = image.convert("L")
+    if max(plane.size) > side:
+        scale = side / max(plane.size)
+        plane = plane.resize((max(1, round(plane.width * scale)), max(1, round(plane.height * scale))), Image.BOX)
+    return numpy.asarray(plane)
+
+
+def _encode(image, output_format, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format=QUALITY_FORMATS[output_format], quality=quality)
+    return buffer.getvalue()
+
+
+def search(image, output_format, target, min_quality=DEFAULT_MIN_QUALITY, max_quality=DEFAULT_MAX_QUALITY):
+    """Binary-searches the lowest quality in [min_quality, max_quality] whose encode reaches `target` SSIM."""
+    reference = luma(image)
+    trials = {}
+
+    def trial(quality):
+        data = _encode(image, output_format, quality)
+        with Image.open(io.BytesIO(data)) as decoded:
+            score = ssim(reference, luma(decoded))
+        trials[quality] = (score, data)
+        return score >= target
+
+    if trial(min_quality) or not trial(max_quality):
+        best = min_quality if trials[min_quality][0] >= target else max_quality
+    else:
+        failing, passing = min_quality, max_quality
+        while passing - failing > 1:
+            middle = (failing + passing) // 2
+            if trial(middle):
+                passing = middle
+            else:
+                failing = middle
+        best = passing
+    score, data = trials[best]
+    return SearchResult(best, score, data, len(trials))
+
+
+def image_key(image, output_format, target, min_quality, max_quality):
+    """Cache key for a search: the decoded pixels plus everything that changes the answer."""
+    digest = hashlib.sha256(image.tobytes())
+    digest.update(f"{image.mode}|{image.size}|{QUALITY_FORMATS[output_format]}|{target}|{min_quality}|{max_quality}".encode())
+    return digest.hexdigest()
+
+
+def _load_cache(cache_path):
+    entries = {}
+    try:
+        with open(cache_path, encoding="utf-8") as cache:
+            for line in cache:
+                try:
+                    entry = json.loads(line)
+                    entries[entry["key"]] = (entry["quality"], entry["ssim"])
+                except (ValueError, KeyError, TypeError):
+                    # A line cut short by a crash only loses that one result.
+                    continue
+    except OSError:
+        pass
+    return entries
+
+
+def _cached(key):
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = _load_cache(_settings["cache_path"])
+        return _cache.get(key)
+
+
+def _remember(key, result):
+    with _cache_lock:
+        _cache[key] = (result.quality, result.score)
+        try:
+            os.makedirs(os.path.dirname(_settings["cache_path"]), exist_ok=True)
+            with open(_settings["cache_path"], "a", encoding="utf-8") as cache:
+                cache.write(json.dumps({"key": key, "quality": result.quality, "ssim": round(result.score, 5)}) + "\n")
+        except OSError:
+            pass
+
+
+def encode(image, output_format):
+    """
+    Encodes an image (already in a mode output_format accepts) at the
+    lowest quality meeting the configured target SSIM, and returns the
+    SearchResult. Earlier results for the same pixels are reused.
+    """
+    target, min_quality, max_quality = _settings["target"], _settings["min_quality"], _settings["max_quality"]
+    key = image_key(image, output_format, target, min_quality, max_quality)
+    cached = _cached(key)
+    if cached is not None:
+        quality, score = cached
+        return SearchResult(quality, score, _encode(image, output_format, quality), 0)
+    result = search(image, output_format, target, min_quality, max_quality)
+    _remember(key, result)
+    return result
+
+
+def applies_to(output_format):
+    """Whether images written as output_format go through the quality search."""
+    return _settings["target"] is not None and output_format in QUALITY_FORMATS
+
+
+def settings():
+    """The configured search settings, as keyword arguments for configure()."""
+    return dict(_settings)
+
+
+def configure(target=None, min_quality=DEFAULT_MIN_QUALITY, max_quality=DEFAULT_MAX_QUALITY, cache_path=None):
+    """
+    Sets the target SSIM (None turns the search off) and the quality range
+    searched. Raises ValueError for an unusable target or range, or when
+    NumPy is missing.
+    """
+    global _cache
+    if target is not None:
+        if numpy is None:
+            raise ValueError("quality search needs NumPy (pip install numpy)")
+        if not 0 < target <= 1:
+            raise ValueError("the target SSIM must be in (0, 1]")
+        if not 1 <= min_quality <= max_quality <= 100:
+            raise ValueError("the quality range must satisfy 1 <= minimum <= maximum <= 100")
+    with _cache_lock:
+        _settings.update(target=target, min_quality=min_quality, max_quality=max_quality,
+                         cache_path=cache_path or ffmpeg_tools.default_cache_path(CACHE_FILE_NAME))
+        _cache = None
@@ -0,0 +1,227 @@
+"""
+Desired-state registry management for the Explorer context menus.
+
+Registration is described as a tree of keys and values (the desired state),
+the keys that currently exist under the managed menu roots are read back
+(the actual state), and only the difference is written: missing keys are
+created, changed values are set, and stale keys under a managed root are
+deleted deepest first. Running --register twice therefore writes nothing
+the second time, and --unregister is simply an empty desired state.
+
+All registry access goes through a small backend interface. WinregBackend
+talks to HKEY_CURRENT_USER; MemoryBackend keeps the tree in a dict so the
+whole flow can be unit-tested and benchmarked on any platform.
+"""
+
+# Value name used for a key's default value.
+DEFAULT_VALUE = ""
+
+
+def _fold(path):
+    # Registry key and value names are case-insensitive.
+    return path.lower()
+
+
+class RegistryBackend(object):
+    """Interface for registry access. Paths are relative to the backend's hive and use backslashes."""
+
+    def key_exists(self, path):
+        raise NotImplementedError
+
+    def values(self, path):
+        """Returns {value_name: data} for the key; the default value is named DEFAULT_VALUE."""
+        raise NotImplementedError
+
+    def subkeys(self, path):
+        raise NotImplementedError
+
+    def create_key(self, path):
+        raise NotImplementedError
+
+    def set_value(self, path, name, data):
+        raise NotImplementedError
+
+    def delete_value(self, path, name):
+        raise NotImplementedError
+
+    def delete_key(self, path):
+        """Deletes a key that has no subkeys."""
+        raise NotImplementedError
+
+
+class MemoryBackend(RegistryBackend):
+    """In-memory registry hive. Counts write operations so tests and benchmarks can check them."""
+
+    def __init__(self):
+        self._keys = {}
+        self.writes = 0
+
+    def _key(self, path):
+        try:
+            return self._keys[_fold(path)]
+        except KeyError:
+            raise FileNotFoundError(path)
+
+    def key_exists(self, path):
+        return _fold(path) in self._keys
+
+    def values(self, path):
+        return dict(self._key(path)["values"])
+
+    def subkeys(self, path):
+        self._key(path)
+        prefix = _fold(path) + "\\"
+        return [key["name"].rsplit("\\", 1)[1] for folded, key in self._keys.items()
+                if folded.startswith(prefix) and "\\" not in folded[len(prefix):]]
+
+    def create_key(self, path):
+        # Like RegCreateKeyEx, missing parents are created too.
+        parts = path.split("\\")
+        for depth in range(1, len(parts) + 1):
+            partial = "\\".join(parts[:depth])
+            if _fold(partial) not in self._keys:
+                self._keys[_fold(partial)] = {"name": partial, "values": {}}
+                self.writes += 1
+
+    def set_value(self, path, name, data):
+        values = self._key(path)["values"]
+        for existing in list(values):
+            if _fold(existing) == _fold(name):
+                del values[existing]
+        values[name] = data
+        self.writes += 1
+
+    def delete_value(self, path, name):
+        values = self._key(path)["values"]
+        for existing in list(values):
+            if _fold(existing) == _fold(name):
+                del values[existing]
+                self.writes += 1
+                return
+        raise FileNotFoundError(f"{path}\\{name}")
+
+    def delete_key(self, path):
+        if self.subkeys(path):
+            raise PermissionError(f"{path} has subkeys")
+        del self._keys[_fold(path)]
+        self.writes += 1
+
+
+class WinregBackend(RegistryBackend):
+    """Registry access through winreg, rooted at HKEY_CURRENT_USER."""
+
+    def __init__(self, winreg, hive=None):
+        self._winreg = winreg
+        self._hive = winreg.HKEY_CURRENT_USER if hive is None else hive
+
+    def key_exists(self, path):
+        try:
+            self._winreg.CloseKey(self._winreg.OpenKey(self._hive, path))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def values(self, path):
+        values = {}
+        with self._winreg.OpenKey(self._hive, path) as key:
+            index = 0
+            while True:
+                try:
+                    name, data, value_type = self._winreg.EnumValue(key, index)
+                except OSError:
+                    return values
+                # Anything that is not a plain string can never match the desired state.
+                values[name] = data if value_type == self._winreg.REG_SZ else (data, value_type)
+                index += 1
+
+    def subkeys(self, path):
+        names = []
+        with self._winreg.OpenKey(self._hive, path) as key:
+            index = 0
+            while True:
+                try:
+                    names.append(self._winreg.EnumKey(key, index))
+                except OSError:
+                    return names
+                index += 1
+
+    def create_key(self, path):
+        self._winreg.CloseKey(self._winreg.CreateKey(self._hive, path))
+
+    def set_value(self, path, name, data):
+        with self._winreg.OpenKey(self._hive, path, 0, self._winreg.KEY_SET_VALUE) as key:
+            self._winreg.SetValueEx(key, name or None, 0, self._winreg.REG_SZ, data)
+
+    def delete_value(self, path, name):
+        with self._winreg.OpenKey(self._hive, path, 0, self._winreg.KEY_SET_VALUE) as key:
+            self._winreg.DeleteValue(key, name or None)
+
+    def delete_key(self, path):
+        self._winreg.DeleteKey(self._hive, path)
+
+
+def read_tree(backend, root):
+    """Returns {key_path: values} for root and everything below it, or {} if root does not exist."""
+    if not backend.key_exists(root):
+        return {}
+    tree = {}
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        tree[path] = backend.values(path)
+        pending.extend(f"{path}\\{name}" for name in backend.subkeys(path))
+    return tree
+
+
+def diff(desired, actual, roots):
+    """
+    Returns the operations that turn `actual` into `desired` under `roots`.
+
+    desired and actual map key paths to {value_name: data}. Operations are
+    tuples: ("create_key", path), ("set_value", path, name, data),
+    ("delete_value", path, name) and ("delete_key", path). Keys in actual that
+    are not desired are deleted only when they lie under one of roots.
+    """
+    actual_by_fold = {_fold(path): (path, values) for path, values in actual.items()}
+    folded_roots = [_fold(root) for root in roots]
+    operations = []
+
+    for path, wanted in sorted(desired.items(), key=lambda item: (item[0].count("\\"), _fold(item[0]))):
+        current = actual_by_fold.get(_fold(path))
+        if current is None:
+            operations.append(("create_key", path))
+            current = (path, {})
+        # Operate on the key's existing spelling when only the casing differs.
+        target, current_values = current
+        current_by_fold = {_fold(name): (name, data) for name, data in current_values.items()}
+        for name, data in wanted.items():
+            existing = current_by_fold.get(_fold(name))
+            if existing is None or existing[1] != data:
+                operations.append(("set_value", target, name, data))
+        wanted_names = {_fold(name) for name in wanted}
+        for folded_name, (name, _) in current_by_fold.items():
+            if folded_name not in wanted_names:
+                operations.append(("delete_value", target, name))
+
+    desired_folds = {_fold(path) for path in desired}
+    stale = [path for folded, (path, _) in actual_by_fold.items()
+             if folded not in desired_folds and any(folded == root or folded.startswith(root + "\\") for root in folded_roots)]
+    for path in sorted(stale, key=lambda p: p.count("\\"), reverse=True):
+        operations.append(("delete_key", path))
+    return operations
+
+
+def apply(backend, operations):
+    """Runs diff() operations against backend in order."""
+    for operation in operations:
+        getattr(backend, operation[0])(*operation[1:])
+
+
+def synchronize(backend, desired, roots):
+    """Brings every key under roots in line with desired and returns the operations that were applied."""
+    actual = {}
+    for root in roots:
+        actual.update(read_tree(backend, root))
+    operations = diff(desired, actual, roots)
+    apply(backend, operations)
+    return operations
@@ -0,0 +1,192 @@
+"""
+Cost-aware ordering and ETA for batch conversions.
+
+Every file in a batch gets an estimated cost before anything is encoded:
+
+    image   pixels, from a header-only Image.open (no pixel data decoded);
+    audio   duration in seconds, from ffprobe;
+    video   duration x width x height, from ffprobe.
+
+Files that cannot be probed are costed from their size, scaled by the
+median cost per byte of the files that could be. The batch is then
+ordered by a policy:
+
+    fifo    discovery order (os.walk), the old behaviour;
+    sjf     shortest job first: short clips are not stuck behind a
+            three-hour video, and the most files finish early;
+    ljf     largest job first: the long jobs start while there is still
+            other work to pack around them, so parallel workers finish
+            together.
+
+The same costs drive the ETA reported with progress events (remaining cost
+divided by the cost per second completed so far) and the --dry-run plan.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, UnidentifiedImageError
+
+POLICIES = ("fifo", "sjf", "ljf")
+DEFAULT_POLICY = "fifo"
+DEFAULT_PROBE_WORKERS = 8
+
+_settings = {"policy": DEFAULT_POLICY, "dry_run": False}
+
+
+class Estimate(object):
+    """Estimated cost of converting one file, with the measurements it came from."""
+
+    __slots__ = ("path", "cost", "pixels", "duration", "size", "from_bytes")
+
+    def __init__(self, path, cost=None, pixels=None, duration=None, size=None, from_bytes=False):
+        self.path = path
+        self.cost = cost
+        self.pixels = pixels
+        self.duration = duration
+        self.size = size
+        self.from_bytes = from_bytes
+
+    def describe(self):
+        parts = []
+        if self.duration is not None:
+            parts.append(format_duration(self.duration))
+        if self.size is not None:
+            parts.append(f"{self.size[0]}x{self.size[1]}")
+        elif self.pixels is not None:
+            parts.append(f"{self.pixels / 1e6:.1f} MP")
+        if self.from_bytes:
+            parts.append("estimated from file size")
+        return ", ".join(parts)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _probe_image(path):
+    with Image.open(path) as image:
+        # Only the header has been read; size is known without decoding pixels.
+        width, height = image.size
+    return Estimate(path, width * height, pixels=width * height, size=(width, height))
+
+
+def _probe_media(path, kind, ffprobe_path):
+    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+    result = subprocess.run([ffprobe_path, "-v", "error", "-show_entries", "format=duration:stream=codec_type,width,height", "-of", "json", path],
+                            capture_output=True, text=True, check=True, creationflags=creationflags)
+    info = json.loads(result.stdout)
+    duration = float(info["format"]["duration"])
+    if kind != "video":
+        return Estimate(path, duration, duration=duration)
+    video = next((stream for stream in info.get("streams", []) if stream.get("codec_type") == "video" and stream.get("width")), None)
+    if video is None:
+        return Estimate(path, duration, duration=duration)
+    width, height = int(video["width"]), int(video["height"])
+    return Estimate(path, duration * width * height, duration=duration, size=(width, height))
+
+
+def _probe(path, kind, ffprobe_path):
+    try:
+        if kind == "image":
+            return _probe_image(path)
+        return _probe_media(path, kind, ffprobe_path)
+    except (OSError, ValueError, KeyError, UnidentifiedImageError, subprocess.CalledProcessError):
+        return Estimate(path)
+
+
+def estimate_costs(files, kind, ffprobe_path=None, workers=DEFAULT_PROBE_WORKERS):
+    """Returns an Estimate for every file, in order. Media files are probed `workers` at a time."""
+    if kind == "image" or len(files) < 2:
+        estimates = [_probe(path, kind, ffprobe_path) for path in files]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as probes:
+            estimates = list(probes.map(lambda path: _probe(path, kind, ffprobe_path), files))
+
+    sizes = {}
+    for estimate in estimates:
+        try:
+            sizes[estimate.path] = os.path.getsize(estimate.path)
+        except OSError:
+            sizes[estimate.path] = 0
+    ratios = [estimate.cost / sizes[estimate.path] for estimate in estimates if estimate.cost is not None and sizes[estimate.path]]
+    cost_per_byte = statistics.median(ratios) if ratios else 1.0
+    for estimate in estimates:
+        if estimate.cost is None:
+            estimate.cost = sizes[estimate.path] * cost_per_byte
+            estimate.from_bytes = True
+    return estimates
+
+
+def order(estimates, policy=DEFAULT_POLICY):
+    """Returns the estimates in the order `policy` runs them. Ties keep discovery order."""
+    if policy == "sjf":
+        return sorted(estimates, key=lambda estimate: estimate.cost)
+    if policy == "ljf":
+        return sorted(estimates, key=lambda estimate: estimate.cost, reverse=True)
+    if policy == "fifo":
+        return list(estimates)
+    raise ValueError(f"Unknown scheduling policy '{policy}'. Supported policies are: {','.join(POLICIES)}")
+
+
+class EtaTracker(object):
+    """Turns completed jobs into an estimate of the seconds left for the batch."""
+
+    def __init__(self, estimates, clock=time.monotonic):
+        self._costs = {estimate.path: estimate.cost for estimate in estimates}
+        self._remaining = sum(self._costs.values())
+        self._done = 0.0
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+
+    def complete(self, path):
+        """Records path as finished and returns the estimated seconds left (None until there is a rate)."""
+        with self._lock:
+            cost = self._costs.pop(path, 0.0)
+            self._done += cost
+            self._remaining -= cost
+            elapsed = self._clock() - self._started
+            if self._done <= 0 or elapsed <= 0:
+                return None
+            return max(0.0, self._remaining) * elapsed / self._done
+
+
+def describe_plan(estimates, kind, policy):
+    """Human-readable dry-run plan: one line per job in run order, then the total."""
+    lines = [f"Dry run: {len(estimates)} {kind} file(s) in {policy} order."]
+    width = len(str(len(estimates)))
+    for number, estimate in enumerate(estimates, 1):
+        lines.append(f"  {number:>{width}}. {estimate.path} ({estimate.describe()})")
+    if kind == "image":
+        total = f"{sum(estimate.cost for estimate in estimates) / 1e6:.1f} megapixels"
+    else:
+        total = f"{format_duration(sum(estimate.duration or 0 for estimate in estimates))} of {kind}"
+        if kind == "video":
+            total += f", {sum(estimate.cost for estimate in estimates) / 1e9:.1f} gigapixel-seconds"
+    estimated = sum(1 for estimate in estimates if estimate.from_bytes)
+    if estimated:
+        total += f" ({estimated} file(s) estimated from their size)"
+    lines.append(f"Total estimated work: {total}.")
+    return "\n".join(lines)
+
+
+def configure(policy=DEFAULT_POLICY, dry_run=False):
+    """Sets the scheduling policy for batches and whether they are only planned."""
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown scheduling policy '{policy}'. Supported policies are: {','.join(POLICIES)}")
+    _settings.update(policy=policy, dry_run=dry_run)
+
+
+def policy():
+    return _settings["policy"]
+
+
+def dry_run():
+    return _settings["dry_run"]
@@ -0,0 +1,299 @@
+"""
+Multi-process image pipeline with a shared-memory pixel transport.
+
+Decoding, transforming (mode normalization, resizing) and encoding an
+image are CPU-bound; with threads they contend for the GIL, and with
+plain process pools every decoded image would be pickled, piped and
+unpickled between stages, which costs about as much as the conversion.
+Here each stage is its own set of processes, scaled independently:
+
+    decode      opens and decodes the input and copies its pixels into a
+                block of shared memory;
+    transform   rebuilds the image on the block with Image.frombuffer (no
+                copy), normalizes or resizes it, and writes the result back
+                into the same block when anything changed;
+    encode      rebuilds the image the same way, encodes it to its output
+                and returns the block to the pool.
+
+Only small descriptors (block number, mode, size, palette, info) travel
+through the queues. The parent creates a fixed pool of equally sized
+blocks up front and recycles them through a free list, so nothing is
+allocated per image, and a decoder waits for a free block when the later
+stages fall behind, which bounds memory. An image too large for a block
+travels inline (pickled) instead.
+"""
+import multiprocessing
+import os
+import pickle
+import queue
+import time
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from conversion_events import report_done, report_progress, report_start
+
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+# Blocks per process beyond one each, so every stage can hold one while another waits.
+SPARE_BLOCKS = 2
+# How often the parent checks that no worker died while it waits for results.
+WORKER_CHECK_SECONDS = 1.0
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+def parse_processes(text, cpu_count=None):
+    """
+    Parses "DECODE,TRANSFORM,ENCODE" process counts. "auto" gives half the
+    CPUs to decoding and to encoding and half as many to transforming, which
+    is usually the cheapest stage. Raises ValueError for anything else.
+    """
+    if text == "auto":
+        half = max(1, (cpu_count or os.cpu_count() or 2) // 2)
+        return half, max(1, half // 2), half
+    counts = tuple(int(part.strip()) for part in text.split(","))
+    if len(counts) != 3 or min(counts) < 1:
+        raise ValueError("expected three positive process counts: DECODE,TRANSFORM,ENCODE")
+    return counts
+
+
+class BlockPool(object):
+    """Equally sized shared-memory blocks, created once by the parent and recycled through a free-list queue."""
+
+    def __init__(self, count, block_size, context):
+        self.block_size = block_size
+        self.blocks = [shared_memory.SharedMemory(create=True, size=block_size) for _ in range(count)]
+        self.names = [block.name for block in self.blocks]
+        self.free = context.Queue()
+        for number in range(count):
+            self.free.put(number)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+class _Blocks(object):
+    """A worker's view of the pool: attaches to each block once and keeps the mapping for its lifetime."""
+
+    def __init__(self, names, free, block_size):
+        self.names = names
+        self.free = free
+        self.block_size = block_size
+        self._attached = {}
+
+    def buffer(self, number):
+        if number not in self._attached:
+            self._attached[number] = shared_memory.SharedMemory(name=self.names[number])
+        return self._attached[number].buf
+
+    def store(self, image, number=None):
+        """Copies image's pixels into block `number` (or a newly acquired one); returns (number, inline_bytes)."""
+        data = image.tobytes()
+        if len(data) > self.block_size:
+            if number is not None:
+                self.release(number)
+            return None, data
+        if number is None:
+            number = self.free.get()
+        self.buffer(number)[:len(data)] = data
+        return number, None
+
+    def load(self, descriptor):
+        """The image a descriptor points at, sharing the block's memory instead of copying it."""
+        number, inline, mode, size, palette, info = descriptor
+        pixels = inline if number is None else self.buffer(number)
+        image = Image.frombuffer(mode, size, pixels, "raw", mode, 0, 1)
+        if palette is not None:
+            image.putpalette(palette[1], rawmode=palette[0])
+        image.info.update(info)
+        return image
+
+    def release(self, number):
+        if number is not None:
+            self.free.put(number)
+
+    def close(self):
+        for block in self._attached.values():
+            block.close()
+        self._attached.clear()
+
+
+def _describe(image, number, inline):
+    palette = (image.palette.mode, image.palette.tobytes()) if image.mode in ("P", "PA") and image.palette else None
+    info = {}
+    for key, value in image.info.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        info[key] = value
+    return number, inline, image.mode, image.size, palette, info
+
+
+def _picklable(error):
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _decode(blocks, decode, input_path):
+    number = None
+    try:
+        with decode(input_path) as image:
+            image.load()
+            number, inline = blocks.store(image)
+            return _describe(image, number, inline)
+    except BaseException:
+        blocks.release(number)
+        raise
+
+
+def _transform(blocks, transform, descriptor, output_format):
+    image = blocks.load(descriptor)
+    transformed = transform(image, output_format)
+    if transformed is image:
+        return descriptor
+    # The source pixels are no longer needed: the result takes over the block.
+    transformed.load()
+    number, inline = blocks.store(transformed, descriptor[0])
+    return _describe(transformed, number, inline)
+
+
+def _encode(blocks, encode, descriptor, output_path, output_format):
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    encode(blocks.load(descriptor), output_path, output_format)
+    return os.path.getsize(output_path)
+
+
+# Each stage does its work in a helper so no image (which pins its block's
+# memory) outlives the task, and blocks can be detached when the stage ends.
+
+def _decode_worker(tasks, output, results, names, free, block_size, decode, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    blocks = _Blocks(names, free, block_size)
+    for index, input_path, output_path, output_format in iter(tasks.get, None):
+        try:
+            descriptor = _decode(blocks, decode, input_path)
+        except Exception as e:
+            results.put((index, _picklable(e), None))
+            continue
+        output.put((index, output_path, output_format, descriptor))
+    blocks.close()
+
+
+def _transform_worker(tasks, output, results, names, free, block_size, transform, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    blocks = _Blocks(names, free, block_size)
+    for index, output_path, output_format, descriptor in iter(tasks.get, None):
+        try:
+            descriptor = _transform(blocks, transform, descriptor, output_format)
+        except Exception as e:
+            blocks.release(descriptor[0])
+            results.put((index, _picklable(e), None))
+            continue
+        output.put((index, output_path, output_format, descriptor))
+    blocks.close()
+
+
+def _encode_worker(tasks, results, names, free, block_size, encode, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    blocks = _Blocks(names, free, block_size)
+    for index, output_path, output_format, descriptor in iter(tasks.get, None):
+        try:
+            results.put((index, None, _encode(blocks, encode, descriptor, output_path, output_format)))
+        except Exception as e:
+            results.put((index, _picklable(e), None))
+        finally:
+            blocks.release(descriptor[0])
+    blocks.close()
+
+
+def run_pipeline(jobs, decode, transform, encode, report_failure, kind="image", processes=(1, 1, 1),
+                 block_size=DEFAULT_BLOCK_BYTES, initializer=None, initargs=()):
+    """
+    Runs `jobs`, a list of (input_path, output_path, output_format) tuples,
+    through decode, transform and encode process stages with
+    processes=(decoders, transformers, encoders) workers.
+
+    decode(input_path) returns an opened PIL image; transform(image,
+    output_format) returns the image to encode (the same object when
+    nothing changes); encode(image, output_path, output_format) writes it.
+    All three must be picklable (module-level functions), and initializer
+    (*initargs) runs first in every worker, e.g. to replay settings that a
+    spawned process would not inherit. report_failure(error, input_path,
+    output_format, output_path, started, bytes_in) must report and return
+    an error event. Returns the final events in job order; jobs that were
+    in flight when a worker process died (e.g. killed for running out of
+    memory) are reported as WorkerCrashed errors.
+    """
+    if not jobs:
+        return []
+    context = multiprocessing.get_context()
+    decoders, transformers, encoders = (max(1, count) for count in processes)
+    pool = BlockPool(decoders + transformers + encoders + SPARE_BLOCKS, block_size, context)
+    to_decode, to_transform, to_encode, results = context.Queue(), context.Queue(), context.Queue(), context.Queue()
+    shared = (results, pool.names, pool.free, block_size)
+    workers = [context.Process(target=_decode_worker, args=(to_decode, to_transform) + shared + (decode, initializer, initargs), daemon=True)
+               for _ in range(decoders)]
+    workers += [context.Process(target=_transform_worker, args=(to_transform, to_encode) + shared + (transform, initializer, initargs), daemon=True)
+                for _ in range(transformers)]
+    workers += [context.Process(target=_encode_worker, args=(to_encode,) + shared + (encode, initializer, initargs), daemon=True)
+                for _ in range(encoders)]
+    events = [None] * len(jobs)
+    bytes_in = [None] * len(jobs)
+    started = [None] * len(jobs)
+    try:
+        for worker in workers:
+            worker.start()
+        for index, (input_path, output_path, output_format) in enumerate(jobs):
+            started[index] = time.perf_counter()
+            try:
+                bytes_in[index] = os.path.getsize(input_path)
+            except OSError:
+                pass
+            report_start(input_path, output_format, kind=kind, bytes_in=bytes_in[index])
+            to_decode.put((index, input_path, output_path, output_format))
+        completed = 0
+        while completed < len(jobs):
+            try:
+                index, error, bytes_out = results.get(timeout=WORKER_CHECK_SECONDS)
+            except queue.Empty:
+                crashed = next((worker for worker in workers if worker.exitcode not in (None, 0)), None)
+                if crashed is None:
+                    continue
+                # The dead worker may have held jobs and blocks; the rest of the batch cannot be trusted to finish.
+                error = WorkerCrashed(f"a pipeline worker process exited with code {crashed.exitcode}")
+                for index, (input_path, output_path, output_format) in enumerate(jobs):
+                    if events[index] is None:
+                        events[index] = report_failure(error, input_path, output_format, output_path, started[index], bytes_in[index])
+                return events
+            completed += 1
+            input_path, output_path, output_format = jobs[index]
+            if error is None:
+                events[index] = report_done(input_path, output_format, output_path, started[index], kind=kind, bytes_in=bytes_in[index], bytes_out=bytes_out)
+            else:
+                events[index] = report_failure(error, input_path, output_format, output_path, started[index], bytes_in[index])
+            report_progress(completed, len(jobs), input_path, kind=kind)
+        for stage, count in ((to_decode, decoders), (to_transform, transformers), (to_encode, encoders)):
+            for _ in range(count):
+                stage.put(None)
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        pool.close()
+    return events
@@ -0,0 +1,99 @@
+import io
+import tarfile
+import zipfile
+import pytest
+import conversion_events
+from archive_io import convert_members, count_members, default_destination, iter_files, iter_members, _safe_member_name
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 8
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+def reverse_bytes(member_path, data, output_format, output):
+    if data.endswith(b"bad"):
+        raise ValueError("cannot decode")
+    output.write(data[::-1])
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+
+def test_safe_member_name_rejects_escapes():
+    assert _safe_member_name("./a/b.png") == "a/b.png"
+    assert _safe_member_name("../evil.png") is None
+    assert _safe_member_name("/etc/evil.png") is None
+    assert _safe_member_name("C:/evil.png") is None
+
+def test_default_destination_keeps_archive_type():
+    assert default_destination("photos.zip", "webp") == "photos_webp.zip"
+    assert default_destination("photos.TAR.GZ", "png") == "photos_png.TAR.GZ"
+
+# Test zip members are converted into a tar archive in member order, with failures and skips reported
+def test_convert_zip_into_tar(tmp_path):
+    source = tmp_path / "in.zip"
+    make_zip(source, [("a/one.gif", b"GIF89a-one"), ("two.gif", b"GIF89a-bad"), ("notes.gif", b"text"),
+                      ("already.png", PNG), ("../escape.gif", b"GIF89a"), ("readme.txt", b"ignored")])
+    destination = tmp_path / "out.tar.gz"
+
+    extensions = (".gif", ".png")
+    results, rejected = convert_members(iter_members(str(source), extensions), str(destination), "png", reverse_bytes, workers=2,
+                                        total=count_members(str(source), extensions))
+
+    assert [(r.event, r.path) for r in results] == [("done", f"{source}/a/one.gif"), ("error", f"{source}/two.gif")]
+    assert results[0].output_path == f"{destination}/a/one.png" and results[0].bytes_out == 10
+    assert results[1].error == "ValueError"
+    assert sorted(reason.split(" ")[0] for _, reason in rejected) == ["already", "content", "member"]
+    with tarfile.open(destination) as archive:
+        assert archive.getnames() == ["a/one.png"]
+        assert archive.extractfile("a/one.png").read() == b"eno-a98FIG"
+
+# Test a tar read as a stream can be unpacked into a directory with a small in-flight budget
+def test_convert_tar_stream_into_directory(tmp_path):
+    source = tmp_path / "in.tar"
+    with tarfile.open(source, "w") as archive:
+        for i in range(6):
+            data = b"GIF89a" + bytes([i]) * 100
+            info = tarfile.TarInfo(f"frames/{i}.gif")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    results, rejected = convert_members(iter_members(str(source), (".gif",)), str(tmp_path / "out"), "bmp", reverse_bytes, workers=3,
+                                        in_flight_bytes=150)
+
+    assert rejected == [] and [r.event for r in results] == ["done"] * 6
+    assert (tmp_path / "out" / "frames" / "5.bmp").read_bytes() == (b"GIF89a" + bytes([5]) * 100)[::-1]
+
+# Test plain files are packed into a zip, storing already-compressed formats uncompressed
+def test_convert_files_into_zip(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "x.gif").write_bytes(b"GIF89a-x")
+    files = [str(tmp_path / "sub" / "x.gif")]
+
+    results, _ = convert_members(iter_files(files, str(tmp_path)), str(tmp_path / "out.zip"), "png", reverse_bytes, total=1)
+
+    assert results[0].ok
+    with zipfile.ZipFile(tmp_path / "out.zip") as archive:
+        info = archive.getinfo("sub/x.png")
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert archive.read(info) == b"x-a98FIG"
+
+# Test an unreadable file fails only its own member, and inputs sharing a stem get distinct member names
+def test_convert_files_survives_unreadable_and_same_stem_inputs(tmp_path):
+    (tmp_path / "a.gif").write_bytes(b"GIF89a-gif")
+    (tmp_path / "a.bmp").write_bytes(b"GIF89a-bmp")
+    (tmp_path / "a_bmp.gif").write_bytes(b"GIF89a-other")
+    files = [str(tmp_path / name) for name in ("a.gif", "missing.gif", "a.bmp", "a_bmp.gif")]
+
+    results, _ = convert_members(iter_files(files, str(tmp_path)), str(tmp_path / "out.zip"), "png", reverse_bytes, total=4)
+
+    assert [r.event for r in results] == ["done", "error", "done", "done"]
+    assert results[1].error == "FileNotFoundError" and "missing.gif" in results[1].message
+    with zipfile.ZipFile(tmp_path / "out.zip") as archive:
+        assert archive.namelist() == ["a.png", "a_bmp.png", "a_bmp_gif.png"]
+        assert archive.read("a_bmp.png") == b"pmb-a98FIG"
@@ -0,0 +1,112 @@
+import os
+import stat
+import sys
+import numpy
+import pytest
+from PIL import Image
+import audio_analysis
+import conversion_events
+from audio_analysis import _ColumnReducer, _peak_combine, _peak_reduce, analysis_command, analyze_audio, render_spectrogram, render_waveform
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+def write_tool(tmp_path, name, source):
+    path = tmp_path / name
+    path.write_text(f"#!{sys.executable}\n{source}")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+# Stand-in for ffmpeg: the input file holds a sample count; writes a full-scale 1 kHz square wave of that
+# length as s16le to stdout (in odd-sized writes) and, when given a conversion output, copies the input there.
+FAKE_DECODER = """
+import sys
+args = sys.argv[1:]
+source = args[args.index("-i") + 1]
+count = int(open(source).read())
+if args[args.index("-i") + 2] != "-map":
+    open(args[args.index("-i") + 2], "w").write("converted")
+period = 22050 // 1000
+data = b"".join((32767 if (i // (period // 2)) % 2 else -32768).to_bytes(2, "little", signed=True) for i in range(count))
+for offset in range(0, len(data), 999):
+    sys.stdout.buffer.write(data[offset:offset + 999])
+    sys.stdout.buffer.flush()
+"""
+
+# Test folding matches an exact min/max over the covered samples, however the stream is chunked
+@pytest.mark.parametrize("chunk", [1, 333, 4096])
+def test_column_reducer_is_exact_and_bounded(chunk):
+    samples = numpy.random.default_rng(1).integers(-32768, 32767, size=20011, dtype=numpy.int16)
+    reducer = _ColumnReducer(16, _peak_reduce, _peak_combine)
+    for offset in range(0, len(samples), chunk):
+        reducer.feed(samples[offset:offset + chunk])
+        assert reducer.columns is None or len(reducer.columns) <= 32
+
+    columns, counts = reducer.finish()
+    assert counts.sum() == len(samples)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    assert (columns[:, 0] == numpy.minimum.reduceat(samples, starts)).all()
+    assert (columns[:, 1] == numpy.maximum.reduceat(samples, starts)).all()
+
+def test_render_waveform_spans_the_peaks():
+    peaks = numpy.array([[0, 0], [-32768, 32767], [0, 16384]], dtype=numpy.int16)
+    image = render_waveform(peaks, (3, 11))
+    pixels = numpy.asarray(image)
+    assert image.mode == "P" and image.size == (3, 11)
+    assert pixels[:, 0].tolist() == [0] * 5 + [1] + [0] * 5
+    assert pixels[:, 1].all()
+    assert pixels[:, 2].tolist() == [0, 0] + [1] * 4 + [0] * 5
+
+def test_render_spectrogram_puts_low_frequencies_at_the_bottom():
+    power = numpy.zeros((4, 8), dtype=numpy.float32)
+    power[:, 1] = 1.0
+    image = render_spectrogram(power, numpy.ones(4), (4, 8))
+    levels = numpy.asarray(image)
+    assert image.mode == "P" and image.size == (4, 8)
+    assert levels[6].min() > levels[0].max()
+
+def test_analysis_command_converts_and_streams_from_one_decode():
+    command = analysis_command("ffmpeg", "in.flac", "out.mp3")
+    assert command.count("-i") == 1
+    assert command.index("out.mp3") < command.index("-map")
+    assert command[-3:] == ["-f", "s16le", "-"]
+    assert "out.mp3" not in analysis_command("ffmpeg", "in.flac")
+
+def test_analyze_audio_renders_both_images_and_converts(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_analysis, "CHUNK_SAMPLES", 1000)
+    ffmpeg = write_tool(tmp_path, "ffmpeg", FAKE_DECODER)
+    track = tmp_path / "song.flac"
+    track.write_text("44100")
+    out = tmp_path / "out"
+
+    result = analyze_audio(str(track), str(out), ffmpeg, str(out / "song.mp3"), waveform_size=(100, 20), spectrogram_size=(100, 64))
+
+    assert result.ok, result.message
+    assert result.output_path == str(out / "song.mp3") and result.format == "mp3"
+    with Image.open(out / "song_waveform.png") as waveform:
+        # A full-scale square wave fills every column from top to bottom.
+        assert waveform.size == (100, 20) and numpy.asarray(waveform).all()
+    with Image.open(out / "song_spectrogram.png") as spectrogram:
+        levels = numpy.asarray(spectrogram.convert("L"))
+        assert spectrogram.size == (100, 64)
+        # The 1 kHz fundamental is near the bottom (11 kHz at the top); its row outshines the top rows.
+        assert levels[-7].mean() > levels[:5].mean()
+    assert result.bytes_out == sum(os.path.getsize(out / name) for name in ("song_waveform.png", "song_spectrogram.png", "song.mp3"))
+
+def test_analyze_audio_reports_silence_and_ffmpeg_failure(tmp_path):
+    ffmpeg = write_tool(tmp_path, "ffmpeg", FAKE_DECODER)
+    track = tmp_path / "empty.wav"
+    track.write_text("0")
+    assert analyze_audio(str(track), str(tmp_path), ffmpeg).error == "NoAudio"
+
+    failing = write_tool(tmp_path, "failing", "import sys; sys.stderr.write('Invalid data found\\n'); sys.exit(1)")
+    result = analyze_audio(str(track), str(tmp_path), failing)
+    assert result.error == "CalledProcessError" and "Invalid data found" in result.stderr
+
+def test_analyze_audio_without_numpy(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_analysis, "numpy", None)
+    assert analyze_audio(str(tmp_path / "a.wav"), str(tmp_path), "ffmpeg").error == "ImportError"
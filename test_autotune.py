@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+from autotune import Autotuner, SystemSampler, map_adaptive
+
+class FakeSampler(object):
+    def __init__(self):
+        self.values = (0.5, 0.0, 0.5)
+
+    def sample(self):
+        return self.values
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def make_tuner(**kwargs):
+    sampler, clock, logged = FakeSampler(), FakeClock(), []
+    tuner = Autotuner(sampler=sampler, clock=clock, log=logged.append, **kwargs)
+    return tuner, sampler, clock, logged
+
+def run_interval(tuner, clock, completions):
+    for _ in range(completions):
+        tuner.record_completion()
+    clock.now += 1.0
+    return tuner.step()
+
+# Test the limit climbs while throughput improves and turns back once it falls
+def test_hill_climbing_follows_throughput():
+    tuner, _, clock, logged = make_tuner(min_workers=1, max_workers=64, initial=8)
+    assert run_interval(tuner, clock, 10).after == 10
+    assert run_interval(tuner, clock, 20).after == 12
+    decision = run_interval(tuner, clock, 12)
+    assert decision.after == 9 and "fell" in decision.reason
+    assert run_interval(tuner, clock, 20).after == 7
+    assert len(logged) == 4 and logged[0].startswith("Autotune: 8 -> 10 workers (first measurement")
+
+def test_memory_pressure_and_cpu_saturation_shrink():
+    tuner, sampler, clock, logged = make_tuner(initial=16)
+    sampler.values = (0.5, 0.0, 0.05)
+    decision = run_interval(tuner, clock, 10)
+    assert decision.after == 12 and "memory" in decision.reason
+    assert "memory free 5%" in logged[-1]
+
+    tuner, sampler, clock, _ = make_tuner(initial=4)
+    run_interval(tuner, clock, 4)
+    sampler.values = (0.99, 0.0, 0.5)
+    decision = run_interval(tuner, clock, 4)
+    assert decision.after == 4 and "CPU saturated" in decision.reason
+
+def test_limit_stays_within_bounds():
+    tuner, _, clock, _ = make_tuner(min_workers=2, max_workers=3, initial=100)
+    assert tuner.limit == 3
+    limits = [run_interval(tuner, clock, 5).after for _ in range(6)]
+    assert set(limits) <= {2, 3}
+
+def test_system_sampler_reads_proc(tmp_path):
+    (tmp_path / "stat").write_text("cpu  100 0 100 700 100 0 0 0 0 0\n")
+    (tmp_path / "meminfo").write_text("MemTotal: 1000 kB\nMemFree: 100 kB\nMemAvailable: 250 kB\n")
+    sampler = SystemSampler(str(tmp_path))
+    (tmp_path / "stat").write_text("cpu  200 0 200 800 200 0 0 0 0 0\n")
+    cpu, io_wait, headroom = sampler.sample()
+    assert cpu == pytest.approx(0.5) and io_wait == pytest.approx(0.25) and headroom == 0.25
+
+    assert SystemSampler(str(tmp_path / "missing")).sample() == (None, None, None)
+
+# Test map_adaptive never runs more calls at once than the current limit and keeps item order
+def test_map_adaptive_respects_the_limit():
+    tuner, _, _, _ = make_tuner(initial=3, max_workers=8)
+    tuner.interval = 60
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def work(item):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return item * 2
+
+    assert map_adaptive(work, list(range(30)), tuner) == [item * 2 for item in range(30)]
+    assert peak[0] == 3
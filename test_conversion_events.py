@@ -0,0 +1,63 @@
+import io
+import json
+import time
+import pytest
+from unittest.mock import patch
+import conversion_events
+from conversion_events import ConversionEvent, JsonlSink, TextSink, report_done, report_error
+
+@pytest.fixture(autouse=True)
+def restore_sinks():
+    sinks = conversion_events.get_sinks()
+    yield
+    conversion_events.set_sinks(sinks)
+
+# Test that the text sink renders the same messages the converters used to print
+def test_text_sink_renders_success_message():
+    conversion_events.set_sinks([TextSink()])
+    with patch('builtins.print') as mock_print:
+        report_done("/path/to/test.png", "jpg", "/path/to/test.jpg", time.perf_counter(), kind="image")
+        mock_print.assert_called_once_with("Success! Converted '/path/to/test.png' to '/path/to/test.jpg'.")
+
+def test_text_sink_renders_error_message():
+    conversion_events.set_sinks([TextSink()])
+    with patch('builtins.print') as mock_print:
+        event = report_error("/path/to/x.png", "jpg", FileNotFoundError, "Error: missing", time.perf_counter())
+        mock_print.assert_called_once_with("Error: missing")
+        assert event.error == "FileNotFoundError"
+        assert not event.ok
+
+# Test JSONL output: one parseable object per event, unset fields omitted
+def test_jsonl_sink_writes_one_line_per_event():
+    stream = io.StringIO()
+    conversion_events.set_sinks([JsonlSink(stream)])
+    conversion_events.report_start("/in/a.png", "jpg", kind="image", bytes_in=10)
+    report_done("/in/a.png", "jpg", "/in/a.jpg", time.perf_counter(), kind="image", bytes_in=10, bytes_out=7)
+    report_error("/in/b.png", "jpg", OSError("boom"), "Error: boom", time.perf_counter(), kind="image")
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r["event"] for r in records] == ["start", "done", "error"]
+    assert records[1]["bytes_out"] == 7 and records[1]["output_path"] == "/in/a.jpg"
+    assert records[2]["error"] == "OSError"
+    assert "stdout" not in records[0]
+
+def test_start_events_are_skipped_when_no_sink_wants_them():
+    conversion_events.set_sinks([TextSink()])
+    assert conversion_events.report_start("/in/a.png", "jpg") is None
+
+def test_configure_output_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        conversion_events.configure_output("xml")
+
+def test_jsonl_sink_appends_to_file(tmp_path):
+    events_file = tmp_path / "events.jsonl"
+    conversion_events.configure_output("text", str(events_file))
+    with patch('builtins.print'):
+        conversion_events.report_progress(1, 2, "/in/a.png")
+    conversion_events.set_sinks([TextSink()])
+    assert json.loads(events_file.read_text())["completed"] == 1
+
+def test_event_round_trips_through_dict():
+    conversion_events.set_sinks([])
+    event = conversion_events.report_error("/in/a.png", "jpg", ValueError, "Error: bad", time.perf_counter(), kind="image", bytes_in=3)
+    copy = conversion_events.ConversionEvent.from_dict(json.loads(json.dumps(event.to_dict())))
+    assert copy.to_dict() == event.to_dict() and not copy.ok
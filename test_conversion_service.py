@@ -0,0 +1,118 @@
+import http.client
+import json
+import os
+import threading
+import time
+import pytest
+import conversion_events
+from conversion_events import report_done, report_error
+from conversion_service import create_server
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+def upper_case_converter(input_path, output_format):
+    # Stand-in converter: "converts" by upper-casing the bytes
+    started = time.perf_counter()
+    output_path = os.path.splitext(input_path)[0] + "." + output_format
+    with open(input_path, "rb") as source:
+        data = source.read()
+    if data == b"corrupt":
+        return report_error(input_path, output_format, ValueError, "Error: corrupt input", started)
+    with open(output_path, "wb") as target:
+        target.write(data.upper())
+    return report_done(input_path, output_format, output_path, started)
+
+@pytest.fixture
+def running_server():
+    servers = []
+
+    def start(converter=upper_case_converter, workers=2, queue_size=2):
+        server = create_server({"image": (converter, ["png", "jpeg"])}, port=0, workers=workers, queue_size=queue_size)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.service.shutdown()
+
+def test_health_and_metrics(running_server):
+    port = running_server()
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("GET", "/health")
+    assert json.loads(connection.getresponse().read()) == {"status": "ok"}
+    connection.request("GET", "/metrics")
+    metrics = json.loads(connection.getresponse().read())
+    assert metrics["workers"] == 2 and metrics["requests"] == 0
+
+# Test several conversions over one keep-alive connection, including a chunked upload
+def test_convert_over_keep_alive_connection(running_server):
+    port = running_server()
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("POST", "/convert/image?format=png&filename=photo.jpg", body=b"abc")
+    response = connection.getresponse()
+    assert response.status == 200 and response.read() == b"ABC"
+    assert response.getheader("Content-Type") == "image/png"
+
+    connection.request("POST", "/convert/image?format=jpeg", body=iter([b"de", b"f"]), encode_chunked=True)
+    response = connection.getresponse()
+    assert response.status == 200 and response.read() == b"DEF"
+
+    connection.request("POST", "/convert/image?format=png", body=b"corrupt")
+    response = connection.getresponse()
+    assert response.status == 422 and json.loads(response.read())["message"] == "Error: corrupt input"
+
+    connection.request("GET", "/metrics")
+    metrics = json.loads(connection.getresponse().read())
+    assert metrics["completed"] == 2 and metrics["failed"] == 1 and metrics["bytes_in"] == 13
+
+def test_unsupported_format_is_rejected(running_server):
+    port = running_server()
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("POST", "/convert/image?format=mp3", body=b"abc")
+    assert connection.getresponse().status == 400
+
+# Test a negative or malformed Content-Length is rejected with 400 instead of reading until the client hangs up
+@pytest.mark.parametrize("length", ["-1", "abc"])
+def test_invalid_content_length_is_rejected(running_server, length):
+    port = running_server()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.putrequest("POST", "/convert/image?format=png")
+    connection.putheader("Content-Length", length)
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400 and "Content-Length" in json.loads(response.read())["message"]
+
+# Test backpressure: with one worker and no queue a second request gets 429
+def test_full_queue_returns_429(running_server):
+    release = threading.Event()
+
+    def blocking_converter(input_path, output_format):
+        release.wait(5)
+        return upper_case_converter(input_path, output_format)
+
+    port = running_server(blocking_converter, workers=1, queue_size=0)
+    results = []
+
+    def first_request():
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        connection.request("POST", "/convert/image?format=png", body=b"a")
+        results.append(connection.getresponse().status)
+
+    thread = threading.Thread(target=first_request)
+    thread.start()
+    time.sleep(0.3)
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("POST", "/convert/image?format=png", body=b"b")
+    response = connection.getresponse()
+    assert response.status == 429 and response.getheader("Retry-After") == "1"
+    release.set()
+    thread.join()
+    assert results == [200]
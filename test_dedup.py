@@ -0,0 +1,61 @@
+import os
+import random
+import pytest
+from PIL import Image
+import dedup
+from dedup import find_duplicate_groups, materialize_copy, find_near_duplicates
+
+# Test identical files are grouped, same-size-but-different files are not
+def test_find_duplicate_groups(tmp_path):
+    big = os.urandom(dedup.HEAD_BYTES + 10)
+    paths = {}
+    for name, data in [("a", b"same"), ("b", b"diff"), ("c", b"same"), ("d", big), ("e", big[:-1] + b"!"), ("f", big)]:
+        paths[name] = str(tmp_path / name)
+        (tmp_path / name).write_bytes(data)
+    groups = find_duplicate_groups([paths[name] for name in "abcdef"])
+    assert groups == [[paths["a"], paths["c"]], [paths["b"]], [paths["d"], paths["f"]], [paths["e"]]]
+
+@pytest.mark.parametrize("mode", ["auto", "hardlink", "copy"])
+def test_materialize_copy(tmp_path, mode):
+    source = tmp_path / "out.png"
+    source.write_bytes(b"converted")
+    destination = tmp_path / "nested" / "copy.png"
+    method = materialize_copy(str(source), str(destination), mode)
+    assert destination.read_bytes() == b"converted"
+    assert method in ("reflink", "hardlink", "copy") if mode == "auto" else method == mode
+
+def test_find_near_duplicates(tmp_path):
+    texture = Image.effect_mandelbrot((64, 64), (-2, -1.5, 1, 1.5), 50).convert("RGB")
+    texture.save(tmp_path / "a.png")
+    texture.save(tmp_path / "b.jpg", quality=70)
+    texture.transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(tmp_path / "c.png")
+    pairs = find_near_duplicates([str(tmp_path / name) for name in ("a.png", "b.jpg", "c.png")])
+    assert [(os.path.basename(a), os.path.basename(b)) for a, b, _ in pairs] == [("a.png", "b.jpg")]
+
+# Test the banded index finds exactly the pairs an all-pairs comparison finds
+@pytest.mark.parametrize("max_distance", [0, 4, 10])
+def test_near_duplicate_index_matches_all_pairs(max_distance):
+    generator = random.Random(max_distance)
+    hashes = {}
+    for index in range(400):
+        base = generator.getrandbits(64) if index % 3 == 0 else hashes[f"{index - index % 3}"]
+        flips = sum(1 << bit for bit in generator.sample(range(64), generator.randint(0, 12)))
+        hashes[str(index)] = base ^ flips
+    files = list(hashes)
+    expected = [(a, b, bin(hashes[a] ^ hashes[b]).count("1")) for i, a in enumerate(files) for b in files[i + 1:]
+                if bin(hashes[a] ^ hashes[b]).count("1") <= max_distance]
+    assert find_near_duplicates(files, max_distance, hashes=hashes) == expected
+
+# Test images the converter already decoded are not decoded again for their dHash
+def test_collected_hashes_are_reused(tmp_path, monkeypatch):
+    texture = Image.effect_mandelbrot((64, 64), (-2, -1.5, 1, 1.5), 50).convert("RGB")
+    with dedup.collecting_hashes() as hashes:
+        dedup.record_hash("a.png", texture)
+        dedup.record_hash("b.png", texture.copy())
+    dedup.record_hash("c.png", texture)
+    assert set(hashes) == {"a.png", "b.png"}
+
+    def no_decoding(path):
+        raise AssertionError(f"{path} was decoded again")
+    monkeypatch.setattr(dedup, "dhash", no_decoding)
+    assert find_near_duplicates(["a.png", "b.png"], hashes=hashes) == [("a.png", "b.png", 0)]
@@ -0,0 +1,177 @@
+import json
+import os
+import socket
+import threading
+import time
+import pytest
+import conversion_events
+from conversion_events import report_done, report_error
+import distributed
+from distributed import ProtocolError, create_coordinator_server, run_worker
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+def upper_case_converter(input_path, output_format, output_dir=None):
+    # Stand-in converter: "converts" by upper-casing the bytes
+    started = time.perf_counter()
+    directory = output_dir or os.path.dirname(input_path)
+    output_path = os.path.join(directory, os.path.splitext(os.path.basename(input_path))[0] + "." + output_format)
+    with open(input_path, "rb") as source:
+        data = source.read()
+    if data == b"corrupt":
+        return report_error(input_path, output_format, ValueError, "Error: corrupt input", started)
+    os.makedirs(directory, exist_ok=True)
+    with open(output_path, "wb") as target:
+        target.write(data.upper())
+    return report_done(input_path, output_format, output_path, started, kind="image")
+
+CONVERTERS = {"image": (upper_case_converter, ["up"])}
+
+@pytest.fixture
+def coordinator():
+    servers = []
+
+    def start(jobs, lease_seconds=5.0, max_attempts=3, secret=None):
+        server = create_coordinator_server(jobs, "127.0.0.1", 0, lease_seconds, max_attempts, secret)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.coordinator, server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def make_jobs(tmp_path, payloads, output_dir=None):
+    jobs = []
+    for i, payload in enumerate(payloads):
+        path = tmp_path / f"{i}.txt"
+        path.write_bytes(payload)
+        jobs.append({"kind": "image", "path": str(path), "format": "up", "output_dir": output_dir})
+    return jobs
+
+def start_workers(port, count, **kwargs):
+    counts = []
+    threads = [threading.Thread(target=lambda i=i: counts.append(run_worker("127.0.0.1", port, CONVERTERS, f"w{i}", **kwargs))) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, counts
+
+# Test several workers on localhost share the batch and every result comes back in job order
+def test_workers_convert_whole_batch(tmp_path, coordinator):
+    jobs = make_jobs(tmp_path, [b"a", b"corrupt"] + [b"x%d" % i for i in range(10)], output_dir=str(tmp_path / "out"))
+    state, port = coordinator(jobs)
+
+    threads, counts = start_workers(port, 3)
+    results = state.wait(poll_interval=0.05)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert [r.path for r in results] == [job["path"] for job in jobs]
+    assert [r.event for r in results] == ["done", "error"] + ["done"] * 10
+    assert sum(counts) == 12
+    assert (tmp_path / "out" / "11.up").read_bytes() == b"X9"
+
+def lease_and_vanish(port):
+    # A worker that takes a job and dies without renewing or reporting it.
+    connection = socket.create_connection(("127.0.0.1", port))
+    stream = connection.makefile("rwb")
+    for message in ({"op": "hello", "worker": "doomed"}, {"op": "lease"}):
+        stream.write(json.dumps(message).encode() + b"\n")
+        stream.flush()
+        reply = json.loads(stream.readline())
+    connection.close()
+    return reply["job"]
+
+# Test a dead worker's lease expires and its job is converted by another worker
+def test_expired_lease_is_requeued(tmp_path, coordinator):
+    jobs = make_jobs(tmp_path, [b"one", b"two"])
+    state, port = coordinator(jobs, lease_seconds=0.3)
+    abandoned = lease_and_vanish(port)
+
+    threads, _ = start_workers(port, 1)
+    results = state.wait(poll_interval=0.05)
+    threads[0].join(timeout=5)
+
+    assert all(result.ok for result in results)
+    assert (tmp_path / f"{abandoned['id']}.up").exists()
+
+# Test a job is given up after max_attempts leases expire
+def test_job_abandoned_after_max_attempts(tmp_path, coordinator):
+    jobs = make_jobs(tmp_path, [b"one"])
+    state, port = coordinator(jobs, lease_seconds=0.1, max_attempts=2)
+    lease_and_vanish(port)
+    time.sleep(0.15)
+    lease_and_vanish(port)
+
+    results = state.wait(poll_interval=0.05)
+    assert results[0].error == "LeaseExpired"
+
+# Test long conversions keep their lease by renewing it
+def test_slow_job_keeps_lease(tmp_path, coordinator):
+    jobs = make_jobs(tmp_path, [b"slow"])
+    state, port = coordinator(jobs, lease_seconds=0.3, max_attempts=1)
+    converted = []
+
+    def slow_converter(input_path, output_format, output_dir=None):
+        time.sleep(0.8)
+        converted.append(input_path)
+        return upper_case_converter(input_path, output_format, output_dir)
+
+    run_worker("127.0.0.1", port, {"image": (slow_converter, ["up"])}, "slow")
+    assert state.wait(poll_interval=0.05)[0].ok and len(converted) == 1
+
+# Test workers without the shared secret are refused
+def test_worker_needs_secret(tmp_path, coordinator):
+    _, port = coordinator(make_jobs(tmp_path, [b"one"]), secret="s3cret")
+    with pytest.raises(ProtocolError):
+        run_worker("127.0.0.1", port, CONVERTERS, secret="wrong")
+
+# Test the coordinator only listens beyond loopback when a secret is set
+def test_non_loopback_bind_needs_secret():
+    assert distributed.insecure_bind_reason("127.0.0.1", None) is None
+    assert distributed.insecure_bind_reason("::1", None) is None
+    assert distributed.insecure_bind_reason("0.0.0.0", "s3cret") is None
+    with pytest.raises(ValueError):
+        create_coordinator_server([], "0.0.0.0", 0)
+
+# Test jobs for unknown kinds or unsupported formats come back as error results instead of being dispatched
+def test_worker_rejects_unsupported_jobs(tmp_path, coordinator):
+    jobs = make_jobs(tmp_path, [b"one", b"two", b"three"])
+    jobs[0]["kind"] = "archive"
+    jobs[1]["format"] = "../../etc"
+    state, port = coordinator(jobs)
+    run_worker("127.0.0.1", port, CONVERTERS, "w")
+    results = state.wait(poll_interval=0.05)
+    assert [result.error for result in results] == ["UnsupportedKind", "UnsupportedFormat", None]
+    assert not (tmp_path / "0.up").exists() and (tmp_path / "2.up").read_bytes() == b"THREE"
+
+# Test a malformed reply ends the worker like a dropped connection
+def test_worker_treats_malformed_reply_as_dropped_connection():
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def reply_garbage():
+        connection, _ = listener.accept()
+        with connection:
+            connection.makefile("rb").readline()
+            connection.sendall(b'{"ok": tr\n')
+
+    thread = threading.Thread(target=reply_garbage)
+    thread.start()
+    try:
+        assert run_worker("127.0.0.1", listener.getsockname()[1], CONVERTERS, "w") == 0
+    finally:
+        thread.join()
+        listener.close()
+
+# Test the coordinator's banner is an event, so JSONL output stays parseable
+def test_coordinator_banner_is_a_summary_event(capsys):
+    conversion_events.set_sinks([conversion_events.JsonlSink()])
+    assert distributed.run_coordinator([], port=0, lease_seconds=0.04) == []
+    event = json.loads(capsys.readouterr().out)
+    assert event["event"] == "summary" and event["total"] == 0 and event["message"].startswith("Coordinating 0 job(s) on 127.0.0.1:")
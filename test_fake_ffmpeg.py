@@ -0,0 +1,80 @@
+import json
+import subprocess
+import sys
+import pytest
+import conversion_events
+import fake_ffmpeg
+import frame_pipes
+import main_converter
+import scheduling
+from ffmpeg_async import FFmpegJob, run_ffmpeg_jobs
+from ffmpeg_tools import query_capabilities
+from ffmpeg_watchdog import WatchdogPolicy
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="fake_ffmpeg launchers need a POSIX system")
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+@pytest.fixture
+def tools(tmp_path):
+    return fake_ffmpeg.install(str(tmp_path / "bin"))
+
+def media(path, **settings):
+    path.write_text(json.dumps(settings))
+    return str(path)
+
+def test_behaviour_layers_file_over_environment_over_defaults(tmp_path):
+    path = media(tmp_path / "a.wav", duration=3)
+    settings = fake_ffmpeg.behaviour(path, {"FAKE_FFMPEG_DURATION": "7", "FAKE_FFMPEG_EXIT": "2"})
+    assert settings["duration"] == 3 and settings["exit"] == 2 and settings["codec"] == "aac"
+    (tmp_path / "raw.wav").write_bytes(b"RIFF\0\0")
+    assert fake_ffmpeg.behaviour(str(tmp_path / "raw.wav"), {}) == fake_ffmpeg.DEFAULTS
+
+# Test the converter's own ffprobe queries parse the fake's answers
+def test_probes_understand_the_fake(tools, tmp_path, monkeypatch):
+    ffmpeg_path, ffprobe_path = tools
+    video = media(tmp_path / "clip.mp4", duration=75.5, width=640, height=360, codec=None)
+    monkeypatch.setattr(main_converter, "FFPROBE_PATH", ffprobe_path)
+
+    estimate = scheduling._probe_media(video, "video", ffprobe_path)
+    assert estimate.duration == 75.5 and estimate.size == (640, 360)
+    assert frame_pipes.probe_video_size(ffprobe_path, video) == (640, 360)
+    portrait = media(tmp_path / "portrait.mp4", width=1920, height=1080, rotation=270)
+    assert frame_pipes.probe_video_size(ffprobe_path, portrait) == (1080, 1920)
+    assert main_converter.probe_audio_codec(video) is None
+    assert main_converter.probe_audio_codec(media(tmp_path / "song.mp4", codec="opus")) == "opus"
+    capabilities = query_capabilities(ffmpeg_path)
+    assert capabilities.version == fake_ffmpeg.VERSION and capabilities.unsupported_reason("webm") is None
+
+# Test conversions report progress, fail as told, and corrupt inputs only pass with the watchdog's retry options
+def test_conversion_outcomes(tools, tmp_path):
+    ffmpeg_path, _ = tools
+    def convert(source, *options):
+        return subprocess.run([ffmpeg_path, "-y", *options, "-i", source, str(tmp_path / "out.mp3")], capture_output=True, text=True)
+
+    result = convert(media(tmp_path / "ok.wav", duration=90, progress=3, output=5))
+    assert result.returncode == 0 and "Duration: 00:01:30.00" in result.stderr and "time=00:01:30.00" in result.stderr
+    assert (tmp_path / "out.mp3").read_bytes() == b"\0" * 5
+    assert convert(media(tmp_path / "bad.wav", exit=3)).returncode == 3
+    corrupt = media(tmp_path / "corrupt.wav", corrupt=True)
+    assert convert(corrupt).returncode == 1
+    assert convert(corrupt, "-err_detect", "ignore_err").returncode == 0
+
+# Test a failed attempt's partial output does not stop the retry, and an encoder failure leaves none behind without a retry
+def test_retry_replaces_partial_output(tools, tmp_path):
+    ffmpeg_path, _ = tools
+    jobs = []
+    for name, settings in (("corrupt", {"corrupt": True, "output": 8}), ("broken", {"exit": 1})):
+        source = media(tmp_path / f"{name}.wav", **settings)
+        output = str(tmp_path / f"{name}.mp3")
+        jobs.append(FFmpegJob(source, "mp3", output, [ffmpeg_path, "-i", source, output]))
+    corrupt, broken = run_ffmpeg_jobs(jobs, watchdog=WatchdogPolicy(retries=1, backoff=0.01))
+
+    assert corrupt.event == "done" and jobs[0].attempts == 2 and corrupt.bytes_out == 8
+    assert broken.error == "CalledProcessError" and jobs[1].attempts == 1
+    assert not (tmp_path / "broken.mp3").exists()
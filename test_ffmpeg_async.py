@@ -0,0 +1,168 @@
+import asyncio
+import sys
+import pytest
+import conversion_events
+from ffmpeg_async import AsyncFFmpegRunner, FFmpegJob, run_ffmpeg_jobs
+from ffmpeg_watchdog import WatchdogPolicy
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+def make_job(tmp_path, name, script, timeout=None):
+    input_path = tmp_path / f"{name}.wav"
+    input_path.write_bytes(b"RIFF")
+    output_path = tmp_path / f"{name}.mp3"
+    command = [sys.executable, "-c", script, str(output_path)]
+    return FFmpegJob(str(input_path), "mp3", str(output_path), command, kind="audio", timeout=timeout)
+
+WRITE_OUTPUT = "import sys; open(sys.argv[1], 'wb').write(b'ID3'); print('done'); print('size=1\\r', file=sys.stderr)"
+
+# Test successful jobs report done events with output sizes and streamed lines
+def test_run_ffmpeg_jobs_success(tmp_path):
+    lines = []
+    jobs = [make_job(tmp_path, f"song{i}", WRITE_OUTPUT) for i in range(3)]
+    results = run_ffmpeg_jobs(jobs, max_concurrency=2, on_output=lambda job, stream, line: lines.append((stream, line)))
+    assert [r.event for r in results] == ["done"] * 3
+    assert results[0].bytes_out == 3
+    assert ("stdout", "done") in lines and ("stderr", "size=1") in lines
+
+# Test a non-zero exit code is reported like the synchronous CalledProcessError path
+def test_run_ffmpeg_jobs_failure(tmp_path):
+    job = make_job(tmp_path, "bad", "import sys; print('Invalid data', file=sys.stderr); sys.exit(1)")
+    result, = run_ffmpeg_jobs([job])
+    assert result.error == "CalledProcessError"
+    assert "Invalid data" in result.stderr
+
+# Test a hung child is killed once its per-job timeout elapses
+def test_run_ffmpeg_jobs_timeout(tmp_path):
+    job = make_job(tmp_path, "hang", "import time; time.sleep(30)", timeout=0.5)
+    result, = run_ffmpeg_jobs([job])
+    assert result.error == "TimeoutError"
+    assert result.duration < 10
+
+# Test the semaphore bounds concurrency and a single job can be cancelled
+def test_runner_concurrency_and_cancellation(tmp_path):
+    running = []
+    peak = []
+    runner = AsyncFFmpegRunner(max_concurrency=2)
+    original = runner._run_job
+
+    async def tracking_run_job(job):
+        running.append(job)
+        peak.append(len(running))
+        try:
+            return await original(job)
+        finally:
+            running.remove(job)
+
+    runner._run_job = tracking_run_job
+    slow = "import time, sys; time.sleep(0.3); open(sys.argv[1], 'wb').write(b'x')"
+    jobs = [make_job(tmp_path, f"clip{i}", slow) for i in range(5)]
+    hung = make_job(tmp_path, "hung", "import time; time.sleep(30)")
+
+    async def main():
+        task = asyncio.ensure_future(runner.run(jobs + [hung]))
+        await asyncio.sleep(0.1)
+        hung.cancel()
+        return await task
+
+    results = asyncio.run(main())
+    assert max(peak) <= 2
+    assert [r.event for r in results[:5]] == ["done"] * 5
+    assert results[5].error == "CancelledError"
+
+# Test a job that stops making progress is killed as Stalled and retried with safer options
+def test_stalled_job_is_killed_and_retried(tmp_path):
+    # Like ffmpeg: the output is created up front and, without -y, never overwritten
+    script = ("import os, sys, time\n"
+              "if os.path.exists(sys.argv[-1]):\n"
+              "    sys.exit('Not overwriting - exiting')\n"
+              "output = open(sys.argv[-1], 'wb')\n"
+              "print('size=0kB time=00:00:00.50', file=sys.stderr, flush=True)\n"
+              "if '-err_detect' in sys.argv:\n"
+              "    output.write(b'ok')\n"
+              "else:\n"
+              "    time.sleep(30)\n")
+    job = make_job(tmp_path, "stuck", script)
+    job.command = [sys.executable, "-c", script, "-i", job.input_path, job.output_path]
+    watchdog = WatchdogPolicy(stall_timeout=0.4, retries=1, backoff=0.01)
+
+    result, = run_ffmpeg_jobs([job], watchdog=watchdog)
+    assert result.event == "done" and job.attempts == 2
+    assert result.duration < 10 and (tmp_path / "stuck.mp3").read_bytes() == b"ok"
+    (tmp_path / "stuck.mp3").unlink()
+
+    job.command = [sys.executable, "-c", "import time\nprint('time=00:00:01.00', flush=True)\ntime.sleep(30)", job.output_path]
+    result, = run_ffmpeg_jobs([job], watchdog=watchdog)
+    assert result.error == "Stalled" and "after 2 attempts" in result.message
+    assert not (tmp_path / "stuck.mp3").exists()
+
+# Test deterministic failures and outputs the job did not create are not retried
+def test_failures_that_would_repeat_are_not_retried(tmp_path):
+    watchdog = WatchdogPolicy(stall_timeout=0.4, retries=2, backoff=0.01)
+    encoder = make_job(tmp_path, "encoder", "import sys; sys.exit(\"Unknown encoder 'libfoo'\")")
+    decoder = make_job(tmp_path, "decoder", "import sys; sys.exit('Error while decoding stream #0:0: Invalid data found when processing input')")
+    existing = make_job(tmp_path, "existing", "import time\nprint('time=00:00:01.00', flush=True)\ntime.sleep(30)")
+    (tmp_path / "existing.mp3").write_bytes(b"keep")
+
+    results = run_ffmpeg_jobs([encoder, decoder, existing], watchdog=watchdog)
+    assert [job.attempts for job in (encoder, decoder, existing)] == [1, 3, 1]
+    assert [result.error for result in results] == ["CalledProcessError", "CalledProcessError", "Stalled"]
+    assert (tmp_path / "existing.mp3").read_bytes() == b"keep"
+
+# Test an over-budget job is killed without a retry
+def test_job_over_time_budget_is_not_retried(tmp_path):
+    script = ("import sys, time\n"
+              "print('Duration: 00:00:00.10', file=sys.stderr, flush=True)\n"
+              "for i in range(300):\n"
+              "    print('time=00:00:%05.2f' % (i / 100), file=sys.stderr, flush=True)\n"
+              "    time.sleep(0.1)\n")
+    job = make_job(tmp_path, "slow", script)
+    watchdog = WatchdogPolicy(stall_timeout=5, budget_factor=2, min_budget=0.5, retries=3)
+
+    result, = run_ffmpeg_jobs([job], watchdog=watchdog)
+    assert result.error == "TimeBudgetExceeded" and job.attempts == 1
+    assert result.duration < 10
+
+# Test an autotuner's limit, not max_concurrency, bounds the running processes
+def test_runner_follows_the_autotuner_limit(tmp_path):
+    from autotune import Autotuner
+    tuner = Autotuner(min_workers=1, max_workers=8, initial=2, interval=60, log=lambda message: None)
+    running = []
+    peak = []
+    runner = AsyncFFmpegRunner(max_concurrency=8, autotuner=tuner)
+    original = runner._run_job
+
+    async def tracking_run_job(job):
+        running.append(job)
+        peak.append(len(running))
+        try:
+            return await original(job)
+        finally:
+            running.remove(job)
+
+    runner._run_job = tracking_run_job
+    jobs = [make_job(tmp_path, f"song{i}", WRITE_OUTPUT) for i in range(6)]
+    results = asyncio.run(runner.run(jobs))
+    assert [r.event for r in results] == ["done"] * 6
+    assert max(peak) == 2
+
+# Test an unexpected exception inside a job becomes that job's error event instead of a missing result
+def test_unexpected_exception_becomes_error_event(tmp_path):
+    jobs = [make_job(tmp_path, "fine", WRITE_OUTPUT), make_job(tmp_path, "broken", WRITE_OUTPUT)]
+    runner = AsyncFFmpegRunner(max_concurrency=2)
+    original = runner._attempt
+
+    async def failing_attempt(job, *args):
+        if job is jobs[1]:
+            raise RuntimeError("boom")
+        return await original(job, *args)
+
+    runner._attempt = failing_attempt
+    results = asyncio.run(runner.run(jobs))
+    assert results[0].event == "done"
+    assert results[1].error == "RuntimeError" and "boom" in results[1].message
@@ -0,0 +1,55 @@
+import sys
+import pytest
+import autotune
+import conversion_events
+import ffmpeg_stress
+from conversion_events import ConversionEvent
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="fake_ffmpeg launchers need a POSIX system")
+
+@pytest.fixture(autouse=True)
+def dense_mix(monkeypatch, tmp_path):
+    # Make failures, retries, memory hogs and hangs all show up in a small batch
+    monkeypatch.setattr(ffmpeg_stress, "FAILURE_EVERY", 11)
+    monkeypatch.setattr(ffmpeg_stress, "CORRUPT_EVERY", 7)
+    monkeypatch.setattr(ffmpeg_stress, "MEMORY_EVERY", 13)
+    monkeypatch.setattr(ffmpeg_stress, "HANG_EVERY", 25)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    sinks = conversion_events.get_sinks()
+    yield
+    assert conversion_events.get_sinks() == sinks
+    autotune.configure(False)
+
+def test_job_spec_mix():
+    assert ffmpeg_stress.job_spec(24)[0]["hang"] is True and ffmpeg_stress.job_spec(24)[1] == ("error", "TimeoutError")
+    assert ffmpeg_stress.job_spec(10)[0]["exit"] == 1 and ffmpeg_stress.job_spec(10)[1] == ("error", "CalledProcessError")
+    assert ffmpeg_stress.job_spec(6)[0]["corrupt"] is True and ffmpeg_stress.job_spec(6)[1] == ("done", None)
+    assert ffmpeg_stress.job_spec(12)[0]["memory"] == ffmpeg_stress.MEMORY_MEGABYTES
+
+# Test a concurrent audio batch ends every job as expected, in order, and leaves no children, threads or descriptors behind
+def test_concurrent_audio_batch_passes_all_checks(tmp_path):
+    report = ffmpeg_stress.run(str(tmp_path), 60, "audio", jobs=8, hang_timeout=1.0)
+
+    assert report.failures() == []
+    assert sum(not event.ok for event in report.results) == 7
+    assert sorted(event.error for event in report.results if not event.ok).count("TimeoutError") == 2
+
+# Test the serial video path and the autotuned runner under the same checks
+@pytest.mark.parametrize("kind, jobs, tuned", [("video", 1, False), ("audio", 2, True)])
+def test_serial_and_autotuned_batches(tmp_path, kind, jobs, tuned):
+    autotune.configure(tuned, max_workers=4)
+    report = ffmpeg_stress.run(str(tmp_path), 12, kind, jobs=jobs, hang_timeout=1.0)
+
+    assert report.failures() == []
+    assert report.slots == (4 if tuned else 1)
+
+# Test the report flags missing events, unexpected outcomes, slow batches, starved jobs and leftovers
+def test_report_failures():
+    events = [ConversionEvent("done", path, "mp3") for path in ("a", "b", "c")]
+    expected = {"a": ("done", None), "b": ("done", None), "c": ("error", "TimeoutError")}
+    records = [("start", "c", None), ("start", "b", None), ("start", "a", None), ("done", "a", None), ("done", "b", None)]
+    report = ffmpeg_stress.StressReport(3, 1, 10.0, events, expected, records, 1, {"thread(s)": 2}, 1.0)
+
+    failures = report.failures()
+    assert [failure.split(":")[0] for failure in failures] == ["completeness", "completeness", "throughput", "fairness", "shutdown"]
+    assert report.max_overtake() == 2
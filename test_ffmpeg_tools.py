@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import pytest
+import ffmpeg_tools
+from ffmpeg_tools import Capabilities, ToolNotFoundError, capabilities, find_tool, parse_encoders, parse_muxers, parse_version
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+ A....D pcm_s16le            PCM signed 16-bit little-endian
+"""
+MUXERS = """File formats:
+ D. = Demuxing supported
+ .E = Muxing supported
+ --
+  E adts            ADTS AAC (Advanced Audio Coding)
+ DE matroska,webm   Matroska
+  E mp4             MP4 (MPEG-4 Part 14)
+ D  mov,mp4,m4a     QuickTime / MOV
+ DE wav             WAV / WAVE (Waveform Audio)
+"""
+
+def make_executable(path):
+    path.write_text("#!/bin/sh\n")
+    path.chmod(0o755)
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def fresh_memory():
+    ffmpeg_tools.clear_memory()
+    yield
+    ffmpeg_tools.clear_memory()
+
+# Test an environment override wins over the bundle, and the bundle over the PATH
+def test_find_tool_resolution_order(tmp_path):
+    bundle, on_path = tmp_path / "bundle", tmp_path / "bin"
+    bundle.mkdir()
+    on_path.mkdir()
+    pinned = make_executable(tmp_path / "pinned-ffmpeg")
+    from_path = make_executable(on_path / ffmpeg_tools.executable_name("ffmpeg"))
+    environ = {"PATH": str(on_path)}
+    assert find_tool("ffmpeg", str(bundle), environ) == (from_path, "PATH")
+    bundled = make_executable(bundle / ffmpeg_tools.executable_name("ffmpeg"))
+    assert find_tool("ffmpeg", str(bundle), environ) == (bundled, "bundle")
+    environ["MEDIA_CONVERTER_FFMPEG"] = pinned
+    assert find_tool("ffmpeg", str(bundle), environ) == (pinned, "env")
+
+def test_find_tool_reports_missing_tools(tmp_path):
+    with pytest.raises(ToolNotFoundError, match=r"\$MEDIA_CONVERTER_FFPROBE"):
+        find_tool("ffprobe", str(tmp_path), {"PATH": str(tmp_path)})
+    with pytest.raises(ToolNotFoundError, match="not an executable file"):
+        find_tool("ffprobe", str(tmp_path), {"PATH": "", "MEDIA_CONVERTER_FFPROBE": str(tmp_path / "missing")})
+
+def test_parse_ffmpeg_listings():
+    assert parse_version("ffmpeg version 6.1.1-3ubuntu5 Copyright (c) 2000-2023") == "6.1.1-3ubuntu5"
+    assert parse_encoders(ENCODERS) == ["libx264", "aac", "pcm_s16le"]
+    assert parse_muxers(MUXERS) == ["adts", "matroska", "webm", "mp4", "wav"]
+
+def test_unsupported_reason():
+    found = Capabilities("6.1", parse_encoders(ENCODERS), parse_muxers(MUXERS))
+    assert found.unsupported_reason("mkv") is None and found.unsupported_reason("aac") is None
+    assert "no 'flv' muxer" in found.unsupported_reason("flv")
+    assert "no 'mp3' muxer" in found.unsupported_reason("mp3")
+    found = Capabilities("6.1", ["aac"], ["mp3"])
+    assert "no encoder for mp3 audio" in found.unsupported_reason("mp3")
+    assert found.audio_encoder("aac") == "aac" and found.audio_encoder("mp3") is None
+
+# Test ffmpeg is only queried once per binary, and again after it changes
+def test_capabilities_are_cached_on_disk(tmp_path):
+    ffmpeg = make_executable(tmp_path / "ffmpeg")
+    cache_path = str(tmp_path / "cache" / "capabilities.json")
+    queries = []
+
+    def query(path):
+        queries.append(path)
+        return Capabilities(f"v{len(queries)}", ["aac"], ["adts"])
+
+    assert capabilities(ffmpeg, cache_path, query).version == "v1"
+    assert capabilities(ffmpeg, cache_path, query).version == "v1"
+    ffmpeg_tools.clear_memory()
+    assert capabilities(ffmpeg, cache_path, query).version == "v1"
+    assert len(queries) == 1
+
+    os.utime(ffmpeg, ns=(0, 10 ** 9))
+    ffmpeg_tools.clear_memory()
+    assert capabilities(ffmpeg, cache_path, query).version == "v2"
+    with open(cache_path) as cache:
+        assert [entry["version"] for entry in json.load(cache).values()] == ["v2"]
+
+# Test a binary that is not ffmpeg is only asked once per process and never cached
+def test_capabilities_of_a_non_ffmpeg_binary(tmp_path):
+    fake = tmp_path / "ffmpeg"
+    fake.write_text(f"#!{sys.executable}\nprint('not ffmpeg')\n")
+    fake.chmod(0o755)
+    cache_path = tmp_path / "capabilities.json"
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            capabilities(str(fake), str(cache_path))
+    assert not cache_path.exists()
@@ -0,0 +1,61 @@
+from ffmpeg_watchdog import STALLED, TIME_BUDGET_EXCEEDED, ProgressMonitor, WatchdogPolicy
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def make_monitor(**policy):
+    clock = FakeClock()
+    return ProgressMonitor(WatchdogPolicy(**policy), clock=clock), clock
+
+# Test only an advancing position counts as progress once ffmpeg has reported one
+def test_monitor_detects_stalls():
+    monitor, clock = make_monitor(stall_timeout=10, budget_factor=None)
+    clock.now += 8
+    monitor.observe("Input #0, wav, from 'in.wav':")
+    clock.now += 8
+    assert monitor.verdict() is None
+    monitor.observe("size=  1kB time=00:00:01.50 bitrate= 5.3kbits/s speed=3x")
+    clock.now += 8
+    monitor.observe("size=  1kB time=00:00:01.50 bitrate= 5.3kbits/s speed=0x")
+    assert monitor.verdict() is None
+    clock.now += 3
+    assert monitor.verdict() == STALLED
+    monitor.observe("out_time_us=2000000")
+    assert monitor.verdict() is None and monitor.position == 2.0
+
+def test_monitor_time_budget_follows_the_media_duration():
+    monitor, clock = make_monitor(stall_timeout=None, budget_factor=2, min_budget=5)
+    clock.now += 1000
+    assert monitor.verdict() is None
+    monitor.observe("  Duration: 00:01:00.00, start: 0.000000, bitrate: 1411 kb/s")
+    assert monitor.duration == 60 and monitor.budget == 120
+    assert monitor.verdict() == TIME_BUDGET_EXCEEDED
+
+    short, clock = make_monitor(stall_timeout=None, budget_factor=2, min_budget=5)
+    short.observe("Duration: 00:00:01.00")
+    clock.now += 4
+    assert short.budget == 5 and short.verdict() is None
+
+def test_policy_retries_with_safer_input_options_and_bounded_backoff():
+    policy = WatchdogPolicy(retries=3, backoff=1, max_backoff=3)
+    command = ["ffmpeg", "-i", "in.mp4", "out.mkv"]
+    assert policy.command_for(command, 0) == command
+    first = policy.command_for(command, 1)
+    assert first[first.index("-i") - 2:] == ["-err_detect", "ignore_err", "-i", "in.mp4", "out.mkv"]
+    assert "-threads" in policy.command_for(command, 3)
+    assert policy.command_for(["tool", "out.mkv"], 1) == ["tool", "out.mkv"]
+    assert [policy.backoff_delay(retry) for retry in (1, 2, 3)] == [1, 2, 3]
+
+# Test only stalls and decoding errors are worth another attempt
+def test_policy_retries_only_stalls_and_decoding_errors():
+    policy = WatchdogPolicy()
+    assert policy.budget_factor == 0 and policy.monitor().budget is None
+    assert policy.retryable(STALLED, "")
+    assert policy.retryable(None, "[h264 @ 0x1] Invalid NAL unit size\nError while decoding stream #0:0: Invalid data found when processing input")
+    assert not policy.retryable(None, "Unknown encoder 'libfoo'")
+    assert not policy.retryable(None, "File 'out.mp3' already exists. Overwrite? [y/N] Not overwriting - exiting")
+    assert not policy.retryable(TIME_BUDGET_EXCEEDED, "Error while decoding stream #0:0")
@@ -0,0 +1,36 @@
+import pytest
+from format_sniffing import sniff_bytes, prefilter, normalize_format
+
+@pytest.mark.parametrize("header, expected", [
+    (b"\x89PNG\r\n\x1a\n" + b"\x00" * 8, ("image", "png")),
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", ("image", "jpeg")),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", ("image", "webp")),
+    (b"RIFF\x00\x00\x00\x00WAVEfmt ", ("audio", "wav")),
+    (b"RIFF\x00\x00\x00\x00AVI LIST", ("video", "avi")),
+    (b"\xff\xfb\x90\x64", ("audio", "mp3")),
+    (b"\xff\xf1\x50\x80", ("audio", "aac")),
+    (b"\x00\x00\x00\x20ftypM4A \x00\x00\x00\x00", ("audio", "m4a")),
+    (b"\x00\x00\x00\x20ftypisom\x00\x00\x02\x00", ("video", "mp4")),
+    (b"\x00\x00\x00\x14ftypqt  \x00\x00\x00\x00", ("video", "mov")),
+    (b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\x82\x84webm", ("video", "webm")),
+    (b"hello world", (None, None)),
+])
+def test_sniff_bytes(header, expected):
+    assert sniff_bytes(header) == expected
+
+def test_normalize_format_aliases():
+    assert normalize_format("JPG") == "jpeg"
+    assert normalize_format("tif") == "tiff"
+
+# Test ffmpeg kinds accept unknown and cross-media content but not images
+def test_prefilter_for_audio(tmp_path):
+    (tmp_path / "a.mp3").write_bytes(b"ID3\x03")
+    (tmp_path / "b.wav").write_bytes(b"\x89PNG\r\n\x1a\n")
+    (tmp_path / "c.m4a").write_bytes(b"\x00\x00\x00\x20ftypisom\x00\x00\x02\x00")
+    (tmp_path / "d.wma").write_bytes(b"unknown header")
+    files = [str(tmp_path / name) for name in ("a.mp3", "b.wav", "c.m4a", "d.wma", "missing.ogg")]
+    accepted, rejected = prefilter(files, "audio", "mp3")
+    assert accepted == [(files[2], "mp4"), (files[3], None)]
+    assert [path for path, _ in rejected] == [files[0], files[1], files[4]]
+    accepted, _ = prefilter(files[:1], "audio", "mp3", force=True)
+    assert accepted == [(files[0], "mp3")]
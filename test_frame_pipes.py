@@ -0,0 +1,153 @@
+import os
+import stat
+import sys
+import pytest
+from PIL import Image
+import conversion_events
+from frame_pipes import encode_image_sequence, extract_frames, extraction_command, natural_sort_key
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+# Stand-in for ffmpeg: reads raw rgb24 frames from stdin and writes the first pixel of each frame to the output file.
+FAKE_ENCODER = """
+import sys
+args = sys.argv[1:]
+width, height = map(int, args[args.index("-s") + 1].split("x"))
+frame_size = width * height * 3
+data = sys.stdin.buffer.read()
+if len(data) % frame_size:
+    sys.stderr.write("truncated frame\\n")
+    sys.exit(1)
+with open(args[-1], "wb") as output:
+    for offset in range(0, len(data), frame_size):
+        output.write(data[offset:offset + 3])
+sys.stderr.write("frames=%d\\n" % (len(data) // frame_size))
+"""
+
+def write_tool(tmp_path, name, source):
+    path = tmp_path / name
+    path.write_text(f"#!{sys.executable}\n{source}")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+def write_frames(directory, count, size=(5, 3)):
+    directory.mkdir()
+    paths = []
+    for i in range(count):
+        path = directory / f"frame_{i}.png"
+        Image.new("RGB" if i % 2 else "P", size, (i, 0, 0) if i % 2 else i).save(path)
+        paths.append(str(path))
+    return paths
+
+def test_natural_sort_key():
+    names = ["f10.png", "f2.png", "F1.png"]
+    assert sorted(names, key=natural_sort_key) == ["F1.png", "f2.png", "f10.png"]
+
+# Test frames reach ffmpeg complete and in order, whatever order the workers finish in
+def test_encode_image_sequence_pipes_frames_in_order(tmp_path):
+    ffmpeg = write_tool(tmp_path, "ffmpeg", FAKE_ENCODER)
+    frames = write_frames(tmp_path / "frames", 12)
+    output_path = str(tmp_path / "clip.mp4")
+
+    result = encode_image_sequence(frames, output_path, ffmpeg, workers=4, reorder_window=3)
+
+    assert result.ok, result.message
+    with open(output_path, "rb") as output:
+        data = output.read()
+    palette_red = [Image.open(frame).convert("RGB").getpixel((0, 0))[0] for frame in frames]
+    assert list(data[::3]) == palette_red
+    assert "frames=12" in result.stderr
+
+def test_encode_image_sequence_rejects_mismatched_frames(tmp_path):
+    ffmpeg = write_tool(tmp_path, "ffmpeg", FAKE_ENCODER)
+    frames = write_frames(tmp_path / "frames", 3)
+    Image.new("RGB", (6, 6)).save(frames[1])
+
+    result = encode_image_sequence(frames, str(tmp_path / "clip.mp4"), ffmpeg, workers=2)
+    assert result.error == "ValueError" and "6x6" in result.message
+
+# Test an ffmpeg that exits early is reported with its stderr instead of hanging the writer
+def test_encode_image_sequence_reports_ffmpeg_failure(tmp_path):
+    ffmpeg = write_tool(tmp_path, "ffmpeg", "import sys; sys.stderr.write('Unknown encoder\\n'); sys.exit(1)")
+    frames = write_frames(tmp_path / "frames", 40, size=(200, 200))
+
+    result = encode_image_sequence(frames, str(tmp_path / "clip.mp4"), ffmpeg, workers=2)
+    assert result.error in ("BrokenPipeError", "CalledProcessError")
+    assert "Unknown encoder" in result.stderr
+
+def test_encode_image_sequence_without_frames():
+    assert encode_image_sequence([], "clip.mp4", "ffmpeg").error == "FileNotFoundError"
+
+# Stand-ins for ffprobe and a decoding ffmpeg: frames are 4x2, frame i filled with the value i.
+FAKE_PROBE = "print('{\"streams\": [{\"width\": 4, \"height\": 2}]}')"
+FAKE_DECODER = """
+import sys
+for i in range(int(open(sys.argv[sys.argv.index("-i") + 1]).read())):
+    sys.stdout.buffer.write(bytes([i]) * 24)
+"""
+
+def save_png(image, path):
+    image.save(path, format="PNG")
+
+def test_extract_frames_writes_every_frame(tmp_path):
+    ffmpeg = write_tool(tmp_path, "ffmpeg", FAKE_DECODER)
+    ffprobe = write_tool(tmp_path, "ffprobe", FAKE_PROBE)
+    video = tmp_path / "clip.mp4"
+    video.write_text("7")
+    frames_dir = tmp_path / "clip_frames"
+
+    result = extract_frames(str(video), str(frames_dir), "png", save_png, ffmpeg, ffprobe, workers=3, max_pending=2)
+
+    assert result.ok, result.message
+    names = sorted(os.listdir(frames_dir))
+    assert names == [f"clip_{i:06d}.png" for i in range(7)]
+    for i, name in enumerate(names):
+        with Image.open(frames_dir / name) as frame:
+            assert frame.size == (4, 2) and frame.getpixel((3, 1)) == (i, i, i)
+    assert result.bytes_out == sum(os.path.getsize(frames_dir / name) for name in names)
+
+# Test a video stored 2x4 with a 90 degree rotation tag is read as the 4x2 frames ffmpeg decodes from it
+def test_extract_frames_follows_rotation_metadata(tmp_path):
+    ffmpeg = write_tool(tmp_path, "ffmpeg", "import sys; sys.stdout.buffer.write(bytes([1]) * 12 + bytes([2]) * 12)")
+    ffprobe = write_tool(tmp_path, "ffprobe", "print('{\"streams\": [{\"width\": 2, \"height\": 4, \"tags\": {\"rotate\": \"90\"}}]}')")
+    video = tmp_path / "portrait.mp4"
+    video.write_text("")
+
+    result = extract_frames(str(video), str(tmp_path / "out"), "png", save_png, ffmpeg, ffprobe)
+
+    assert result.ok, result.message
+    with Image.open(tmp_path / "out" / "portrait_000000.png") as frame:
+        assert frame.size == (4, 2) and frame.getpixel((3, 0)) == (1, 1, 1) and frame.getpixel((0, 1)) == (2, 2, 2)
+
+def test_extract_frames_reports_encoder_and_empty_selection_errors(tmp_path):
+    ffmpeg = write_tool(tmp_path, "ffmpeg", FAKE_DECODER)
+    ffprobe = write_tool(tmp_path, "ffprobe", FAKE_PROBE)
+    video = tmp_path / "clip.mp4"
+    video.write_text("0")
+    assert extract_frames(str(video), str(tmp_path / "out"), "png", save_png, ffmpeg, ffprobe).error == "NoFramesSelected"
+
+    video.write_text("3")
+    def failing(image, path):
+        raise OSError("disk full")
+    assert extract_frames(str(video), str(tmp_path / "out"), "png", failing, ffmpeg, ffprobe, workers=1).error == "OSError"
+
+def test_extract_frames_reports_unreadable_video(tmp_path):
+    ffprobe = write_tool(tmp_path, "ffprobe", "import sys; sys.stderr.write('Invalid data\\n'); sys.exit(1)")
+    video = tmp_path / "clip.mp4"
+    video.write_text("")
+
+    result = extract_frames(str(video), str(tmp_path / "out"), "png", save_png, "ffmpeg", ffprobe)
+    assert result.error == "CalledProcessError" and "Invalid data" in result.stderr
+
+def test_extraction_command_only_decodes_requested_frames():
+    command = extraction_command("ffmpeg", "in.mp4", start=5, end=65, frame_step=10, scene_threshold=0.3, keyframes_only=True)
+    assert command.index("-skip_frame") < command.index("-ss") < command.index("-i")
+    assert command[command.index("-t") + 1] == "60"
+    assert command[command.index("-vf") + 1] == "select='not(mod(n\\,10))*gt(scene\\,0.3)'"
+    assert "vfr" in command and command[-4:] == ["rawvideo", "-pix_fmt", "rgb24", "-"]
+    assert "-vf" not in extraction_command("ffmpeg", "in.mp4")
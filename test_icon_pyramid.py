@@ -0,0 +1,48 @@
+import io
+import pytest
+from PIL import Image
+import icon_pyramid
+from icon_pyramid import build_pyramid, parse_sizes, save_ico
+
+def test_parse_sizes():
+    assert parse_sizes("48, 16,32,16") == (16, 32, 48)
+    for bad in ("0", "300", "big", ""):
+        with pytest.raises(ValueError):
+            parse_sizes(bad)
+
+# Test each level is resized from the previous one, not from the full image
+def test_pyramid_downscales_successively(monkeypatch):
+    source = Image.new("RGB", (1000, 1000), "red")
+    resized_from = []
+    original_resize = Image.Image.resize
+
+    def recording_resize(self, size, *args, **kwargs):
+        resized_from.append(self.size)
+        return original_resize(self, size, *args, **kwargs)
+
+    monkeypatch.setattr(Image.Image, "resize", recording_resize)
+    levels = build_pyramid(source, [16, 64, 256])
+
+    assert [level.size for level in levels] == [(256, 256), (64, 64), (16, 16)]
+    assert list(dict.fromkeys(resized_from)) == [(1000, 1000), (256, 256), (64, 64)]
+    assert all(level.mode == "RGBA" for level in levels)
+
+def test_pyramid_pads_non_square_and_skips_upscaling():
+    levels = build_pyramid(Image.new("RGB", (100, 50), "blue"), [16, 64, 256])
+    assert [level.size for level in levels] == [(64, 64), (16, 16)]
+    assert levels[0].getpixel((0, 0))[3] == 0 and levels[0].getpixel((32, 32)) == (0, 0, 255, 255)
+    assert [level.size for level in build_pyramid(Image.new("L", (8, 8)), [16, 32])] == [(16, 16)]
+
+# Test a JPEG source is decoded in draft mode and the ICO holds every configured size
+def test_save_ico_from_jpeg_uses_draft(tmp_path):
+    source = io.BytesIO()
+    Image.new("RGB", (2048, 1536), "green").save(source, format="JPEG")
+    icon_pyramid.configure((16, 32, 128))
+    try:
+        with Image.open(source) as image:
+            save_ico(image, tmp_path / "icon.ico")
+            assert image.size == (256, 192)
+    finally:
+        icon_pyramid.configure()
+    with Image.open(tmp_path / "icon.ico") as icon:
+        assert sorted(icon.info["sizes"]) == [(16, 16), (32, 32), (128, 128)]
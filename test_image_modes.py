@@ -0,0 +1,63 @@
+import io
+import pytest
+from PIL import Image
+import image_modes
+from image_modes import TARGET_MODES, normalize_mode, reduce_bit_depth, _reduce_bit_depth_with_pillow
+
+SOURCE_MODES = ["1", "L", "LA", "P", "PA", "RGB", "RGBA", "RGBa", "La", "CMYK", "YCbCr", "I", "I;16", "I;16B", "F"]
+
+@pytest.fixture(autouse=True)
+def default_background():
+    yield
+    image_modes.configure()
+
+# Test every source mode ends up in a mode each target accepts and saves cleanly
+@pytest.mark.parametrize("output_format", sorted(TARGET_MODES))
+def test_normalized_images_save(output_format):
+    pillow_format = {"jpg": "JPEG", "jpeg": "JPEG"}.get(output_format, output_format.upper())
+    for mode in SOURCE_MODES:
+        normalized = normalize_mode(Image.new(mode, (8, 8)), output_format)
+        assert normalized.mode in TARGET_MODES[output_format], mode
+        normalized.save(io.BytesIO(), format=pillow_format)
+
+def test_accepted_modes_are_untouched():
+    image = Image.new("RGBA", (2, 2))
+    assert normalize_mode(image, "png") is image
+
+def test_alpha_is_flattened_onto_configured_background():
+    image = Image.new("RGBA", (2, 2), (255, 0, 0, 0))
+    image.putpixel((1, 1), (255, 0, 0, 255))
+    image_modes.configure("#00ff00")
+    flattened = normalize_mode(image, "jpeg")
+    assert flattened.mode == "RGB"
+    assert flattened.getpixel((0, 0)) == (0, 255, 0) and flattened.getpixel((1, 1)) == (255, 0, 0)
+    assert normalize_mode(Image.new("LA", (1, 1), (10, 0)), "jpeg", background="white").getpixel((0, 0)) == 255
+
+def test_palette_transparency_survives_until_flattened():
+    image = Image.new("P", (1, 1), 1)
+    image.info["transparency"] = 1
+    assert normalize_mode(image, "gif") is image
+    assert normalize_mode(image, "jpeg", background="black").getpixel((0, 0)) == (0, 0, 0)
+
+def test_configure_rejects_unknown_colour():
+    with pytest.raises(ValueError):
+        image_modes.configure("not-a-colour")
+
+# Test NumPy and Pillow-only bit-depth reduction agree
+@pytest.mark.parametrize("mode, value, expected", [("I;16", 0xABCD, 0xAB), ("I;16B", 0x1234, 0x12), ("I", 70000, 255), ("I", -5, 0), ("F", 0.5, 127), ("F", 1000.0, 3)])
+def test_reduce_bit_depth(mode, value, expected):
+    image = Image.new(mode, (3, 2), value)
+    for reduce in (reduce_bit_depth, _reduce_bit_depth_with_pillow):
+        reduced = reduce(image)
+        assert reduced.mode == "L" and reduced.size == (3, 2)
+        assert abs(reduced.getpixel((2, 1)) - expected) <= 1
+
+# Test block-wise scaling matches scaling the whole image at once, across block boundaries
+@pytest.mark.parametrize("mode, scale", [("I", 1 / 256), ("F", 1 / 256)])
+def test_reduce_bit_depth_in_blocks(monkeypatch, mode, scale):
+    numpy = pytest.importorskip("numpy")
+    pixels = numpy.arange(7 * 5, dtype=numpy.int32 if mode == "I" else numpy.float32).reshape(5, 7) * 2000 - 3000
+    image = Image.fromarray(pixels, mode)
+    expected = numpy.clip(pixels * scale if mode == "F" else pixels >> 8, 0, 255).astype(numpy.uint8)
+    monkeypatch.setattr(image_modes, "REDUCE_BLOCK_PIXELS", 14)
+    assert numpy.array_equal(numpy.asarray(reduce_bit_depth(image)), expected)
@@ -0,0 +1,65 @@
+import time
+import pytest
+import conversion_events
+import io_pipeline
+from conversion_events import report_error
+from io_pipeline import ByteBudget, run_pipeline
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+def upper_case(input_path, data, output_format, output):
+    if data == b"bad":
+        raise ValueError("cannot decode")
+    output.write(data.upper())
+
+def report_failure(e, input_path, output_format, output_path, started, bytes_in):
+    return report_error(input_path, output_format, e, f"Error: {e}", started, output_path=output_path, bytes_in=bytes_in)
+
+def test_byte_budget_admits_oversized_item_only_when_empty():
+    budget = ByteBudget(10)
+    assert budget.try_acquire(8)
+    assert not budget.try_acquire(8, force=True)
+    budget.release(8)
+    assert budget.try_acquire(50, force=True)
+    assert budget.used == 50
+
+# Test results come back in job order, failures included, with outputs written to a different directory
+def test_run_pipeline_writes_outputs_in_order(tmp_path):
+    source = tmp_path / "in"
+    source.mkdir()
+    jobs = []
+    for i, payload in enumerate([b"one", b"bad", b"three", b"four"]):
+        (source / f"{i}.txt").write_bytes(payload)
+        jobs.append((str(source / f"{i}.txt"), str(tmp_path / "out" / f"{i}.up"), "up"))
+    jobs.append((str(source / "missing.txt"), str(tmp_path / "out" / "missing.up"), "up"))
+
+    results = run_pipeline(jobs, upper_case, report_failure, io_threads=2, prefetch_bytes=4, write_behind_bytes=4)
+
+    assert [r.event for r in results] == ["done", "error", "done", "done", "error"]
+    assert results[1].error == "ValueError" and results[4].error == "FileNotFoundError"
+    assert (tmp_path / "out" / "2.up").read_bytes() == b"THREE"
+    assert results[3].bytes_in == 4 and results[3].bytes_out == 4
+
+# Test the read-ahead stage never holds more than the byte budget (plus one forced item)
+def test_read_ahead_respects_budget(tmp_path, monkeypatch):
+    peak = []
+    jobs = []
+    for i in range(12):
+        (tmp_path / f"{i}.bin").write_bytes(b"x" * 100)
+        jobs.append((str(tmp_path / f"{i}.bin"), str(tmp_path / f"{i}.out"), "out"))
+
+    original = io_pipeline.ByteBudget.try_acquire
+
+    def tracking_try_acquire(self, amount, force=False):
+        admitted = original(self, amount, force)
+        peak.append(self.used)
+        return admitted
+
+    monkeypatch.setattr(io_pipeline.ByteBudget, "try_acquire", tracking_try_acquire)
+    run_pipeline(jobs, lambda path, data, fmt, output: (time.sleep(0.01), output.write(data)), report_failure, prefetch_bytes=300)
+    assert max(peak) <= 300
@@ -0,0 +1,393 @@
+import io
+import json
+import os
+import pytest
+from unittest.mock import patch, MagicMock
+from PIL import UnidentifiedImageError
+import conversion_events
+import main_converter
+from main_converter import convert_image, run_conversion_logic_image
+
+@pytest.fixture(autouse=True)
+def unknown_ffmpeg_capabilities(monkeypatch):
+    # The fake ffmpeg scripts used here cannot answer -version/-encoders/-muxers.
+    monkeypatch.setattr(main_converter, "_ffmpeg_capabilities", lambda: None)
+
+@pytest.fixture(autouse=True)
+def text_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([conversion_events.TextSink()])
+    yield
+    conversion_events.set_sinks(sinks)
+
+# Test successful conversion renders the success message and returns a done event
+def test_convert_image_success():
+    mock_image = MagicMock()
+    mock_image.mode = "RGB"
+    mock_image.save.return_value = None
+
+    with patch('os.path.exists', return_value=True), patch('os.path.getsize', return_value=42):
+        with patch('main_converter.Image.open', return_value=mock_image):
+            with patch('builtins.print') as mock_print:
+                input_path = os.path.join("path", "to", "test.png")
+                event = convert_image(input_path, "jpeg")
+                output_path = os.path.join("path", "to", "test.jpeg")
+                mock_image.save.assert_called_once_with(output_path, format="JPEG")
+                mock_print.assert_called_once_with(f"Success! Converted '{input_path}' to '{output_path}'.")
+                assert event.ok and event.bytes_in == 42 and event.bytes_out == 42
+
+# Test UnidentifiedImageError is reported as an error event
+def test_convert_image_unidentified_image_error():
+    with patch('os.path.exists', return_value=True), patch('os.path.getsize', return_value=1):
+        with patch('main_converter.Image.open', side_effect=UnidentifiedImageError):
+            with patch('builtins.print') as mock_print:
+                input_path = "/path/to/corrupt.txt"
+                event = convert_image(input_path, "png")
+                mock_print.assert_called_once_with(f"Error: Could not identify image file '{input_path}'. It might be corrupt or an unsupported format.")
+                assert event.error == "UnidentifiedImageError"
+
+# Test a directory batch emits start/progress/done events as JSONL
+def test_run_conversion_logic_image_jsonl(tmp_path):
+    from PIL import Image
+    Image.new("RGB", (4, 4)).save(tmp_path / "a.png")
+    Image.new("RGB", (4, 4)).save(tmp_path / "b.bmp")
+    stream = io.StringIO()
+    conversion_events.set_sinks([conversion_events.JsonlSink(stream)])
+    results = run_conversion_logic_image(str(tmp_path), "gif", False)
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert all(result.ok for result in results)
+    assert [r["event"] for r in records].count("done") == 2
+    assert records[-1]["event"] == "progress" and records[-1]["completed"] == 2 and records[-1]["total"] == 2
+    assert (tmp_path / "a.gif").exists()
+
+# Test the pipelined image batch writes into --output-dir, mirroring subdirectories
+def test_run_conversion_logic_image_pipeline_with_output_dir(tmp_path):
+    from PIL import Image
+    source = tmp_path / "photos"
+    (source / "2024").mkdir(parents=True)
+    Image.new("RGB", (8, 8), "red").save(source / "a.png")
+    Image.new("RGB", (8, 8), "blue").save(source / "2024" / "b.bmp")
+    output_dir = tmp_path / "converted"
+    conversion_events.set_sinks([])
+
+    results = run_conversion_logic_image(str(source), "png", True, output_dir=str(output_dir), pipeline=True, force=True)
+
+    by_name = {os.path.basename(r.path): r for r in results}
+    assert by_name["a.png"].ok and by_name["b.bmp"].ok
+    assert Image.open(output_dir / "2024" / "b.png").getpixel((0, 0)) == (0, 0, 255)
+    assert (output_dir / "a.png").exists()
+    assert not (source / "2024" / "b.png").exists()
+
+# Test the process pipeline flattens alpha onto the configured background in its worker processes
+def test_run_conversion_logic_image_process_pipeline(tmp_path):
+    from PIL import Image
+    import image_modes
+    Image.new("RGBA", (8, 8), (0, 0, 0, 0)).save(tmp_path / "clear.png")
+    Image.new("RGB", (8, 8), "blue").save(tmp_path / "blue.png")
+    conversion_events.set_sinks([])
+    image_modes.configure("#ff0000")
+    try:
+        results = run_conversion_logic_image(str(tmp_path), "jpeg", False, output_dir=str(tmp_path / "out"), processes=(1, 1, 1))
+    finally:
+        image_modes.configure()
+
+    assert all(result.ok for result in results) and len(results) == 2
+    assert Image.open(tmp_path / "out" / "clear.jpeg").getpixel((4, 4))[0] > 240
+    assert Image.open(tmp_path / "out" / "blue.jpeg").getpixel((4, 4))[2] > 240
+
+# Test image conversions are measured and ranked when memory profiling is on
+def test_run_conversion_logic_image_memory_profile(tmp_path):
+    from PIL import Image
+    import memory_profile
+    Image.new("RGB", (400, 300)).save(tmp_path / "big.png")
+    Image.new("L", (10, 10)).save(tmp_path / "small.png")
+    conversion_events.set_sinks([])
+    memory_profile.configure(True)
+    try:
+        run_conversion_logic_image(str(tmp_path), "bmp", False)
+        worst = memory_profile.describe_worst(top=1)
+    finally:
+        memory_profile.configure(False)
+
+    assert "big.png (image -> bmp;" in worst and "decoded 0.5 MiB" in worst and "small.png" not in worst
+
+# Test mislabeled and already-converted files are skipped by the prefilter and summarized
+def test_run_conversion_logic_image_prefilter(tmp_path):
+    from PIL import Image
+    Image.new("RGB", (4, 4)).save(tmp_path / "real.png")
+    Image.new("RGB", (4, 4)).save(tmp_path / "actually_jpeg.png", format="JPEG")
+    (tmp_path / "song.gif").write_bytes(b"ID3\x03\x00" + b"\x00" * 32)
+    (tmp_path / "notes.bmp").write_bytes(b"hello world")
+
+    with patch('main_converter.Image.open', wraps=Image.open) as mock_open:
+        with patch('builtins.print') as mock_print:
+            results = run_conversion_logic_image(str(tmp_path), "png", False)
+
+    assert [os.path.basename(r.path) for r in results] == ["actually_jpeg.png"]
+    assert results[0].ok
+    mock_open.assert_called_once_with(os.path.join(str(tmp_path), "actually_jpeg.png"), formats=["JPEG"])
+    summary = mock_print.call_args_list[-1][0][0]
+    assert summary.startswith("Skipped 3 file(s)")
+    assert "already png" in summary and "content is audio (mp3), not image" in summary and "not a recognized image format" in summary
+
+# Test duplicates are converted once and the output is reused for the copies
+def test_run_conversion_logic_image_dedup(tmp_path):
+    from PIL import Image
+    (tmp_path / "2023").mkdir()
+    Image.new("RGB", (4, 4), "green").save(tmp_path / "a.png")
+    (tmp_path / "2023" / "copy_of_a.png").write_bytes((tmp_path / "a.png").read_bytes())
+    Image.new("RGB", (4, 4), "red").save(tmp_path / "b.png")
+    conversion_events.set_sinks([])
+
+    with patch('main_converter.convert_image', wraps=convert_image) as mock_convert:
+        results = run_conversion_logic_image(str(tmp_path), "bmp", True, deduplicate=True, link_mode="copy")
+
+    assert sorted(os.path.basename(call.args[0]) for call in mock_convert.call_args_list) == ["a.png", "b.png"]
+    assert all(result.ok for result in results) and len(results) == 3
+    assert (tmp_path / "2023" / "copy_of_a.bmp").read_bytes() == (tmp_path / "a.bmp").read_bytes()
+
+# Test a zip of images is converted into a sibling zip without extracting it
+def test_run_conversion_logic_image_zip_input(tmp_path):
+    import zipfile
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), "blue").save(buffer, format="PNG")
+    with zipfile.ZipFile(tmp_path / "photos.zip", "w") as archive:
+        archive.writestr("2023/blue.png", buffer.getvalue())
+        archive.writestr("broken.png", b"\x89PNG\r\n\x1a\n" + b"\x00" * 16)
+    conversion_events.set_sinks([])
+
+    results = run_conversion_logic_image(str(tmp_path / "photos.zip"), "bmp", False, workers=2)
+
+    assert [r.event for r in results] == ["done", "error"]
+    with zipfile.ZipFile(tmp_path / "photos_bmp.zip") as archive:
+        assert archive.namelist() == ["2023/blue.bmp"]
+        assert archive.read("2023/blue.bmp").startswith(b"BM")
+
+# Test an unreadable archive is reported as a single error
+def test_run_conversion_logic_image_corrupt_archive(tmp_path):
+    (tmp_path / "bad.zip").write_bytes(b"not a zip")
+    conversion_events.set_sinks([])
+    results = run_conversion_logic_image(str(tmp_path / "bad.zip"), "png", False)
+    assert len(results) == 1 and results[0].error == "BadZipFile"
+
+# Test registering twice writes nothing the second time and unregistering cleans up old menus too
+def test_register_context_menu_is_incremental():
+    from registry_state import MemoryBackend
+    backend = MemoryBackend()
+    old_key = main_converter._context_menu_key(main_converter.IMAGE_FILE_TYPE, main_converter.OLD_IMAGE_MENU_NAME)
+    backend.create_key(old_key + r"\shell\PNG\command")
+    with patch('main_converter.is_admin', return_value=True), patch('builtins.print') as mock_print:
+        main_converter.register_context_menu(backend)
+        assert main_converter.check_if_entries_exist(backend)
+        writes = backend.writes
+        main_converter.register_context_menu(backend)
+        assert backend.writes == writes
+        mock_print.assert_called_with("Context menu entries are already up to date.")
+
+        main_converter.unregister_context_menu(backend)
+        assert not main_converter.check_if_entries_exist(backend) and not backend.key_exists(old_key)
+        main_converter.unregister_context_menu(backend)
+        mock_print.assert_called_with("No context menu entries were found.")
+
+# Test images the target cannot store as is (alpha to JPEG, 16-bit to WEBP) are normalized instead of failing
+def test_convert_image_normalizes_modes(tmp_path):
+    from PIL import Image
+    Image.new("RGBA", (4, 4), (0, 0, 255, 0)).save(tmp_path / "clear.png")
+    Image.new("I;16", (4, 4), 0x8000).save(tmp_path / "deep.tiff")
+    conversion_events.set_sinks([])
+
+    assert convert_image(str(tmp_path / "clear.png"), "jpeg").ok
+    assert convert_image(str(tmp_path / "deep.tiff"), "webp").ok
+    with Image.open(tmp_path / "clear.jpeg") as flattened:
+        assert flattened.mode == "RGB" and min(flattened.getpixel((0, 0))) > 250
+    with Image.open(tmp_path / "deep.webp") as reduced:
+        assert abs(reduced.convert("L").getpixel((0, 0)) - 128) <= 2
+
+# Test a directory of frames is encoded into a video named after the directory
+def test_run_image_sequence_to_video(tmp_path):
+    import stat, sys
+    from PIL import Image
+    fake_ffmpeg = tmp_path / "ffmpeg"
+    fake_ffmpeg.write_text(f"#!{sys.executable}\nimport sys\nopen(sys.argv[-1], 'wb').write(sys.stdin.buffer.read())\n")
+    fake_ffmpeg.chmod(fake_ffmpeg.stat().st_mode | stat.S_IEXEC)
+    (tmp_path / "shot").mkdir()
+    for i in (10, 2, 1):
+        Image.new("RGB", (2, 1), (i, i, i)).save(tmp_path / "shot" / f"f{i}.png")
+    conversion_events.set_sinks([])
+
+    with patch('main_converter.FFMPEG_PATH', str(fake_ffmpeg)):
+        result = main_converter.run_image_sequence_to_video(str(tmp_path / "shot"), "mp4", str(tmp_path / "out"), workers=2)
+
+    assert result.ok and result.output_path == str(tmp_path / "out" / "shot.mp4")
+    assert (tmp_path / "out" / "shot.mp4").read_bytes() == bytes([1] * 6 + [2] * 6 + [10] * 6)
+
+def test_run_video_to_frames(tmp_path):
+    import stat, sys
+    from PIL import Image
+    for name, source in (("ffprobe", "print('{\"streams\": [{\"width\": 2, \"height\": 1}]}')"), ("ffmpeg", "import sys\nsys.stdout.buffer.write(bytes(range(12)))\n")):
+        tool = tmp_path / name
+        tool.write_text(f"#!{sys.executable}\n{source}")
+        tool.chmod(tool.stat().st_mode | stat.S_IEXEC)
+    video = tmp_path / "movie.mp4"
+    video.write_bytes(b"\x00\x00\x00\x18ftypisom" + bytes(20))
+    conversion_events.set_sinks([])
+
+    with patch('main_converter.FFMPEG_PATH', str(tmp_path / "ffmpeg")), patch('main_converter.FFPROBE_PATH', str(tmp_path / "ffprobe")):
+        results = main_converter.run_video_to_frames(str(video), "jpeg", False, str(tmp_path / "out"), workers=2)
+
+    assert [result.ok for result in results] == [True]
+    assert sorted(os.listdir(tmp_path / "out" / "movie_frames")) == ["movie_000000.jpeg", "movie_000001.jpeg"]
+    with Image.open(tmp_path / "out" / "movie_frames" / "movie_000001.jpeg") as frame:
+        assert frame.format == "JPEG" and frame.size == (2, 1)
+
+def test_run_audio_analysis_converts_from_the_same_decode(tmp_path):
+    import stat, sys
+    fake_ffmpeg = tmp_path / "ffmpeg"
+    fake_ffmpeg.write_text(f"#!{sys.executable}\nimport sys\nconversion = sys.argv[sys.argv.index('-i') + 2]\n"
+                           "if not conversion.startswith('-'):\n    open(conversion, 'w').write('ogg')\n"
+                           "sys.stdout.buffer.write(bytes(range(256)) * 64)\n")
+    fake_ffmpeg.chmod(fake_ffmpeg.stat().st_mode | stat.S_IEXEC)
+    (tmp_path / "album").mkdir()
+    (tmp_path / "album" / "track.wav").write_bytes(b"\x00" * 16)
+    conversion_events.set_sinks([])
+
+    with patch('main_converter.FFMPEG_PATH', str(fake_ffmpeg)):
+        results = main_converter.run_audio_analysis(str(tmp_path / "album"), "ogg", False, str(tmp_path / "out"))
+
+    assert [result.ok for result in results] == [True]
+    assert sorted(os.listdir(tmp_path / "out")) == ["track.ogg", "track_spectrogram.png", "track_waveform.png"]
+
+    # A file already in the target format is analyzed without being converted
+    (tmp_path / "album" / "track.wav").unlink()
+    (tmp_path / "album" / "song.ogg").write_bytes(b"OggS" + b"\x00" * 28)
+    with patch('main_converter.FFMPEG_PATH', str(fake_ffmpeg)), patch('main_converter.analyze_audio', wraps=main_converter.analyze_audio) as analyze:
+        results = main_converter.run_audio_analysis(str(tmp_path / "album"), "ogg", False, str(tmp_path / "out"))
+
+    assert [result.ok for result in results] == [True] and analyze.call_args.args[1] is None
+    assert "song_waveform.png" in os.listdir(tmp_path / "out") and "song.ogg" not in os.listdir(tmp_path / "out")
+
+def _write_extraction_tools(tmp_path):
+    import stat, sys
+    # ffprobe reports the codec named in the file; ffmpeg writes its arguments to the output file.
+    tools = {"ffprobe": "import sys\nprint(open(sys.argv[-1]).read())\n",
+             "ffmpeg": "import sys, json\nopen(sys.argv[-1], 'w').write(json.dumps(sys.argv[1:-1]))\n"}
+    for name, source in tools.items():
+        tool = tmp_path / name
+        tool.write_text(f"#!{sys.executable}\n{source}")
+        tool.chmod(tool.stat().st_mode | stat.S_IEXEC)
+    return patch('main_converter.FFMPEG_PATH', str(tmp_path / "ffmpeg")), patch('main_converter.FFPROBE_PATH', str(tmp_path / "ffprobe"))
+
+@pytest.mark.parametrize("codec, requested, expected_format, copied", [
+    ("aac", None, "aac", True),
+    ("opus", None, "ogg", True),
+    ("ac3", None, "mp3", False),
+    ("flac", "flac", "flac", True),
+    ("aac", "mp3", "mp3", False),
+])
+def test_extract_audio_copies_the_stream_when_the_container_allows(tmp_path, codec, requested, expected_format, copied):
+    ffmpeg_patch, ffprobe_patch = _write_extraction_tools(tmp_path)
+    video = tmp_path / "clip.mkv"
+    video.write_text(codec)
+    conversion_events.set_sinks([])
+
+    with ffmpeg_patch, ffprobe_patch:
+        result = main_converter.extract_audio(str(video), requested, str(tmp_path / "out"))
+
+    assert result.ok and result.format == expected_format
+    arguments = json.loads((tmp_path / "out" / f"clip.{expected_format}").read_text())
+    assert "-vn" in arguments and ("copy" in arguments) == copied
+
+def test_run_audio_extraction_batches_through_the_async_runner(tmp_path):
+    ffmpeg_patch, ffprobe_patch = _write_extraction_tools(tmp_path)
+    (tmp_path / "videos").mkdir()
+    (tmp_path / "videos" / "a.mp4").write_text("aac")
+    (tmp_path / "videos" / "b.mov").write_text("pcm_s16le")
+    (tmp_path / "videos" / "silent.mp4").write_text("")
+    conversion_events.set_sinks([])
+
+    with ffmpeg_patch, ffprobe_patch:
+        results = main_converter.run_audio_extraction(str(tmp_path / "videos"), None, False, jobs=2, output_dir=str(tmp_path / "out"))
+
+    outcomes = sorted((os.path.basename(result.path), result.ok, result.error) for result in results)
+    assert outcomes == [("a.mp4", True, None), ("b.mov", True, None), ("silent.mp4", False, "NoAudioStream")]
+    assert sorted(os.listdir(tmp_path / "out")) == ["a.aac", "b.wav"]
+
+def test_run_conversion_logic_image_with_autotune(tmp_path):
+    from PIL import Image
+    import autotune
+    for i in range(5):
+        Image.new("RGB", (4, 4), (i, 0, 0)).save(tmp_path / f"img{i}.png")
+    conversion_events.set_sinks([])
+    autotune.configure(True, min_workers=1, max_workers=4)
+    try:
+        results = run_conversion_logic_image(str(tmp_path), "bmp", False, str(tmp_path / "out"))
+    finally:
+        autotune.configure(False)
+
+    assert sorted(os.path.basename(result.output_path) for result in results) == [f"img{i}.bmp" for i in range(5)]
+    assert all(result.ok for result in results)
+
+def test_dry_run_plans_the_batch_without_converting(tmp_path, capsys):
+    from PIL import Image
+    import scheduling
+    Image.new("RGB", (10, 10)).save(tmp_path / "small.png")
+    Image.new("RGB", (100, 50)).save(tmp_path / "large.png")
+    scheduling.configure("ljf", dry_run=True)
+    try:
+        results = run_conversion_logic_image(str(tmp_path), "bmp", False, str(tmp_path / "out"))
+    finally:
+        scheduling.configure()
+
+    assert results == []
+    assert not os.path.exists(tmp_path / "out")
+    output = capsys.readouterr().out
+    assert "Dry run: 2 image file(s) in ljf order." in output
+    assert output.index("large.png (100x50)") < output.index("small.png (10x10)")
+    assert "Total estimated work: 0.0 megapixels." in output
+
+def test_run_manifest_converts_mixed_jobs_in_one_process(tmp_path):
+    from PIL import Image
+    Image.new("RGB", (4, 4)).save(tmp_path / "a.png")
+    Image.new("RGB", (4, 4)).save(tmp_path / "b.png")
+    jobs = [{"input": str(tmp_path / "a.png"), "format": "bmp", "id": "first"},
+            {"input": str(tmp_path / "b.png"), "format": "jpeg", "output": str(tmp_path / "out" / "renamed.jpg")},
+            {"input": str(tmp_path / "a.png"), "format": "mp3"},
+            {"input": str(tmp_path / "clip.mp4"), "format": "mkv", "options": {"analyze": True}}]
+    (tmp_path / "jobs.jsonl").write_text("\n".join(json.dumps(job) for job in jobs) + "\n")
+    conversion_events.set_sinks([])
+
+    succeeded, failed = main_converter.run_manifest(str(tmp_path / "jobs.jsonl"), str(tmp_path / "results.jsonl"), workers=2)
+
+    rows = [json.loads(line) for line in (tmp_path / "results.jsonl").read_text().splitlines()]
+    assert (succeeded, failed) == (2, 2)
+    assert [(row["line"], row["ok"]) for row in rows] == [(1, True), (2, True), (3, False), (4, False)]
+    assert rows[0]["id"] == "first" and os.path.isfile(tmp_path / "a.bmp")
+    assert rows[1]["output_path"] == str(tmp_path / "out" / "renamed.jpg") and os.path.isfile(tmp_path / "out" / "renamed.jpg")
+    assert rows[2]["error"] == "InvalidJob" and rows[3]["error"] == "InvalidManifestLine"
+
+def test_convert_audio_rejects_formats_the_installed_ffmpeg_cannot_write(tmp_path, monkeypatch):
+    import ffmpeg_tools
+    (tmp_path / "a.wav").write_bytes(b"RIFF")
+    monkeypatch.setattr(main_converter, "_ffmpeg_capabilities", lambda: ffmpeg_tools.Capabilities("6.1", ["aac"], ["mp3", "adts"]))
+    conversion_events.set_sinks([])
+
+    event = main_converter.convert_audio(str(tmp_path / "a.wav"), "mp3")
+
+    assert event.error == "UnsupportedByFFmpeg" and "no encoder for mp3 audio" in event.message
+    assert main_converter._audio_extraction_plan("pcm_alaw") == ("aac", False)
+
+def test_convert_image_with_target_ssim_writes_the_searched_encode(tmp_path):
+    import quality_search
+    from PIL import Image
+    pytest.importorskip("numpy")
+    Image.radial_gradient("L").convert("RGB").save(tmp_path / "a.png")
+    quality_search.configure(0.99, cache_path=str(tmp_path / "cache.jsonl"))
+    try:
+        event = convert_image(str(tmp_path / "a.png"), "jpeg")
+        expected = quality_search.encode(Image.open(tmp_path / "a.png").convert("RGB"), "jpeg")
+    finally:
+        quality_search.configure()
+
+    assert event.ok and expected.trials == 0
+    assert (tmp_path / "a.jpeg").read_bytes() == expected.data
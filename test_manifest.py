@@ -0,0 +1,93 @@
+import io
+import json
+import threading
+import time
+import pytest
+import conversion_events
+from conversion_events import report_done
+from manifest import ManifestError, parse_job, run_manifest
+
+def recording_converter(calls, delays=None):
+    def convert(input_path, output_format, output_dir=None, output_path=None, **options):
+        calls.append((input_path, output_format, output_dir, output_path, options))
+        time.sleep((delays or {}).get(input_path, 0))
+        return report_done(input_path, output_format, output_path or f"{input_path}.{output_format}", time.perf_counter())
+    return convert
+
+def converters(calls, delays=None):
+    convert = recording_converter(calls, delays)
+    return {"image": (convert, (".png", ".jpg"), ()), "audio": (convert, (".wav",), ("analyze",))}
+
+@pytest.fixture(autouse=True)
+def quiet_events():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+# Test the kind comes from the extension and the format from the output path
+def test_parse_job_defaults():
+    job = parse_job('{"input": "a.WAV", "output": "out/b.MP3", "options": {"analyze": true}, "id": "x"}', 3, converters([]))
+    assert (job.line, job.id, job.kind, job.output_format, job.output_path, job.options) == (3, "x", "audio", "mp3", "out/b.MP3", {"analyze": True})
+    assert parse_job("   ", 1, converters([])) is None
+    assert parse_job("# comment", 1, converters([])) is None
+
+@pytest.mark.parametrize("text, message", [
+    ("{not json", "not valid JSON"),
+    ('["a.png"]', "not a JSON object"),
+    ('{"format": "bmp"}', "no input path"),
+    ('{"input": "a.png", "fromat": "bmp"}', "unknown field(s): fromat"),
+    ('{"input": "a.xyz", "format": "bmp"}', "cannot tell the kind"),
+    ('{"input": "a.png", "kind": "text", "format": "bmp"}', "unknown kind 'text'"),
+    ('{"input": "a.png", "format": "bmp", "options": {"analyze": true}}', "unknown image option(s): analyze"),
+])
+def test_parse_job_rejects_invalid_lines(text, message):
+    with pytest.raises(ManifestError, match=message.replace("(", r"\(").replace(")", r"\)")):
+        parse_job(text, 1, converters([]))
+
+# Test results come back in manifest order even when later jobs finish first
+def test_run_manifest_writes_results_in_order():
+    calls = []
+    lines = ['{"input": "slow.png", "format": "bmp", "id": 1}', "", '{"input": "bad"}', '{"input": "fast.wav", "format": "mp3", "output_dir": "out"}']
+    results = io.StringIO()
+    counts = run_manifest(lines, converters(calls, {"slow.png": 0.2}), results, workers=4)
+
+    rows = [json.loads(line) for line in results.getvalue().splitlines()]
+    assert [(row["line"], row["ok"], row.get("id"), row["event"]) for row in rows] == [(1, True, 1, "done"), (3, False, None, "error"), (4, True, None, "done")]
+    assert rows[1]["error"] == "InvalidManifestLine" and rows[2]["output_path"] == "fast.wav.mp3"
+    assert counts == (2, 1)
+    assert sorted(calls)[0] == ("fast.wav", "mp3", "out", None, {})
+
+# Test an explicit output path is handed to the converter with its directory
+def test_run_manifest_passes_output_path():
+    calls = []
+    run_manifest(['{"input": "a.png", "output": "out/x.jpg"}'], converters(calls), io.StringIO(), workers=1)
+    assert calls == [("a.png", "jpg", "out", "out/x.jpg", {})]
+
+# Test a converter rejecting a job becomes an error result instead of stopping the manifest
+def test_run_manifest_reports_rejected_jobs():
+    def convert(input_path, output_format, output_dir=None, output_path=None):
+        raise ValueError(f"Unsupported image output format '{output_format}'.")
+    results = io.StringIO()
+    assert run_manifest(['{"input": "a.png", "format": "xyz"}'], {"image": (convert, (".png",), ())}, results) == (0, 1)
+    row = json.loads(results.getvalue())
+    assert row["error"] == "InvalidJob" and "line 1: Unsupported image output format 'xyz'" in row["message"]
+
+# Test results are streamed while the manifest is still being read
+def test_run_manifest_streams_results():
+    written = threading.Event()
+
+    class Results(io.StringIO):
+        def write(self, text):
+            written.set()
+            return super().write(text)
+
+    def lines():
+        yield '{"input": "a.png", "format": "bmp"}'
+        # Stdin may stay open for a long time; the first result must not wait for the next line.
+        assert written.wait(2)
+        yield '{"input": "b.png", "format": "bmp"}'
+
+    results = Results()
+    assert run_manifest(lines(), converters([]), results, workers=2) == (2, 0)
+    assert [json.loads(line)["line"] for line in results.getvalue().splitlines()] == [1, 2]
@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+import pytest
+from PIL import Image
+import conversion_events
+import memory_profile
+from ffmpeg_async import FFmpegJob, run_ffmpeg_jobs
+
+try:
+    import resource
+except ImportError:
+    # Windows has neither resource nor os.wait4; the tests that need them are skipped.
+    resource = None
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+    memory_profile.configure(False)
+
+def allocating_script():
+    """
+    A child script that touches 40 MiB more than this process's peak RSS
+    (which Linux counts toward the child's peak), writes the output named by
+    its last argument and exits with the code given first. Returns (bytes, script).
+    """
+    size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 + (40 << 20)
+    return size, (f"import sys; block = bytearray({size}); block[::4096] = b'x' * len(block[::4096]); "
+                  "open(sys.argv[-1], 'wb').write(b'ID3'); sys.exit(int(sys.argv[1]))")
+
+def test_decoded_size_follows_pillow_storage():
+    assert memory_profile.decoded_size(Image.new("L", (10, 10))) == 100
+    assert memory_profile.decoded_size(Image.new("RGB", (10, 10))) == 400
+    assert memory_profile.decoded_size(Image.new("I;16", (10, 10))) == 200
+    assert memory_profile.decoded_size(Image.new("F", (10, 10))) == 400
+
+# Test nothing is recorded while the instrumentation is off
+def test_disabled_records_nothing():
+    with memory_profile.track_image("a.png", "jpeg") as probe:
+        probe.decoded(Image.new("RGB", (4, 4)))
+    assert memory_profile.records() == [] and memory_profile.describe_worst() is None
+
+# Test the Python peak, the decoded footprint and the collapsed-stack dump of the chosen job
+def test_track_image_records_peak_and_dumps_allocations(tmp_path):
+    dump = tmp_path / "job.folded"
+    memory_profile.configure(True, dump_job="big.png", dump_path=str(dump))
+    kept = []
+    with memory_profile.track_image(os.path.join("photos", "big.png"), "webp") as probe:
+        transient = bytearray(8 << 20)
+        del transient
+        kept.append(bytearray(1 << 20))
+        probe.decoded(Image.new("RGBA", (100, 50)))
+    with memory_profile.track_image("small.png", "webp"):
+        pass
+
+    big, small = sorted(memory_profile.records(), key=lambda record: record.path)
+    assert big.python_peak >= 8 << 20 and big.decoded_bytes == 20000
+    assert small.python_peak < 1 << 20
+    lines = dump.read_text().splitlines()
+    stack, size = max((line.rsplit(" ", 1) for line in lines), key=lambda parts: int(parts[1]))
+    assert int(size) >= 1 << 20 and stack.split(";")[-1].startswith("test_memory_profile.py:")
+    assert "tracemalloc" not in dump.read_text()
+
+# Test wait() reaps a Popen child with wait4, keeping its exit status and recording its peak RSS
+@pytest.mark.skipif(resource is None, reason="needs os.wait4")
+def test_wait_records_child_rss(tmp_path):
+    memory_profile.configure(True)
+    size, script = allocating_script()
+    process = subprocess.Popen([sys.executable, "-c", script, "3", str(tmp_path / "out")])
+
+    assert memory_profile.wait(process, "in.wav", "audio", "mp3") == 3
+    assert process.poll() == 3
+    record, = memory_profile.records()
+    assert record.child_rss >= size
+
+# Test the asyncio runner reaps ffmpeg itself under the instrumentation and still streams output and kills hung jobs
+@pytest.mark.skipif(resource is None, reason="needs os.wait4")
+def test_async_runner_records_child_rss(tmp_path):
+    memory_profile.configure(True, top=1)
+    size, allocate = allocating_script()
+    jobs = []
+    for name, script, code in (("big", allocate, "0"), ("small", "import sys; open(sys.argv[-1], 'wb').write(b'ID3'); print('done')", "0"),
+                               ("hang", "import time; time.sleep(30)", "0")):
+        (tmp_path / f"{name}.wav").write_bytes(b"RIFF")
+        command = [sys.executable, "-c", script, code, str(tmp_path / f"{name}.mp3")]
+        jobs.append(FFmpegJob(str(tmp_path / f"{name}.wav"), "mp3", str(tmp_path / f"{name}.mp3"), command, timeout=5 if name != "hang" else 0.5))
+
+    results = run_ffmpeg_jobs(jobs, max_concurrency=3)
+
+    assert [r.event for r in results] == ["done", "done", "error"] and results[2].error == "TimeoutError"
+    assert results[1].stdout == "done"
+    by_name = {os.path.basename(record.path): record for record in memory_profile.records()}
+    assert by_name["big.wav"].child_rss >= size and by_name["small.wav"].child_rss < by_name["big.wav"].child_rss
+    worst = memory_profile.describe_worst()
+    assert worst.splitlines()[0] == "Peak memory, top 1 job(s):" and "big.wav" in worst and "ffmpeg RSS" in worst
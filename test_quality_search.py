@@ -0,0 +1,78 @@
+import io
+import json
+import pytest
+from PIL import Image, ImageFilter
+numpy = pytest.importorskip("numpy")
+import quality_search
+from quality_search import encode, search, ssim
+
+def photo(size=(160, 120), seed=0):
+    rng = numpy.random.default_rng(seed)
+    ramp = numpy.add.outer(numpy.arange(size[1]), numpy.arange(size[0])) % 256
+    pixels = numpy.stack([ramp, ramp[::-1], ramp[:, ::-1]], -1) + rng.normal(0, 12, (size[1], size[0], 3))
+    return Image.fromarray(pixels.clip(0, 255).astype(numpy.uint8)).filter(ImageFilter.GaussianBlur(1))
+
+def score_at(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return ssim(quality_search.luma(image), quality_search.luma(Image.open(buffer)))
+
+@pytest.fixture(autouse=True)
+def configured(tmp_path):
+    quality_search.configure(0.98, cache_path=str(tmp_path / "cache.jsonl"))
+    yield
+    quality_search.configure()
+
+# Test the vectorized SSIM matches a per-window computation
+def test_ssim_matches_windowed_definition():
+    rng = numpy.random.default_rng(1)
+    a = rng.integers(0, 256, (12, 15)).astype(numpy.uint8)
+    b = (a + rng.normal(0, 20, a.shape)).clip(0, 255).astype(numpy.uint8)
+    scores = []
+    for i in range(a.shape[0] - 6):
+        for j in range(a.shape[1] - 6):
+            x, y = a[i:i + 7, j:j + 7].astype(float).ravel(), b[i:i + 7, j:j + 7].astype(float).ravel()
+            covariance = numpy.cov(x, y)
+            scores.append(((2 * x.mean() * y.mean() + quality_search._C1) * (2 * covariance[0, 1] + quality_search._C2)) /
+                          ((x.mean() ** 2 + y.mean() ** 2 + quality_search._C1) * (covariance[0, 0] + covariance[1, 1] + quality_search._C2)))
+    assert ssim(a, b) == pytest.approx(numpy.mean(scores))
+    assert ssim(a, a) == pytest.approx(1.0)
+
+# Test the search returns the lowest quality that reaches the target
+def test_search_finds_lowest_passing_quality():
+    image = photo()
+    result = search(image, "jpeg", 0.98)
+    assert 30 < result.quality <= 95 and result.score >= 0.98
+    assert score_at(image, result.quality - 1) < 0.98
+    assert result.trials <= 9
+    assert Image.open(io.BytesIO(result.data)).format == "JPEG"
+
+# Test the search stops after one encode when the lowest quality already passes
+def test_search_exits_early_for_simple_images():
+    result = search(Image.new("RGB", (64, 64), (200, 30, 30)), "webp", 0.98)
+    assert (result.quality, result.trials) == (30, 1)
+
+def test_search_keeps_the_highest_quality_when_the_target_is_out_of_reach():
+    result = search(photo(), "jpeg", 1.0, max_quality=60)
+    assert (result.quality, result.trials) == (60, 2)
+
+# Test a repeated image costs a single encode, also after a restart
+def test_encode_caches_results_per_image(tmp_path):
+    image = photo(seed=2)
+    first = encode(image, "jpeg")
+    assert first.trials > 1
+    second = encode(image.copy(), "jpeg")
+    assert (second.quality, second.trials, second.data) == (first.quality, 0, first.data)
+
+    quality_search.configure(0.98, cache_path=str(tmp_path / "cache.jsonl"))
+    assert encode(image, "jpeg").trials == 0
+    assert encode(image, "webp").trials > 0
+    lines = [json.loads(line) for line in (tmp_path / "cache.jsonl").read_text().splitlines()]
+    assert [line["quality"] for line in lines][0] == first.quality and len(lines) == 2
+
+def test_configure_validates_settings():
+    for target, low, high in ((1.5, 30, 95), (0.98, 90, 50), (0.98, 0, 95)):
+        with pytest.raises(ValueError):
+            quality_search.configure(target, low, high)
+    assert not quality_search.applies_to("png")
+    assert quality_search.applies_to("webp")
@@ -0,0 +1,60 @@
+import pytest
+from registry_state import MemoryBackend, diff, read_tree, synchronize
+
+ROOT = r"Software\Classes\Directory\shell\Menu"
+
+def desired_menu(command="convert.exe %1"):
+    return {
+        ROOT: {"SubCommands": ""},
+        rf"{ROOT}\shell": {},
+        rf"{ROOT}\shell\PNG": {},
+        rf"{ROOT}\shell\PNG\command": {"": command},
+    }
+
+def test_memory_backend_creates_parents_and_folds_case():
+    backend = MemoryBackend()
+    backend.create_key(rf"{ROOT}\shell")
+    assert backend.key_exists(ROOT.upper())
+    assert backend.subkeys(ROOT) == ["shell"]
+    backend.set_value(ROOT, "SubCommands", "")
+    backend.set_value(ROOT, "subcommands", "x")
+    assert backend.values(ROOT) == {"subcommands": "x"}
+    with pytest.raises(PermissionError):
+        backend.delete_key(ROOT)
+
+def test_synchronize_writes_only_differences():
+    backend = MemoryBackend()
+    first = synchronize(backend, desired_menu(), [ROOT])
+    assert ("create_key", rf"{ROOT}\shell\PNG\command") in first
+    assert read_tree(backend, ROOT) == desired_menu()
+
+    writes = backend.writes
+    assert synchronize(backend, desired_menu(), [ROOT]) == []
+    assert backend.writes == writes
+
+    changed = synchronize(backend, desired_menu("convert.exe -ir %1"), [ROOT])
+    assert changed == [("set_value", rf"{ROOT}\shell\PNG\command", "", "convert.exe -ir %1")]
+
+# Test stale keys and values under a managed root are removed deepest first, and nothing outside it is touched
+def test_diff_prunes_stale_entries_under_roots_only():
+    actual = dict(desired_menu())
+    actual[ROOT] = {"SubCommands": "", "Icon": "old.ico"}
+    actual[rf"{ROOT}\shell\GIF"] = {}
+    actual[rf"{ROOT}\shell\GIF\command"] = {"": "old"}
+    actual[r"Software\Classes\Directory\shell\Other"] = {}
+
+    operations = diff(desired_menu(), actual, [ROOT])
+
+    assert operations == [("delete_value", ROOT, "Icon"),
+                          ("delete_key", rf"{ROOT}\shell\GIF\command"),
+                          ("delete_key", rf"{ROOT}\shell\GIF")]
+
+def test_diff_matches_keys_case_insensitively():
+    actual = {path.upper(): values for path, values in desired_menu().items()}
+    assert diff(desired_menu(), actual, [ROOT]) == []
+
+def test_empty_desired_state_removes_everything():
+    backend = MemoryBackend()
+    synchronize(backend, desired_menu(), [ROOT])
+    synchronize(backend, {}, [ROOT])
+    assert not backend.key_exists(ROOT) and backend.key_exists(r"Software\Classes\Directory\shell")
@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import pytest
+from PIL import Image
+import scheduling
+from scheduling import Estimate, EtaTracker, describe_plan, estimate_costs, order
+
+def estimates(*costs):
+    return [Estimate(f"f{i}", cost) for i, cost in enumerate(costs)]
+
+# Test each policy orders by estimated cost and ties keep discovery order
+@pytest.mark.parametrize("policy, expected", [("fifo", ["f0", "f1", "f2", "f3"]),
+                                              ("sjf", ["f1", "f0", "f3", "f2"]),
+                                              ("ljf", ["f2", "f0", "f3", "f1"])])
+def test_order(policy, expected):
+    assert [estimate.path for estimate in order(estimates(5, 1, 9, 5), policy)] == expected
+
+def test_order_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        order(estimates(1), "random")
+    with pytest.raises(ValueError):
+        scheduling.configure("random")
+
+# Test images are costed in pixels from their headers
+def test_estimate_costs_for_images(tmp_path):
+    Image.new("RGB", (20, 10)).save(tmp_path / "a.png")
+    Image.new("RGB", (5, 4)).save(tmp_path / "b.png")
+    result = estimate_costs([str(tmp_path / "a.png"), str(tmp_path / "b.png")], "image")
+    assert [(estimate.cost, estimate.size, estimate.from_bytes) for estimate in result] == [(200, (20, 10), False), (20, (5, 4), False)]
+
+# Test files that cannot be probed are costed from their size at the median cost per byte
+def test_estimate_costs_falls_back_to_file_size(tmp_path):
+    Image.new("RGB", (20, 10)).save(tmp_path / "a.png")
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"x" * (2 * os.path.getsize(tmp_path / "a.png")))
+    good, bad = estimate_costs([str(tmp_path / "a.png"), str(broken)], "image")
+    assert bad.from_bytes and not good.from_bytes
+    assert bad.cost == pytest.approx(2 * good.cost)
+
+# Test media files are probed with ffprobe; video costs duration times pixels
+def test_estimate_costs_for_video(tmp_path):
+    probe = tmp_path / "ffprobe"
+    info = {"format": {"duration": "12.5"}, "streams": [{"codec_type": "audio"}, {"codec_type": "video", "width": 640, "height": 360}]}
+    probe.write_text(f"#!{sys.executable}\nimport sys\nif 'missing' in sys.argv[-1]: sys.exit(1)\nprint({json.dumps(json.dumps(info))})\n")
+    probe.chmod(0o755)
+    (tmp_path / "clip.mp4").write_bytes(b"x" * 100)
+    (tmp_path / "missing.mp4").write_bytes(b"x" * 300)
+    clip, missing = estimate_costs([str(tmp_path / "clip.mp4"), str(tmp_path / "missing.mp4")], "video", str(probe))
+    assert (clip.duration, clip.size, clip.cost) == (12.5, (640, 360), 12.5 * 640 * 360)
+    assert missing.from_bytes and missing.cost == pytest.approx(3 * clip.cost)
+
+# Test the ETA is the remaining cost at the rate completed so far
+def test_eta_tracker():
+    now = [0.0]
+    tracker = EtaTracker(estimates(10, 30, 60), clock=lambda: now[0])
+    now[0] = 5.0
+    assert tracker.complete("f0") == pytest.approx(45.0)
+    now[0] = 20.0
+    assert tracker.complete("f1") == pytest.approx(30.0)
+    assert tracker.complete("unknown") == pytest.approx(30.0)
+    now[0] = 50.0
+    assert tracker.complete("f2") == 0.0
+
+def test_describe_plan():
+    plan = [Estimate("long.mp4", 2e9, duration=3700, size=(1920, 1080)), Estimate("odd.mp4", 5e8, from_bytes=True)]
+    assert describe_plan(plan, "video", "ljf").splitlines() == [
+        "Dry run: 2 video file(s) in ljf order.",
+        "  1. long.mp4 (1:01:40, 1920x1080)",
+        "  2. odd.mp4 (estimated from file size)",
+        "Total estimated work: 1:01:40 of video, 2.5 gigapixel-seconds (1 file(s) estimated from their size).",
+    ]
@@ -0,0 +1,101 @@
+import os
+import pytest
+from PIL import Image
+import conversion_events
+from conversion_events import report_error
+import shm_pipeline
+from shm_pipeline import parse_processes, run_pipeline
+
+@pytest.fixture(autouse=True)
+def quiet_output():
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([])
+    yield
+    conversion_events.set_sinks(sinks)
+
+def keep(image, output_format):
+    return image
+
+def to_rgb_for_jpeg(image, output_format):
+    return image.convert("RGB") if output_format == "jpeg" and image.mode != "RGB" else image
+
+def save(image, output_path, output_format):
+    image.save(output_path, format=output_format.upper())
+
+def report_failure(e, input_path, output_format, output_path, started, bytes_in):
+    return report_error(input_path, output_format, e, f"Error: {e}", started, output_path=output_path, bytes_in=bytes_in)
+
+def test_parse_processes():
+    assert parse_processes("2,1,3") == (2, 1, 3)
+    assert parse_processes("auto", cpu_count=8) == (4, 2, 4)
+    assert parse_processes("auto", cpu_count=1) == (1, 1, 1)
+    for text in ("1,2", "1,0,1", "a,b,c"):
+        with pytest.raises(ValueError):
+            parse_processes(text)
+
+# Test pixels, palettes and transparency survive the shared-memory hand-offs, and transformed images replace their block
+def test_round_trips_modes_through_shared_memory(tmp_path):
+    gradient = Image.new("RGB", (40, 30))
+    gradient.putdata([(x * 6, y * 8, 100) for y in range(30) for x in range(40)])
+    gradient.save(tmp_path / "rgb.png")
+    palette = Image.new("P", (16, 16), 1)
+    palette.putpalette([0, 0, 0, 255, 0, 0] + [0] * 762)
+    palette.save(tmp_path / "palette.png", transparency=0)
+    Image.new("RGBA", (20, 20), (0, 128, 255, 128)).save(tmp_path / "alpha.png")
+    jobs = [(str(tmp_path / "rgb.png"), str(tmp_path / "out" / "rgb.png"), "png"),
+            (str(tmp_path / "palette.png"), str(tmp_path / "out" / "palette.png"), "png"),
+            (str(tmp_path / "alpha.png"), str(tmp_path / "out" / "alpha.jpeg"), "jpeg")]
+
+    results = run_pipeline(jobs, Image.open, to_rgb_for_jpeg, save, report_failure, processes=(1, 2, 1))
+
+    assert [r.event for r in results] == ["done", "done", "done"]
+    with Image.open(tmp_path / "out" / "rgb.png") as image:
+        assert image.convert("RGB").tobytes() == gradient.tobytes()
+    with Image.open(tmp_path / "out" / "palette.png") as image:
+        assert image.mode == "P" and image.info["transparency"] == 0 and image.getpixel((3, 3)) == 1
+        assert image.getpalette()[3:6] == [255, 0, 0]
+    with Image.open(tmp_path / "out" / "alpha.jpeg") as image:
+        assert image.mode == "RGB" and image.size == (20, 20)
+    assert results[2].bytes_out == os.path.getsize(tmp_path / "out" / "alpha.jpeg")
+
+# Test images larger than a block travel inline, and more jobs than blocks still finish as blocks are recycled
+def test_oversized_images_and_block_recycling(tmp_path):
+    jobs = []
+    for i in range(12):
+        side = 64 if i % 4 == 0 else 8
+        Image.new("RGB", (side, side), (i * 20, 0, 0)).save(tmp_path / f"{i}.png")
+        jobs.append((str(tmp_path / f"{i}.png"), str(tmp_path / "out" / f"{i}.bmp"), "bmp"))
+
+    results = run_pipeline(jobs, Image.open, keep, save, report_failure, processes=(1, 1, 1), block_size=1024)
+
+    assert all(r.event == "done" for r in results)
+    with Image.open(tmp_path / "out" / "4.bmp") as image:
+        assert image.size == (64, 64) and image.getpixel((10, 10)) == (80, 0, 0)
+    with Image.open(tmp_path / "out" / "5.bmp") as image:
+        assert image.getpixel((0, 0)) == (100, 0, 0)
+
+# Test decode failures are reported without holding a block, in job order
+def test_decode_errors_are_reported(tmp_path):
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+    Image.new("L", (4, 4), 9).save(tmp_path / "fine.png")
+    jobs = [(str(tmp_path / "broken.png"), str(tmp_path / "broken.bmp"), "bmp"),
+            (str(tmp_path / "missing.png"), str(tmp_path / "missing.bmp"), "bmp"),
+            (str(tmp_path / "fine.png"), str(tmp_path / "fine.bmp"), "bmp")]
+
+    results = run_pipeline(jobs, Image.open, keep, save, report_failure, processes=(1, 1, 1), block_size=64)
+
+    assert [r.event for r in results] == ["error", "error", "done"]
+    assert results[0].error == "UnidentifiedImageError" and results[1].error == "FileNotFoundError"
+
+def crash(image, output_format):
+    os._exit(3)
+
+# Test a worker that dies fails the unfinished jobs instead of hanging the batch
+def test_crashed_worker_fails_remaining_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(shm_pipeline, "WORKER_CHECK_SECONDS", 0.05)
+    Image.new("L", (4, 4)).save(tmp_path / "a.png")
+    jobs = [(str(tmp_path / "a.png"), str(tmp_path / "a.bmp"), "bmp")]
+
+    results = run_pipeline(jobs, Image.open, crash, save, report_failure)
+
+    assert results[0].event == "error" and results[0].error == "WorkerCrashed"
@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+import threading
+import time
+import pytest
+import conversion_events
+import watch_folder
+from watch_folder import watch_directory, _route_for
+
+def run_watcher(directory, routes, **kwargs):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=watch_directory, args=(str(directory), routes), kwargs=dict(stop_event=stop_event, **kwargs))
+    thread.start()
+    time.sleep(0.3)
+    return stop_event, thread
+
+def recording_converter(calls):
+    def convert(input_path, output_format):
+        with open(input_path, "rb") as source:
+            data = source.read()
+        output_path = os.path.splitext(input_path)[0] + "." + output_format
+        with open(output_path, "wb") as target:
+            target.write(data)
+        calls.append((input_path, data))
+    return convert
+
+def test_route_for_skips_files_already_in_target_format():
+    routes = {".png": ("png-converter", "jpeg"), ".jpeg": ("jpeg-converter", "jpeg")}
+    assert _route_for("/in/a.PNG", routes) == ("png-converter", "jpeg")
+    assert _route_for("/in/a.jpeg", routes) is None
+    assert _route_for("/in/a.txt", routes) is None
+
+# Test a file written in several pieces is converted once, only after it stops growing
+@pytest.mark.parametrize("use_inotify", [pytest.param(True, marks=pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")), False])
+def test_partially_written_file_is_converted_once(tmp_path, use_inotify):
+    calls = []
+    routes = {".png": (recording_converter(calls), "jpeg")}
+    stop_event, thread = run_watcher(tmp_path, routes, use_inotify=use_inotify, poll_interval=0.1, settle=0.4)
+    try:
+        with open(tmp_path / "frame.png", "wb") as f:
+            for _ in range(3):
+                f.write(b"data")
+                f.flush()
+                time.sleep(0.15)
+        deadline = time.time() + 5
+        while not calls and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.6)
+    finally:
+        stop_event.set()
+        thread.join()
+    assert calls == [(str(tmp_path / "frame.png"), b"datadatadata")]
+    assert (tmp_path / "frame.jpeg").exists()
+
+def test_recursive_watch_picks_up_new_subdirectories(tmp_path):
+    calls = []
+    routes = {".wav": (recording_converter(calls), "mp3")}
+    stop_event, thread = run_watcher(tmp_path, routes, recursive=True, poll_interval=0.1, settle=0.2)
+    try:
+        (tmp_path / "day1").mkdir()
+        (tmp_path / "day1" / "take.wav").write_bytes(b"RIFF")
+        deadline = time.time() + 5
+        while not calls and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop_event.set()
+        thread.join()
+    assert [path for path, _ in calls] == [str(tmp_path / "day1" / "take.wav")]
+
+def test_existing_files_are_processed_on_request(tmp_path):
+    calls = []
+    (tmp_path / "old.png").write_bytes(b"old")
+    (tmp_path / "notes.txt").write_bytes(b"skip me")
+    stop_event, thread = run_watcher(tmp_path, {".png": (recording_converter(calls), "gif")}, process_existing=True, settle=0.1)
+    try:
+        deadline = time.time() + 5
+        while not calls and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop_event.set()
+        thread.join()
+    assert calls == [(str(tmp_path / "old.png"), b"old")]
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+
+# Test a subdirectory that vanishes before it can be watched is skipped instead of ending the watch
+@linux_only
+def test_inotify_skips_directories_that_vanish(tmp_path):
+    watcher = watch_folder.InotifyWatcher(str(tmp_path), recursive=True)
+    try:
+        (tmp_path / "tmp-copy").mkdir()
+        (tmp_path / "tmp-copy").rmdir()
+        (tmp_path / "kept").mkdir()
+        (tmp_path / "kept" / "a.wav").write_bytes(b"RIFF")
+        assert watcher.wait(1) == {str(tmp_path / "kept" / "a.wav")}
+    finally:
+        watcher.close()
+
+# Test a queue overflow rescans the tree for files changed since the last read
+@linux_only
+def test_inotify_overflow_rescans_the_tree(tmp_path, monkeypatch):
+    (tmp_path / "before.wav").write_bytes(b"RIFF")
+    time.sleep(0.1)
+    watcher = watch_folder.InotifyWatcher(str(tmp_path), recursive=True)
+    real_read = os.read
+
+    def overflowing_read(fd, size):
+        # Drop the real events, as the kernel does when its queue is full
+        real_read(fd, size)
+        return watch_folder._EVENT_HEADER.pack(-1, watch_folder.IN_Q_OVERFLOW, 0, 0)
+
+    try:
+        (tmp_path / "burst").mkdir()
+        (tmp_path / "burst" / "missed.wav").write_bytes(b"RIFF")
+        monkeypatch.setattr(watch_folder.os, "read", overflowing_read)
+        assert watcher.wait(1) == {str(tmp_path / "burst" / "missed.wav")}
+        monkeypatch.undo()
+        assert str(tmp_path / "burst") in watcher._directories.values()
+    finally:
+        watcher.close()
+
+# Test the polling fallback warning is an event, so JSONL output stays parseable
+def test_inotify_fallback_warning_is_a_summary_event(tmp_path, monkeypatch, capsys):
+    def unavailable(directory, recursive):
+        raise OSError("inotify_init1 failed")
+    monkeypatch.setattr(watch_folder, "InotifyWatcher", unavailable)
+    sinks = conversion_events.get_sinks()
+    conversion_events.set_sinks([conversion_events.JsonlSink()])
+    try:
+        watcher = watch_folder.create_watcher(str(tmp_path), use_inotify=True)
+    finally:
+        conversion_events.set_sinks(sinks)
+    assert isinstance(watcher, watch_folder.PollingWatcher)
+    event = json.loads(capsys.readouterr().out)
+    assert event["event"] == "summary" and "falling back to polling" in event["message"]
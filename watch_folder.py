@@ -0,0 +1,262 @@
+"""
+Watch-folder mode: convert files as they are dropped into a directory.
+
+On Linux the directory is watched with inotify, so an idle watcher sleeps in
+the kernel and uses no CPU; elsewhere it falls back to polling the directory
+listing. New or changed files are held back until their size and
+modification time stop changing (so partially written files are never
+converted), bursts of events for the same file are coalesced, and ready
+files are fed to the normal converters through a worker pool.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conversion_events import report_summary
+
+# How long a file's size/mtime must stay unchanged before it is converted.
+DEFAULT_SETTLE_SECONDS = 0.3
+# Directory rescan interval for the polling fallback.
+DEFAULT_POLL_INTERVAL = 1.0
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+# Kernel file timestamps come from a coarse clock that can lag time.time() slightly.
+_CLOCK_SLACK_SECONDS = 0.05
+
+
+class InotifyWatcher(object):
+    """Reports changed paths under a directory using Linux inotify."""
+
+    def __init__(self, directory, recursive=False):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directory = directory
+        self.recursive = recursive
+        self._directories = {}
+        self._last_read = time.time()
+        self._watch(directory)
+        if recursive:
+            for root, dirs, _ in os.walk(directory):
+                for name in dirs:
+                    self._watch(os.path.join(root, name))
+
+    def _watch(self, directory):
+        wd = self._add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch '{directory}'")
+        self._directories[wd] = directory
+
+    def _watch_tree(self, directory, since=None):
+        """
+        Watches directory and its subdirectories, skipping any that vanish
+        first (temporary directories of copy tools), and returns the files in
+        them, or only those changed at or after `since` (a time.time() value).
+        """
+        found = set()
+        for root, dirs, files in os.walk(directory):
+            try:
+                self._watch(root)
+            except OSError:
+                dirs[:] = []
+                continue
+            if not self.recursive:
+                dirs[:] = []
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # ctime also changes when a file is moved in, which keeps its mtime.
+                if since is None or max(stat.st_mtime, stat.st_ctime) >= since:
+                    found.add(path)
+        return found
+
+    def wait(self, timeout):
+        """Blocks until something changes (or timeout, None = forever) and returns the changed file paths."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        previous_read, self._last_read = self._last_read, time.time()
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+            directory = self._directories.get(wd)
+            if mask & IN_Q_OVERFLOW:
+                # The kernel queue overflowed and events were dropped: rescan the whole
+                # tree for anything changed since the last read (and any missed directories).
+                changed.update(self._watch_tree(self.directory, since=previous_read - _CLOCK_SLACK_SECONDS))
+                continue
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    # Watch the new directory, then pick up files copied in before the watch existed.
+                    changed.update(self._watch_tree(path))
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher(object):
+    """Portable fallback that compares directory listings every poll_interval seconds."""
+
+    def __init__(self, directory, recursive=False, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.recursive = recursive
+        self.poll_interval = poll_interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        pending = [self.directory]
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            pending.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+        return snapshot
+
+    def wait(self, timeout):
+        interval = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+        time.sleep(interval)
+        snapshot = self._scan()
+        changed = {path for path, signature in snapshot.items() if self._snapshot.get(path) != signature}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, recursive=False, poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=None):
+    """Returns an inotify watcher on Linux and a polling watcher elsewhere (or if inotify fails)."""
+    if use_inotify is None:
+        use_inotify = sys.platform.startswith("linux")
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory, recursive)
+        except (OSError, AttributeError) as e:
+            report_summary(f"Warning: inotify is unavailable ({e}); falling back to polling every {poll_interval} seconds.")
+    return PollingWatcher(directory, recursive, poll_interval)
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _route_for(path, routes):
+    """Returns (convert_function, output_format) for path, or None if it should be ignored."""
+    name = path.lower()
+    for extension, route in routes.items():
+        if name.endswith(extension):
+            # Files already in the target format are skipped, which also keeps the
+            # watcher from re-converting the outputs it writes into the folder.
+            if name.endswith("." + route[1]):
+                return None
+            return route
+    return None
+
+
+def watch_directory(directory, routes, recursive=False, workers=None, settle=DEFAULT_SETTLE_SECONDS,
+                    poll_interval=DEFAULT_POLL_INTERVAL, stop_event=None, process_existing=False, use_inotify=None):
+    """
+    Watches `directory` and converts every new file whose extension appears in
+    `routes`, a mapping of lower-case extension -> (convert_function,
+    output_format). Runs until stop_event is set (or forever) and returns the
+    number of files handed to the converters.
+    """
+    stop_event = stop_event or threading.Event()
+    watcher = create_watcher(directory, recursive, poll_interval, use_inotify)
+    pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="watch")
+    pending = {}
+    submitted = 0
+
+    if process_existing:
+        for root, _, files in os.walk(directory):
+            for file in files:
+                path = os.path.join(root, file)
+                if _route_for(path, routes) is not None:
+                    pending[path] = (None, 0.0)
+            if not recursive:
+                break
+
+    try:
+        while not stop_event.is_set():
+            # Sleep in the watcher while idle, waking only to check stop_event;
+            # tick quickly while files are settling.
+            timeout = settle / 2 if pending else 0.5
+            for path in watcher.wait(timeout):
+                if _route_for(path, routes) is not None:
+                    # A new event restarts the settle timer for that file.
+                    pending[path] = (None, 0.0)
+
+            now = time.monotonic()
+            for path, (signature, stable_since) in list(pending.items()):
+                current = _file_signature(path)
+                if current is None:
+                    del pending[path]
+                elif current != signature:
+                    pending[path] = (current, now)
+                elif now - stable_since >= settle:
+                    del pending[path]
+                    convert_function, output_format = _route_for(path, routes)
+                    pool.submit(convert_function, path, output_format)
+                    submitted += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        pool.shutdown(wait=True)
+    return submitted